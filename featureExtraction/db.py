@@ -8,6 +8,7 @@ load_dotenv()
 DB_NAME = "drug-sentencing-predictor"
 JUDGEMENTS_COLLECTION_NAME = "judgement-html"
 EXTRACTED_FEATURES_COLLECTION_NAME = "llm-extracted-features"
+VERIFIED_FEATURES_COLLECTION_NAME = "verified-features"
 
 
 class DB:
@@ -21,3 +22,6 @@ class DB:
 
     def get_extracted_features_collection(self):
         return self.database.get_collection(EXTRACTED_FEATURES_COLLECTION_NAME)
+
+    def get_verified_features_collection(self):
+        return self.database.get_collection(VERIFIED_FEATURES_COLLECTION_NAME)
@@ -1,16 +1,24 @@
 import argparse
+import math
 from collections import defaultdict
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from typing import Any
 
 from bson import ObjectId
+from pymongo import DeleteMany, UpdateMany, UpdateOne
 from pymongo.collection import Collection
 
-from db import DB
+from db import (
+    DB,
+    EXTRACTED_FEATURES_COLLECTION_NAME,
+    JUDGEMENTS_COLLECTION_NAME,
+    VERIFIED_FEATURES_COLLECTION_NAME,
+)
 
-VERIFIED_FEATURES_COLLECTION_NAME = "verified-features"
 EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+BULK_BATCH_SIZE = 1000
+DIFF_VALUE_WIDTH = 60
 
 
 @dataclass(frozen=True)
@@ -33,6 +41,28 @@ class Summary:
     verified_deletes: int = 0
 
 
+@dataclass(frozen=True)
+class GroupPlan:
+    group: DuplicateGroup
+    keeper: dict[str, Any]
+    judgement_update: dict[str, Any]
+    judgement_ids_to_delete: list[Any]
+    primary_extraction: dict[str, Any] | None
+    primary_extraction_id: ObjectId | None
+    extraction_update: dict[str, Any]
+    extraction_ids_to_delete: list[Any]
+    primary_verified: dict[str, Any] | None
+    verified_update: dict[str, Any]
+    verified_ids_to_delete: list[Any]
+
+
+@dataclass
+class BulkOperations:
+    judgements: list[UpdateOne | DeleteMany] = field(default_factory=list)
+    extractions: list[UpdateOne | DeleteMany] = field(default_factory=list)
+    verified: list[UpdateOne | UpdateMany | DeleteMany] = field(default_factory=list)
+
+
 def normalize_object_id(value: Any) -> str | None:
     if isinstance(value, ObjectId):
         return str(value)
@@ -82,13 +112,27 @@ def document_timestamp(doc: dict[str, Any]) -> datetime:
     return max(present_values) if present_values else EPOCH
 
 
+def verified_set(update_fields: dict[str, Any]) -> dict[str, Any]:
+    """Build a verified-features ``$set`` that also bumps ``updated_at``.
+
+    The modelling snapshot refreshes incrementally on ``updated_at``, so a
+    repointed reference would otherwise never reach its cache.
+    """
+    return {"$set": update_fields, "$currentDate": {"updated_at": True}}
+
+
 def build_id_filter(field_name: str, object_ids: list[ObjectId]) -> dict[str, Any]:
-    return {
-        "$or": [
-            {field_name: {"$in": object_ids}},
-            {field_name: {"$in": [str(object_id) for object_id in object_ids]}},
-        ]
-    }
+    """Match references to ``object_ids``.
+
+    References are ObjectIds once migrateSourceJudgementIds.py has run, so a
+    single ``$in`` stays on the reference index; ``main`` refuses to run while
+    string references remain.
+    """
+    return {field_name: {"$in": object_ids}}
+
+
+def count_string_references(collection: Collection, field_name: str) -> int:
+    return collection.count_documents({field_name: {"$type": "string"}})
 
 
 def parse_args() -> argparse.Namespace:
@@ -97,18 +141,18 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--filename")
     parser.add_argument("--limit", type=int, default=0)
     parser.add_argument("--apply", action="store_true")
+    parser.add_argument(
+        "--bulk",
+        action="store_true",
+        help="Fetch groups with one $lookup aggregation and write with bulk_write",
+    )
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE)
     return parser.parse_args()
 
 
-def find_duplicate_groups(
-    judgements_collection: Collection,
-    extracted_collection: Collection,
-    verified_collection: Collection,
-    *,
-    year: str | None,
-    filename: str | None,
-    limit: int,
-) -> list[DuplicateGroup]:
+def build_group_pipeline(
+    *, year: str | None, filename: str | None, limit: int
+) -> list[dict[str, Any]]:
     match_filter: dict[str, Any] = {}
     if year:
         match_filter["year"] = year
@@ -137,6 +181,19 @@ def find_duplicate_groups(
     if limit > 0:
         pipeline.append({"$limit": limit})
 
+    return pipeline
+
+
+def find_duplicate_groups(
+    judgements_collection: Collection,
+    extracted_collection: Collection,
+    verified_collection: Collection,
+    *,
+    year: str | None,
+    filename: str | None,
+    limit: int,
+) -> list[DuplicateGroup]:
+    pipeline = build_group_pipeline(year=year, filename=filename, limit=limit)
     raw_groups = list(judgements_collection.aggregate(pipeline, allowDiskUse=True))
     if not raw_groups:
         return []
@@ -211,6 +268,63 @@ def find_duplicate_groups(
     return groups
 
 
+def build_related_lookup(collection_name: str, output_field: str) -> dict[str, Any]:
+    """Join related docs on the normalised ObjectId source_judgement_id.
+
+    An equality lookup runs as an index probe on source_judgement_id.
+    """
+    return {
+        "$lookup": {
+            "from": collection_name,
+            "localField": "ids",
+            "foreignField": "source_judgement_id",
+            "as": output_field,
+        }
+    }
+
+
+def build_bulk_group_pipeline(
+    *, year: str | None, filename: str | None, limit: int
+) -> list[dict[str, Any]]:
+    pipeline = build_group_pipeline(year=year, filename=filename, limit=limit)
+    pipeline.extend(
+        [
+            {
+                "$lookup": {
+                    "from": JUDGEMENTS_COLLECTION_NAME,
+                    "localField": "ids",
+                    "foreignField": "_id",
+                    "as": "docs",
+                }
+            },
+            build_related_lookup(EXTRACTED_FEATURES_COLLECTION_NAME, "extraction_docs"),
+            build_related_lookup(VERIFIED_FEATURES_COLLECTION_NAME, "verified_docs"),
+        ]
+    )
+    return pipeline
+
+
+def find_duplicate_groups_bulk(
+    judgements_collection: Collection,
+    *,
+    year: str | None,
+    filename: str | None,
+    limit: int,
+) -> list[DuplicateGroup]:
+    pipeline = build_bulk_group_pipeline(year=year, filename=filename, limit=limit)
+    return [
+        DuplicateGroup(
+            filename=raw_group["_id"].get("filename"),
+            year=raw_group["_id"].get("year"),
+            docs=raw_group["docs"],
+            extraction_docs=raw_group["extraction_docs"],
+            verified_docs=raw_group["verified_docs"],
+        )
+        for raw_group in judgements_collection.aggregate(pipeline, allowDiskUse=True)
+        if raw_group["docs"]
+    ]
+
+
 def choose_keeper(group: DuplicateGroup) -> dict[str, Any]:
     extraction_counts: dict[str, int] = defaultdict(int)
     for doc in group.extraction_docs:
@@ -345,23 +459,9 @@ def build_verified_update(
     return update_fields
 
 
-def apply_group(
-    group: DuplicateGroup,
-    judgements_collection: Collection,
-    extracted_collection: Collection,
-    verified_collection: Collection,
-    *,
-    apply: bool,
-    summary: Summary,
-) -> None:
+def plan_group(group: DuplicateGroup) -> GroupPlan:
     keeper = choose_keeper(group)
     keeper_id = keeper["_id"]
-    keeper_id_str = str(keeper_id)
-
-    judgement_update = build_judgement_update(keeper, group.docs)
-    judgement_ids_to_delete = [
-        doc["_id"] for doc in group.docs if doc.get("_id") != keeper_id
-    ]
 
     primary_extraction = choose_primary_extraction(group.extraction_docs, keeper_id)
     primary_extraction_id = (
@@ -370,79 +470,276 @@ def apply_group(
         and isinstance(primary_extraction.get("_id"), ObjectId)
         else None
     )
-    extraction_update = build_extraction_update(primary_extraction, keeper)
-    extraction_ids_to_delete = [
-        doc["_id"]
-        for doc in group.extraction_docs
-        if primary_extraction is not None
-        and doc.get("_id") != primary_extraction.get("_id")
-    ]
-
     primary_verified = choose_primary_verified(group.verified_docs, keeper_id)
-    verified_update = build_verified_update(
-        primary_verified, keeper, primary_extraction_id
+
+    return GroupPlan(
+        group=group,
+        keeper=keeper,
+        judgement_update=build_judgement_update(keeper, group.docs),
+        judgement_ids_to_delete=[
+            doc["_id"] for doc in group.docs if doc.get("_id") != keeper_id
+        ],
+        primary_extraction=primary_extraction,
+        primary_extraction_id=primary_extraction_id,
+        extraction_update=build_extraction_update(primary_extraction, keeper),
+        extraction_ids_to_delete=[
+            doc["_id"]
+            for doc in group.extraction_docs
+            if primary_extraction is not None
+            and doc.get("_id") != primary_extraction.get("_id")
+        ],
+        primary_verified=primary_verified,
+        verified_update=build_verified_update(
+            primary_verified, keeper, primary_extraction_id
+        ),
+        verified_ids_to_delete=[
+            doc["_id"]
+            for doc in group.verified_docs
+            if primary_verified is not None
+            and doc.get("_id") != primary_verified.get("_id")
+        ],
     )
-    verified_ids_to_delete = [
-        doc["_id"]
-        for doc in group.verified_docs
-        if primary_verified is not None
-        and doc.get("_id") != primary_verified.get("_id")
-    ]
 
+
+def record_plan(plan: GroupPlan, summary: Summary, *, apply: bool) -> None:
     summary.groups += 1
-    summary.judgement_updates += int(bool(judgement_update))
-    summary.judgement_deletes += len(judgement_ids_to_delete)
-    summary.extraction_updates += int(bool(extraction_update))
-    summary.extraction_deletes += len(extraction_ids_to_delete)
-    summary.verified_updates += int(bool(verified_update))
-    summary.verified_deletes += len(verified_ids_to_delete)
+    summary.judgement_updates += int(bool(plan.judgement_update))
+    summary.judgement_deletes += len(plan.judgement_ids_to_delete)
+    summary.extraction_updates += int(bool(plan.extraction_update))
+    summary.extraction_deletes += len(plan.extraction_ids_to_delete)
+    summary.verified_updates += int(bool(plan.verified_update))
+    summary.verified_deletes += len(plan.verified_ids_to_delete)
 
     mode = "APPLY" if apply else "DRY RUN"
     print(
-        f"[{mode}] {group.year or '?'} / {group.filename or '?'} "
-        f"keep={keeper_id_str} "
-        f"delete_judgements={len(judgement_ids_to_delete)} "
-        f"delete_extractions={len(extraction_ids_to_delete)} "
-        f"delete_verified={len(verified_ids_to_delete)}"
+        f"[{mode}] {plan.group.year or '?'} / {plan.group.filename or '?'} "
+        f"keep={plan.keeper['_id']} "
+        f"delete_judgements={len(plan.judgement_ids_to_delete)} "
+        f"delete_extractions={len(plan.extraction_ids_to_delete)} "
+        f"delete_verified={len(plan.verified_ids_to_delete)}"
     )
 
+
+def apply_group(
+    group: DuplicateGroup,
+    judgements_collection: Collection,
+    extracted_collection: Collection,
+    verified_collection: Collection,
+    *,
+    apply: bool,
+    summary: Summary,
+) -> None:
+    plan = plan_group(group)
+    record_plan(plan, summary, apply=apply)
+
     if not apply:
         return
 
-    if judgement_update:
-        judgements_collection.update_one({"_id": keeper_id}, {"$set": judgement_update})
+    keeper_id = plan.keeper["_id"]
+    if plan.judgement_update:
+        judgements_collection.update_one(
+            {"_id": keeper_id}, {"$set": plan.judgement_update}
+        )
 
-    if primary_extraction is not None and extraction_update:
+    if plan.primary_extraction is not None and plan.extraction_update:
         extracted_collection.update_one(
-            {"_id": primary_extraction["_id"]}, {"$set": extraction_update}
+            {"_id": plan.primary_extraction["_id"]}, {"$set": plan.extraction_update}
         )
 
-    if extraction_ids_to_delete and primary_extraction_id is not None:
+    if plan.extraction_ids_to_delete and plan.primary_extraction_id is not None:
         verified_collection.update_many(
-            build_id_filter("source_llm_extraction_id", extraction_ids_to_delete),
-            {"$set": {"source_llm_extraction_id": primary_extraction_id}},
+            build_id_filter("source_llm_extraction_id", plan.extraction_ids_to_delete),
+            verified_set({"source_llm_extraction_id": plan.primary_extraction_id}),
+        )
+        extracted_collection.delete_many(
+            {"_id": {"$in": plan.extraction_ids_to_delete}}
         )
-        extracted_collection.delete_many({"_id": {"$in": extraction_ids_to_delete}})
 
-    if primary_verified is not None and verified_update:
+    if plan.primary_verified is not None and plan.verified_update:
         verified_collection.update_one(
-            {"_id": primary_verified["_id"]}, {"$set": verified_update}
+            {"_id": plan.primary_verified["_id"]}, verified_set(plan.verified_update)
         )
 
-    if verified_ids_to_delete:
-        verified_collection.delete_many({"_id": {"$in": verified_ids_to_delete}})
+    if plan.verified_ids_to_delete:
+        verified_collection.delete_many({"_id": {"$in": plan.verified_ids_to_delete}})
 
-    if judgement_ids_to_delete:
-        judgements_collection.delete_many({"_id": {"$in": judgement_ids_to_delete}})
+    if plan.judgement_ids_to_delete:
+        judgements_collection.delete_many(
+            {"_id": {"$in": plan.judgement_ids_to_delete}}
+        )
 
 
-def main() -> None:
-    args = parse_args()
-    db = DB()
-    judgements_collection = db.get_judgements_collection()
-    extracted_collection = db.get_extracted_features_collection()
-    verified_collection = db.database.get_collection(VERIFIED_FEATURES_COLLECTION_NAME)
+def add_plan_operations(plan: GroupPlan, operations: BulkOperations) -> None:
+    """Queue a plan's writes in the same per-collection order as apply_group."""
+    keeper_id = plan.keeper["_id"]
+    if plan.judgement_update:
+        operations.judgements.append(
+            UpdateOne({"_id": keeper_id}, {"$set": plan.judgement_update})
+        )
+
+    if plan.primary_extraction is not None and plan.extraction_update:
+        operations.extractions.append(
+            UpdateOne(
+                {"_id": plan.primary_extraction["_id"]},
+                {"$set": plan.extraction_update},
+            )
+        )
+
+    if plan.extraction_ids_to_delete and plan.primary_extraction_id is not None:
+        operations.verified.append(
+            UpdateMany(
+                build_id_filter(
+                    "source_llm_extraction_id", plan.extraction_ids_to_delete
+                ),
+                verified_set({"source_llm_extraction_id": plan.primary_extraction_id}),
+            )
+        )
+        operations.extractions.append(
+            DeleteMany({"_id": {"$in": plan.extraction_ids_to_delete}})
+        )
+
+    if plan.primary_verified is not None and plan.verified_update:
+        operations.verified.append(
+            UpdateOne(
+                {"_id": plan.primary_verified["_id"]},
+                verified_set(plan.verified_update),
+            )
+        )
+
+    if plan.verified_ids_to_delete:
+        operations.verified.append(
+            DeleteMany({"_id": {"$in": plan.verified_ids_to_delete}})
+        )
+
+    if plan.judgement_ids_to_delete:
+        operations.judgements.append(
+            DeleteMany({"_id": {"$in": plan.judgement_ids_to_delete}})
+        )
+
+
+def write_in_batches(
+    collection: Collection, operations: list[Any], batch_size: int
+) -> int:
+    for start in range(0, len(operations), batch_size):
+        collection.bulk_write(operations[start : start + batch_size], ordered=True)
+    return math.ceil(len(operations) / batch_size)
+
+
+def apply_bulk_operations(
+    operations: BulkOperations,
+    judgements_collection: Collection,
+    extracted_collection: Collection,
+    verified_collection: Collection,
+    *,
+    batch_size: int,
+) -> int:
+    # Verified docs are repointed before the extractions and judgements they
+    # reference are deleted, matching the per-group order of apply_group.
+    return (
+        write_in_batches(verified_collection, operations.verified, batch_size)
+        + write_in_batches(extracted_collection, operations.extractions, batch_size)
+        + write_in_batches(judgements_collection, operations.judgements, batch_size)
+    )
+
+
+def format_diff_value(value: Any) -> str:
+    text = repr(value)
+    if len(text) > DIFF_VALUE_WIDTH:
+        return text[: DIFF_VALUE_WIDTH - 3] + "..."
+    return text
+
+
+def format_update_diff(
+    collection_name: str, doc: dict[str, Any], update: dict[str, Any]
+) -> list[str]:
+    return [
+        f"  ~ {collection_name} {doc['_id']} {field_name}: "
+        f"{format_diff_value(doc.get(field_name))} -> {format_diff_value(value)}"
+        for field_name, value in update.items()
+    ]
+
+
+def format_plan_diff(plan: GroupPlan) -> list[str]:
+    lines: list[str] = []
+    if plan.primary_extraction is not None:
+        lines.extend(
+            format_update_diff(
+                EXTRACTED_FEATURES_COLLECTION_NAME,
+                plan.primary_extraction,
+                plan.extraction_update,
+            )
+        )
+    if plan.primary_verified is not None:
+        lines.extend(
+            format_update_diff(
+                VERIFIED_FEATURES_COLLECTION_NAME,
+                plan.primary_verified,
+                plan.verified_update,
+            )
+        )
+    lines.extend(
+        format_update_diff(
+            JUDGEMENTS_COLLECTION_NAME, plan.keeper, plan.judgement_update
+        )
+    )
+    if plan.extraction_ids_to_delete and plan.primary_extraction_id is not None:
+        lines.append(
+            f"  ~ {VERIFIED_FEATURES_COLLECTION_NAME} source_llm_extraction_id in "
+            f"{[str(value) for value in plan.extraction_ids_to_delete]} "
+            f"-> {plan.primary_extraction_id}"
+        )
+    for collection_name, ids in (
+        (EXTRACTED_FEATURES_COLLECTION_NAME, plan.extraction_ids_to_delete),
+        (VERIFIED_FEATURES_COLLECTION_NAME, plan.verified_ids_to_delete),
+        (JUDGEMENTS_COLLECTION_NAME, plan.judgement_ids_to_delete),
+    ):
+        lines.extend(f"  - {collection_name} {object_id}" for object_id in ids)
+    return lines
 
+
+def run_bulk(
+    judgements_collection: Collection,
+    extracted_collection: Collection,
+    verified_collection: Collection,
+    args: argparse.Namespace,
+) -> Summary | None:
+    groups = find_duplicate_groups_bulk(
+        judgements_collection,
+        year=args.year,
+        filename=args.filename,
+        limit=args.limit,
+    )
+    if not groups:
+        return None
+
+    summary = Summary()
+    operations = BulkOperations()
+    for group in groups:
+        plan = plan_group(group)
+        record_plan(plan, summary, apply=args.apply)
+        if not args.apply:
+            for line in format_plan_diff(plan):
+                print(line)
+        add_plan_operations(plan, operations)
+
+    if args.apply:
+        round_trips = apply_bulk_operations(
+            operations,
+            judgements_collection,
+            extracted_collection,
+            verified_collection,
+            batch_size=args.batch_size,
+        )
+        print(f"Applied writes in {round_trips} bulk_write round-trips.")
+    return summary
+
+
+def run_per_group(
+    judgements_collection: Collection,
+    extracted_collection: Collection,
+    verified_collection: Collection,
+    args: argparse.Namespace,
+) -> Summary | None:
     groups = find_duplicate_groups(
         judgements_collection,
         extracted_collection,
@@ -451,10 +748,8 @@ def main() -> None:
         filename=args.filename,
         limit=args.limit,
     )
-
     if not groups:
-        print("No duplicate judgement groups found.")
-        return
+        return None
 
     summary = Summary()
     for group in groups:
@@ -466,6 +761,44 @@ def main() -> None:
             apply=args.apply,
             summary=summary,
         )
+    return summary
+
+
+def main() -> None:
+    args = parse_args()
+    db = DB()
+    judgements_collection = db.get_judgements_collection()
+    extracted_collection = db.get_extracted_features_collection()
+    verified_collection = db.get_verified_features_collection()
+
+    string_references = {
+        f"{collection.name}.{field_name}": count_string_references(
+            collection, field_name
+        )
+        for collection, field_name in (
+            (extracted_collection, "source_judgement_id"),
+            (verified_collection, "source_judgement_id"),
+            (verified_collection, "source_llm_extraction_id"),
+        )
+    }
+    if any(string_references.values()):
+        raise SystemExit(
+            f"String id references remain ({string_references}); "
+            "run migrateSourceJudgementIds.py --apply first."
+        )
+
+    if args.bulk:
+        summary = run_bulk(
+            judgements_collection, extracted_collection, verified_collection, args
+        )
+    else:
+        summary = run_per_group(
+            judgements_collection, extracted_collection, verified_collection, args
+        )
+
+    if summary is None:
+        print("No duplicate judgement groups found.")
+        return
 
     mode = "Applied" if args.apply else "Planned"
     print(
@@ -1,6 +1,12 @@
 from __future__ import annotations
 
+import argparse
+import html as html_lib
+import os
 import re
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from typing import Any
 
 from bs4 import BeautifulSoup
@@ -8,12 +14,26 @@ from pymongo import UpdateOne
 from tqdm import tqdm
 
 from db import DB
+from utils.judgement_html import HTML_FIELDS, judgement_html_hash
 
 LANGUAGE_FIELD = "language"
+LANGUAGE_HASH_FIELD = "language_html_hash"
 BATCH_SIZE = 500
+# Documents longer than this are classified from evenly spaced windows rather
+# than the full text; the CJK/Latin ratio is stable well below this size.
+SAMPLE_CHARS = 200_000
+SAMPLE_WINDOWS = 8
+POOL_CHUNKSIZE = 16
 
 CJK_RE = re.compile(r"[\u3400-\u4DBF\u4E00-\u9FFF\uF900-\uFAFF]")
 LATIN_RE = re.compile(r"[A-Za-z]")
+CJK_RUN_RE = re.compile(r"[\u3400-\u4DBF\u4E00-\u9FFF\uF900-\uFAFF]+")
+LATIN_RUN_RE = re.compile(r"[A-Za-z]+")
+SCRIPT_STYLE_RE = re.compile(
+    r"<(script|style)\b[^>]*>.*?</\1\s*>", re.IGNORECASE | re.DOTALL
+)
+COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+TAG_RE = re.compile(r"<[^>]*>")
 
 
 def html_to_text(html: Any) -> str:
@@ -23,12 +43,35 @@ def html_to_text(html: Any) -> str:
     return soup.get_text(separator=" ", strip=True)
 
 
-def detect_language(text: str) -> str:
-    if not text:
-        return "unknown"
+def fast_html_to_text(html: Any) -> str:
+    """Strip markup with regexes instead of building a BeautifulSoup tree."""
+    if not html or not isinstance(html, str):
+        return ""
+    text = SCRIPT_STYLE_RE.sub(" ", html)
+    text = COMMENT_RE.sub(" ", text)
+    text = TAG_RE.sub(" ", text)
+    return html_lib.unescape(text)
+
+
+def count_characters(pattern: re.Pattern[str], text: str) -> int:
+    """Count characters matched by a run pattern without building a match list."""
+    return sum(match.end() - match.start() for match in pattern.finditer(text))
+
+
+def sample_text(text: str) -> tuple[str, float]:
+    """Return a bounded sample of ``text`` and the factor to scale counts by."""
+    if len(text) <= SAMPLE_CHARS:
+        return text, 1.0
+    window = SAMPLE_CHARS // SAMPLE_WINDOWS
+    stride = (len(text) - window) // (SAMPLE_WINDOWS - 1)
+    sample = " ".join(
+        text[start : start + window]
+        for start in range(0, stride * SAMPLE_WINDOWS, stride)
+    )
+    return sample, len(text) / len(sample)
 
-    cjk_count = len(CJK_RE.findall(text))
-    latin_count = len(LATIN_RE.findall(text))
+
+def classify_counts(cjk_count: float, latin_count: float) -> str:
     total = cjk_count + latin_count
 
     if total == 0:
@@ -40,15 +83,68 @@ def detect_language(text: str) -> str:
     return "english"
 
 
+def detect_language(text: str) -> str:
+    if not text:
+        return "unknown"
+
+    cjk_count = len(CJK_RE.findall(text))
+    latin_count = len(LATIN_RE.findall(text))
+    return classify_counts(cjk_count, latin_count)
+
+
+def fast_detect_language(text: str) -> str:
+    if not text:
+        return "unknown"
+
+    sample, scale = sample_text(text)
+    return classify_counts(
+        count_characters(CJK_RUN_RE, sample) * scale,
+        count_characters(LATIN_RUN_RE, sample) * scale,
+    )
+
+
 def build_judgement_text(doc: dict[str, Any]) -> str:
-    parts = [
-        html_to_text(doc.get("html")),
-        html_to_text(doc.get("appeal_html")),
-        html_to_text(doc.get("corrigendum_html")),
-    ]
+    parts = [html_to_text(doc.get(field_name)) for field_name in HTML_FIELDS]
+    return " ".join(part for part in parts if part).strip()
+
+
+def build_fast_judgement_text(doc: dict[str, Any]) -> str:
+    parts = [fast_html_to_text(doc.get(field_name)) for field_name in HTML_FIELDS]
     return " ".join(part for part in parts if part).strip()
 
 
+def classify_document(doc: dict[str, Any], exact: bool = False) -> str:
+    if exact:
+        return detect_language(build_judgement_text(doc))
+    return fast_detect_language(build_fast_judgement_text(doc))
+
+
+def needs_detection(doc: dict[str, Any], digest: str) -> bool:
+    return not doc.get(LANGUAGE_FIELD) or doc.get(LANGUAGE_HASH_FIELD) != digest
+
+
+def iter_pending_docs(
+    cursor: Iterable[dict[str, Any]], *, force: bool, progress: tqdm | None = None
+) -> Iterator[tuple[dict[str, Any], str]]:
+    for doc in cursor:
+        if progress is not None:
+            progress.update()
+        digest = judgement_html_hash(doc)
+        if force or needs_detection(doc, digest):
+            yield doc, digest
+
+
+def iter_batches(items: Iterable[Any], size: int) -> Iterator[list[Any]]:
+    batch: list[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
 def flush_updates(collection, ops: list[UpdateOne]) -> int:
     if not ops:
         return 0
@@ -56,44 +152,79 @@ def flush_updates(collection, ops: list[UpdateOne]) -> int:
     return result.modified_count
 
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="Relabel every document, even when its language and HTML hash are current",
+    )
+    parser.add_argument(
+        "--missing-only",
+        action="store_true",
+        help="Only fetch documents without a language label",
+    )
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Use the BeautifulSoup text path and uncapped character counts",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    return parser.parse_args()
+
+
 def main() -> None:
+    args = parse_args()
     db = DB()
     collection = db.get_judgements_collection()
 
+    query: dict[str, Any] = {}
+    if args.missing_only and not args.all:
+        query = {LANGUAGE_FIELD: {"$in": [None, ""]}}
     cursor = collection.find(
-        {},
+        query,
         {
             "_id": 1,
-            "html": 1,
-            "appeal_html": 1,
-            "corrigendum_html": 1,
+            LANGUAGE_FIELD: 1,
+            LANGUAGE_HASH_FIELD: 1,
+            **{field_name: 1 for field_name in HTML_FIELDS},
         },
     )
 
-    ops: list[UpdateOne] = []
-    total = 0
+    classify = partial(classify_document, exact=args.exact)
+    total_docs = collection.count_documents(query)
+
+    processed = 0
     modified_total = 0
 
-    for doc in tqdm(
-        cursor, desc="Detecting language", total=collection.count_documents({})
+    with (
+        ProcessPoolExecutor(max_workers=max(args.workers, 1)) as executor,
+        tqdm(desc="Detecting language", total=total_docs) as progress,
     ):
-        text = build_judgement_text(doc)
-        language = detect_language(text)
-        ops.append(
-            UpdateOne(
-                {"_id": doc["_id"]},
-                {"$set": {LANGUAGE_FIELD: language}},
+        for batch in iter_batches(
+            iter_pending_docs(cursor, force=args.all, progress=progress),
+            BATCH_SIZE,
+        ):
+            languages = executor.map(
+                classify, (doc for doc, _ in batch), chunksize=POOL_CHUNKSIZE
             )
-        )
-
-        total += 1
-        if len(ops) >= BATCH_SIZE:
+            ops = [
+                UpdateOne(
+                    {"_id": doc["_id"]},
+                    {
+                        "$set": {
+                            LANGUAGE_FIELD: language,
+                            LANGUAGE_HASH_FIELD: digest,
+                        }
+                    },
+                )
+                for (doc, digest), language in zip(batch, languages)
+            ]
+            processed += len(ops)
             modified_total += flush_updates(collection, ops)
-            ops = []
-
-    modified_total += flush_updates(collection, ops)
 
-    print(f"Processed: {total}")
+    print(f"Scanned: {total_docs}")
+    print(f"Processed: {processed}")
     print(f"Updated: {modified_total}")
 
 
@@ -1,3 +1,4 @@
+from .daemon import run_daemon
 from .runner import main
 
-__all__ = ["main"]
+__all__ = ["main", "run_daemon"]
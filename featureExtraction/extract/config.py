@@ -26,6 +26,10 @@ MAX_RETRIES = _get_int_at_least("MAX_RETRIES", 5, 1)
 MODEL = os.getenv("MODEL", "gpt-5-mini")
 EXTRACT_LIMIT = _get_int_at_least("EXTRACT_LIMIT", 0, 0)
 EXTRACT_CONCURRENCY = _get_int_at_least("EXTRACT_CONCURRENCY", 1, 1)
+EXTRACT_POLL_INTERVAL_SECONDS = _get_int_at_least(
+    "EXTRACT_POLL_INTERVAL_SECONDS", 30, 1
+)
+EXTRACT_STATE_PATH = os.getenv("EXTRACT_STATE_PATH", ".cache/extract_daemon_state.json")
 MUST_INCLUDE_TRIALS: list[str] = [
     "[2021] HKDC 1500",
     "[2025] HKCFI 4288",
@@ -0,0 +1,463 @@
+"""Long-running extraction mode.
+
+Watches ``judgement-html`` through a change stream and queues inserted or
+HTML-changed judgements for ``process_judgement_doc``.  Standalone servers do
+not support change streams, so the daemon falls back to polling the
+``updated_at`` index every ``EXTRACT_POLL_INTERVAL_SECONDS``.
+
+The change-stream resume token and the polling watermark are kept in
+``EXTRACT_STATE_PATH``.  Both only advance past a change once its extraction
+has finished, so a restart re-reads anything that was still queued.  On first
+start (or with ``--catch-up``) the existing backlog is queued once through
+``build_docs_to_process``.
+"""
+
+import os
+import signal
+import threading
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+from functools import partial
+from itertools import count
+from typing import Any
+
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+
+from utils.judgement_html import HTML_FIELDS, judgement_html_hash
+
+from .client import create_db
+from .config import (
+    EXTRACT_CONCURRENCY,
+    EXTRACT_POLL_INTERVAL_SECONDS,
+    EXTRACT_STATE_PATH,
+)
+from .runner import ProcessResult, build_docs_to_process, process_judgement_doc
+
+UPDATED_AT_FIELD = "updated_at"
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAM_UNSUPPORTED_CODE = 40573
+WATCH_AWAIT_MS = 1000
+
+OnDone = Callable[[], None]
+
+
+@dataclass
+class DaemonState:
+    resume_token: dict[str, Any] | None = None
+    updated_at: datetime | None = None
+    # ``_id`` of the last polled judgement at ``updated_at``.  insert_many
+    # stamps a whole batch with one ``updated_at``, so the watermark needs the
+    # ``_id`` as a tie-breaker to resume part-way through a batch.
+    last_id: Any = None
+
+    def set_poll_position(self, position: tuple[datetime, Any]) -> None:
+        self.updated_at, self.last_id = position
+
+
+def load_state(path: str) -> DaemonState | None:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        data = json_util.loads(f.read())
+    return DaemonState(
+        resume_token=data.get("resume_token"),
+        updated_at=data.get("updated_at"),
+        last_id=data.get("last_id"),
+    )
+
+
+def save_state(path: str, state: DaemonState) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(
+            json_util.dumps(
+                {
+                    "resume_token": state.resume_token,
+                    "updated_at": state.updated_at,
+                    "last_id": state.last_id,
+                }
+            )
+        )
+    os.replace(tmp_path, path)
+
+
+def build_change_stream_pipeline() -> list[dict[str, Any]]:
+    html_updated = [
+        {f"updateDescription.updatedFields.{field_name}": {"$exists": True}}
+        for field_name in HTML_FIELDS
+    ]
+    return [
+        {
+            "$match": {
+                "$or": [
+                    {"operationType": {"$in": ["insert", "replace"]}},
+                    {"operationType": "update", "$or": html_updated},
+                ]
+            }
+        }
+    ]
+
+
+def extraction_action(
+    judgement_doc: dict,
+    extracted_features_collection: Collection,
+    *,
+    html_changed: bool,
+) -> str | None:
+    """Return ``"insert"``, ``"replace"`` or ``None`` when the extraction is current."""
+    existing = extracted_features_collection.find_one(
+        {"source_judgement_id": judgement_doc["_id"]}, {"source_html_hash": 1}
+    )
+    if existing is None:
+        return "insert"
+    stored_hash = existing.get("source_html_hash")
+    if stored_hash is None:
+        # Extractions written before hashes were stored are only redone when
+        # the change stream reports an HTML edit.
+        return "replace" if html_changed else None
+    if stored_hash != judgement_html_hash(judgement_doc):
+        return "replace"
+    return None
+
+
+class CompletionWatermark:
+    """Stream position that only moves past changes whose extraction finished.
+
+    Positions are tracked in the order they are read.  ``commit`` is called
+    with the newest position that has no unfinished position before it, so
+    a change still queued or running is never skipped after a restart.
+    """
+
+    def __init__(self, commit: Callable[[Any], None]) -> None:
+        self._commit = commit
+        self._lock = threading.Lock()
+        self._sequence = count()
+        # Insertion ordered: sequence number -> [position, finished].
+        self._tracked: dict[int, list[Any]] = {}
+
+    def track(self, position: Any) -> OnDone:
+        with self._lock:
+            sequence = next(self._sequence)
+            self._tracked[sequence] = [position, False]
+        return partial(self._finish, sequence)
+
+    def _finish(self, sequence: int) -> None:
+        with self._lock:
+            self._tracked[sequence][1] = True
+            committed = None
+            while self._tracked:
+                oldest = next(iter(self._tracked))
+                if not self._tracked[oldest][1]:
+                    break
+                committed = self._tracked.pop(oldest)
+            if committed is not None:
+                self._commit(committed[0])
+
+
+class ExtractionQueue:
+    """Bounded work queue in front of ``process_judgement_doc``.
+
+    ``submit`` blocks once ``2 * concurrency`` judgements are running or
+    waiting, which throttles the change stream instead of buffering it.  A
+    judgement that changes again while it is being extracted is re-run once
+    the current extraction finishes, unless the queue is shutting down.
+    ``on_done`` callbacks run once the submitted version has been extracted;
+    a re-run dropped at shutdown never calls them.
+    """
+
+    def __init__(
+        self, extracted_features_collection: Collection, concurrency: int
+    ) -> None:
+        self._collection = extracted_features_collection
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._slots = threading.BoundedSemaphore(concurrency * 2)
+        self._lock = threading.Lock()
+        self._in_flight: set[Any] = set()
+        self._pending: dict[Any, tuple[dict, bool, list[OnDone]]] = {}
+        self._closed = False
+        self.counts: Counter[str] = Counter()
+
+    def submit(
+        self,
+        judgement_doc: dict,
+        *,
+        replace_existing: bool,
+        on_done: OnDone | None = None,
+    ) -> None:
+        source_id = judgement_doc["_id"]
+        callbacks = [on_done] if on_done is not None else []
+        with self._lock:
+            if source_id in self._in_flight:
+                # A newer version supersedes a queued re-run, but the older
+                # version's callbacks still wait for the extraction.
+                queued = self._pending.get(source_id)
+                if queued is not None:
+                    callbacks = queued[2] + callbacks
+                self._pending[source_id] = (judgement_doc, replace_existing, callbacks)
+                return
+            self._in_flight.add(source_id)
+        self._slots.acquire()
+        future = self._executor.submit(
+            process_judgement_doc,
+            judgement_doc,
+            self._collection,
+            replace_existing=replace_existing,
+        )
+        future.add_done_callback(partial(self._finish, source_id, callbacks))
+
+    def _finish(self, source_id: Any, callbacks: list[OnDone], future: Future) -> None:
+        # process_judgement_doc reports extraction errors itself; anything
+        # raised here is a database error from the skip check or write.
+        exc = future.exception()
+        if exc is None:
+            result = future.result()
+        else:
+            result = ProcessResult(
+                status="failed", source_id=source_id, message=str(exc)
+            )
+        log_result(result)
+        for on_done in callbacks:
+            on_done()
+        with self._lock:
+            self.counts[result.status] += 1
+            pending = self._pending.pop(source_id, None)
+            if pending is not None and self._closed:
+                print(
+                    f"Dropping queued re-run of source {source_id}; "
+                    "it is picked up again on restart."
+                )
+                pending = None
+            if pending is None:
+                self._in_flight.discard(source_id)
+            else:
+                # Hand this slot straight to the re-run so worker threads
+                # never block waiting for one.  Submitting under the lock
+                # keeps shutdown from closing the executor in between, since
+                # it sets _closed under the same lock first.
+                judgement_doc, replace_existing, callbacks = pending
+                rerun = self._executor.submit(
+                    process_judgement_doc,
+                    judgement_doc,
+                    self._collection,
+                    replace_existing=replace_existing,
+                )
+        if pending is None:
+            self._slots.release()
+        else:
+            # Outside the lock: a re-run that already finished calls _finish
+            # straight away on this thread.
+            rerun.add_done_callback(partial(self._finish, source_id, callbacks))
+
+    def shutdown(self) -> None:
+        with self._lock:
+            self._closed = True
+        self._executor.shutdown(wait=True)
+
+
+def log_result(result: ProcessResult) -> None:
+    if result.status == "processed":
+        print(f"Extracted features for source {result.source_id}.")
+    elif result.status == "failed":
+        print(f"Failed to process source {result.source_id}: {result.message}")
+    elif result.message:
+        print(result.message)
+
+
+def enqueue_if_needed(
+    judgement_doc: dict,
+    queue: ExtractionQueue,
+    extracted_features_collection: Collection,
+    *,
+    html_changed: bool,
+    on_done: OnDone,
+) -> None:
+    action = extraction_action(
+        judgement_doc, extracted_features_collection, html_changed=html_changed
+    )
+    if action is None:
+        on_done()
+    else:
+        queue.submit(
+            judgement_doc, replace_existing=action == "replace", on_done=on_done
+        )
+
+
+def catch_up(
+    judgements_collection: Collection,
+    extracted_features_collection: Collection,
+    queue: ExtractionQueue,
+) -> None:
+    docs_to_process, judgement_count = build_docs_to_process(
+        judgements_collection, extracted_features_collection
+    )
+    print(f"Catching up on {judgement_count} unprocessed judgement records.")
+    for judgement_doc in docs_to_process:
+        queue.submit(judgement_doc, replace_existing=False)
+
+
+def latest_poll_position(
+    judgements_collection: Collection,
+) -> tuple[datetime, Any] | None:
+    doc = judgements_collection.find_one(
+        {UPDATED_AT_FIELD: {"$exists": True}},
+        {UPDATED_AT_FIELD: 1},
+        sort=[(UPDATED_AT_FIELD, DESCENDING), ("_id", DESCENDING)],
+    )
+    return (doc[UPDATED_AT_FIELD], doc["_id"]) if doc else None
+
+
+def build_poll_query(updated_at: datetime | None, last_id: Any) -> dict[str, Any]:
+    """Match judgements after ``(updated_at, last_id)`` in poll order."""
+    if updated_at is None:
+        return {UPDATED_AT_FIELD: {"$exists": True}}
+    if last_id is None:
+        # State written before the _id tie-breaker was stored: re-read the
+        # whole batch at updated_at; current extractions are skipped.
+        return {UPDATED_AT_FIELD: {"$gte": updated_at}}
+    return {
+        "$or": [
+            {UPDATED_AT_FIELD: {"$gt": updated_at}},
+            {UPDATED_AT_FIELD: updated_at, "_id": {"$gt": last_id}},
+        ]
+    }
+
+
+def watch_changes(
+    judgements_collection: Collection,
+    extracted_features_collection: Collection,
+    queue: ExtractionQueue,
+    state: DaemonState,
+    *,
+    state_path: str,
+    run_catch_up: bool,
+    stop: threading.Event,
+) -> None:
+    # Open the stream before the catch-up so nothing inserted meanwhile is missed.
+    with judgements_collection.watch(
+        build_change_stream_pipeline(),
+        full_document="updateLookup",
+        resume_after=state.resume_token,
+        max_await_time_ms=WATCH_AWAIT_MS,
+    ) as stream:
+        print("Watching judgement-html change stream.")
+        if run_catch_up:
+            catch_up(judgements_collection, extracted_features_collection, queue)
+        watermark = CompletionWatermark(partial(setattr, state, "resume_token"))
+        saved_token = state.resume_token
+        read_token = state.resume_token
+        while not stop.is_set() and stream.alive:
+            change = stream.try_next()
+            judgement_doc = change.get("fullDocument") if change else None
+            if stream.resume_token and stream.resume_token != read_token:
+                read_token = stream.resume_token
+                on_done = watermark.track(read_token)
+                if judgement_doc is None:
+                    on_done()
+                else:
+                    enqueue_if_needed(
+                        judgement_doc,
+                        queue,
+                        extracted_features_collection,
+                        html_changed=change["operationType"] != "insert",
+                        on_done=on_done,
+                    )
+            if state.resume_token != saved_token:
+                saved_token = state.resume_token
+                save_state(state_path, state)
+
+
+def poll_changes(
+    judgements_collection: Collection,
+    extracted_features_collection: Collection,
+    queue: ExtractionQueue,
+    state: DaemonState,
+    *,
+    state_path: str,
+    run_catch_up: bool,
+    stop: threading.Event,
+) -> None:
+    print(
+        f"Polling judgement-html {UPDATED_AT_FIELD} every "
+        f"{EXTRACT_POLL_INTERVAL_SECONDS}s."
+    )
+    if state.updated_at is None:
+        position = latest_poll_position(judgements_collection)
+        if position is not None:
+            state.set_poll_position(position)
+    if run_catch_up:
+        catch_up(judgements_collection, extracted_features_collection, queue)
+
+    watermark = CompletionWatermark(state.set_poll_position)
+    read_at, read_id = state.updated_at, state.last_id
+    while not stop.is_set():
+        query = build_poll_query(read_at, read_id)
+        for judgement_doc in judgements_collection.find(query).sort(
+            [(UPDATED_AT_FIELD, ASCENDING), ("_id", ASCENDING)]
+        ):
+            read_at, read_id = judgement_doc[UPDATED_AT_FIELD], judgement_doc["_id"]
+            enqueue_if_needed(
+                judgement_doc,
+                queue,
+                extracted_features_collection,
+                html_changed=False,
+                on_done=watermark.track((read_at, read_id)),
+            )
+            if stop.is_set():
+                break
+        save_state(state_path, state)
+        stop.wait(EXTRACT_POLL_INTERVAL_SECONDS)
+
+
+def run_daemon(*, force_catch_up: bool = False) -> None:
+    db = create_db()
+    judgements_collection = db.get_judgements_collection()
+    extracted_features_collection = db.get_extracted_features_collection()
+
+    saved_state = load_state(EXTRACT_STATE_PATH)
+    state = saved_state or DaemonState()
+    run_catch_up = force_catch_up or saved_state is None
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    queue = ExtractionQueue(extracted_features_collection, EXTRACT_CONCURRENCY)
+    print(f"Using concurrency={EXTRACT_CONCURRENCY}.")
+    try:
+        try:
+            watch_changes(
+                judgements_collection,
+                extracted_features_collection,
+                queue,
+                state,
+                state_path=EXTRACT_STATE_PATH,
+                run_catch_up=run_catch_up,
+                stop=stop,
+            )
+        except OperationFailure as exc:
+            if exc.code != CHANGE_STREAM_UNSUPPORTED_CODE:
+                raise
+            poll_changes(
+                judgements_collection,
+                extracted_features_collection,
+                queue,
+                state,
+                state_path=EXTRACT_STATE_PATH,
+                run_catch_up=run_catch_up,
+                stop=stop,
+            )
+    finally:
+        print("Waiting for in-flight extractions to finish.")
+        queue.shutdown()
+        save_state(EXTRACT_STATE_PATH, state)
+        print(
+            "Extraction daemon stopped. "
+            + ", ".join(f"{status}={count}" for status, count in queue.counts.items())
+        )
@@ -6,6 +6,8 @@ from typing import Any
 from pymongo.collection import Collection
 from tqdm import tqdm
 
+from utils.judgement_html import judgement_html_hash
+
 from .case_text import build_case_text
 from .client import create_db, create_langfuse, create_openai_client
 from .config import (
@@ -77,12 +79,16 @@ def build_docs_to_process(
 def process_judgement_doc(
     judgement_doc: dict,
     extracted_features_collection: Collection,
+    *,
+    replace_existing: bool = False,
 ) -> ProcessResult:
     source_id = judgement_doc.get("_id")
     if source_id is None:
         return ProcessResult(status="skipped", message="Skipping document without _id.")
 
-    if should_skip_extraction(source_id, extracted_features_collection):
+    if not replace_existing and should_skip_extraction(
+        source_id, extracted_features_collection
+    ):
         return ProcessResult(status="skipped", source_id=source_id)
 
     case_txt, judgement_type = build_case_text(judgement_doc)
@@ -114,8 +120,15 @@ def process_judgement_doc(
             "model": MODEL,
             "judgement_type": judgement_type,
             "trace_id": trace_id,
+            "source_html_hash": judgement_html_hash(judgement_doc),
         }
-        extracted_features_collection.insert_one(extracted_doc)
+        if replace_existing:
+            # Keep the existing _id so verified-features references stay valid.
+            extracted_features_collection.replace_one(
+                {"source_judgement_id": source_id}, extracted_doc, upsert=True
+            )
+        else:
+            extracted_features_collection.insert_one(extracted_doc)
         langfuse.flush()
         return ProcessResult(status="processed", source_id=source_id)
     except Exception as exc:
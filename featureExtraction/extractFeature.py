@@ -1,5 +1,27 @@
 # sys.stderr = open("errors.log", "w")
-from extract.runner import main
+import argparse
+
+from extract import main, run_daemon
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and extract judgements as they are inserted or changed",
+    )
+    parser.add_argument(
+        "--catch-up",
+        action="store_true",
+        help="With --watch, queue the unprocessed backlog even when resuming",
+    )
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
-    main()
+    args = parse_args()
+    if args.watch:
+        run_daemon(force_catch_up=args.catch_up)
+    else:
+        main()
@@ -0,0 +1,301 @@
+"""Declarative MongoDB index spec for the judgement, extraction and verified collections.
+
+Usage (from featureExtraction/):
+
+    uv run indexes.py apply [--dry-run]
+    uv run indexes.py drop [--unmanaged] [--dry-run]
+    uv run indexes.py audit [--since-minutes 1440] [--enable-profiler]
+
+``apply`` creates every index in ``INDEX_SPECS`` that is missing, matching by
+key pattern so indexes created under another name are left alone.  ``drop``
+removes the managed indexes, or with ``--unmanaged`` every index that is not
+in the spec.  ``audit`` lists missing indexes and the collection scans the
+database profiler recorded against these collections.
+"""
+
+import argparse
+from collections import Counter
+from dataclasses import dataclass
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+from db import (
+    DB,
+    EXTRACTED_FEATURES_COLLECTION_NAME,
+    JUDGEMENTS_COLLECTION_NAME,
+    VERIFIED_FEATURES_COLLECTION_NAME,
+)
+
+PROFILE_COLLECTION_NAME = "system.profile"
+PROFILER_SLOW_MS = 50
+AUDIT_SINCE_MINUTES = 24 * 60
+
+IndexKeys = tuple[tuple[str, int | str], ...]
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    collection: str
+    keys: IndexKeys
+    reason: str
+
+    @property
+    def name(self) -> str:
+        return "_".join(
+            f"{field_name}_{direction}" for field_name, direction in self.keys
+        )
+
+    def to_model(self) -> IndexModel:
+        return IndexModel(list(self.keys), name=self.name)
+
+
+INDEX_SPECS: tuple[IndexSpec, ...] = (
+    IndexSpec(
+        JUDGEMENTS_COLLECTION_NAME,
+        (("trial", ASCENDING),),
+        "trial lookups and the runner must-include filter",
+    ),
+    IndexSpec(
+        JUDGEMENTS_COLLECTION_NAME,
+        (("appeal", ASCENDING),),
+        "appeal lookups",
+    ),
+    IndexSpec(
+        JUDGEMENTS_COLLECTION_NAME,
+        (("corrigendum", ASCENDING),),
+        "corrigendum lookups",
+    ),
+    IndexSpec(
+        JUDGEMENTS_COLLECTION_NAME,
+        (("trial", ASCENDING), ("year", DESCENDING)),
+        "latest judgement per trial",
+    ),
+    IndexSpec(
+        JUDGEMENTS_COLLECTION_NAME,
+        (("year", DESCENDING), ("filename", ASCENDING)),
+        "deduplicateJudgements grouping by (filename, year)",
+    ),
+    IndexSpec(
+        JUDGEMENTS_COLLECTION_NAME,
+        (("assigned_to", ASCENDING),),
+        "verification app assignment queries",
+    ),
+    IndexSpec(
+        JUDGEMENTS_COLLECTION_NAME,
+        (("updated_at", ASCENDING), ("_id", ASCENDING)),
+        "extraction daemon polling fallback",
+    ),
+    IndexSpec(
+        EXTRACTED_FEATURES_COLLECTION_NAME,
+        (("source_judgement_id", ASCENDING),),
+        "runner skip check and dedup joins",
+    ),
+    IndexSpec(
+        VERIFIED_FEATURES_COLLECTION_NAME,
+        (
+            ("is_verified", ASCENDING),
+            ("exclude", ASCENDING),
+            ("source_judgement_id", ASCENDING),
+        ),
+        "modelling snapshot and evaluate_verified_sentences filters",
+    ),
+    IndexSpec(
+        VERIFIED_FEATURES_COLLECTION_NAME,
+        (("source_judgement_id", ASCENDING),),
+        "joins from judgement-html and dedup",
+    ),
+    IndexSpec(
+        VERIFIED_FEATURES_COLLECTION_NAME,
+        (("source_llm_extraction_id", ASCENDING),),
+        "dedup repointing of merged extractions",
+    ),
+    IndexSpec(
+        VERIFIED_FEATURES_COLLECTION_NAME,
+        (("judgement.neutral_citation", ASCENDING),),
+        "citation lookups",
+    ),
+    IndexSpec(
+        VERIFIED_FEATURES_COLLECTION_NAME,
+        (("verified_by", ASCENDING),),
+        "verifier username lookups",
+    ),
+    IndexSpec(
+        VERIFIED_FEATURES_COLLECTION_NAME,
+        (("updated_at", ASCENDING),),
+        "incremental modelling snapshot refresh",
+    ),
+    IndexSpec(
+        VERIFIED_FEATURES_COLLECTION_NAME,
+        (("verified_at", ASCENDING),),
+        "incremental modelling snapshot refresh",
+    ),
+)
+MANAGED_COLLECTIONS = tuple(dict.fromkeys(spec.collection for spec in INDEX_SPECS))
+
+
+def existing_index_keys(
+    database: Database, collection_name: str
+) -> dict[str, IndexKeys]:
+    return {
+        name: tuple(
+            (field_name, direction if isinstance(direction, str) else int(direction))
+            for field_name, direction in info["key"]
+        )
+        for name, info in database.get_collection(collection_name)
+        .index_information()
+        .items()
+    }
+
+
+def missing_specs(
+    database: Database, collections: tuple[str, ...] = MANAGED_COLLECTIONS
+) -> list[IndexSpec]:
+    existing = {
+        collection_name: set(existing_index_keys(database, collection_name).values())
+        for collection_name in collections
+    }
+    return [
+        spec
+        for spec in INDEX_SPECS
+        if spec.collection in existing and spec.keys not in existing[spec.collection]
+    ]
+
+
+def apply_indexes(
+    database: Database,
+    *,
+    dry_run: bool,
+    collections: tuple[str, ...] = MANAGED_COLLECTIONS,
+) -> list[IndexSpec]:
+    missing = missing_specs(database, collections)
+    for spec in missing:
+        print(f"  + {spec.collection}.{spec.name} ({spec.reason})")
+    if dry_run:
+        return missing
+    for collection_name in collections:
+        models = [
+            spec.to_model() for spec in missing if spec.collection == collection_name
+        ]
+        if models:
+            database.get_collection(collection_name).create_indexes(models)
+    return missing
+
+
+def drop_indexes(database: Database, *, dry_run: bool, unmanaged: bool) -> list[str]:
+    managed_keys = {(spec.collection, spec.keys) for spec in INDEX_SPECS}
+    dropped: list[str] = []
+    for collection_name in MANAGED_COLLECTIONS:
+        collection = database.get_collection(collection_name)
+        for name, keys in existing_index_keys(database, collection_name).items():
+            if name == "_id_":
+                continue
+            if ((collection_name, keys) in managed_keys) == unmanaged:
+                continue
+            print(f"  - {collection_name}.{name}")
+            dropped.append(f"{collection_name}.{name}")
+            if not dry_run:
+                collection.drop_index(name)
+    return dropped
+
+
+def enable_profiler(database: Database, slow_ms: int = PROFILER_SLOW_MS) -> None:
+    database.command("profile", 1, slowms=slow_ms)
+
+
+def query_shape(entry: dict[str, Any]) -> str:
+    command = entry.get("command") or {}
+    query = command.get("filter") or command.get("query") or command.get("q")
+    pipeline = command.get("pipeline") or []
+    if query is None and pipeline and "$match" in pipeline[0]:
+        query = pipeline[0]["$match"]
+    fields = ", ".join(sorted(query)) if isinstance(query, dict) else ""
+    return f"{entry.get('op', '?')} {{{fields}}}"
+
+
+def profiled_collection_scans(
+    database: Database, *, since: datetime
+) -> Counter[tuple[str, str]]:
+    namespaces = [f"{database.name}.{name}" for name in MANAGED_COLLECTIONS]
+    entries = database.get_collection(PROFILE_COLLECTION_NAME).find(
+        {
+            "ns": {"$in": namespaces},
+            "planSummary": {"$regex": "^COLLSCAN"},
+            "ts": {"$gte": since},
+        },
+        {"ns": 1, "op": 1, "command": 1},
+    )
+    return Counter(
+        (entry["ns"].split(".", 1)[1], query_shape(entry)) for entry in entries
+    )
+
+
+def audit(database: Database, *, since_minutes: int) -> bool:
+    missing = missing_specs(database)
+    print(f"Missing indexes: {len(missing)}")
+    for spec in missing:
+        print(f"  ! {spec.collection}.{spec.name} ({spec.reason})")
+
+    since = datetime.now(UTC) - timedelta(minutes=since_minutes)
+    try:
+        scans = profiled_collection_scans(database, since=since)
+    except OperationFailure as exc:
+        print(f"Profiler unavailable: {exc}")
+        return not missing
+    print(f"Profiled collection scans since {since.isoformat()}: {sum(scans.values())}")
+    for (collection_name, shape), count in scans.most_common():
+        print(f"  ! {collection_name} {shape} x{count}")
+    return not missing and not scans
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    apply_parser = subparsers.add_parser("apply", help="Create missing spec indexes")
+    apply_parser.add_argument("--dry-run", action="store_true")
+
+    drop_parser = subparsers.add_parser("drop", help="Drop managed indexes")
+    drop_parser.add_argument(
+        "--unmanaged",
+        action="store_true",
+        help="Drop indexes that are not in the spec instead",
+    )
+    drop_parser.add_argument("--dry-run", action="store_true")
+
+    audit_parser = subparsers.add_parser(
+        "audit", help="Report missing indexes and profiled collection scans"
+    )
+    audit_parser.add_argument("--since-minutes", type=int, default=AUDIT_SINCE_MINUTES)
+    audit_parser.add_argument(
+        "--enable-profiler",
+        action="store_true",
+        help=f"Turn on the profiler for operations slower than {PROFILER_SLOW_MS}ms",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = parse_args(argv)
+    database = DB().database
+
+    if args.command == "apply":
+        missing = apply_indexes(database, dry_run=args.dry_run)
+        mode = "Planned" if args.dry_run else "Created"
+        print(f"{mode} {len(missing)} indexes.")
+    elif args.command == "drop":
+        dropped = drop_indexes(database, dry_run=args.dry_run, unmanaged=args.unmanaged)
+        mode = "Planned" if args.dry_run else "Dropped"
+        print(f"{mode} {len(dropped)} indexes.")
+    else:
+        if args.enable_profiler:
+            enable_profiler(database)
+        if not audit(database, since_minutes=args.since_minutes):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+from datetime import UTC, datetime
 from db import DB
 from dotenv import load_dotenv
 import pandas as pd
@@ -99,6 +100,8 @@ if __name__ == "__main__":
 
         df.to_excel(os.path.join(file_path, f"judgements_{year}.xlsx"), index=False)
 
+        # updated_at drives the extraction daemon's polling fallback.
+        df["updated_at"] = datetime.now(UTC)
         judgements_collection.insert_many(df.to_dict("records"))
 
         # break
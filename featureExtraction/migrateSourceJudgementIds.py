@@ -0,0 +1,371 @@
+"""Normalise judgement references to ObjectId and verify the hot query plans.
+
+``source_judgement_id`` (and ``source_llm_extraction_id`` on verified docs)
+has been written both as an ObjectId and as its hex string, and some early
+verified docs use ``sourceJudgementId``.  Mixed types force ``$or`` filters
+over both forms.  This tool converts every reference to ObjectId server-side,
+creates the compound indexes used by the modelling and dedup queries, and
+explains those queries to show they run on index plans.  The dedup entries
+explain the filter and pipeline objects deduplicateJudgements.py builds, so
+the check covers the queries it really sends.  Converted verified
+docs get a fresh ``updated_at`` so incremental modelling snapshots pick them up.
+
+Dry run by default; pass ``--apply`` to write.
+"""
+
+import argparse
+from dataclasses import dataclass
+from typing import Any
+
+from bson import ObjectId
+from pymongo.collection import Collection
+
+from db import (
+    DB,
+    EXTRACTED_FEATURES_COLLECTION_NAME,
+    VERIFIED_FEATURES_COLLECTION_NAME,
+)
+from deduplicateJudgements import build_bulk_group_pipeline, build_id_filter
+from indexes import apply_indexes
+
+LEGACY_SOURCE_JUDGEMENT_FIELD = "sourceJudgementId"
+UPDATED_AT_FIELD = "updated_at"
+REFERENCE_FIELDS = {
+    "extracted": ("source_judgement_id",),
+    "verified": ("source_judgement_id", "source_llm_extraction_id"),
+}
+INDEX_STAGES = {"IXSCAN", "COUNT_SCAN", "DISTINCT_SCAN", "IDHACK", "EXPRESS_IXSCAN"}
+
+
+@dataclass(frozen=True)
+class PlanReport:
+    name: str
+    stages: list[str]
+    docs_examined: int | None
+    keys_examined: int | None
+    returned: int | None
+
+    @property
+    def uses_index(self) -> bool:
+        if "COLLSCAN" in self.stages:
+            return False
+        # An empty collection explains as EOF, which is not a scan either way.
+        return self.stages == ["EOF"] or any(
+            stage in INDEX_STAGES for stage in self.stages
+        )
+
+    @property
+    def index_only(self) -> bool:
+        return self.uses_index and "FETCH" not in self.stages
+
+
+def object_id_conversion(field_name: str) -> dict[str, Any]:
+    return {
+        "$convert": {
+            "input": f"${field_name}",
+            "to": "objectId",
+            "onError": f"${field_name}",
+            "onNull": f"${field_name}",
+        }
+    }
+
+
+def count_types(collection: Collection, field_name: str) -> dict[str, int]:
+    pipeline = [
+        {"$group": {"_id": {"$type": f"${field_name}"}, "count": {"$sum": 1}}},
+    ]
+    return {row["_id"]: row["count"] for row in collection.aggregate(pipeline)}
+
+
+def normalise_reference(
+    collection: Collection, field_name: str, *, apply: bool, touch: bool = False
+) -> int:
+    string_filter = {field_name: {"$type": "string"}}
+    if not apply:
+        return collection.count_documents(string_filter)
+    converted: dict[str, Any] = {field_name: object_id_conversion(field_name)}
+    if touch:
+        converted[UPDATED_AT_FIELD] = "$$NOW"
+    result = collection.update_many(string_filter, [{"$set": converted}])
+    return result.modified_count
+
+
+def rename_legacy_source_field(collection: Collection, *, apply: bool) -> int:
+    legacy_filter = {
+        LEGACY_SOURCE_JUDGEMENT_FIELD: {"$exists": True},
+        "source_judgement_id": {"$exists": False},
+    }
+    if not apply:
+        return collection.count_documents(legacy_filter)
+    result = collection.update_many(
+        legacy_filter,
+        [
+            {
+                "$set": {
+                    "source_judgement_id": object_id_conversion(
+                        LEGACY_SOURCE_JUDGEMENT_FIELD
+                    ),
+                    UPDATED_AT_FIELD: "$$NOW",
+                }
+            },
+            {"$unset": LEGACY_SOURCE_JUDGEMENT_FIELD},
+        ],
+    )
+    return result.modified_count
+
+
+def collect_stages(plan: dict[str, Any]) -> list[str]:
+    stages = [plan["stage"]] if "stage" in plan else []
+    for child_key in ("inputStage", "queryPlan"):
+        if child_key in plan:
+            stages.extend(collect_stages(plan[child_key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(collect_stages(child))
+    return stages
+
+
+def plan_report(name: str, explain: dict[str, Any]) -> PlanReport:
+    winning_plan = explain["queryPlanner"]["winningPlan"]
+    execution = explain.get("executionStats", {})
+    return PlanReport(
+        name=name,
+        stages=collect_stages(winning_plan),
+        docs_examined=execution.get("totalDocsExamined"),
+        keys_examined=execution.get("totalKeysExamined"),
+        returned=execution.get("nReturned"),
+    )
+
+
+def explain_find(
+    collection: Collection, query: dict[str, Any], projection: dict[str, Any]
+) -> dict[str, Any]:
+    return collection.database.command(
+        "explain",
+        {"find": collection.name, "filter": query, "projection": projection},
+        verbosity="executionStats",
+    )
+
+
+def explain_count(collection: Collection, query: dict[str, Any]) -> dict[str, Any]:
+    return collection.database.command(
+        "explain",
+        {"count": collection.name, "query": query},
+        verbosity="executionStats",
+    )
+
+
+def explain_aggregate(
+    collection: Collection, pipeline: list[dict[str, Any]]
+) -> dict[str, Any]:
+    return collection.database.command(
+        "explain",
+        {"aggregate": collection.name, "pipeline": pipeline, "cursor": {}},
+        verbosity="executionStats",
+    )
+
+
+def lookup_reports(name: str, explain: dict[str, Any]) -> list[PlanReport]:
+    """One report per ``$lookup`` of an explained aggregation.
+
+    Classic execution lists each ``$lookup`` stage with the indexes it used;
+    the slot-based engine folds it into an ``EQ_LOOKUP`` plan node whose
+    strategy is ``IndexedLoopJoin`` when it probes an index.
+    """
+    reports = []
+    for stage in explain.get("stages", []):
+        if "$lookup" not in stage:
+            continue
+        scans = stage.get("collectionScans", 0)
+        reports.append(
+            PlanReport(
+                name=f"{name} $lookup {stage['$lookup']['from']}",
+                stages=["COLLSCAN"]
+                if scans or not stage.get("indexesUsed")
+                else ["IXSCAN", "FETCH"],
+                docs_examined=stage.get("totalDocsExamined"),
+                keys_examined=stage.get("totalKeysExamined"),
+                returned=stage.get("nReturned"),
+            )
+        )
+    pending = [explain.get("queryPlanner", {}).get("winningPlan", {})]
+    while pending:
+        plan = pending.pop()
+        if plan.get("stage") == "EQ_LOOKUP":
+            reports.append(
+                PlanReport(
+                    name=f"{name} $lookup {plan.get('foreignCollection')}",
+                    stages=["IXSCAN", "FETCH"]
+                    if plan.get("strategy") == "IndexedLoopJoin"
+                    else ["COLLSCAN"],
+                    docs_examined=None,
+                    keys_examined=None,
+                    returned=None,
+                )
+            )
+        pending.extend(plan[key] for key in ("inputStage", "queryPlan") if key in plan)
+        pending.extend(plan.get("inputStages", []))
+    return reports
+
+
+def sample_ids(
+    collection: Collection, field_name: str, limit: int = 50
+) -> list[ObjectId]:
+    return [
+        doc[field_name]
+        for doc in collection.find(
+            {field_name: {"$type": "objectId"}}, {field_name: 1}
+        ).limit(limit)
+    ]
+
+
+def verify_plans(collections: dict[str, Collection]) -> list[PlanReport]:
+    extracted = collections["extracted"]
+    verified = collections["verified"]
+    source_ids = sample_ids(extracted, "source_judgement_id")
+    extraction_ids = sample_ids(extracted, "_id")
+    modelling_query = {"is_verified": True}
+    evaluation_query = {"is_verified": True, "exclude": {"$ne": True}}
+    return [
+        plan_report(
+            "modelling snapshot (verified-features is_verified)",
+            explain_find(
+                verified,
+                modelling_query,
+                {
+                    "source_judgement_id": 1,
+                    "filename": 1,
+                    "exclude": 1,
+                    "judgement.neutral_citation": 1,
+                    "trials": 1,
+                },
+            ),
+        ),
+        plan_report(
+            "modelling source ids (covered)",
+            explain_find(
+                verified, modelling_query, {"_id": 0, "source_judgement_id": 1}
+            ),
+        ),
+        plan_report(
+            "evaluation count (is_verified, exclude != true)",
+            explain_count(verified, evaluation_query),
+        ),
+        plan_report(
+            "runner skip check (llm-extracted-features source_judgement_id)",
+            explain_count(extracted, {"source_judgement_id": {"$in": source_ids[:1]}}),
+        ),
+        plan_report(
+            "dedup extraction lookup",
+            explain_find(
+                extracted, build_id_filter("source_judgement_id", source_ids), {}
+            ),
+        ),
+        plan_report(
+            "dedup verified lookup",
+            explain_find(
+                verified, build_id_filter("source_judgement_id", source_ids), {}
+            ),
+        ),
+        plan_report(
+            "dedup extraction repointing (verified-features source_llm_extraction_id)",
+            explain_find(
+                verified,
+                build_id_filter("source_llm_extraction_id", extraction_ids),
+                {},
+            ),
+        ),
+        plan_report(
+            "citation lookup (judgement.neutral_citation)",
+            explain_find(
+                verified,
+                {"judgement.neutral_citation": "[2021] HKDC 1500"},
+                {"_id": 0, "judgement.neutral_citation": 1},
+            ),
+        ),
+        *lookup_reports(
+            "dedup --bulk",
+            explain_aggregate(
+                collections["judgements"],
+                build_bulk_group_pipeline(year=None, filename=None, limit=50),
+            ),
+        ),
+    ]
+
+
+def print_plan_reports(reports: list[PlanReport]) -> bool:
+    all_indexed = True
+    for report in reports:
+        if report.index_only:
+            verdict = "INDEX-ONLY"
+        elif report.uses_index:
+            verdict = "INDEXED"
+        else:
+            verdict = "COLLSCAN"
+            all_indexed = False
+        print(
+            f"[{verdict}] {report.name}: {' > '.join(report.stages)} "
+            f"keys={report.keys_examined} docs={report.docs_examined} "
+            f"returned={report.returned}"
+        )
+    return all_indexed
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apply", action="store_true")
+    parser.add_argument(
+        "--verify-only",
+        action="store_true",
+        help="Skip the migration and only explain the hot query plans",
+    )
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    db = DB()
+    collections = {
+        "judgements": db.get_judgements_collection(),
+        "extracted": db.get_extracted_features_collection(),
+        "verified": db.get_verified_features_collection(),
+    }
+
+    if not args.verify_only:
+        mode = "APPLY" if args.apply else "DRY RUN"
+        renamed = rename_legacy_source_field(collections["verified"], apply=args.apply)
+        print(
+            f"[{mode}] verified-features {LEGACY_SOURCE_JUDGEMENT_FIELD} "
+            f"-> source_judgement_id: {renamed}"
+        )
+        for collection_key, field_names in REFERENCE_FIELDS.items():
+            collection = collections[collection_key]
+            for field_name in field_names:
+                before = count_types(collection, field_name)
+                converted = normalise_reference(
+                    collection,
+                    field_name,
+                    apply=args.apply,
+                    touch=collection_key == "verified",
+                )
+                print(
+                    f"[{mode}] {collection.name}.{field_name} types={before} "
+                    f"string_to_objectId={converted}"
+                )
+
+        print(f"[{mode}] indexes:")
+        apply_indexes(
+            db.database,
+            dry_run=not args.apply,
+            collections=(
+                EXTRACTED_FEATURES_COLLECTION_NAME,
+                VERIFIED_FEATURES_COLLECTION_NAME,
+            ),
+        )
+
+    all_indexed = print_plan_reports(verify_plans(collections))
+    if not all_indexed:
+        raise SystemExit("At least one hot query still uses a collection scan.")
+
+
+if __name__ == "__main__":
+    main()
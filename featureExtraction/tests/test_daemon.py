@@ -0,0 +1,142 @@
+import threading
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import patch
+
+from extract import daemon
+from extract.runner import ProcessResult
+
+WAIT_SECONDS = 5
+
+
+def wait_until(condition) -> None:
+    deadline = time.monotonic() + WAIT_SECONDS
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out waiting for the extraction queue")
+        time.sleep(0.01)
+
+
+class FakeExtraction:
+    """Stands in for ``process_judgement_doc``; each call blocks until released."""
+
+    def __init__(self, error: Exception | None = None) -> None:
+        self.error = error
+        self.calls: list[tuple[dict, bool]] = []
+        self.release = threading.Event()
+
+    def __call__(self, judgement_doc, collection, *, replace_existing):
+        self.calls.append((judgement_doc, replace_existing))
+        self.release.wait(WAIT_SECONDS)
+        if self.error is not None:
+            raise self.error
+        return ProcessResult(status="processed", source_id=judgement_doc["_id"])
+
+
+class ExtractionQueueTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.extraction = FakeExtraction()
+        patcher = patch.object(daemon, "process_judgement_doc", self.extraction)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.queue = daemon.ExtractionQueue(object(), concurrency=1)
+        self.done: list[str] = []
+
+    def on_done(self, label: str):
+        return lambda: self.done.append(label)
+
+    def test_change_during_extraction_is_rerun_with_the_newest_version(self) -> None:
+        self.queue.submit(
+            {"_id": 1, "v": 1}, replace_existing=False, on_done=self.on_done("v1")
+        )
+        wait_until(lambda: len(self.extraction.calls) == 1)
+        self.queue.submit(
+            {"_id": 1, "v": 2}, replace_existing=True, on_done=self.on_done("v2")
+        )
+        self.queue.submit(
+            {"_id": 1, "v": 3}, replace_existing=True, on_done=self.on_done("v3")
+        )
+        self.extraction.release.set()
+        wait_until(lambda: len(self.done) == 3)
+        self.queue.shutdown()
+
+        self.assertEqual(
+            self.extraction.calls,
+            [({"_id": 1, "v": 1}, False), ({"_id": 1, "v": 3}, True)],
+        )
+        self.assertEqual(self.done, ["v1", "v2", "v3"])
+        self.assertEqual(self.queue.counts["processed"], 2)
+
+    def test_shutdown_drops_a_queued_rerun(self) -> None:
+        self.queue.submit(
+            {"_id": 1, "v": 1}, replace_existing=False, on_done=self.on_done("v1")
+        )
+        wait_until(lambda: len(self.extraction.calls) == 1)
+        self.queue.submit(
+            {"_id": 1, "v": 2}, replace_existing=True, on_done=self.on_done("v2")
+        )
+        shutdown = threading.Thread(target=self.queue.shutdown)
+        shutdown.start()
+        wait_until(lambda: self.queue._closed)
+        self.extraction.release.set()
+        shutdown.join(WAIT_SECONDS)
+
+        self.assertFalse(shutdown.is_alive())
+        self.assertEqual(self.extraction.calls, [({"_id": 1, "v": 1}, False)])
+        self.assertEqual(self.done, ["v1"])
+
+    def test_database_errors_are_counted_as_failures(self) -> None:
+        self.extraction.error = RuntimeError("connection reset")
+        self.extraction.release.set()
+        self.queue.submit(
+            {"_id": 1}, replace_existing=False, on_done=self.on_done("v1")
+        )
+        self.queue.shutdown()
+
+        self.assertEqual(self.done, ["v1"])
+        self.assertEqual(self.queue.counts["failed"], 1)
+
+
+class CompletionWatermarkTest(unittest.TestCase):
+    def test_commits_only_past_a_finished_prefix(self) -> None:
+        committed: list[str] = []
+        watermark = daemon.CompletionWatermark(committed.append)
+        first, second, third = (watermark.track(name) for name in ("a", "b", "c"))
+
+        second()
+        self.assertEqual(committed, [])
+        first()
+        self.assertEqual(committed, ["b"])
+        third()
+        self.assertEqual(committed, ["b", "c"])
+
+
+class BuildPollQueryTest(unittest.TestCase):
+    updated_at = datetime(2026, 1, 1)
+
+    def test_first_poll_reads_every_stamped_judgement(self) -> None:
+        self.assertEqual(
+            daemon.build_poll_query(None, None), {"updated_at": {"$exists": True}}
+        )
+
+    def test_state_without_an_id_rereads_the_batch(self) -> None:
+        self.assertEqual(
+            daemon.build_poll_query(self.updated_at, None),
+            {"updated_at": {"$gte": self.updated_at}},
+        )
+
+    def test_id_breaks_ties_within_a_batch(self) -> None:
+        self.assertEqual(
+            daemon.build_poll_query(self.updated_at, 7),
+            {
+                "$or": [
+                    {"updated_at": {"$gt": self.updated_at}},
+                    {"updated_at": self.updated_at, "_id": {"$gt": 7}},
+                ]
+            },
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
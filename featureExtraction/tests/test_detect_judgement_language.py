@@ -0,0 +1,81 @@
+import unittest
+from pathlib import Path
+
+import detectJudgementLanguage as detect
+
+SAMPLE_DIR = Path(__file__).resolve().parents[1] / "sampleJudgments"
+
+CHINESE = "<p>被告承認一項販運危險藥物罪，違反香港法例第134章《危險藥物條例》第4(1)(a)條。</p>"
+ENGLISH = (
+    "<p>The defendant, CHAN Tai-man (陳大文), pleaded guilty to one charge of "
+    "trafficking in a dangerous drug.</p>"
+)
+MIXED = (
+    "<p>本案涉及 cocaine 約 12.5 克，控方依據 HKSAR v Lau Tak Ming "
+    "[2002] 2 HKLRD 612 一案的量刑指引。</p>"
+)
+
+
+def entity_encoded(text: str) -> str:
+    return "".join(f"&#{ord(char)};" if ord(char) > 127 else char for char in text)
+
+
+class DetectJudgementLanguageTest(unittest.TestCase):
+    def assert_paths_agree(self, doc: dict, expected: str) -> None:
+        self.assertEqual(detect.classify_document(doc, exact=True), expected)
+        self.assertEqual(detect.classify_document(doc), expected)
+
+    def test_sample_judgments_get_the_same_label_on_both_paths(self) -> None:
+        labels = set()
+        for path in sorted(SAMPLE_DIR.glob("*.htm")):
+            doc = {"html": path.read_text(encoding="utf-8", errors="replace")}
+            with self.subTest(path.name):
+                label = detect.classify_document(doc, exact=True)
+                self.assertEqual(detect.classify_document(doc), label)
+                labels.add(label)
+        self.assertEqual(labels, {"chinese", "english"})
+
+    def test_chinese_english_and_mixed_judgments(self) -> None:
+        cases = {
+            "chinese": ({"html": CHINESE * 3}, "chinese"),
+            "entity-encoded chinese": (
+                {"html": entity_encoded(CHINESE) * 3},
+                "chinese",
+            ),
+            "english with chinese names": ({"html": ENGLISH * 20}, "english"),
+            "chinese with english citations": ({"html": MIXED * 5}, "chinese"),
+            "mixed across html fields": (
+                {"html": ENGLISH, "appeal_html": CHINESE * 3},
+                "chinese",
+            ),
+            "too few chinese characters": ({"html": CHINESE}, "english"),
+            "empty": ({"html": "", "appeal_html": None}, "unknown"),
+        }
+        for name, (doc, expected) in cases.items():
+            with self.subTest(name):
+                self.assert_paths_agree(doc, expected)
+
+    def test_long_judgments_are_classified_from_samples(self) -> None:
+        cases = {
+            "english": (MIXED + ENGLISH) * 2000,
+            "chinese": (MIXED + CHINESE) * 2000,
+        }
+        for expected, html in cases.items():
+            doc = {"html": html}
+            with self.subTest(expected):
+                self.assertGreater(
+                    len(detect.build_fast_judgement_text(doc)), detect.SAMPLE_CHARS
+                )
+                self.assert_paths_agree(doc, expected)
+
+    def test_fast_text_drops_scripts_styles_and_comments(self) -> None:
+        html = (
+            "<style>p { color: red }</style><script>var x = 1;</script>"
+            "<!-- note --><p>陳大文 &amp; Lee</p>"
+        )
+
+        self.assertEqual(detect.fast_html_to_text(html).split(), ["陳大文", "&", "Lee"])
+
+
+if __name__ == "__main__":
+    unittest.main()
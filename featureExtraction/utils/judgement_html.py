@@ -0,0 +1,14 @@
+import hashlib
+from typing import Any
+
+HTML_FIELDS = ("html", "appeal_html", "corrigendum_html")
+
+
+def judgement_html_hash(doc: dict[str, Any]) -> str:
+    """Hash the HTML fields of a judgement doc to detect content changes."""
+    digest = hashlib.sha1()
+    for field_name in HTML_FIELDS:
+        value = doc.get(field_name)
+        digest.update(value.encode("utf-8") if isinstance(value, str) else b"")
+        digest.update(b"\x00")
+    return digest.hexdigest()
@@ -0,0 +1,276 @@
+"""Memoised, make-style stages for the modelling notebooks.
+
+A ``Stage`` is a function that reads named values and produces named values.
+The values are either sources passed in by the caller (the flattened trial
+tables, the notebook directory) or outputs of earlier stages.  Every stage's
+outputs are pickled to ``.cache/analysis_pipeline/<stage>/<key>.pkl`` and
+reused while the key is unchanged.  The key hashes:
+
+- the source and defaults of the stage function and of every notebook
+  function it calls, directly or not, whether defined in the same module or
+  imported from another one under ``LOCAL_CODE_DIRS``, plus the upper-case
+  constants they read.
+- the source file of every notebook module or class those functions use, such
+  as ``verified_snapshot`` in ``verified_snapshot.read_parquet(...)``.
+  Library code (numpy, pandas, the standard library) is not hashed; bump
+  ``PIPELINE_FORMAT_VERSION`` when an upgrade changes stage outputs.
+- the content of each source it reads, or the key of the stage that produced
+  each input.
+- the bytes of the files in the notebook directory the stage reads.
+
+So a change to ``learn_factor_effects`` refits the factor effects and the
+stages downstream of them but loads the cached reconciliation, split and
+curves.  Only the outputs a caller asks for, and the stages they need, are
+loaded or run.  Each stage keeps the outputs of its ``STAGE_CACHE_KEYS`` most
+recently used keys, so switching back to an earlier configuration is still
+a cache hit.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import inspect
+import json
+import pickle
+import re
+import types
+from collections.abc import Callable, Iterable, Mapping
+from dataclasses import dataclass, field
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+PIPELINE_DIRNAME = "analysis_pipeline"
+# Bump to discard every cached stage output, e.g. after a pandas upgrade that
+# changes how pickled frames read back.
+PIPELINE_FORMAT_VERSION = 1
+STAGE_CACHE_KEYS = 4
+# Code under these directories is part of a stage's key; anything else is a
+# library.
+LOCAL_CODE_DIRS = (Path(__file__).resolve().parent,)
+
+
+@dataclass(frozen=True)
+class Stage:
+	"""``run(**{parameter: values[name] for parameter, name in inputs.items()})``
+	returns one value per name in ``outputs`` (a tuple when there are several)."""
+
+	name: str
+	run: Callable[..., Any]
+	inputs: Mapping[str, str]
+	outputs: tuple[str, ...]
+	files: tuple[str, ...] = field(default=())
+
+
+def stage_cache_dir(notebook_dir: Path) -> Path:
+	return notebook_dir / ".cache" / PIPELINE_DIRNAME
+
+
+def json_text(value: Any) -> str:
+	return json.dumps(value, sort_keys=True, default=str)
+
+
+def frame_digest(frame: pd.DataFrame) -> str:
+	"""Hash a frame's columns, dtypes, index and values.  List, tuple and dict
+	cells are hashed through their JSON text."""
+	encoded: dict[str, pd.Series] = {}
+	for column, dtype in frame.dtypes.items():
+		if dtype == object:
+			encoded[column] = frame[column].map(
+				lambda value: json_text(value) if isinstance(value, (list, tuple, dict, set)) else value
+			)
+	hashable = frame.assign(**encoded) if encoded else frame
+	digest = hashlib.sha256()
+	digest.update(json_text([[str(column), str(dtype)] for column, dtype in frame.dtypes.items()]).encode())
+	row_hashes = pd.util.hash_pandas_object(hashable.set_axis(range(frame.shape[1]), axis=1), index=True)
+	digest.update(row_hashes.to_numpy().tobytes())
+	return digest.hexdigest()
+
+
+def content_digest(value: Any) -> str:
+	"""A stable hash of ``value`` that does not depend on set or dict order."""
+	if isinstance(value, pd.DataFrame):
+		return frame_digest(value)
+	if isinstance(value, pd.Series):
+		return frame_digest(value.to_frame())
+	if isinstance(value, np.ndarray):
+		return hashlib.sha256(f"{value.dtype}{value.shape}".encode() + value.tobytes()).hexdigest()
+	if isinstance(value, Mapping):
+		parts = sorted(f"{content_digest(key)}:{content_digest(item)}" for key, item in value.items())
+	elif isinstance(value, (set, frozenset)):
+		parts = sorted(content_digest(item) for item in value)
+	elif isinstance(value, (list, tuple)):
+		parts = [content_digest(item) for item in value]
+	elif isinstance(value, re.Pattern):
+		parts = [value.pattern, str(value.flags)]
+	else:
+		parts = [type(value).__name__, repr(value)]
+	return hashlib.sha256("\x1f".join([type(value).__name__, *parts]).encode()).hexdigest()
+
+
+def file_digest(path: Path) -> str:
+	if not path.is_file():
+		return "missing"
+	return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def referenced_names(code: types.CodeType) -> set[str]:
+	names = set(code.co_names)
+	for constant in code.co_consts:
+		if isinstance(constant, types.CodeType):
+			names |= referenced_names(constant)
+	return names
+
+
+def local_source_file(value: Any) -> Path | None:
+	"""The file defining a module, class or function under ``LOCAL_CODE_DIRS``;
+	None for library and built-in code."""
+	try:
+		path = Path(inspect.getfile(value)).resolve()
+	except TypeError:
+		return None
+	if "site-packages" in path.parts or not any(path.is_relative_to(root) for root in LOCAL_CODE_DIRS):
+		return None
+	return path
+
+
+@lru_cache(maxsize=None)
+def code_fingerprint(function: Callable[..., Any]) -> str:
+	"""Hash ``function`` with every notebook function, module, class and
+	constant it reaches, following imports between notebook modules."""
+	pending = [function]
+	seen: set[str] = set()
+	parts: list[str] = []
+	while pending:
+		current = pending.pop()
+		identity = f"{current.__module__}.{current.__qualname__}"
+		if identity in seen:
+			continue
+		seen.add(identity)
+		parts.append(inspect.getsource(current))
+		parts.append(content_digest([current.__defaults__, current.__kwdefaults__]))
+		module_globals = current.__globals__
+		for name in sorted(referenced_names(current.__code__)):
+			if name not in module_globals:
+				continue
+			value = module_globals[name]
+			if inspect.isfunction(value):
+				if value.__module__ == current.__module__ or local_source_file(value) is not None:
+					pending.append(value)
+			elif inspect.ismodule(value) or inspect.isclass(value):
+				path = local_source_file(value)
+				if path is not None:
+					parts.append(f"{path.name}={file_digest(path)}")
+			elif name.isupper():
+				parts.append(f"{name}={content_digest(value)}")
+	return hashlib.sha256("\n".join(sorted(parts)).encode()).hexdigest()
+
+
+def stage_keys(
+	stages: list[Stage],
+	sources: Mapping[str, Any],
+	notebook_dir: Path,
+) -> dict[str, str]:
+	"""Key every stage, in order, from its code, inputs and files."""
+	value_keys = {name: content_digest(value) for name, value in sources.items()}
+	keys: dict[str, str] = {}
+	for stage in stages:
+		missing = [name for name in stage.inputs.values() if name not in value_keys]
+		if missing:
+			raise KeyError(f"Stage {stage.name!r} reads {missing}, which no source or earlier stage provides")
+		key = hashlib.sha256(json_text({
+			"format_version": PIPELINE_FORMAT_VERSION,
+			"stage": stage.name,
+			"code": code_fingerprint(stage.run),
+			"inputs": {parameter: value_keys[name] for parameter, name in stage.inputs.items()},
+			"outputs": stage.outputs,
+			"files": {filename: file_digest(notebook_dir / filename) for filename in stage.files},
+		}).encode()).hexdigest()[:32]
+		keys[stage.name] = key
+		for output in stage.outputs:
+			value_keys[output] = f"{stage.name}:{output}:{key}"
+	return keys
+
+
+def stage_path(cache_dir: Path, stage: Stage, key: str) -> Path:
+	return cache_dir / re.sub(r"[^a-z0-9]+", "_", stage.name.lower()).strip("_") / f"{key}.pkl"
+
+
+def load_stage(path: Path) -> dict[str, Any] | None:
+	if not path.exists():
+		return None
+	try:
+		with path.open("rb") as handle:
+			values = pickle.load(handle)
+	except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+		return None
+	# The modification time records the last use for save_stage's pruning.
+	path.touch()
+	return values
+
+
+def save_stage(path: Path, values: dict[str, Any], keep: int = STAGE_CACHE_KEYS) -> None:
+	"""Write the stage outputs and drop all but the ``keep`` most recently used
+	keys of the stage, this one included."""
+	path.parent.mkdir(parents=True, exist_ok=True)
+	temporary_path = path.with_suffix(".tmp")
+	with temporary_path.open("wb") as handle:
+		pickle.dump(values, handle, protocol=pickle.HIGHEST_PROTOCOL)
+	temporary_path.replace(path)
+	older_paths = sorted(
+		(cached_path for cached_path in path.parent.glob("*.pkl") if cached_path != path),
+		key=lambda cached_path: cached_path.stat().st_mtime_ns,
+		reverse=True,
+	)
+	for stale_path in older_paths[keep - 1:]:
+		stale_path.unlink(missing_ok=True)
+
+
+def run_stages(
+	stages: list[Stage],
+	sources: Mapping[str, Any],
+	outputs: Iterable[str],
+	*,
+	notebook_dir: Path,
+	cache_dir: Path | None = None,
+) -> tuple[dict[str, Any], pd.DataFrame]:
+	"""Return the requested ``outputs`` and a log of the stages used.
+
+	Stages whose cached outputs match their key are loaded instead of run.
+	``cache_dir=None`` runs every needed stage without reading or writing the
+	cache.  The log has one row per stage with its key and whether it was
+	``cached``, ``run`` or ``not needed``.
+	"""
+	keys = stage_keys(stages, sources, notebook_dir)
+	producers = {output: stage for stage in stages for output in stage.outputs}
+	values: dict[str, Any] = dict(sources)
+	status = {stage.name: "not needed" for stage in stages}
+
+	def resolve(name: str) -> Any:
+		if name not in values:
+			stage = producers[name]
+			path = None if cache_dir is None else stage_path(cache_dir, stage, keys[stage.name])
+			cached = None if path is None else load_stage(path)
+			if cached is None:
+				result = stage.run(**{
+					parameter: resolve(input_name) for parameter, input_name in stage.inputs.items()
+				})
+				cached = dict(zip(stage.outputs, result if len(stage.outputs) > 1 else (result,)))
+				if path is not None:
+					save_stage(path, cached)
+				status[stage.name] = "run"
+			else:
+				status[stage.name] = "cached"
+			values.update(cached)
+		return values[name]
+
+	requested = {name: resolve(name) for name in outputs}
+	log = pd.DataFrame({
+		"stage": [stage.name for stage in stages],
+		"key": [keys[stage.name] for stage in stages],
+		"status": [status[stage.name] for stage in stages],
+	})
+	return requested, log
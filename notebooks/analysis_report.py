@@ -0,0 +1,132 @@
+"""Report output for the modelling notebooks.
+
+``write_report`` takes an ordered mapping of sheet name to DataFrame and
+writes any of:
+
+- ``xlsx``: a write-only openpyxl workbook that streams rows instead of
+  building every cell in memory first.
+- ``parquet`` / ``csv``: one file per sheet in a directory named after the
+  workbook, e.g. ``linear_interpolation_analysis/held_out_predictions.csv``.
+  Parquet needs ``pyarrow``.
+
+List, tuple and dict values are written as JSON text in every format.  Only
+object and string columns are inspected, and characters Excel rejects are
+stripped column-wise for the workbook.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from collections.abc import Iterable, Mapping
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+from openpyxl import Workbook
+
+import verified_snapshot
+
+EXCEL_ILLEGAL_CHARACTERS = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F]")
+REPORT_FORMATS = ("xlsx", "parquet", "csv")
+
+
+def sheet_slug(sheet_name: str) -> str:
+	return re.sub(r"[^a-z0-9]+", "_", sheet_name.lower()).strip("_")
+
+
+def object_columns(frame: pd.DataFrame) -> list[str]:
+	return [column for column, dtype in frame.dtypes.items() if dtype == object]
+
+
+def string_columns(frame: pd.DataFrame) -> list[str]:
+	return [
+		column
+		for column, dtype in frame.dtypes.items()
+		if dtype != object and pd.api.types.is_string_dtype(dtype)
+	]
+
+
+def containers_as_json(frame: pd.DataFrame) -> pd.DataFrame:
+	"""Replace list, tuple and dict cells with their JSON text."""
+	encoded: dict[str, pd.Series] = {}
+	for column in object_columns(frame):
+		values = frame[column]
+		is_container = values.map(lambda value: isinstance(value, (list, tuple, dict))).to_numpy(dtype=bool)
+		if is_container.any():
+			encoded[column] = values.where(
+				~is_container,
+				values[is_container].map(lambda value: json.dumps(value, default=str)),
+			)
+	return frame.assign(**encoded) if encoded else frame
+
+
+def excel_safe_frame(frame: pd.DataFrame) -> pd.DataFrame:
+	"""JSON-encode containers and strip characters that Excel rejects."""
+	frame = containers_as_json(frame)
+	cleaned = {
+		column: frame[column].str.replace(EXCEL_ILLEGAL_CHARACTERS, "", regex=True)
+		for column in string_columns(frame)
+	}
+	for column in object_columns(frame):
+		values = frame[column]
+		is_text = values.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool)
+		if is_text.any():
+			cleaned[column] = values.where(
+				~is_text,
+				values[is_text].astype(str).str.replace(EXCEL_ILLEGAL_CHARACTERS, "", regex=True),
+			)
+	return frame.assign(**cleaned) if cleaned else frame
+
+
+def excel_rows(frame: pd.DataFrame) -> Iterable[tuple[Any, ...]]:
+	yield tuple(str(column) for column in frame.columns)
+	values = frame.astype(object)
+	yield from values.where(values.notna(), None).itertuples(index=False, name=None)
+
+
+def write_workbook(path: Path, sheets: Mapping[str, pd.DataFrame]) -> None:
+	workbook = Workbook(write_only=True)
+	for sheet_name, frame in sheets.items():
+		worksheet = workbook.create_sheet(sheet_name)
+		for row in excel_rows(excel_safe_frame(frame)):
+			worksheet.append(row)
+	temporary_path = path.with_name(f"{path.stem}.tmp{path.suffix}")
+	workbook.save(temporary_path)
+	temporary_path.replace(path)
+
+
+def write_report(
+	path: Path,
+	sheets: Mapping[str, pd.DataFrame],
+	formats: Iterable[str] = ("xlsx",),
+) -> list[Path]:
+	"""Write ``sheets`` in each of ``formats`` and return the paths written.
+
+	``path`` is the workbook path; table formats go in the directory of the
+	same name without the suffix.
+	"""
+	formats = tuple(formats)
+	unknown = set(formats) - set(REPORT_FORMATS)
+	if unknown:
+		raise ValueError(f"Report formats must be among {REPORT_FORMATS}, got {sorted(unknown)}")
+	if "parquet" in formats and not verified_snapshot.arrow_available():
+		raise RuntimeError("Parquet reports need pyarrow")
+	written: list[Path] = []
+	if "xlsx" in formats:
+		write_workbook(path, sheets)
+		written.append(path)
+	table_formats = [report_format for report_format in formats if report_format != "xlsx"]
+	if table_formats:
+		table_dir = path.with_suffix("")
+		table_dir.mkdir(parents=True, exist_ok=True)
+		for sheet_name, frame in sheets.items():
+			table = containers_as_json(frame)
+			for report_format in table_formats:
+				table_path = table_dir / f"{sheet_slug(sheet_name)}.{report_format}"
+				if report_format == "csv":
+					table.to_csv(table_path, index=False)
+				else:
+					table.to_parquet(table_path, index=False)
+				written.append(table_path)
+	return written
@@ -0,0 +1,99 @@
+"""Single-prediction latency and memory of the deployment predictor.
+
+Interactive predictions go through ``predict`` one case at a time, so this
+times one representative case with a warm profile cache and reports:
+
+- ``microseconds``: best mean time per call over ``REPEATS`` runs.
+- ``peak_bytes``: the most memory held at once during one call, as traced by
+  ``tracemalloc``.  The call's result is included.
+- ``retained_bytes``: memory still held after the call, i.e. the result.
+
+``PEAK_BYTES_BUDGET`` pins the peak of each call and ``MICROSECONDS_BUDGET``
+its time; ``test_linear_interpolation_model`` fails when a change goes over
+either.  The time budget is some 25 times the measured cost, so it catches
+an accidental per-call rebuild rather than noise on a loaded machine.
+"""
+
+from __future__ import annotations
+
+import timeit
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+import pandas as pd
+
+from data_derived_linear_model import DataDerivedLinearPredictor
+
+CALLS_PER_REPEAT = 20_000
+REPEATS = 5
+PEAK_BYTES_BUDGET = {
+	"predict": 3072,
+	"predict_stages": 2048,
+}
+MICROSECONDS_BUDGET = {
+	"predict": 500.0,
+	"predict_stages": 500.0,
+}
+
+
+def benchmark_case(predictor: DataDerivedLinearPredictor) -> dict[str, Any]:
+	"""Two drugs, learned aggravating and mitigating factors, a plea and a
+	role profile: every stage of the prediction does work."""
+	return {
+		"drug_amounts": {"Cocaine": 120.0, "Heroin": 30.0},
+		"aggravating_factors": list(predictor.factor_effects["aggravation"])[:2],
+		"mitigating_factors": list(predictor.factor_effects["mitigation"])[:1],
+		"pleaded_guilty": True,
+		"guilty_plea_stage": "Up to committal",
+		"primary_role": "Actual trafficker",
+		"additional_circumstances": ["Divan keeping"],
+	}
+
+
+def call_memory(call: Callable[[], Any]) -> tuple[int, int]:
+	"""Peak and retained traced bytes of one ``call()``."""
+	call()
+	tracemalloc.start()
+	try:
+		before, _ = tracemalloc.get_traced_memory()
+		tracemalloc.reset_peak()
+		result = call()
+		retained, peak = tracemalloc.get_traced_memory()
+	finally:
+		tracemalloc.stop()
+	del result
+	return peak - before, retained - before
+
+
+def call_microseconds(call: Callable[[], Any], calls: int = CALLS_PER_REPEAT, repeats: int = REPEATS) -> float:
+	return min(timeit.repeat(call, number=calls, repeat=repeats)) / calls * 1e6
+
+
+def benchmark_predictor(
+	predictor: DataDerivedLinearPredictor | None = None,
+	case: dict[str, Any] | None = None,
+	*,
+	calls: int = CALLS_PER_REPEAT,
+	repeats: int = REPEATS,
+) -> pd.DataFrame:
+	predictor = predictor or DataDerivedLinearPredictor()
+	case = case or benchmark_case(predictor)
+	rows = []
+	for method in PEAK_BYTES_BUDGET:
+		predict = getattr(predictor, method)
+		call = lambda: predict(**case)
+		peak_bytes, retained_bytes = call_memory(call)
+		rows.append({
+			"method": method,
+			"microseconds": call_microseconds(call, calls, repeats),
+			"peak_bytes": peak_bytes,
+			"retained_bytes": retained_bytes,
+			"peak_bytes_budget": PEAK_BYTES_BUDGET[method],
+			"microseconds_budget": MICROSECONDS_BUDGET[method],
+		})
+	return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+	print(benchmark_predictor().to_string(index=False))
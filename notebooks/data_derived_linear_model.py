@@ -5,16 +5,39 @@ curves and direct-adjustment effects live in ``data_derived_linear_model.json``;
 regenerate that artifact by running the analysis notebook against an approved
 cache snapshot.  This module never reads MongoDB and does not need pandas,
 numpy, or scikit-learn.
+
+The artifact is compiled once at load time into a ``CompiledModel``:
+
+- curve knots as bisect-ready tuples.
+- interned canonical factor names with integer ids.
+- one effect table per stage, indexed by factor id.
+
+``predict_stages`` returns a ``Prediction`` tuple and ``predict`` renders the
+same prediction as a plain dict.  Factor and role arguments resolve to a
+``CaseProfile`` shared by every case with those arguments; its status strings
+are only built when read.
+
+``predict_many`` scores a batch of cases and returns one list per result
+column.  When NumPy is installed the curve interpolation and stage
+arithmetic run column-wise; the results are the same numbers ``predict``
+returns case by case.
 """
 
 from __future__ import annotations
 
+import hashlib
 import json
 import math
+import sys
 from bisect import bisect_right
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, Mapping, Sequence
+from typing import Any, Iterable, Mapping, NamedTuple, Sequence
 
+try:
+	import numpy as np
+except ImportError:  # NumPy only speeds up predict_many.
+	np = None
 
 DEFAULT_MODEL_PATH = Path(__file__).with_suffix(".json")
 ROLE_FACTOR = "Role of the defendant"
@@ -41,6 +64,179 @@ LEGACY_DRUG_ARGUMENTS = {
 	"cannabisresin_amount": "Cannabis",
 	"herbalcannabis_amount": "Cannabis",
 }
+STAGE_COLUMNS = (
+	"starting_point_months",
+	"role_enhancement_months",
+	"sentence_after_role_months",
+	"aggravation_months",
+	"notional_sentence_months",
+	"mitigation_reduction_months",
+	"pre_plea_months",
+	"plea_reduction_months",
+	"final_sentence_months",
+)
+EFFECT_STAGES = ("aggravation", "mitigation", "plea")
+FACTOR_STATUS_STAGES = ("role", *EFFECT_STAGES)
+BATCH_COLUMNS = (
+	"status",
+	"unsupported_drugs",
+	*(f"{stage}_status" for stage in FACTOR_STATUS_STAGES),
+	*STAGE_COLUMNS,
+)
+# Resolved factor and role profiles each predictor keeps; requests carry
+# free-text factors, so the distinct profiles are unbounded.
+PROFILE_CACHE_SIZE = 4096
+
+
+def artifact_digest(model: Mapping[str, Any]) -> str:
+	"""Content hash of a parsed artifact, independent of its JSON formatting."""
+	return hashlib.sha256(json.dumps(model, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class CompiledModel(NamedTuple):
+	"""Lookup tables built once from the artifact for the per-case path."""
+
+	# drug -> (knot quantities, knot months)
+	curves: dict[str, tuple[tuple[float, ...], tuple[float, ...]]]
+	# raw or canonical factor name -> interned canonical name
+	canonical_factors: dict[str, str]
+	# canonical factor name -> factor id
+	factor_ids: dict[str, int]
+	# one table per EFFECT_STAGES entry: effect fraction by factor id, None
+	# when the stage has no effect for that factor
+	stage_effects: tuple[tuple[float | None, ...], ...]
+
+
+def compile_model(
+	drug_curves: Mapping[str, Sequence[tuple[float, float]]],
+	factor_effects: Mapping[str, Mapping[str, float]],
+	canonical_factor_map: Mapping[str, str],
+) -> CompiledModel:
+	names = dict.fromkeys([
+		*canonical_factor_map.values(),
+		*(factor for stage in EFFECT_STAGES for factor in factor_effects.get(stage, {})),
+	])
+	factor_ids = {sys.intern(name): factor_id for factor_id, name in enumerate(names)}
+	canonical_factors = {name: name for name in factor_ids}
+	canonical_factors.update(
+		(raw, sys.intern(canonical)) for raw, canonical in canonical_factor_map.items()
+	)
+	return CompiledModel(
+		curves={
+			drug: (
+				tuple(quantity for quantity, _ in knots),
+				tuple(months for _, months in knots),
+			)
+			for drug, knots in drug_curves.items()
+		},
+		canonical_factors=canonical_factors,
+		factor_ids=factor_ids,
+		stage_effects=tuple(
+			tuple(factor_effects.get(stage, {}).get(name) for name in factor_ids)
+			for stage in EFFECT_STAGES
+		),
+	)
+
+
+def stage_factor_status(factors: Sequence[str], unsupported: Sequence[str]) -> str:
+	"""Status of one effect stage's factors, listing ``unsupported`` in order."""
+	if not factors:
+		return "no factors"
+	if unsupported:
+		return f"unsupported factors: {' | '.join(unsupported)}"
+	return "supported"
+
+
+class CaseProfile:
+	"""The role and factor effects resolved from one set of factor and role
+	arguments.  Stage tuples follow ``EFFECT_STAGES``."""
+
+	__slots__ = ("role_effect", "role_status", "stage_factors", "stage_effects", "unsupported_factors", "_factors")
+
+	def __init__(
+		self,
+		role_effect: float | None,
+		role_status: str,
+		stage_factors: tuple[tuple[str, ...], ...],
+		stage_effects: tuple[tuple[float, ...], ...],
+		unsupported_factors: tuple[tuple[str, ...], ...],
+	) -> None:
+		self.role_effect = role_effect
+		self.role_status = role_status
+		self.stage_factors = stage_factors
+		# Each factor's effect fraction, 0 when unsupported.
+		self.stage_effects = stage_effects
+		self.unsupported_factors = unsupported_factors
+		self._factors: dict[str, str] | None = None
+
+	@property
+	def factors(self) -> dict[str, str]:
+		"""Status of the role profile and of each stage's factors."""
+		if self._factors is None:
+			factors = {"role": self.role_status}
+			for stage, stage_factors, unsupported in zip(
+				EFFECT_STAGES,
+				self.stage_factors,
+				self.unsupported_factors,
+			):
+				factors[stage] = stage_factor_status(stage_factors, unsupported)
+			self._factors = factors
+		return self._factors
+
+
+class Prediction(NamedTuple):
+	"""One prediction.  Stage months are ``None`` unless ``status`` is
+	``"supported"``."""
+
+	status: str
+	unsupported_drugs: list[str]
+	drug_amounts: dict[str, float] | None
+	profile: CaseProfile | None
+	adjustment_strategy: str
+	starting_point_months: float | None = None
+	role_enhancement_months: float | None = None
+	sentence_after_role_months: float | None = None
+	aggravation_months: float | None = None
+	notional_sentence_months: float | None = None
+	mitigation_reduction_months: float | None = None
+	pre_plea_months: float | None = None
+	plea_reduction_months: float | None = None
+	final_sentence_months: float | None = None
+
+	@property
+	def stages(self) -> dict[str, float | None]:
+		return dict(zip(STAGE_COLUMNS, self[5:]))
+
+	@property
+	def factors(self) -> dict[str, str]:
+		return {} if self.profile is None else dict(self.profile.factors)
+
+	@property
+	def reported_months(self) -> dict[str, int]:
+		if self.status != "supported":
+			return {}
+		return {name: round(value) for name, value in zip(STAGE_COLUMNS, self[5:])}
+
+	def as_dict(self) -> dict[str, Any]:
+		"""The result format of ``DataDerivedLinearPredictor.predict``."""
+		if self.status != "supported":
+			return {
+				"status": self.status,
+				"unsupported_drugs": self.unsupported_drugs,
+				"starting_point_months": None,
+				"final_sentence_months": None,
+				"reported_months": {},
+			}
+		stages = self.stages
+		return {
+			"status": "supported",
+			"adjustment_strategy": self.adjustment_strategy,
+			"unsupported_drugs": [],
+			"drug_amounts": self.drug_amounts,
+			"factors": self.factors,
+			**stages,
+			"reported_months": {name: round(value) for name, value in stages.items()},
+		}
 
 
 class DataDerivedLinearPredictor:
@@ -62,6 +258,13 @@ class DataDerivedLinearPredictor:
 			drug: [(float(quantity), float(months)) for quantity, months in knots]
 			for drug, knots in self.model["drug_curves"].items()
 		}
+		self.knot_arrays = None if np is None else {
+			drug: (
+				np.array([quantity for quantity, _ in knots], dtype=float),
+				np.array([months for _, months in knots], dtype=float),
+			)
+			for drug, knots in self.drug_curves.items()
+		}
 		strategy_sources = {
 			"learned": "factor_effects",
 			"legacy_percentages": "legacy_percentage_effects",
@@ -80,24 +283,32 @@ class DataDerivedLinearPredictor:
 			"circumstance_effects": {},
 			"severe_cross_border_effect": None,
 		})
+		self.compiled = compile_model(self.drug_curves, self.factor_effects, self.canonical_factor_map)
+		# Resolved profiles keyed by the raw factor and role arguments, least
+		# recently used first.  What-if batches repeat a handful of profiles
+		# across many quantities.
+		self._profile_cache: OrderedDict[tuple[Any, ...], CaseProfile] = OrderedDict()
 
 	def interpolate_curve(self, drug_type: str, quantity_grams: float) -> float | None:
 		"""Interpolate one supported drug curve, clamping outside its observed range."""
-		knots = self.drug_curves.get(drug_type)
-		if knots is None:
+		curve = self.compiled.curves.get(drug_type)
+		if curve is None:
 			return None
 		if not math.isfinite(quantity_grams) or quantity_grams < 0:
 			raise ValueError("Drug quantity must be a finite, non-negative number")
-		quantities = [quantity for quantity, _ in knots]
+		return self._interpolate(curve, quantity_grams)
+
+	@staticmethod
+	def _interpolate(curve: tuple[tuple[float, ...], tuple[float, ...]], quantity_grams: float) -> float:
+		quantities, months = curve
 		if quantity_grams <= quantities[0]:
-			return knots[0][1]
+			return months[0]
 		if quantity_grams >= quantities[-1]:
-			return knots[-1][1]
+			return months[-1]
 		right = bisect_right(quantities, quantity_grams)
-		left = right - 1
-		x0, y0 = knots[left]
-		x1, y1 = knots[right]
-		return y0 + (y1 - y0) * (quantity_grams - x0) / (x1 - x0)
+		x0 = quantities[right - 1]
+		y0 = months[right - 1]
+		return y0 + (months[right] - y0) * (quantity_grams - x0) / (quantities[right] - x0)
 
 	def predict_drug(self, drug_type: str, quantity_grams: float) -> float | None:
 		"""Return the supported drug curve result, or ``None`` when unsupported."""
@@ -125,11 +336,15 @@ class DataDerivedLinearPredictor:
 	) -> float | None:
 		"""Use the legacy total-quantity weighted rule across supported drug curves."""
 		amounts = self._normalise_drug_amounts(drug_amounts, legacy_amounts)
-		if not amounts or any(drug not in self.drug_curves for drug in amounts):
+		if not amounts or any(drug not in self.compiled.curves for drug in amounts):
 			return None
+		return self._starting_point(amounts)
+
+	def _starting_point(self, amounts: Mapping[str, float]) -> float:
+		curves = self.compiled.curves
 		total = sum(amounts.values())
 		return sum(
-			self.interpolate_curve(drug, total) * amount
+			self._interpolate(curves[drug], total) * amount
 			for drug, amount in amounts.items()
 		) / total
 
@@ -144,14 +359,138 @@ class DataDerivedLinearPredictor:
 		additional_circumstances: Sequence[str] = (),
 	) -> dict[str, Any]:
 		"""Return full-precision stages, whole-month display values, and statuses."""
+		return self.predict_stages(
+			drug_amounts,
+			aggravating_factors,
+			mitigating_factors,
+			pleaded_guilty,
+			guilty_plea_stage,
+			primary_role,
+			additional_circumstances,
+		).as_dict()
+
+	def predict_stages(
+		self,
+		drug_amounts: Mapping[str, float],
+		aggravating_factors: Sequence[str] = (),
+		mitigating_factors: Sequence[str] = (),
+		pleaded_guilty: bool = False,
+		guilty_plea_stage: str | None = None,
+		primary_role: str | None = None,
+		additional_circumstances: Sequence[str] = (),
+	) -> Prediction:
+		"""``predict`` as a ``Prediction``, without building the result dicts."""
+		status, unsupported_drugs, amounts, profile = self._resolve_case(
+			drug_amounts,
+			aggravating_factors,
+			mitigating_factors,
+			pleaded_guilty,
+			guilty_plea_stage,
+			primary_role,
+			additional_circumstances,
+		)
+		if profile is None:
+			return Prediction(status, unsupported_drugs, None, None, self.adjustment_strategy)
+		return Prediction(
+			status,
+			unsupported_drugs,
+			amounts,
+			profile,
+			self.adjustment_strategy,
+			*self._stage_months(amounts, profile),
+		)
+
+	def predict_many(
+		self,
+		cases: Iterable[Mapping[str, Any]] | Mapping[str, Sequence[Any]],
+		*,
+		use_numpy: bool | None = None,
+	) -> dict[str, list[Any]]:
+		"""Predict a batch of cases and return one list per ``BATCH_COLUMNS`` entry.
+
+		``cases`` is either records holding ``predict``'s keyword arguments or a
+		mapping from those argument names to equal-length columns.  Stage values
+		are ``None`` for cases without a supported starting point.  ``use_numpy``
+		defaults to whether NumPy is installed.
+		"""
+		if use_numpy is None:
+			use_numpy = np is not None
+		if use_numpy and np is None:
+			raise RuntimeError("use_numpy=True needs NumPy")
+		resolved = [self._resolve_case(**case) for case in self._case_records(cases)]
+		supported_rows = [index for index, case in enumerate(resolved) if case[3] is not None]
+		amounts = [resolved[index][2] for index in supported_rows]
+		profiles = [resolved[index][3] for index in supported_rows]
+		if use_numpy:
+			stage_columns = self._batch_stage_months(amounts, profiles)
+		else:
+			stage_rows = list(map(self._stage_months, amounts, profiles))
+			stage_columns = [[stages[position] for stages in stage_rows] for position in range(len(STAGE_COLUMNS))]
+		results: dict[str, list[Any]] = {
+			"status": [status for status, _, _, _ in resolved],
+			"unsupported_drugs": [unsupported_drugs for _, unsupported_drugs, _, _ in resolved],
+		}
+		for stage in FACTOR_STATUS_STAGES:
+			results[f"{stage}_status"] = [
+				None if profile is None else profile.factors[stage]
+				for _, _, _, profile in resolved
+			]
+		for name, values in zip(STAGE_COLUMNS, stage_columns):
+			if len(supported_rows) == len(resolved):
+				results[name] = values
+				continue
+			column: list[float | None] = [None] * len(resolved)
+			for index, value in zip(supported_rows, values):
+				column[index] = value
+			results[name] = column
+		return results
+
+	def _resolve_case(
+		self,
+		drug_amounts: Mapping[str, float],
+		aggravating_factors: Sequence[str] = (),
+		mitigating_factors: Sequence[str] = (),
+		pleaded_guilty: bool = False,
+		guilty_plea_stage: str | None = None,
+		primary_role: str | None = None,
+		additional_circumstances: Sequence[str] = (),
+	) -> tuple[str, list[str], dict[str, float] | None, CaseProfile | None]:
+		"""Status, unsupported drugs, drug amounts and profile of a case.  Only
+		cases with a supported starting point get amounts and a profile."""
 		amounts = self._normalise_drug_amounts(drug_amounts, {})
-		unsupported_drugs = sorted(drug for drug in amounts if drug not in self.drug_curves)
 		if not amounts:
-			return self._unsupported_result("no positive drug quantity", [])
-		if unsupported_drugs:
-			return self._unsupported_result("unsupported drug curve", unsupported_drugs)
+			return "no positive drug quantity", [], None, None
+		curves = self.compiled.curves
+		for drug in amounts:
+			if drug not in curves:
+				unsupported_drugs = sorted(drug for drug in amounts if drug not in curves)
+				return "unsupported drug curve", unsupported_drugs, None, None
+		profile_key = (
+			tuple(aggravating_factors),
+			tuple(mitigating_factors),
+			bool(pleaded_guilty),
+			guilty_plea_stage,
+			primary_role,
+			tuple(additional_circumstances),
+		)
+		profile = self._profile_cache.get(profile_key)
+		if profile is None:
+			profile = self._profile_cache[profile_key] = self._resolve_profile(*profile_key)
+			if len(self._profile_cache) > PROFILE_CACHE_SIZE:
+				self._profile_cache.popitem(last=False)
+		else:
+			self._profile_cache.move_to_end(profile_key)
+		return "supported", [], amounts, profile
 
-		starting_point = self.get_starting_point(amounts)
+	def _resolve_profile(
+		self,
+		aggravating_factors: Sequence[str],
+		mitigating_factors: Sequence[str],
+		pleaded_guilty: bool,
+		guilty_plea_stage: str | None,
+		primary_role: str | None,
+		additional_circumstances: Sequence[str],
+	) -> CaseProfile:
 		canonical_aggravating = self._canonical_factors(aggravating_factors)
 		canonical_mitigating = self._canonical_factors(mitigating_factors)
 		other_aggravating = [factor for factor in canonical_aggravating if factor != ROLE_FACTOR]
@@ -161,10 +500,9 @@ class DataDerivedLinearPredictor:
 				primary_role,
 				additional_circumstances,
 			)
-			role_enhancement, role_status, courier_cross_border = self._role_profile_effect(
+			role_effect, role_status, courier_cross_border = self._role_profile_effect(
 				primary_role,
 				circumstances,
-				starting_point,
 			)
 			if courier_cross_border:
 				other_aggravating = list(dict.fromkeys([
@@ -180,41 +518,161 @@ class DataDerivedLinearPredictor:
 					if factor != "Cross-border trafficking"
 				]
 		else:
-			role_enhancement = 0.0
+			role_effect = None
 			role_status = "no sentencing role profile"
+		plea_factors = [f"Guilty plea: {guilty_plea_stage or 'Unknown'}"] if pleaded_guilty else []
+		stage_factors = (tuple(other_aggravating), tuple(canonical_mitigating), tuple(plea_factors))
+		factor_ids = self.compiled.factor_ids
+		stage_effects: list[tuple[float, ...]] = []
+		unsupported_factors: list[tuple[str, ...]] = []
+		for factors, effects_by_id in zip(stage_factors, self.compiled.stage_effects):
+			effects = [
+				effects_by_id[factor_ids[factor]] if factor in factor_ids else None
+				for factor in factors
+			]
+			stage_effects.append(tuple(0.0 if effect is None else effect for effect in effects))
+			unsupported_factors.append(tuple(
+				factor for factor, effect in zip(factors, effects) if effect is None
+			))
+		return CaseProfile(
+			role_effect,
+			role_status,
+			stage_factors,
+			tuple(stage_effects),
+			tuple(unsupported_factors),
+		)
+
+	def _stage_months(self, amounts: Mapping[str, float], profile: CaseProfile) -> tuple[float, ...]:
+		"""Every stage of a supported case, in ``STAGE_COLUMNS`` order."""
+		starting_point = self._starting_point(amounts)
+		role_effect = profile.role_effect
+		aggravation_effects, mitigation_effects, plea_effects = profile.stage_effects
+		role_enhancement = 0.0 if role_effect is None else starting_point * role_effect
 		after_role = max(0.0, starting_point + role_enhancement)
-		aggravation = self._effect(other_aggravating, "aggravation", starting_point)
+		aggravation = sum(starting_point * effect for effect in aggravation_effects)
 		notional = max(0.0, after_role + aggravation)
-		mitigation = min(notional, max(0.0, self._effect(canonical_mitigating, "mitigation", notional)))
+		mitigation = min(notional, max(0.0, sum(notional * effect for effect in mitigation_effects)))
 		pre_plea = max(0.0, notional - mitigation)
-		plea_factors = [f"Guilty plea: {guilty_plea_stage or 'Unknown'}"] if pleaded_guilty else []
-		plea_reduction = min(pre_plea, max(0.0, self._effect(plea_factors, "plea", pre_plea)))
+		plea_reduction = min(pre_plea, max(0.0, sum(pre_plea * effect for effect in plea_effects)))
 		final_sentence = max(0.0, pre_plea - plea_reduction)
-		stages = {
-			"starting_point_months": starting_point,
-			"role_enhancement_months": role_enhancement,
-			"sentence_after_role_months": after_role,
-			"aggravation_months": aggravation,
-			"notional_sentence_months": notional,
-			"mitigation_reduction_months": mitigation,
-			"pre_plea_months": pre_plea,
-			"plea_reduction_months": plea_reduction,
-			"final_sentence_months": final_sentence,
-		}
-		return {
-			"status": "supported",
-			"adjustment_strategy": self.adjustment_strategy,
-			"unsupported_drugs": [],
-			"drug_amounts": amounts,
-			"factors": {
-				"role": role_status,
-				"aggravation": self._factor_status(other_aggravating, "aggravation"),
-				"mitigation": self._factor_status(canonical_mitigating, "mitigation"),
-				"plea": self._factor_status(plea_factors, "plea"),
-			},
-			**stages,
-			"reported_months": {name: round(value) for name, value in stages.items()},
-		}
+		return (
+			starting_point,
+			role_enhancement,
+			after_role,
+			aggravation,
+			notional,
+			mitigation,
+			pre_plea,
+			plea_reduction,
+			final_sentence,
+		)
+
+	def _batch_stage_months(
+		self,
+		amounts: Sequence[Mapping[str, float]],
+		profiles: Sequence[CaseProfile],
+	) -> list[list[float]]:
+		"""``_stage_months`` for many cases, column-wise with NumPy.
+
+		Sums run position by position in each case's own order, so every value
+		matches the scalar path exactly.
+		"""
+		starting_point = self._batch_starting_points(amounts)
+		role_effect = np.array(
+			[0.0 if profile.role_effect is None else profile.role_effect for profile in profiles],
+			dtype=float,
+		)
+		role_enhancement = starting_point * role_effect
+		after_role = np.maximum(0.0, starting_point + role_enhancement)
+		aggravation = self._batch_effect(profiles, 0, starting_point)
+		notional = np.maximum(0.0, after_role + aggravation)
+		mitigation = np.minimum(
+			notional,
+			np.maximum(0.0, self._batch_effect(profiles, 1, notional)),
+		)
+		pre_plea = np.maximum(0.0, notional - mitigation)
+		plea_reduction = np.minimum(
+			pre_plea,
+			np.maximum(0.0, self._batch_effect(profiles, 2, pre_plea)),
+		)
+		final_sentence = np.maximum(0.0, pre_plea - plea_reduction)
+		return [
+			values.tolist()
+			for values in (
+				starting_point,
+				role_enhancement,
+				after_role,
+				aggravation,
+				notional,
+				mitigation,
+				pre_plea,
+				plea_reduction,
+				final_sentence,
+			)
+		]
+
+	def _batch_starting_points(self, drug_amounts: Sequence[Mapping[str, float]]) -> np.ndarray:
+		width = max((len(amounts) for amounts in drug_amounts), default=0)
+		drugs = [[*amounts, *[None] * (width - len(amounts))] for amounts in drug_amounts]
+		quantities = np.array(
+			[[*amounts.values(), *[0.0] * (width - len(amounts))] for amounts in drug_amounts],
+			dtype=float,
+		).reshape(len(drug_amounts), width)
+		total = np.zeros(len(drug_amounts))
+		for position in range(width):
+			total = total + quantities[:, position]
+		weighted = np.zeros(len(drug_amounts))
+		for position in range(width):
+			interpolated = np.zeros(len(drug_amounts))
+			position_drugs = [row[position] for row in drugs]
+			for drug in set(position_drugs) - {None}:
+				rows = np.array([value == drug for value in position_drugs])
+				interpolated[rows] = self._interpolate_many(drug, total[rows])
+			weighted = weighted + interpolated * quantities[:, position]
+		return weighted / total
+
+	def _interpolate_many(self, drug_type: str, quantities: np.ndarray) -> np.ndarray:
+		"""``interpolate_curve`` over an array, with the same arithmetic."""
+		knot_quantities, knot_months = self.knot_arrays[drug_type]
+		if len(knot_quantities) == 1:
+			return np.full(len(quantities), knot_months[0])
+		right = np.clip(np.searchsorted(knot_quantities, quantities, side="right"), 1, len(knot_quantities) - 1)
+		left = right - 1
+		x0, x1 = knot_quantities[left], knot_quantities[right]
+		y0, y1 = knot_months[left], knot_months[right]
+		values = y0 + (y1 - y0) * (quantities - x0) / (x1 - x0)
+		values = np.where(quantities <= knot_quantities[0], knot_months[0], values)
+		return np.where(quantities >= knot_quantities[-1], knot_months[-1], values)
+
+	@staticmethod
+	def _batch_effect(
+		profiles: Sequence[CaseProfile],
+		stage_index: int,
+		base_months: np.ndarray,
+	) -> np.ndarray:
+		stage_effects = [profile.stage_effects[stage_index] for profile in profiles]
+		width = max((len(effects) for effects in stage_effects), default=0)
+		padded = np.array(
+			[(*effects, *(0.0,) * (width - len(effects))) for effects in stage_effects],
+			dtype=float,
+		).reshape(len(profiles), width)
+		total = np.zeros(len(profiles))
+		for position in range(width):
+			total = total + base_months * padded[:, position]
+		return total
+
+	@staticmethod
+	def _case_records(
+		cases: Iterable[Mapping[str, Any]] | Mapping[str, Sequence[Any]],
+	) -> list[Mapping[str, Any]]:
+		if not isinstance(cases, Mapping):
+			return list(cases)
+		columns = {name: list(values) for name, values in cases.items()}
+		lengths = {len(values) for values in columns.values()}
+		if len(lengths) > 1:
+			raise ValueError("predict_many columns must all have the same length")
+		count = lengths.pop() if lengths else 0
+		return [{name: values[index] for name, values in columns.items()} for index in range(count)]
 
 	def _normalise_role_profile(
 		self,
@@ -242,11 +700,12 @@ class DataDerivedLinearPredictor:
 		self,
 		primary_role: str,
 		circumstances: Sequence[str],
-		starting_point: float,
-	) -> tuple[float, str, bool]:
+	) -> tuple[float | None, str, bool]:
+		"""Return the role effect fraction (``None`` when the primary role is
+		unsupported), its status and whether a courier is cross-border."""
 		primary_effect = self.role_effects.get("primary_effects", {}).get(primary_role)
 		if primary_effect is None:
-			return 0.0, f"unsupported primary role: {primary_role}", False
+			return None, f"unsupported primary role: {primary_role}", False
 		effect = float(primary_effect)
 		statuses = ["primary role supported"]
 		for circumstance in circumstances:
@@ -272,7 +731,7 @@ class DataDerivedLinearPredictor:
 				effect += float(circumstance_effect)
 				statuses.append(f"{circumstance} supported")
 		return (
-			starting_point * effect,
+			effect,
 			" | ".join(statuses),
 			primary_role == COURIER_STOREKEEPER_ROLE
 			and "Cross-border trafficking" in circumstances,
@@ -300,27 +759,8 @@ class DataDerivedLinearPredictor:
 			amounts[drug_type] = amounts.get(drug_type, 0.0) + amount
 
 	def _canonical_factors(self, factors: Sequence[str]) -> list[str]:
-		return list(dict.fromkeys(self.canonical_factor_map.get(factor, factor) for factor in factors if factor))
-
-	def _effect(self, factors: Sequence[str], stage: str, base_months: float) -> float:
-		effects = self.factor_effects.get(stage, {})
-		return sum(base_months * effects.get(factor, 0.0) for factor in factors)
-
-	def _factor_status(self, factors: Sequence[str], stage: str) -> str:
-		if not factors:
-			return "no factors"
-		unsupported = [factor for factor in factors if factor not in self.factor_effects.get(stage, {})]
-		return f"unsupported factors: {' | '.join(unsupported)}" if unsupported else "supported"
-
-	@staticmethod
-	def _unsupported_result(status: str, unsupported_drugs: list[str]) -> dict[str, Any]:
-		return {
-			"status": status,
-			"unsupported_drugs": unsupported_drugs,
-			"starting_point_months": None,
-			"final_sentence_months": None,
-			"reported_months": {},
-		}
+		canonical_factors = self.compiled.canonical_factors
+		return list(dict.fromkeys(canonical_factors.get(factor, factor) for factor in factors if factor))
 
 
 if __name__ == "__main__":
@@ -1,17 +1,55 @@
+"""Compare predicted final sentences with verified ones.
+
+By default the verified documents are read from MongoDB and scored by the
+legacy ``DkPredictor``: every trial becomes one row of ``explain``'s 17-slot
+input and the whole matrix is scored by ``DkPredictor.explain_many`` at once.
+
+``--snapshot`` is the offline harness.  It reads the verified documents from
+the modelling cache (``linear_interpolation_model.load_documents``) and
+scores them with every model named by ``--models``:
+
+- ``legacy``: ``DkPredictor``.
+- ``data-derived[:<adjustment strategy>]``: ``DataDerivedLinearPredictor``
+  on ``data_derived_linear_model.json``.
+- anything else: a ``model_registry`` variant, ``<ref>[:<strategy>]``.
+
+Per-trial results are cached in ``.cache/verified_evaluation/`` by trial
+content hash and model version, so a rerun only scores trials that changed
+since the last run, and only under models it has not seen them with.  The
+version includes a fingerprint of the code that maps a trial to model input,
+so editing that mapping also re-scores everything.  The
+cache holds no reviewer, so ``verified_username`` is empty in this mode.
+"""
+
 from __future__ import annotations
 
 import argparse
+import hashlib
+import inspect
+import json
 import os
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable, NamedTuple
 
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from bson import ObjectId
 from pymongo import MongoClient
-from tqdm.auto import tqdm
 
-from legacy_model import DkPredictor
+import legacy_model
+from data_derived_linear_model import DataDerivedLinearPredictor, artifact_digest
+from legacy_model import INPUT_WIDTH, DkPredictor
+from linear_interpolation_model import (
+    COURIER_STOREKEEPER_ROLE,
+    clean_quantity,
+    load_documents,
+    normalize_circumstance,
+    normalize_circumstances,
+    normalize_key_text,
+    normalize_primary_role,
+)
+from model_registry import ModelRegistry
 
 
 ASSISTANCE_FACTOR_TO_INPUT = {
@@ -32,6 +70,10 @@ DRUG_TYPE_TO_INPUT_INDEX = {
     'Cannabis': 14,
 }
 
+RESULTS_DIRNAME = 'verified_evaluation'
+DEFAULT_MODELS = ('legacy', 'data-derived')
+TRIAL_COLUMNS = ['neutral_citation', 'verified_username', 'trial_index', 'charge_no']
+
 PLEA_EARLY_HIGH_COURT_STAGES = {'Up to committal'}
 PLEA_LATE_HIGH_COURT_STAGES = {
     'After committal',
@@ -149,7 +191,7 @@ def set_bool_flag(vector: list[float], index: int) -> None:
 
 
 def build_model_input(trial: dict[str, Any]) -> list[float]:
-    vector = [0.0] * 17
+    vector = [0.0] * INPUT_WIDTH
 
     for factor in trial.get('mitigating_factors') or []:
         factor_name = factor.get('factor')
@@ -188,14 +230,236 @@ def build_model_input(trial: dict[str, Any]) -> list[float]:
     return vector
 
 
+def build_model_inputs(trials: list[dict[str, Any]]) -> np.ndarray:
+    matrix = np.zeros((len(trials), INPUT_WIDTH))
+    for row, trial in zip(matrix, trials):
+        row[:] = build_model_input(trial)
+    return matrix
+
+
+def trial_rows(
+    documents: list[dict[str, Any]],
+    username_map: dict[str, str] | None = None,
+) -> tuple[pd.DataFrame, list[dict[str, Any]]]:
+    """One ``TRIAL_COLUMNS`` row per trial of ``documents``, and the trials."""
+    username_map = username_map or {}
+    rows: list[dict[str, Any]] = []
+    trials: list[dict[str, Any]] = []
+    for doc in documents:
+        verified_by = normalize_user_id(doc.get('verified_by'))
+        for index, trial in enumerate((doc.get('trials') or {}).get('trials') or []):
+            rows.append(
+                {
+                    'neutral_citation': (doc.get('judgement') or {}).get(
+                        'neutral_citation'
+                    ),
+                    'verified_username': username_map.get(
+                        verified_by or '',
+                        verified_by or '',
+                    ),
+                    'trial_index': index,
+                    'charge_no': (trial.get('charge_type') or {}).get('charge_no'),
+                }
+            )
+            trials.append(trial)
+    return pd.DataFrame(rows, columns=TRIAL_COLUMNS), trials
+
+
+def actual_months(trials: list[dict[str, Any]]) -> np.ndarray:
+    return np.array(
+        [get_total_months(trial.get('final_sentence')) for trial in trials],
+        dtype=np.int64,
+    )
+
+
+def score_documents(
+    documents: list[dict[str, Any]],
+    username_map: dict[str, str] | None = None,
+) -> pd.DataFrame:
+    """One row per trial of ``documents`` with its legacy prediction."""
+    df, trials = trial_rows(documents, username_map)
+    predicted = DkPredictor().explain_many(build_model_inputs(trials))['final_sentence']
+    actual = actual_months(trials)
+    df['predicted_months'] = predicted
+    df['actual_months'] = actual
+    df['difference_months'] = predicted - actual
+    df['absolute_difference_months'] = np.abs(predicted - actual)
+    return df
+
+
+class TrialScorer(NamedTuple):
+    """A model for ``evaluate_models``.
+
+    ``score`` returns the predicted final months of each trial, NaN where the
+    model makes no prediction.  Cached results are reused for as long as
+    ``version`` is unchanged, so it must change whenever the scores could.
+    """
+
+    name: str
+    version: str
+    score: Callable[[list[dict[str, Any]]], np.ndarray]
+
+
+def code_fingerprint(*parts: Any) -> str:
+    """Hash the source of functions and the contents of lookup tables.
+
+    Sets are hashed in sorted order, so the fingerprint is stable across
+    interpreter runs.
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if callable(part):
+            text = inspect.getsource(part)
+        else:
+            text = json.dumps(part, sort_keys=True, default=sorted)
+        digest.update(text.encode())
+    return digest.hexdigest()[:16]
+
+
+def legacy_scorer() -> TrialScorer:
+    predictor = DkPredictor()
+    source = Path(legacy_model.__file__).read_bytes()
+    mapping = code_fingerprint(
+        build_model_inputs,
+        build_model_input,
+        set_bool_flag,
+        infer_plea_flag,
+        ASSISTANCE_FACTOR_TO_INPUT,
+        DRUG_TYPE_TO_INPUT_INDEX,
+        PLEA_EARLY_HIGH_COURT_STAGES,
+        PLEA_LATE_HIGH_COURT_STAGES,
+        PLEA_EARLY_DISTRICT_COURT_STAGES,
+        PLEA_LATE_DISTRICT_COURT_STAGES,
+    )
+    return TrialScorer(
+        'legacy',
+        f'{hashlib.sha256(source).hexdigest()[:16]}:{mapping}',
+        lambda trials: predictor.explain_many(build_model_inputs(trials))['final_sentence'].astype(float),
+    )
+
+
+def factor_names(factors: list[dict[str, Any]] | None) -> list[str]:
+    return list(dict.fromkeys(item['factor'] for item in factors or [] if item.get('factor')))
+
+
+def deployment_case(trial: dict[str, Any]) -> dict[str, Any]:
+    """``DataDerivedLinearPredictor.predict`` arguments for a verified trial.
+
+    Invalid quantities are dropped.  Circumstances without a recognised
+    primary role are ignored: the predictor only scores them as part of a
+    role profile.
+    """
+    drug_amounts: dict[str, float] = {}
+    for drug in trial.get('drugs') or []:
+        quantity, invalid = clean_quantity(drug.get('quantity'))
+        if drug.get('drug_type') and not invalid:
+            drug_amounts[drug['drug_type']] = drug_amounts.get(drug['drug_type'], 0.0) + quantity
+    guilty_plea = trial.get('guilty_plea') or {}
+    role = trial.get('sentencing_role')
+    primary_role = normalize_primary_role(role.get('primary_role')) if isinstance(role, dict) else None
+    return {
+        'drug_amounts': drug_amounts,
+        'aggravating_factors': factor_names(trial.get('aggravating_factors')),
+        'mitigating_factors': factor_names(trial.get('mitigating_factors')),
+        'pleaded_guilty': bool(guilty_plea.get('pleaded_guilty')),
+        'guilty_plea_stage': guilty_plea.get('high_court_stage') or guilty_plea.get('district_court_stage'),
+        'primary_role': primary_role,
+        'additional_circumstances': (
+            normalize_circumstances(role.get('additional_circumstances')) if primary_role else []
+        ),
+    }
+
+
+def deployment_scorer(predictor: DataDerivedLinearPredictor, name: str) -> TrialScorer:
+    def score(trials: list[dict[str, Any]]) -> np.ndarray:
+        months = predictor.predict_many([deployment_case(trial) for trial in trials])['final_sentence_months']
+        return np.array([np.nan if value is None else value for value in months], dtype=float)
+
+    mapping = code_fingerprint(
+        deployment_case,
+        factor_names,
+        clean_quantity,
+        normalize_primary_role,
+        normalize_circumstances,
+        normalize_circumstance,
+        normalize_key_text,
+        COURIER_STOREKEEPER_ROLE,
+    )
+    return TrialScorer(
+        name,
+        f"{predictor.model.get('model_version')}:{predictor.adjustment_strategy}:{artifact_digest(predictor.model)}:{mapping}",
+        score,
+    )
+
+
+def model_scorer(spec: str, registry: ModelRegistry | None = None) -> TrialScorer:
+    """The ``TrialScorer`` of a ``--models`` entry."""
+    if spec == 'legacy':
+        return legacy_scorer()
+    kind, _, strategy = spec.partition(':')
+    if kind == 'data-derived':
+        return deployment_scorer(DataDerivedLinearPredictor(adjustment_strategy=strategy or 'learned'), spec)
+    return deployment_scorer((registry or ModelRegistry()).variant(spec), spec)
+
+
+def trial_digest(trial: dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps(trial, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def results_path(results_dir: Path, scorer: TrialScorer) -> Path:
+    version = hashlib.sha256(scorer.version.encode()).hexdigest()[:16]
+    return results_dir / f"{scorer.name.replace(':', '-').replace('/', '-')}-{version}.json"
+
+
+def evaluate_models(
+    documents: list[dict[str, Any]],
+    scorers: list[TrialScorer],
+    results_dir: Path | None = None,
+) -> pd.DataFrame:
+    """Score every trial of ``documents`` with each model, side by side.
+
+    Each model adds ``<name>_predicted_months``, ``<name>_difference_months``
+    and ``<name>_absolute_difference_months``.  With ``results_dir``,
+    per-trial results are cached there and a model only scores trials without
+    a cached result for its version; ``df.attrs['scored_trials']`` counts them.
+    """
+    df, trials = trial_rows(documents)
+    actual = actual_months(trials)
+    df['actual_months'] = actual
+    digests = [trial_digest(trial) for trial in trials]
+    scored_trials: dict[str, int] = {}
+    for scorer in scorers:
+        path = None if results_dir is None else results_path(results_dir, scorer)
+        cached: dict[str, float | None] = (
+            json.loads(path.read_text()) if path is not None and path.exists() else {}
+        )
+        missing = [index for index, digest in enumerate(digests) if digest not in cached]
+        if missing:
+            scores = scorer.score([trials[index] for index in missing])
+            for index, value in zip(missing, scores):
+                cached[digests[index]] = None if np.isnan(value) else float(value)
+            if path is not None:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                temporary_path = path.with_suffix('.json.tmp')
+                temporary_path.write_text(json.dumps(cached))
+                temporary_path.replace(path)
+        predicted = np.array(
+            [np.nan if cached[digest] is None else cached[digest] for digest in digests],
+            dtype=float,
+        )
+        df[f'{scorer.name}_predicted_months'] = predicted
+        df[f'{scorer.name}_difference_months'] = predicted - actual
+        df[f'{scorer.name}_absolute_difference_months'] = np.abs(predicted - actual)
+        scored_trials[scorer.name] = len(missing)
+    df.attrs['scored_trials'] = scored_trials
+    return df
+
+
 def evaluate(
     verified_collection,
     user_collection,
     limit: int | None = None,
 ) -> pd.DataFrame:
-    predictor = DkPredictor()
-    rows: list[dict[str, Any]] = []
-
     query = {
         'is_verified': True,
         'exclude': {'$ne': True},
@@ -213,52 +477,25 @@ def evaluate(
         query,
     )
 
-    total_docs = verified_collection.count_documents(query)
-    if limit is not None:
-        total_docs = min(total_docs, limit)
-
     docs = verified_collection.find(query, projection)
     if limit is not None:
         docs = docs.limit(limit)
 
-    docs = tqdm(docs, total=total_docs, desc='verified judgements')
-
-    for doc in docs:
-        trials_container = doc.get('trials') or {}
-        trials = trials_container.get('trials') or []
-        doc_label = doc.get('filename') or (doc.get('judgement') or {}).get(
-            'neutral_citation',
-            'verified judgement',
-        )
+    return score_documents(list(docs), verified_username_map)
 
-        for index, trial in enumerate(
-            tqdm(trials, desc=doc_label, leave=False, position=1)
-        ):
-            model_input = build_model_input(trial)
-            prediction = predictor.explain(model_input)
-            predicted_months = int(prediction['final_sentence'])
-            actual_months = get_total_months(trial.get('final_sentence'))
-            verified_by = normalize_user_id(doc.get('verified_by'))
-
-            rows.append(
-                {
-                    'neutral_citation': (doc.get('judgement') or {}).get(
-                        'neutral_citation'
-                    ),
-                    'verified_username': verified_username_map.get(
-                        verified_by or '',
-                        verified_by or '',
-                    ),
-                    'trial_index': index,
-                    'charge_no': (trial.get('charge_type') or {}).get('charge_no'),
-                    'predicted_months': predicted_months,
-                    'actual_months': actual_months,
-                    'difference_months': predicted_months - actual_months,
-                    'absolute_difference_months': abs(predicted_months - actual_months),
-                }
-            )
 
-    return pd.DataFrame(rows)
+def evaluate_snapshot(
+    notebook_dir: Path = Path(__file__).resolve().parent,
+    limit: int | None = None,
+    models: list[str] | tuple[str, ...] = DEFAULT_MODELS,
+    *,
+    use_results_cache: bool = True,
+) -> pd.DataFrame:
+    """``evaluate_models`` over the cached verified documents."""
+    documents, _ = load_documents(notebook_dir, refresh_cache=False)
+    documents = [doc for doc in documents if doc.get('exclude') is not True]
+    results_dir = notebook_dir / '.cache' / RESULTS_DIRNAME if use_results_cache else None
+    return evaluate_models(documents[:limit], [model_scorer(spec) for spec in models], results_dir)
 
 
 def print_summary(df: pd.DataFrame) -> None:
@@ -285,20 +522,64 @@ def print_summary(df: pd.DataFrame) -> None:
     print(df.head(20).to_string(index=False))
 
 
+def model_summary(df: pd.DataFrame) -> pd.DataFrame:
+    """Error statistics of each model in an ``evaluate_models`` frame, over
+    the trials it predicts."""
+    rows = []
+    for name in df.attrs['scored_trials']:
+        errors = df[f'{name}_absolute_difference_months'].dropna()
+        rows.append(
+            {
+                'model': name,
+                'trials': len(df),
+                'predicted_trials': len(errors),
+                'scored_this_run': df.attrs['scored_trials'][name],
+                'mean_abs_error_months': round(float(errors.mean()), 2) if len(errors) else None,
+                'median_abs_error_months': float(errors.median()) if len(errors) else None,
+                'exact_match_rate': round(float((errors == 0).mean() * 100), 2) if len(errors) else None,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(
         description=(
-            'Compare predictor.explain() final sentence months against verified '
+            'Compare predicted final sentence months against verified '
             'final_sentence.total_months'
         )
     )
     parser.add_argument('--limit', type=int, default=None)
     parser.add_argument('--csv', type=str, default="notebooks/verified_sentence_compare.csv")
+    parser.add_argument(
+        '--snapshot',
+        action='store_true',
+        help='read the cached verified documents instead of MongoDB',
+    )
+    parser.add_argument(
+        '--models',
+        nargs='+',
+        default=list(DEFAULT_MODELS),
+        help="with --snapshot: legacy, data-derived[:<strategy>] or a model registry variant",
+    )
+    parser.add_argument(
+        '--no-results-cache',
+        action='store_true',
+        help='with --snapshot: rescore every trial and leave the results cache alone',
+    )
     args = parser.parse_args()
 
-    verified_collection, user_collection = get_collection()
-    df = evaluate(verified_collection, user_collection, limit=args.limit)
-    print_summary(df)
+    if args.snapshot:
+        df = evaluate_snapshot(
+            limit=args.limit,
+            models=args.models,
+            use_results_cache=not args.no_results_cache,
+        )
+        print(model_summary(df).to_string(index=False))
+    else:
+        verified_collection, user_collection = get_collection()
+        df = evaluate(verified_collection, user_collection, limit=args.limit)
+        print_summary(df)
 
     if args.csv:
         df.to_csv(args.csv, index=False)
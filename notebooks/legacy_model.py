@@ -1,5 +1,144 @@
+"""The original rule-based sentence predictor.
+
+Each drug's starting point comes from a bucket table: ``thresholds`` are the
+upper bounds of every bucket but the last, and bucket ``i`` interpolates from
+``smin[i]`` to ``smax[i]`` months between ``dmin[i]`` and ``dmax[i]`` grams.
+``explain`` scores one 17-slot input vector; ``explain_many`` scores a matrix
+of them with ``np.searchsorted`` over the same tables and returns the same
+months.
+"""
+
 import sys
 import json
+from bisect import bisect_right
+from typing import NamedTuple
+
+import numpy as np
+
+
+class BucketTable(NamedTuple):
+    thresholds: np.ndarray
+    smin: np.ndarray
+    smax: np.ndarray
+    dmin: np.ndarray
+    dmax: np.ndarray
+
+
+def bucket_table(thresholds, buckets):
+    """``buckets`` holds one ``(smin, smax, dmin, dmax)`` row per bucket."""
+    if len(buckets) != len(thresholds) + 1:
+        raise ValueError("A bucket table needs one more bucket than thresholds")
+    return BucketTable(np.array(thresholds, dtype=float), *np.array(buckets, dtype=float).T)
+
+
+COCAINE_BUCKETS = bucket_table(
+    [10, 50, 200, 400, 600, 1200, 4000, 15000],
+    [
+        (24, 60, 0, 10),
+        (60, 96, 10, 50),
+        (96, 144, 50, 200),
+        (144, 180, 200, 400),
+        (180, 240, 400, 600),
+        (240, 276, 600, 1200),
+        (276, 312, 1200, 4000),
+        (312, 360, 4000, 15000),
+        (360, 420, 15000, 100000),
+    ],
+)
+METH_BUCKETS = bucket_table(
+    [10, 70, 300, 600, 1200, 4000, 15000],
+    [
+        (36, 84, 0, 10),
+        (84, 132, 10, 70),
+        (132, 180, 70, 300),
+        (180, 240, 300, 600),
+        (240, 276, 600, 1200),
+        (276, 312, 1200, 4000),
+        (312, 360, 4000, 15000),
+        (360, 420, 15000, 100000),
+    ],
+)
+# From KETAMINE_COCAINE_THRESHOLD grams ketamine follows the cocaine table
+# scaled by KETAMINE_COCAINE_RATIO (HKSAR v. HO CHI HENG).
+KETAMINE_BUCKETS = bucket_table(
+    [1, 10, 50, 300, 600, 1000, 2000],
+    [
+        (12, 24, 0, 1),
+        (24, 48, 1, 10),
+        (48, 72, 10, 50),
+        (72, 108, 50, 300),
+        (108, 144, 300, 600),
+        (144, 168, 600, 1000),
+        (168, 216, 1000, 2000),  # HKSAR v. SIN CHUNG KIN
+        (216, 240, 2000, 3000),  # HKSAR v. SIN CHUNG KIN
+    ],
+)
+KETAMINE_COCAINE_THRESHOLD = 3000
+KETAMINE_COCAINE_RATIO = 0.806
+# Flat months below 1000g, written as buckets with smin == smax.
+CANNABIS_RESIN_BUCKETS = bucket_table(
+    [10, 100, 300, 500, 750, 1000, 2000, 3000, 6000, 9000],
+    [
+        (2, 2, 0, 10),
+        (3, 3, 10, 100),
+        (4, 4, 100, 300),
+        (6, 6, 300, 500),
+        (8, 8, 500, 750),
+        (10, 10, 750, 1000),
+        (10, 16, 0, 2000),
+        (16, 24, 2000, 3000),
+        (24, 36, 3000, 6000),
+        (36, 48, 6000, 9000),
+        (48, 72, 9000, 100000),
+    ],
+)
+HERBAL_CANNABIS_RESIN_RATIO = 4
+# explain's input slots
+DRUG_SLOTS = slice(7, 15)
+INPUT_WIDTH = 17
+# One (slot, starting-point fraction) pair per aggravating factor, in the
+# order explain applies them: refugee, bail, persistent, international.
+AGGRAVATING_FRACTIONS = ((3, 0.0595), (4, 0.0411), (5, 0.0591), (6, 0.0519))
+SELF_CONSUMPTION_FRACTION = -0.1
+# assist_authorities level -> fraction of the sentence after trial
+ASSISTANCE_FRACTIONS = {1: -0.05, 2: -0.1, 3: -0.167, 4: -0.25}
+OTHER_MITIGATING_MONTHS = -2
+
+
+def bucket_sentences(table, amounts):
+    """Vectorised ``DkPredictor.bucket_sentence``."""
+    index = np.searchsorted(table.thresholds, amounts, side="right")
+    smin, smax, dmin, dmax = table.smin[index], table.smax[index], table.dmin[index], table.dmax[index]
+    # fmin keeps interpolate_sentence's min(), which ignores a NaN amount.
+    months = smin + (smax - smin) / (dmax - dmin) * np.fmin(dmax - dmin, amounts - dmin)
+    return np.where(amounts > dmax, smax, months)
+
+
+def ketamine_sentences(amounts):
+    return np.where(
+        amounts < KETAMINE_COCAINE_THRESHOLD,
+        bucket_sentences(KETAMINE_BUCKETS, amounts),
+        bucket_sentences(COCAINE_BUCKETS, amounts) * KETAMINE_COCAINE_RATIO,
+    )
+
+
+def cannabis_resin_sentences(amounts):
+    return bucket_sentences(CANNABIS_RESIN_BUCKETS, amounts)
+
+
+# explain's drug slots, in order, and the starting-point curve of each
+DRUG_SENTENCES = (
+    lambda amounts: bucket_sentences(COCAINE_BUCKETS, amounts),  # cocaine
+    lambda amounts: bucket_sentences(COCAINE_BUCKETS, amounts),  # heroin
+    lambda amounts: bucket_sentences(METH_BUCKETS, amounts),  # meth
+    ketamine_sentences,  # ketamine
+    ketamine_sentences,  # nimetazepam
+    ketamine_sentences,  # ecstasy
+    cannabis_resin_sentences,  # cannabis resin
+    lambda amounts: cannabis_resin_sentences(amounts / HERBAL_CANNABIS_RESIN_RATIO),  # herbal cannabis
+)
+
+
 class DkPredictor:
     def __init__(self):
         pass
@@ -9,66 +148,29 @@ class DkPredictor:
             return smax
         return smin + (smax-smin)/(dmax-dmin) * min(dmax-dmin, damount-dmin)
     
+    def bucket_sentence(self, table, amount):
+        index = bisect_right(table.thresholds, amount)
+        return self.interpolate_sentence(
+            float(table.smin[index]),
+            float(table.smax[index]),
+            float(table.dmin[index]),
+            float(table.dmax[index]),
+            amount,
+        )
+
     def predict_cocaine(self, amount):
-        if amount < 10:
-            return self.interpolate_sentence(24, 60, 0, 10, amount)
-        elif amount < 50:
-            return self.interpolate_sentence(60, 96, 10, 50, amount)
-        elif amount < 200:
-            return self.interpolate_sentence(96, 144, 50, 200, amount)
-        elif amount < 400:
-            return self.interpolate_sentence(144, 180, 200, 400, amount)
-        elif amount < 600:
-            return self.interpolate_sentence(180, 240, 400, 600, amount)
-        elif amount < 1200:
-            return self.interpolate_sentence(240, 276, 600, 1200, amount)
-        elif amount < 4000:
-            return self.interpolate_sentence(276, 312, 1200, 4000, amount)
-        elif amount < 15000:
-            return self.interpolate_sentence(312, 360, 4000, 15000, amount)
-        else:
-            return self.interpolate_sentence(360, 420, 15000, 100000, amount)
+        return self.bucket_sentence(COCAINE_BUCKETS, amount)
         
     def predict_heroin(self, amount):
         return self.predict_cocaine(amount)
         
     def predict_meth(self, amount):
-        if amount < 10:
-            return self.interpolate_sentence(36, 84, 0, 10, amount)
-        elif amount < 70:
-            return self.interpolate_sentence(84, 132, 10, 70, amount)
-        elif amount < 300:
-            return self.interpolate_sentence(132, 180, 70, 300, amount)
-        elif amount < 600:
-            return self.interpolate_sentence(180, 240, 300, 600, amount)
-        elif amount < 1200:
-            return self.interpolate_sentence(240, 276, 600, 1200, amount)
-        elif amount < 4000:
-            return self.interpolate_sentence(276, 312, 1200, 4000, amount)
-        elif amount < 15000:
-            return self.interpolate_sentence(312, 360, 4000, 15000, amount)
-        else:
-            return self.interpolate_sentence(360, 420, 15000, 100000, amount)
+        return self.bucket_sentence(METH_BUCKETS, amount)
         
     def predict_ketamine(self, amount):
-        if amount < 1:
-            return self.interpolate_sentence(12, 24, 0, 1, amount)
-        elif amount < 10:
-            return self.interpolate_sentence(24, 48, 1, 10, amount)
-        elif amount < 50:
-            return self.interpolate_sentence(48, 72, 10, 50, amount)
-        elif amount < 300:
-            return self.interpolate_sentence(72, 108, 50, 300, amount)
-        elif amount < 600:
-            return self.interpolate_sentence(108, 144, 300, 600, amount)
-        elif amount < 1000:
-            return self.interpolate_sentence(144, 168, 600, 1000, amount)
-        elif amount < 2000:  # HKSAR v. SIN CHUNG KIN
-            return self.interpolate_sentence(168, 216, 1000, 2000, amount)
-        elif amount < 3000:  # HKSAR v. SIN CHUNG KIN
-            return self.interpolate_sentence(216, 240, 2000, 3000, amount)
-        else: #HKSAR v. HO CHI HENG
-            return self.predict_cocaine(amount) * 0.806
+        if amount < KETAMINE_COCAINE_THRESHOLD:
+            return self.bucket_sentence(KETAMINE_BUCKETS, amount)
+        return self.predict_cocaine(amount) * KETAMINE_COCAINE_RATIO
 
     def predict_nimetazepam(self, amount):
         return self.predict_ketamine(amount)
@@ -78,31 +180,10 @@ class DkPredictor:
         return self.predict_ketamine(amount)
 
     def predict_cannabisresin(self, amount):
-        if amount < 10:
-            return 2
-        elif amount < 100:
-            return 3
-        elif amount < 300:
-            return 4
-        elif amount < 500:
-            return 6
-        elif amount < 750:
-            return 8
-        elif amount < 1000:
-            return 10
-        elif amount < 2000:
-            return self.interpolate_sentence(10, 16, 0, 2000, amount)
-        elif amount < 3000:
-            return self.interpolate_sentence(16, 24, 2000, 3000, amount)
-        elif amount < 6000:
-            return self.interpolate_sentence(24, 36, 3000, 6000, amount)
-        elif amount < 9000:
-            return self.interpolate_sentence(36, 48, 6000, 9000, amount)
-        else:
-            return self.interpolate_sentence(48, 72, 9000, 100000, amount)
+        return self.bucket_sentence(CANNABIS_RESIN_BUCKETS, amount)
             
     def predict_herbalcannabis(self, amount):
-        return self.predict_cannabisresin(amount / 4)
+        return self.predict_cannabisresin(amount / HERBAL_CANNABIS_RESIN_RATIO)
 
         
     def get_starting_point(self, cocaine_amount, heroin_amount,
@@ -126,6 +207,19 @@ class DkPredictor:
                             self.predict_herbalcannabis(total_amount) * herbalcannabis_amount
                            )/ total_amount
         return starting
+
+    def get_starting_points(self, drug_amounts):
+        """``get_starting_point`` of each row of an ``(n, 8)`` amount matrix."""
+        columns = list(drug_amounts.T)
+        # Summed slot by slot, in get_starting_point's order, for the same floats.
+        total_amount = columns[0]
+        for amounts in columns[1:]:
+            total_amount = total_amount + amounts
+        weighted = DRUG_SENTENCES[0](total_amount) * columns[0]
+        for sentences, amounts in zip(DRUG_SENTENCES[1:], columns[1:]):
+            weighted = weighted + sentences(total_amount) * amounts
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(total_amount > 0, weighted / total_amount, 0.0)
     
 
         
@@ -270,6 +364,40 @@ class DkPredictor:
         
         return message
 
+    def explain_many(self, matrix):
+        """Score an ``(n, 17)`` matrix of ``explain`` inputs at once.
+
+        Returns ``starting_point``, ``sentence_after_trial`` and
+        ``final_sentence`` as integer arrays, each row what ``explain``
+        reports for that input.
+        """
+        x = np.asarray(matrix, dtype=float)
+        if x.ndim != 2 or x.shape[1] != INPUT_WIDTH:
+            raise ValueError(f"explain_many needs an (n, {INPUT_WIDTH}) matrix")
+        starting_point = self.get_starting_points(x[:, DRUG_SLOTS])
+        # Whole months are held as floats; np.trunc is int() on each step.
+        sentence = np.trunc(starting_point)
+        starting_months = sentence
+        for slot, fraction in AGGRAVATING_FRACTIONS:
+            sentence = sentence + np.where(x[:, slot] != 0, np.trunc(starting_point * fraction), 0.0)
+        sentence = sentence + np.where(x[:, 0] != 0, np.trunc(starting_point * SELF_CONSUMPTION_FRACTION), 0.0)
+        sentence_after_trial = sentence
+
+        pleaded = x[:, 15] + x[:, 16] > 0
+        plea_early = pleaded & (x[:, 15] != 0)
+        plea_late = pleaded & ~plea_early & (x[:, 16] != 0)
+        sentence = np.where(plea_early, sentence + sentence * -1 / 3, sentence)
+        sentence = np.where(plea_late, sentence + sentence * -1 / 4, sentence)
+
+        for level, fraction in ASSISTANCE_FRACTIONS.items():
+            sentence = sentence + np.where(x[:, 1] == level, np.trunc(sentence_after_trial * fraction), 0.0)
+        sentence = sentence + np.where(x[:, 2] != 0, OTHER_MITIGATING_MONTHS, 0)
+        return {
+            'starting_point': starting_months.astype(np.int64),
+            'sentence_after_trial': sentence_after_trial.astype(np.int64),
+            'final_sentence': np.trunc(sentence).astype(np.int64),
+        }
+
 if __name__ == '__main__':
     predictor = DkPredictor()
     #run the script with:
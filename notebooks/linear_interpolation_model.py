@@ -5,6 +5,8 @@ import math
 import os
 import re
 import warnings
+from collections.abc import Sequence
+from datetime import datetime
 from pathlib import Path
 from typing import Any
 
@@ -12,6 +14,12 @@ import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 from pymongo import MongoClient
+from pymongo.collection import Collection
+
+import analysis_pipeline
+import analysis_report
+import verified_snapshot
+from model_registry import ModelRegistry, write_replacing
 
 
 RANDOM_SEED = 2026
@@ -21,7 +29,93 @@ MIN_CURVE_SUPPORT = 10
 # Drug curves retain their separate 10-case minimum because sparse curves cannot
 # be interpolated reliably.
 MIN_FACTOR_SUPPORT = 1
+# Bump when flatten_documents changes so cached snapshot tables are rebuilt.
+FLATTEN_VERSION = "3"
+# Columns of the flatten_documents tables.
+TRIAL_TABLE_COLUMNS = (
+	"case_id",
+	"neutral_citation",
+	"source_judgement_id",
+	"source_document_excluded",
+	"filename",
+	"trial_index",
+	"charge_no",
+	"defendant_id",
+	"defendant_name",
+	"role_catalogue_key",
+	"drugs",
+	"aggravating_factors",
+	"mitigating_factors",
+	"drug_amounts",
+	"invalid_drug_quantities",
+	"canonical_aggravating_factors",
+	"canonical_mitigating_factors",
+	"sentencing_role",
+	"role_factors",
+	"other_aggravating_factors",
+	"guilty_plea",
+	"starting_point_months",
+	"starting_point_source",
+	"starting_point_inferred",
+	"sentence_after_role_months",
+	"sentence_after_role_source",
+	"sentence_after_role_inferred",
+	"notional_sentence_months",
+	"notional_sentence_source",
+	"notional_sentence_inferred",
+	"mitigation_reduction_months",
+	"mitigation_reduction_source",
+	"mitigation_reduction_inferred",
+	"pre_plea_months",
+	"final_sentence_months",
+	"final_sentence_source",
+	"final_sentence_inferred",
+	"guilty_plea_source",
+	"guilty_plea_inferred",
+)
+EFFECT_TABLE_COLUMNS = (
+	"case_id",
+	"role_catalogue_key",
+	"stage",
+	"canonical_factor",
+	"adjustment_months",
+	"base_months",
+	"effect_fraction",
+)
+# The trial columns the modelling stages read.  Source quotations, names and
+# the raw drug and factor payloads are only shown in run_analysis's report.
+MODELLING_TRIAL_COLUMNS = tuple(
+	column
+	for column in TRIAL_TABLE_COLUMNS
+	if not column.endswith("_source")
+	and column not in {
+		"defendant_name",
+		"drugs",
+		"aggravating_factors",
+		"mitigating_factors",
+		"invalid_drug_quantities",
+		"canonical_aggravating_factors",
+		"role_factors",
+	}
+)
+VERIFIED_QUERY = {"is_verified": True}
+VERIFIED_PROJECTION = {
+	"source_judgement_id": 1,
+	"filename": 1,
+	"exclude": 1,
+	"judgement.neutral_citation": 1,
+	"trials": 1,
+}
+# Set by the verification app on every save and on verification.
+WATERMARK_FIELDS = ("updated_at", "verified_at")
 QUANTILES = (0.0, 0.10, 0.25, 0.50, 0.75, 0.90, 1.0)
+# How a multi-drug trial's starting point combines the drug curves.  The
+# deployed predictor implements "total quantity" only.
+MIXED_DRUG_METHODS = {
+	"total quantity": "legacy total-quantity weighted average",
+	"own quantity": "own-quantity weighted average",
+}
+MIXED_DRUG_METHOD = "total quantity"
 INFERRED_ROLE_SOURCE = "Inferred as starting point since role adjustment not provided"
 CANONICAL_FACTOR_MAP = {
 	"Import": "Cross-border trafficking",
@@ -48,7 +142,6 @@ LEGACY_PERCENTAGE_EFFECTS = {
 		"Guilty plea: During trial": 1 / 4,
 	},
 }
-EXCEL_ILLEGAL_CHARACTERS = re.compile(r"[\x00-\x08\x0B\x0C\x0E-\x1F]")
 ROLE_WORKBOOK_FILENAME = "Role Sentence Adjustments.xlsx"
 ROLE_WORKBOOK_COLUMNS = {
 	"neutral_citation",
@@ -107,6 +200,41 @@ def trial_catalogue_fallback_key(
 	))
 
 
+def normalized_key_column(values: pd.Series | list[Any]) -> pd.Series:
+	"""Column form of ``normalize_key_text``."""
+	series = pd.Series(values, dtype=object)
+	text = series.where(series.notna(), "").astype(str)
+	return text.str.strip().str.replace(r"\s+", " ", regex=True).str.lower()
+
+
+def trial_catalogue_key_column(
+	neutral_citations: pd.Series | list[Any],
+	trial_indexes: pd.Series | list[Any],
+	charge_nos: pd.Series | list[Any],
+	defendant_ids: pd.Series | list[Any],
+) -> pd.Series:
+	"""Column form of ``trial_catalogue_key``."""
+	return (
+		normalized_key_column(neutral_citations)
+		+ "|" + normalized_key_column(trial_indexes)
+		+ "|" + normalized_key_column(charge_nos)
+		+ "|" + normalized_key_column(defendant_ids)
+	)
+
+
+def trial_catalogue_fallback_key_column(
+	neutral_citations: pd.Series | list[Any],
+	charge_nos: pd.Series | list[Any],
+	defendant_ids: pd.Series | list[Any],
+) -> pd.Series:
+	"""Column form of ``trial_catalogue_fallback_key``."""
+	return (
+		normalized_key_column(neutral_citations)
+		+ "|" + normalized_key_column(charge_nos)
+		+ "|" + normalized_key_column(defendant_ids)
+	)
+
+
 def normalize_primary_role(value: Any) -> str | None:
 	role_map = {
 		"courier / storekeeper": COURIER_STOREKEEPER_ROLE,
@@ -152,22 +280,16 @@ def load_role_catalogue(notebook_dir: Path) -> tuple[pd.DataFrame, dict[str, Any
 	if missing_columns:
 		raise RuntimeError(f"Role workbook is missing required columns: {', '.join(missing_columns)}")
 	catalogue = catalogue.copy()
-	catalogue["role_catalogue_key"] = catalogue.apply(
-		lambda row: trial_catalogue_key(
-			row["neutral_citation"],
-			row["trial_index"],
-			row["Charge_no"],
-			row["Defendant_id"],
-		),
-		axis=1,
+	catalogue["role_catalogue_key"] = trial_catalogue_key_column(
+		catalogue["neutral_citation"],
+		catalogue["trial_index"],
+		catalogue["Charge_no"],
+		catalogue["Defendant_id"],
 	)
-	catalogue["role_catalogue_fallback_key"] = catalogue.apply(
-		lambda row: trial_catalogue_fallback_key(
-			row["neutral_citation"],
-			row["Charge_no"],
-			row["Defendant_id"],
-		),
-		axis=1,
+	catalogue["role_catalogue_fallback_key"] = trial_catalogue_fallback_key_column(
+		catalogue["neutral_citation"],
+		catalogue["Charge_no"],
+		catalogue["Defendant_id"],
 	)
 	if (catalogue["role_catalogue_key"] == "|||").any():
 		raise RuntimeError("Role workbook contains a row without a complete trial key")
@@ -214,22 +336,16 @@ def attach_role_catalogue(
 ) -> tuple[pd.DataFrame, pd.DataFrame, dict[str, Any]]:
 	catalogue, provenance = load_role_catalogue(notebook_dir)
 	trials = trials.copy()
-	trials["role_catalogue_key"] = trials.apply(
-		lambda row: trial_catalogue_key(
-			row["neutral_citation"],
-			row["trial_index"],
-			row["charge_no"],
-			row["defendant_id"],
-		),
-		axis=1,
+	trials["role_catalogue_key"] = trial_catalogue_key_column(
+		trials["neutral_citation"],
+		trials["trial_index"],
+		trials["charge_no"],
+		trials["defendant_id"],
 	)
-	trials["role_catalogue_fallback_key"] = trials.apply(
-		lambda row: trial_catalogue_fallback_key(
-			row["neutral_citation"],
-			row["charge_no"],
-			row["defendant_id"],
-		),
-		axis=1,
+	trials["role_catalogue_fallback_key"] = trial_catalogue_fallback_key_column(
+		trials["neutral_citation"],
+		trials["charge_no"],
+		trials["defendant_id"],
 	)
 	trial_keys = set(trials["role_catalogue_key"])
 	catalogue["matched_trial"] = catalogue["role_catalogue_key"].isin(trial_keys)
@@ -238,26 +354,32 @@ def attach_role_catalogue(
 		None,
 	)
 	catalogue["match_method"] = np.where(catalogue["matched_trial"], "exact", "unmatched")
-	exact_matched_trial_keys = set(catalogue.loc[catalogue["matched_trial"], "matched_trial_key"])
+	exact_matched_trial_keys = catalogue.loc[catalogue["matched_trial"], "matched_trial_key"]
+	# An unmatched excluded row falls back to citation/charge/defendant only when
+	# that key names exactly one trial, no other unmatched excluded row shares
+	# it, and the trial was not already matched exactly.
 	fallback_candidates = trials.groupby("role_catalogue_fallback_key")["role_catalogue_key"].agg(
-		lambda values: set(values)
+		candidate_count="nunique",
+		candidate_key="first",
 	)
 	unmatched_excluded = catalogue.loc[
-		catalogue["workbook_excluded"] & ~catalogue["matched_trial"]
-	].copy()
-	unmatched_by_fallback_key = unmatched_excluded["role_catalogue_fallback_key"].value_counts()
-	fallback_matches = 0
-	for row_index, row in unmatched_excluded.iterrows():
-		candidate_trial_keys = fallback_candidates.get(row["role_catalogue_fallback_key"], set())
-		if (
-			len(candidate_trial_keys) == 1
-			and unmatched_by_fallback_key[row["role_catalogue_fallback_key"]] == 1
-			and not candidate_trial_keys.intersection(exact_matched_trial_keys)
-		):
-			catalogue.loc[row_index, "matched_trial"] = True
-			catalogue.loc[row_index, "matched_trial_key"] = next(iter(candidate_trial_keys))
-			catalogue.loc[row_index, "match_method"] = "citation-charge-defendant fallback"
-			fallback_matches += 1
+		catalogue["workbook_excluded"] & ~catalogue["matched_trial"],
+		["role_catalogue_fallback_key"],
+	]
+	unmatched_excluded = unmatched_excluded.assign(
+		shared_count=unmatched_excluded.groupby("role_catalogue_fallback_key")[
+			"role_catalogue_fallback_key"
+		].transform("size"),
+	).join(fallback_candidates, on="role_catalogue_fallback_key")
+	fallback_rows = unmatched_excluded.loc[
+		unmatched_excluded["candidate_count"].eq(1)
+		& unmatched_excluded["shared_count"].eq(1)
+		& ~unmatched_excluded["candidate_key"].isin(exact_matched_trial_keys)
+	]
+	catalogue.loc[fallback_rows.index, "matched_trial"] = True
+	catalogue.loc[fallback_rows.index, "matched_trial_key"] = fallback_rows["candidate_key"]
+	catalogue.loc[fallback_rows.index, "match_method"] = "citation-charge-defendant fallback"
+	fallback_matches = len(fallback_rows)
 	unmatched_excluded = catalogue.loc[
 		catalogue["workbook_excluded"] & ~catalogue["matched_trial"]
 	]
@@ -313,26 +435,18 @@ def attach_role_catalogue(
 	trials["has_verified_sentencing_role"] = trials["sentencing_role"].map(
 		lambda profile: isinstance(profile, dict)
 	)
-	trials["selected_primary_role"] = trials.apply(
-		lambda row: (
-			row["verified_primary_role"]
-			if row["has_verified_sentencing_role"]
-			else row["workbook_primary_role"]
-		)
-		if isinstance(
-			row["verified_primary_role"]
-			if row["has_verified_sentencing_role"]
-			else row["workbook_primary_role"],
-			str,
-		)
-		else None,
-		axis=1,
+	selected_primary_role = np.where(
+		trials["has_verified_sentencing_role"].to_numpy(dtype=bool),
+		trials["verified_primary_role"].to_numpy(dtype=object),
+		trials["workbook_primary_role"].to_numpy(dtype=object),
+	)
+	trials["selected_primary_role"] = pd.Series(
+		[value if isinstance(value, str) else None for value in selected_primary_role],
+		index=trials.index,
 	)
-	trials["selected_circumstances"] = trials.apply(
-		lambda row: row["verified_circumstances"]
-		if row["has_verified_sentencing_role"]
-		else row["workbook_circumstances"],
-		axis=1,
+	trials["selected_circumstances"] = trials["verified_circumstances"].where(
+		trials["has_verified_sentencing_role"],
+		trials["workbook_circumstances"],
 	)
 	trials["role_selection_source"] = np.select(
 		[
@@ -606,14 +720,15 @@ def direct_plea_reduction(plea: dict[str, Any], incoming_months: float | None) -
 	return None
 
 
-def load_documents(notebook_dir: Path, refresh_cache: bool) -> tuple[list[dict[str, Any]], dict[str, Any]]:
-	cache_dir = notebook_dir / ".cache"
-	cache_path = cache_dir / "stage_model_analysis_verified_features.json"
+def load_snapshot_manifest(cache_dir: Path) -> dict[str, Any] | None:
+	# A snapshot built from an older JSON cache (for example one refreshed by
+	# stage_model_analysis.ipynb) is stale and ignored.
 	metadata_path = cache_dir / "stage_model_analysis_verified_features.metadata.json"
-	if cache_path.exists() and not refresh_cache:
-		metadata = json.loads(metadata_path.read_text()) if metadata_path.exists() else {}
-		return json.loads(cache_path.read_text()), metadata
+	created_at = json.loads(metadata_path.read_text()).get("created_at") if metadata_path.exists() else None
+	return verified_snapshot.load_manifest(cache_dir, created_at=created_at)
+
 
+def verified_features_collection(notebook_dir: Path) -> Collection:
 	repo_root = notebook_dir.parent
 	for env_path in (
 		repo_root / "featureExtraction" / ".env",
@@ -625,21 +740,114 @@ def load_documents(notebook_dir: Path, refresh_cache: bool) -> tuple[list[dict[s
 	mongo_uri = os.getenv("DB_MONGODB_URI")
 	if not mongo_uri:
 		raise RuntimeError("DB_MONGODB_URI is required when the shared cache is missing or refresh_cache is True")
-	query = {"is_verified": True}
-	projection = {
-		"source_judgement_id": 1,
-		"filename": 1,
-		"exclude": 1,
-		"judgement.neutral_citation": 1,
-		"trials": 1,
-	}
 	client = MongoClient(mongo_uri)
 	database = client.get_database(os.getenv("DB_NAME", "drug-sentencing-predictor"))
-	documents = list(database.get_collection("verified-features").find(query, projection))
+	return database.get_collection("verified-features")
+
+
+def pop_watermark(documents: list[dict[str, Any]]) -> datetime | None:
+	"""Remove the watermark fields from fetched documents and return their maximum."""
+	latest = None
+	for document in documents:
+		for field_name in WATERMARK_FIELDS:
+			value = document.pop(field_name, None)
+			if isinstance(value, datetime) and (latest is None or value > latest):
+				latest = value
+	return latest
+
+
+def fetch_changed_documents(
+	collection: Collection,
+	cached_documents: list[dict[str, Any]],
+	watermark: datetime,
+) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+	"""Merge documents changed since ``watermark`` into ``cached_documents``.
+
+	Deletions and documents returned to in-progress carry no timestamp, so the
+	current verified ids are listed and cached documents outside them dropped.
+	Verified documents missing from the cache are fetched whatever their
+	timestamps.  The watermark comparison is inclusive; re-fetching a document
+	written in the same millisecond is harmless.
+	"""
+	current_ids = [document["_id"] for document in collection.find(VERIFIED_QUERY, {"_id": 1})]
+	current_keys = {str(document_id) for document_id in current_ids}
+	merged = {
+		str(document["_id"]): document
+		for document in cached_documents
+		if str(document["_id"]) in current_keys
+	}
+	uncached_ids = [document_id for document_id in current_ids if str(document_id) not in merged]
+	changed = list(collection.find(
+		{
+			**VERIFIED_QUERY,
+			"$or": [
+				*({field_name: {"$gte": watermark}} for field_name in WATERMARK_FIELDS),
+				{"_id": {"$in": uncached_ids}},
+			],
+		},
+		{**VERIFIED_PROJECTION, **dict.fromkeys(WATERMARK_FIELDS, 1)},
+	))
+	latest = pop_watermark(changed)
+	removed_count = len(cached_documents) - len(merged)
+	for document in changed:
+		merged[str(document["_id"])] = document
+	return list(merged.values()), {
+		"watermark": max(watermark, latest) if latest is not None else watermark,
+		"changed_document_count": len(changed),
+		"removed_document_count": removed_count,
+	}
+
+
+def load_documents(
+	notebook_dir: Path,
+	refresh_cache: bool,
+	incremental: bool = True,
+) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+	"""Load the verified documents, refreshing from MongoDB when asked.
+
+	A refresh is incremental when the cache records a watermark: only documents
+	whose ``updated_at`` or ``verified_at`` moved past it are fetched.  Pass
+	``incremental=False`` to re-download everything.
+	"""
+	cache_dir = notebook_dir / ".cache"
+	cache_path = cache_dir / "stage_model_analysis_verified_features.json"
+	metadata_path = cache_dir / "stage_model_analysis_verified_features.metadata.json"
+	if not refresh_cache:
+		manifest = load_snapshot_manifest(cache_dir)
+		if manifest is not None:
+			return verified_snapshot.read_documents(cache_dir, manifest)
+	if cache_path.exists() and not refresh_cache:
+		metadata = json.loads(metadata_path.read_text()) if metadata_path.exists() else {}
+		documents = json.loads(cache_path.read_text())
+		verified_snapshot.write_documents(cache_dir, documents, metadata)
+		return documents, metadata
+
+	collection = verified_features_collection(notebook_dir)
+	previous_metadata = json.loads(metadata_path.read_text()) if metadata_path.exists() else {}
+	if incremental and cache_path.exists() and previous_metadata.get("watermark"):
+		cached_documents, _ = load_documents(notebook_dir, refresh_cache=False)
+		documents, refresh_summary = fetch_changed_documents(
+			collection,
+			cached_documents,
+			datetime.fromisoformat(previous_metadata["watermark"]),
+		)
+		refresh_summary["refresh_mode"] = "incremental"
+	else:
+		documents = list(collection.find(
+			VERIFIED_QUERY,
+			{**VERIFIED_PROJECTION, **dict.fromkeys(WATERMARK_FIELDS, 1)},
+		))
+		refresh_summary = {
+			"refresh_mode": "full",
+			"watermark": pop_watermark(documents),
+			"changed_document_count": len(documents),
+			"removed_document_count": 0,
+		}
 	cache_dir.mkdir(parents=True, exist_ok=True)
 	temporary_path = cache_path.with_suffix(".tmp")
 	temporary_path.write_text(json.dumps(documents, default=str))
 	temporary_path.replace(cache_path)
+	watermark = refresh_summary.pop("watermark")
 	metadata = {
 		"created_at": pd.Timestamp.now(tz="UTC").isoformat(),
 		"document_count": len(documents),
@@ -647,156 +855,275 @@ def load_documents(notebook_dir: Path, refresh_cache: bool) -> tuple[list[dict[s
 		"source_excluded_documents_included_for_trial_reconciliation": True,
 		"source_excluded_documents_used_for_role_fitting": True,
 		"source_excluded_documents_used_for_non_role_stages": False,
-		"query": query,
-		"projection_fields": sorted(projection),
+		"query": VERIFIED_QUERY,
+		"projection_fields": sorted(VERIFIED_PROJECTION),
+		"watermark_fields": list(WATERMARK_FIELDS),
+		"watermark": watermark.isoformat() if watermark is not None else None,
+		**refresh_summary,
 	}
-	metadata_path.write_text(json.dumps(metadata, indent=2))
+	temporary_metadata_path = metadata_path.with_suffix(".tmp")
+	temporary_metadata_path.write_text(json.dumps(metadata, indent=2))
+	temporary_metadata_path.replace(metadata_path)
+	# The JSON cache stays the interchange format for notebooks that read it
+	# directly; the columnar snapshot is what load_documents reads back.
+	verified_snapshot.write_documents(cache_dir, documents, metadata)
 	return documents, metadata
 
 
+def load_trial_tables(
+	notebook_dir: Path,
+	refresh_cache: bool,
+	*,
+	trial_columns: Sequence[str],
+	effect_columns: Sequence[str] = EFFECT_TABLE_COLUMNS,
+) -> tuple[pd.DataFrame, pd.DataFrame, dict[str, Any]]:
+	"""Return ``trial_columns`` of the flattened trial table and ``effect_columns``
+	of the effect table, reading only those columns from the snapshot copies."""
+	cache_dir = notebook_dir / ".cache"
+	manifest = None if refresh_cache else load_snapshot_manifest(cache_dir)
+	if manifest is not None:
+		trials = verified_snapshot.read_table(
+			cache_dir, manifest, "trials", version=FLATTEN_VERSION, columns=list(trial_columns)
+		)
+		effects = verified_snapshot.read_table(
+			cache_dir, manifest, "effects", version=FLATTEN_VERSION, columns=list(effect_columns)
+		)
+		if trials is not None and effects is not None:
+			return trials, effects, {**manifest["metadata"], "document_count": manifest["documents"]["rows"]}
+	documents, metadata = load_documents(notebook_dir, refresh_cache)
+	metadata = {**metadata, "document_count": len(documents)}
+	trials, effects = flatten_documents(documents)
+	verified_snapshot.write_tables(
+		cache_dir,
+		{"trials": trials, "effects": effects},
+		version=FLATTEN_VERSION,
+	)
+	return trials[list(trial_columns)], effects[list(effect_columns)], metadata
+
+
+def numeric_column(values: list[Any]) -> np.ndarray:
+	return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=float)
+
+
+def detail_values(details: list[dict[str, Any] | None], key: str) -> list[Any]:
+	return [detail.get(key) if detail else None for detail in details]
+
+
+def detail_total_months(details: list[dict[str, Any] | None]) -> np.ndarray:
+	"""Column form of ``total_months``: NaN where it would return None."""
+	total = numeric_column(detail_values(details, "total_months"))
+	years = numeric_column(detail_values(details, "sentence_years"))
+	months = numeric_column(detail_values(details, "sentence_months"))
+	from_parts = np.where(
+		np.isnan(years) & np.isnan(months),
+		np.nan,
+		np.nan_to_num(years) * 12 + np.nan_to_num(months),
+	)
+	return np.where(np.isnan(total), from_parts, total)
+
+
+def explode_factors(factor_lists: list[list[dict[str, Any]]], adjustment_key: str) -> pd.DataFrame:
+	"""One row per factor entry with its trial row, canonical label and adjustment."""
+	factors = pd.DataFrame(
+		[
+			(row, position, item.get("factor"), item.get(adjustment_key), is_inferred(item))
+			for row, items in enumerate(factor_lists)
+			for position, item in enumerate(items)
+		],
+		columns=["row", "position", "factor", "adjustment", "inferred"],
+	)
+	names = factors["factor"].astype(object)
+	present = names.notna() & names.astype(bool)
+	factors["canonical_factor"] = names.map(CANONICAL_FACTOR_MAP).fillna(names).where(present, None)
+	factors["adjustment"] = numeric_column(factors["adjustment"].tolist())
+	return factors
+
+
+def canonical_factor_lists(factors: pd.DataFrame, row_count: int) -> list[list[str]]:
+	named = factors.loc[factors["canonical_factor"].notna(), ["row", "canonical_factor"]].drop_duplicates()
+	lists: list[list[str]] = [[] for _ in range(row_count)]
+	for row, name in zip(named["row"].tolist(), named["canonical_factor"].tolist()):
+		lists[row].append(name)
+	return lists
+
+
+def drug_amount_dicts(drug_lists: list[list[dict[str, Any]]], row_count: int) -> tuple[list[dict[str, float]], list[str]]:
+	drugs = pd.DataFrame(
+		[
+			(row, drug.get("drug_type"), drug.get("quantity"))
+			for row, items in enumerate(drug_lists)
+			for drug in items
+			if drug.get("drug_type")
+		],
+		columns=["row", "drug_type", "quantity"],
+	)
+	quantity = numeric_column(drugs["quantity"].tolist())
+	invalid = ~np.isfinite(quantity) | (quantity < 0)
+	drugs["clean_quantity"] = np.where(invalid, 0.0, quantity)
+	drugs["invalid_label"] = drugs["drug_type"].astype(str) + ":" + drugs["quantity"].map(str).astype(str)
+	invalid_labels: list[list[str]] = [[] for _ in range(row_count)]
+	for row, label in zip(drugs.loc[invalid, "row"].tolist(), drugs.loc[invalid, "invalid_label"].tolist()):
+		invalid_labels[row].append(label)
+	totals = drugs.groupby(["row", "drug_type"], sort=False)["clean_quantity"].sum()
+	amounts: list[dict[str, float]] = [{} for _ in range(row_count)]
+	for (row, drug_type), total in totals.items():
+		amounts[row][drug_type] = float(total)
+	return amounts, [" | ".join(labels) for labels in invalid_labels]
+
+
 def flatten_documents(documents: list[dict[str, Any]]) -> tuple[pd.DataFrame, pd.DataFrame]:
-	trial_rows: list[dict[str, Any]] = []
-	effect_rows: list[dict[str, Any]] = []
-	for document in documents:
-		judgement = document.get("judgement") or {}
-		citation = judgement.get("neutral_citation") or document.get("filename")
-		case_id = str(citation or document.get("source_judgement_id") or document.get("_id"))
-		source_document_excluded = document.get("exclude") is True
-		for trial_index, trial in enumerate((document.get("trials") or {}).get("trials") or []):
-			charge = trial.get("charge_type") or {}
-			drugs = trial.get("drugs") or []
-			aggravating = trial.get("aggravating_factors") or []
-			mitigating = trial.get("mitigating_factors") or []
-			plea = trial.get("guilty_plea") or {}
-			starting_detail = trial.get("starting_point")
-			after_role_detail = trial.get("sentence_after_role")
-			notional_detail = trial.get("notional_sentence")
-			mitigation_detail = trial.get("mitigation_reduction")
-			final_detail = trial.get("final_sentence")
-			starting = total_months(starting_detail)
-			after_role = total_months(after_role_detail)
-			notional = total_months(notional_detail)
-			mitigation_reduction = (
-				float(mitigation_detail["reduction_months"])
-				if mitigation_detail and mitigation_detail.get("reduction_months") is not None
-				else None
-			)
-			pre_plea = notional - (mitigation_reduction or 0) if notional is not None else None
-			final = total_months(final_detail)
-			drug_amounts: dict[str, float] = {}
-			invalid_quantities: list[str] = []
-			for drug in drugs:
-				drug_type = drug.get("drug_type")
-				if not drug_type:
-					continue
-				quantity, invalid = clean_quantity(drug.get("quantity"))
-				if invalid:
-					invalid_quantities.append(f"{drug_type}:{drug.get('quantity')}")
-				drug_amounts[drug_type] = drug_amounts.get(drug_type, 0.0) + quantity
-			canonical_aggravating = unique_canonical_factors(aggravating)
-			canonical_mitigating = unique_canonical_factors(mitigating)
-			role_catalogue_key = trial_catalogue_key(
-				citation,
-				trial_index,
-				charge.get("charge_no"),
-				charge.get("defendant_id"),
-			)
-			row = {
-				"case_id": case_id,
-				"neutral_citation": citation,
-				"source_judgement_id": str(document.get("source_judgement_id") or ""),
-				"source_document_excluded": source_document_excluded,
-				"filename": document.get("filename"),
-				"trial_index": trial_index,
-				"charge_no": charge.get("charge_no"),
-				"defendant_id": charge.get("defendant_id"),
-				"defendant_name": charge.get("defendant_name"),
-				"role_catalogue_key": role_catalogue_key,
-				"drugs_json": json.dumps(drugs, default=str),
-				"aggravating_factors_json": json.dumps(aggravating, default=str),
-				"mitigating_factors_json": json.dumps(mitigating, default=str),
-				"drug_amounts": drug_amounts,
-				"invalid_drug_quantities": " | ".join(invalid_quantities),
-				"canonical_aggravating_factors": canonical_aggravating,
-				"canonical_mitigating_factors": canonical_mitigating,
-				"sentencing_role": trial.get("sentencing_role"),
-				"role_factors": [name for name in canonical_aggravating if name == "Role of the defendant"],
-				"other_aggravating_factors": [
-					name for name in canonical_aggravating if name != "Role of the defendant"
-				],
-				"guilty_plea_json": json.dumps(plea, default=str),
-				"starting_point_months": starting,
-				"starting_point_source": (starting_detail or {}).get("source"),
-				"starting_point_inferred": is_inferred(starting_detail),
-				"sentence_after_role_months": after_role,
-				"sentence_after_role_source": (after_role_detail or {}).get("source"),
-				"sentence_after_role_inferred": is_inferred(after_role_detail),
-				"notional_sentence_months": notional,
-				"notional_sentence_source": (notional_detail or {}).get("source"),
-				"notional_sentence_inferred": is_inferred(notional_detail),
-				"mitigation_reduction_months": mitigation_reduction,
-				"mitigation_reduction_source": (mitigation_detail or {}).get("source"),
-				"mitigation_reduction_inferred": is_inferred(mitigation_detail),
-				"pre_plea_months": pre_plea,
-				"final_sentence_months": final,
-				"final_sentence_source": (final_detail or {}).get("source"),
-				"final_sentence_inferred": is_inferred(final_detail),
-				"guilty_plea_source": plea.get("source"),
-				"guilty_plea_inferred": is_inferred(plea),
-			}
-			trial_rows.append(row)
-			for factor in aggravating:
-				canonical = canonical_factor(factor.get("factor"))
-				if canonical == "Role of the defendant":
-					continue
-				adjustment = factor.get("enhancement_months")
-				stage = "aggravation"
-				base = starting
-				if adjustment is not None and canonical and base and base > 0 and not is_inferred(factor):
-					effect_rows.append({
-						"case_id": case_id,
-						"role_catalogue_key": role_catalogue_key,
-						"stage": stage,
-						"canonical_factor": canonical,
-						"adjustment_months": float(adjustment),
-						"base_months": float(base),
-						"effect_fraction": float(adjustment) / float(base),
-					})
-			for factor in mitigating:
-				canonical = canonical_factor(factor.get("factor"))
-				adjustment = factor.get("reduction_months")
-				if adjustment is not None and canonical and notional and notional > 0 and not is_inferred(factor):
-					effect_rows.append({
-						"case_id": case_id,
-						"role_catalogue_key": role_catalogue_key,
-						"stage": "mitigation",
-						"canonical_factor": canonical,
-						"adjustment_months": float(adjustment),
-						"base_months": float(notional),
-						"effect_fraction": float(adjustment) / float(notional),
-					})
-			plea_adjustment = direct_plea_reduction(plea, pre_plea)
-			plea_stage = plea.get("high_court_stage") or plea.get("district_court_stage") or "Unknown"
-			if plea_adjustment is not None and pre_plea and pre_plea > 0:
-				effect_rows.append({
-					"case_id": case_id,
-					"role_catalogue_key": role_catalogue_key,
-					"stage": "plea",
-					"canonical_factor": f"Guilty plea: {plea_stage}",
-					"adjustment_months": plea_adjustment,
-					"base_months": float(pre_plea),
-					"effect_fraction": plea_adjustment / float(pre_plea),
-				})
-	effect_columns = [
-		"case_id",
-		"role_catalogue_key",
-		"stage",
-		"canonical_factor",
-		"adjustment_months",
-		"base_months",
-		"effect_fraction",
+	"""Flatten verified documents into one row per trial and one row per factor effect.
+
+	Columns are built whole rather than row by row, and the raw drug, factor and
+	plea payloads are kept as native lists and dicts.
+	"""
+	rows = [
+		(document, trial_index, trial)
+		for document in documents
+		for trial_index, trial in enumerate((document.get("trials") or {}).get("trials") or [])
+	]
+	row_count = len(rows)
+	row_documents = [document for document, _, _ in rows]
+	trial_indexes = [trial_index for _, trial_index, _ in rows]
+	trials = [trial for _, _, trial in rows]
+	citations = [
+		(document.get("judgement") or {}).get("neutral_citation") or document.get("filename")
+		for document in row_documents
 	]
-	return pd.DataFrame(trial_rows), pd.DataFrame(effect_rows, columns=effect_columns)
+	case_ids = [
+		str(citation or document.get("source_judgement_id") or document.get("_id"))
+		for citation, document in zip(citations, row_documents)
+	]
+	charges = [trial.get("charge_type") or {} for trial in trials]
+	charge_nos = [charge.get("charge_no") for charge in charges]
+	defendant_ids = [charge.get("defendant_id") for charge in charges]
+	drugs = [trial.get("drugs") or [] for trial in trials]
+	aggravating = [trial.get("aggravating_factors") or [] for trial in trials]
+	mitigating = [trial.get("mitigating_factors") or [] for trial in trials]
+	pleas = [trial.get("guilty_plea") or {} for trial in trials]
+	details = {
+		name: [trial.get(name) for trial in trials]
+		for name in ("starting_point", "sentence_after_role", "notional_sentence", "mitigation_reduction", "final_sentence")
+	}
+
+	starting = detail_total_months(details["starting_point"])
+	notional = detail_total_months(details["notional_sentence"])
+	mitigation_reduction = numeric_column(detail_values(details["mitigation_reduction"], "reduction_months"))
+	pre_plea = notional - np.nan_to_num(mitigation_reduction)
+	role_catalogue_keys = trial_catalogue_key_column(citations, trial_indexes, charge_nos, defendant_ids).tolist()
+	drug_amounts, invalid_quantities = drug_amount_dicts(drugs, row_count)
+	aggravating_factors = explode_factors(aggravating, "enhancement_months")
+	mitigating_factors = explode_factors(mitigating, "reduction_months")
+	canonical_aggravating = canonical_factor_lists(aggravating_factors, row_count)
+	canonical_mitigating = canonical_factor_lists(mitigating_factors, row_count)
+
+	trial_frame = pd.DataFrame({
+		"case_id": case_ids,
+		"neutral_citation": citations,
+		"source_judgement_id": [str(document.get("source_judgement_id") or "") for document in row_documents],
+		"source_document_excluded": [document.get("exclude") is True for document in row_documents],
+		"filename": [document.get("filename") for document in row_documents],
+		"trial_index": trial_indexes,
+		"charge_no": charge_nos,
+		"defendant_id": defendant_ids,
+		"defendant_name": [charge.get("defendant_name") for charge in charges],
+		"role_catalogue_key": role_catalogue_keys,
+		"drugs": drugs,
+		"aggravating_factors": aggravating,
+		"mitigating_factors": mitigating,
+		"drug_amounts": drug_amounts,
+		"invalid_drug_quantities": invalid_quantities,
+		"canonical_aggravating_factors": canonical_aggravating,
+		"canonical_mitigating_factors": canonical_mitigating,
+		"sentencing_role": [trial.get("sentencing_role") for trial in trials],
+		"role_factors": [
+			[name for name in names if name == "Role of the defendant"] for names in canonical_aggravating
+		],
+		"other_aggravating_factors": [
+			[name for name in names if name != "Role of the defendant"] for names in canonical_aggravating
+		],
+		"guilty_plea": pleas,
+		"starting_point_months": starting,
+		"starting_point_source": detail_values(details["starting_point"], "source"),
+		"starting_point_inferred": [is_inferred(detail) for detail in details["starting_point"]],
+		"sentence_after_role_months": detail_total_months(details["sentence_after_role"]),
+		"sentence_after_role_source": detail_values(details["sentence_after_role"], "source"),
+		"sentence_after_role_inferred": [is_inferred(detail) for detail in details["sentence_after_role"]],
+		"notional_sentence_months": notional,
+		"notional_sentence_source": detail_values(details["notional_sentence"], "source"),
+		"notional_sentence_inferred": [is_inferred(detail) for detail in details["notional_sentence"]],
+		"mitigation_reduction_months": mitigation_reduction,
+		"mitigation_reduction_source": detail_values(details["mitigation_reduction"], "source"),
+		"mitigation_reduction_inferred": [is_inferred(detail) for detail in details["mitigation_reduction"]],
+		"pre_plea_months": pre_plea,
+		"final_sentence_months": detail_total_months(details["final_sentence"]),
+		"final_sentence_source": detail_values(details["final_sentence"], "source"),
+		"final_sentence_inferred": [is_inferred(detail) for detail in details["final_sentence"]],
+		"guilty_plea_source": [plea.get("source") for plea in pleas],
+		"guilty_plea_inferred": [is_inferred(plea) for plea in pleas],
+	})
+
+	aggravation_base = starting[aggravating_factors["row"].to_numpy(dtype=int)]
+	aggravation_effects = aggravating_factors.loc[
+		(aggravating_factors["canonical_factor"] != "Role of the defendant")
+		& aggravating_factors["canonical_factor"].notna()
+		& aggravating_factors["adjustment"].notna()
+		& (aggravation_base > 0)
+		& ~aggravating_factors["inferred"].astype(bool)
+	].assign(stage="aggravation", stage_order=0)
+	aggravation_effects["base_months"] = starting[aggravation_effects["row"].to_numpy(dtype=int)]
+
+	mitigation_base = notional[mitigating_factors["row"].to_numpy(dtype=int)]
+	mitigation_effects = mitigating_factors.loc[
+		mitigating_factors["canonical_factor"].notna()
+		& mitigating_factors["adjustment"].notna()
+		& (mitigation_base > 0)
+		& ~mitigating_factors["inferred"].astype(bool)
+	].assign(stage="mitigation", stage_order=1)
+	mitigation_effects["base_months"] = notional[mitigation_effects["row"].to_numpy(dtype=int)]
+
+	# Column form of direct_plea_reduction.
+	reduction_years = numeric_column([plea.get("reduction_years") for plea in pleas])
+	reduction_months = numeric_column([plea.get("reduction_months") for plea in pleas])
+	reduction_percentage = numeric_column([plea.get("reduction_percentage") for plea in pleas])
+	direct_plea = np.array(
+		[bool(plea.get("pleaded_guilty")) and not is_inferred(plea) for plea in pleas],
+		dtype=bool,
+	)
+	plea_adjustment = np.where(
+		np.isnan(reduction_years) & np.isnan(reduction_months),
+		pre_plea * reduction_percentage / 100,
+		np.nan_to_num(reduction_years) * 12 + np.nan_to_num(reduction_months),
+	)
+	plea_rows = np.flatnonzero(direct_plea & ~np.isnan(plea_adjustment) & (pre_plea > 0))
+	plea_effects = pd.DataFrame({
+		"row": plea_rows,
+		"position": 0,
+		"canonical_factor": [
+			f"Guilty plea: {pleas[row].get('high_court_stage') or pleas[row].get('district_court_stage') or 'Unknown'}"
+			for row in plea_rows
+		],
+		"adjustment": plea_adjustment[plea_rows],
+		"stage": "plea",
+		"stage_order": 2,
+		"base_months": pre_plea[plea_rows],
+	})
+
+	effect_columns = list(EFFECT_TABLE_COLUMNS)
+	effects = pd.concat(
+		[frame for frame in (aggravation_effects, mitigation_effects, plea_effects) if not frame.empty],
+		ignore_index=True,
+	) if row_count else pd.DataFrame()
+	if effects.empty:
+		return trial_frame, pd.DataFrame(columns=effect_columns)
+	effects = effects.sort_values(["row", "stage_order", "position"], kind="stable").reset_index(drop=True)
+	row_index = effects["row"].to_numpy(dtype=int)
+	effects["case_id"] = np.asarray(case_ids, dtype=object)[row_index]
+	effects["role_catalogue_key"] = np.asarray(role_catalogue_keys, dtype=object)[row_index]
+	effects["adjustment_months"] = effects["adjustment"].astype(float)
+	effects["base_months"] = effects["base_months"].astype(float)
+	effects["effect_fraction"] = effects["adjustment_months"] / effects["base_months"]
+	return trial_frame, effects[effect_columns]
 
 
 def assign_partition(trials: pd.DataFrame, notebook_dir: Path) -> tuple[pd.DataFrame, pd.DataFrame]:
@@ -842,19 +1169,38 @@ def assign_partition(trials: pd.DataFrame, notebook_dir: Path) -> tuple[pd.DataF
 	return trials, split_membership
 
 
-def build_curve(drug_type: str, training_rows: pd.DataFrame) -> tuple[pd.DataFrame, dict[str, Any]]:
+def partition_effects(trials: pd.DataFrame, effects: pd.DataFrame) -> pd.DataFrame:
+	"""Give each factor adjustment the partition of its trial."""
+	partition_lookup = trials[["role_catalogue_key", "partition"]].drop_duplicates(
+		"role_catalogue_key"
+	)
+	return effects.merge(
+		partition_lookup,
+		on="role_catalogue_key",
+		how="left",
+		validate="many_to_one",
+	)
+
+
+def build_curve(
+	drug_type: str,
+	training_rows: pd.DataFrame,
+	*,
+	min_support: int = MIN_CURVE_SUPPORT,
+	quantiles: tuple[float, ...] = QUANTILES,
+) -> tuple[pd.DataFrame, dict[str, Any]]:
 	training_trials = len(training_rows)
 	training_judgments = training_rows["case_id"].nunique()
-	if len(training_rows) < MIN_CURVE_SUPPORT:
+	if len(training_rows) < min_support:
 		return pd.DataFrame(), {
 			"drug_type": drug_type,
 			"supported": False,
-			"reason": "fewer than 10 training trials",
+			"reason": f"fewer than {min_support} training trials",
 			"training_trials": training_trials,
 			"training_judgments": training_judgments,
 		}
 	quantities = training_rows["single_drug_quantity"].to_numpy(dtype=float)
-	boundaries = np.unique(np.quantile(quantities, QUANTILES))
+	boundaries = np.unique(np.quantile(quantities, quantiles))
 	if len(boundaries) < 2:
 		return pd.DataFrame(), {
 			"drug_type": drug_type,
@@ -890,30 +1236,154 @@ def build_curve(drug_type: str, training_rows: pd.DataFrame) -> tuple[pd.DataFra
 	}
 
 
-def interpolate_curve(quantity: float, knots: pd.DataFrame) -> float:
-	x = knots["quantity_grams"].to_numpy(dtype=float)
-	y = knots["interpolated_months"].to_numpy(dtype=float)
-	return float(np.interp(quantity, x, y))
+def compile_curves(curves: dict[str, pd.DataFrame]) -> dict[str, tuple[np.ndarray, np.ndarray]]:
+	"""Knot quantities and interpolated months per drug as contiguous arrays."""
+	return {
+		drug_type: (
+			np.ascontiguousarray(knots["quantity_grams"].to_numpy(dtype=float)),
+			np.ascontiguousarray(knots["interpolated_months"].to_numpy(dtype=float)),
+		)
+		for drug_type, knots in curves.items()
+	}
+
+
+def drug_quantity_triples(drug_amounts: pd.Series | list[dict[str, float]]) -> pd.DataFrame:
+	"""One ``(trial, drug_type, quantity)`` row per positive quantity.
+
+	``trial`` is the position in ``drug_amounts`` and rows keep each trial's
+	drug order.
+	"""
+	trial_indices: list[int] = []
+	drug_types: list[str] = []
+	quantities: list[float] = []
+	for trial_index, amounts in enumerate(drug_amounts):
+		for drug_type, quantity in amounts.items():
+			if quantity > 0:
+				trial_indices.append(trial_index)
+				drug_types.append(drug_type)
+				quantities.append(quantity)
+	return pd.DataFrame({
+		"trial": np.asarray(trial_indices, dtype=np.intp),
+		"drug_type": pd.Series(drug_types, dtype=object),
+		"quantity": np.asarray(quantities, dtype=float),
+	})
 
 
-def starting_point_from_legacy_weighted_total(
-	drug_amounts: dict[str, float], curves: dict[str, pd.DataFrame]
-) -> tuple[float | None, str, list[str]]:
-	positive_amounts = {drug: amount for drug, amount in drug_amounts.items() if amount > 0}
-	if not positive_amounts:
-		return None, "no positive drug quantity", []
-	unsupported = sorted(drug for drug in positive_amounts if drug not in curves)
-	if unsupported:
-		return None, "unsupported drug curve", unsupported
-	total_amount = sum(positive_amounts.values())
-	weighted_months = sum(
-		interpolate_curve(total_amount, curves[drug_type]) * quantity
-		for drug_type, quantity in positive_amounts.items()
+def interpolate_curves(
+	drug_types: np.ndarray,
+	quantities: np.ndarray,
+	compiled_curves: dict[str, tuple[np.ndarray, np.ndarray]],
+) -> np.ndarray:
+	"""Read each quantity off its drug's curve; NaN where the drug has no curve."""
+	months = np.full(len(quantities), np.nan)
+	codes, uniques = pd.factorize(drug_types)
+	for code, drug_type in enumerate(uniques):
+		if drug_type in compiled_curves:
+			mask = codes == code
+			months[mask] = np.interp(quantities[mask], *compiled_curves[drug_type])
+	return months
+
+
+def weighted_starting_points(
+	triples: pd.DataFrame,
+	compiled_curves: dict[str, tuple[np.ndarray, np.ndarray]],
+	trial_count: int,
+	mixed_drug_method: str = MIXED_DRUG_METHOD,
+) -> pd.DataFrame:
+	"""Apply a weighted mixed-drug rule to every trial at once.
+
+	Each drug's curve is read at the trial's total positive quantity ("total
+	quantity", the legacy rule) or at the drug's own quantity ("own
+	quantity"), and weighted by that drug's quantity.  Trials with no positive
+	quantity, or with any drug lacking a curve, get no starting point.
+	"""
+	if mixed_drug_method not in MIXED_DRUG_METHODS:
+		raise ValueError(f"mixed_drug_method must be one of {sorted(MIXED_DRUG_METHODS)}")
+	trial_indices = triples["trial"].to_numpy(dtype=np.intp)
+	drug_types = triples["drug_type"].to_numpy(dtype=object)
+	quantities = triples["quantity"].to_numpy(dtype=float)
+	drug_counts = np.bincount(trial_indices, minlength=trial_count)
+	total_amounts = np.bincount(trial_indices, weights=quantities, minlength=trial_count)
+	months = interpolate_curves(
+		drug_types,
+		total_amounts[trial_indices] if mixed_drug_method == "total quantity" else quantities,
+		compiled_curves,
+	)
+	missing_curve = np.isnan(months)
+	weighted_months = np.bincount(
+		trial_indices,
+		weights=np.where(missing_curve, 0.0, months * quantities),
+		minlength=trial_count,
 	)
-	return weighted_months / total_amount, "supported", []
+	unsupported: dict[int, set[str]] = {}
+	for trial_index, drug_type in zip(trial_indices[missing_curve], drug_types[missing_curve]):
+		unsupported.setdefault(int(trial_index), set()).add(drug_type)
+	supported = drug_counts > 0
+	supported[list(unsupported)] = False
+	starting_points = np.full(trial_count, np.nan)
+	np.divide(weighted_months, total_amounts, out=starting_points, where=supported)
+	return pd.DataFrame({
+		"predicted_starting_point_months": starting_points,
+		"starting_prediction_status": np.select(
+			[drug_counts == 0, ~supported],
+			["no positive drug quantity", "unsupported drug curve"],
+			"supported",
+		).tolist(),
+		"unsupported_drugs": [
+			" | ".join(sorted(unsupported.get(trial_index, ()))) for trial_index in range(trial_count)
+		],
+	})
 
 
-def learn_factor_effects(training_effects: pd.DataFrame) -> pd.DataFrame:
+def fit_curves(
+	training_trials: pd.DataFrame,
+	drug_types: list[str],
+	*,
+	min_support: int = MIN_CURVE_SUPPORT,
+	quantiles: tuple[float, ...] = QUANTILES,
+) -> tuple[dict[str, pd.DataFrame], pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+	"""Fit a curve for each drug from single-drug training trials.
+
+	Returns the supported curves, the support table, the combined knots and the
+	single-drug rows the curves were fitted on.
+	"""
+	curve_candidates = training_trials.loc[
+		training_trials["starting_point_months"].notna()
+		& ~training_trials["starting_point_inferred"]
+	].copy()
+	curve_candidates["positive_drugs"] = curve_candidates["drug_amounts"].map(
+		lambda amounts: {drug: quantity for drug, quantity in amounts.items() if quantity > 0}
+	)
+	curve_candidates["single_drug_type"] = curve_candidates["positive_drugs"].map(
+		lambda amounts: next(iter(amounts)) if len(amounts) == 1 else None
+	)
+	curve_candidates["single_drug_quantity"] = curve_candidates["positive_drugs"].map(
+		lambda amounts: next(iter(amounts.values())) if len(amounts) == 1 else np.nan
+	)
+	single_drug_rows = curve_candidates.loc[curve_candidates["single_drug_type"].notna()].copy()
+	curves: dict[str, pd.DataFrame] = {}
+	curve_support_rows: list[dict[str, Any]] = []
+	curve_knot_frames: list[pd.DataFrame] = []
+	for drug_type in drug_types:
+		knots, support = build_curve(
+			drug_type,
+			single_drug_rows.loc[single_drug_rows["single_drug_type"] == drug_type],
+			min_support=min_support,
+			quantiles=quantiles,
+		)
+		curve_support_rows.append(support)
+		if support["supported"]:
+			curves[drug_type] = knots
+			curve_knot_frames.append(knots)
+	curve_support = pd.DataFrame(curve_support_rows).sort_values("drug_type").reset_index(drop=True)
+	curve_knots = pd.concat(curve_knot_frames, ignore_index=True) if curve_knot_frames else pd.DataFrame()
+	return curves, curve_support, curve_knots, single_drug_rows
+
+
+def learn_factor_effects(
+	training_effects: pd.DataFrame,
+	min_support: int = MIN_FACTOR_SUPPORT,
+) -> pd.DataFrame:
 	rows: list[dict[str, Any]] = []
 	for (stage, factor), group in training_effects.groupby(["stage", "canonical_factor"]):
 		rows.append({
@@ -921,7 +1391,7 @@ def learn_factor_effects(training_effects: pd.DataFrame) -> pd.DataFrame:
 			"canonical_factor": factor,
 			"support_trials": len(group),
 			"support_judgments": group["case_id"].nunique(),
-			"supported": len(group) >= MIN_FACTOR_SUPPORT,
+			"supported": len(group) >= min_support,
 			"median_effect_fraction": group["effect_fraction"].median(),
 			"median_adjustment_months": group["adjustment_months"].median(),
 		})
@@ -949,55 +1419,278 @@ def factor_status(factors: list[str], stage: str, supported_effects: dict[tuple[
 	return "supported"
 
 
-def legacy_percentage_prediction(row: pd.Series) -> dict[str, Any]:
-	"""Apply legacy percentages in the new model's stage order for a fair comparison."""
-	starting = row["predicted_starting_point_months"]
-	if pd.isna(starting):
-		return {
-			"legacy_percentage_factor_status": "starting point unavailable",
-			"legacy_percentage_compatible": False,
-			"legacy_percentage_sentence_after_role_months": np.nan,
-			"legacy_percentage_notional_sentence_months": np.nan,
-			"legacy_percentage_mitigation_reduction_months": np.nan,
-			"legacy_percentage_final_sentence_months": np.nan,
-		}
-	aggravating_factors = row["other_aggravating_factors"]
-	mitigating_factors = row["canonical_mitigating_factors"]
-	plea_factors = plea_factor(row["guilty_plea_json"])
-	unsupported = [
-		f"{stage}: {factor}"
-		for stage, factors in (
-			("aggravation", aggravating_factors),
-			("mitigation", mitigating_factors),
-			("plea", plea_factors),
+def factor_status_column(
+	factor_lists: list[list[str]],
+	stage: str,
+	supported_effects: dict[tuple[str, str], float],
+) -> list[str]:
+	statuses: dict[tuple[str, ...], str] = {}
+	for factors in map(tuple, factor_lists):
+		if factors not in statuses:
+			statuses[factors] = factor_status(list(factors), stage, supported_effects)
+	return [statuses[tuple(factors)] for factors in factor_lists]
+
+
+def encode_stage_factors(
+	stage_factor_lists: dict[str, list[list[str]]],
+) -> tuple[dict[str, tuple[np.ndarray, np.ndarray]], list[tuple[str, str]]]:
+	"""Encode each stage's factor lists as a sparse trial×factor indicator matrix.
+
+	Each stage maps to ``(trial, column)`` coordinate arrays over the shared
+	``(stage, factor)`` columns.  Repeated factors are dropped and entries keep
+	each trial's factor order, so summing them in order matches ``stage_effect``.
+	"""
+	columns: dict[tuple[str, str], int] = {}
+	indicators: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+	for stage, factor_lists in stage_factor_lists.items():
+		trial_indices: list[int] = []
+		column_indices: list[int] = []
+		for trial_index, factors in enumerate(factor_lists):
+			for factor in dict.fromkeys(factors):
+				trial_indices.append(trial_index)
+				column_indices.append(columns.setdefault((stage, factor), len(columns)))
+		indicators[stage] = (
+			np.asarray(trial_indices, dtype=np.intp),
+			np.asarray(column_indices, dtype=np.intp),
+		)
+	return indicators, list(columns)
+
+
+def effect_matrix(
+	columns: list[tuple[str, str]],
+	candidate_effects: list[dict[tuple[str, str], float]],
+) -> np.ndarray:
+	"""Stack candidate models' effect fractions into a candidates×factors matrix."""
+	return np.array(
+		[[effects.get(column, 0.0) for column in columns] for effects in candidate_effects],
+		dtype=float,
+	).reshape(len(candidate_effects), len(columns))
+
+
+def sparse_stage_effect(
+	indicators: tuple[np.ndarray, np.ndarray],
+	base_months: np.ndarray,
+	effects: np.ndarray,
+) -> np.ndarray:
+	"""Vectorised ``stage_effect`` for every candidate model and trial at once."""
+	trial_indices, column_indices = indicators
+	candidate_count, trial_count = base_months.shape
+	totals = np.empty((candidate_count, trial_count))
+	for candidate in range(candidate_count):
+		totals[candidate] = np.bincount(
+			trial_indices,
+			weights=base_months[candidate, trial_indices] * effects[candidate, column_indices],
+			minlength=trial_count,
+		)
+	totals[np.isnan(base_months)] = np.nan
+	return totals
+
+
+def predict_stages(
+	starting_points: np.ndarray,
+	role_enhancements: np.ndarray,
+	indicators: dict[str, tuple[np.ndarray, np.ndarray]],
+	effects: np.ndarray,
+	*,
+	legacy_clamps: bool = False,
+) -> dict[str, np.ndarray]:
+	"""Run the aggravation, mitigation and plea stages for every candidate model.
+
+	``effects`` holds one row of factor effect fractions per candidate and the
+	results are candidates×trials arrays.  ``legacy_clamps`` applies the legacy
+	comparison's order: aggravation scales the sentence after role and every
+	running total is floored at zero.
+	"""
+	candidate_count = len(effects)
+	starting = np.broadcast_to(np.asarray(starting_points, dtype=float), (candidate_count, len(starting_points)))
+	role = np.broadcast_to(np.asarray(role_enhancements, dtype=float), starting.shape)
+	after_role = starting + role
+	if legacy_clamps:
+		after_role = np.maximum(0.0, after_role)
+	aggravation = sparse_stage_effect(
+		indicators["aggravation"],
+		after_role if legacy_clamps else starting,
+		effects,
+	)
+	notional = after_role + aggravation
+	if legacy_clamps:
+		notional = np.maximum(0.0, notional)
+	mitigation = np.minimum(
+		notional,
+		np.maximum(0.0, sparse_stage_effect(indicators["mitigation"], notional, effects)),
+	)
+	pre_plea = notional - mitigation
+	if legacy_clamps:
+		pre_plea = np.maximum(0.0, pre_plea)
+	plea = np.minimum(
+		pre_plea,
+		np.maximum(0.0, sparse_stage_effect(indicators["plea"], pre_plea, effects)),
+	)
+	final = pre_plea - plea
+	if legacy_clamps:
+		final = np.maximum(0.0, final)
+	return {
+		"sentence_after_role_months": after_role,
+		"aggravation_months": aggravation,
+		"notional_sentence_months": notional,
+		"mitigation_reduction_months": mitigation,
+		"pre_plea_months": pre_plea,
+		"plea_reduction_months": plea,
+		"final_sentence_months": final,
+	}
+
+
+def role_profile_predictions(
+	trials: pd.DataFrame,
+	role_effects: dict[str, Any],
+) -> tuple[np.ndarray, list[str], list[bool]]:
+	"""Role enhancement, status and courier cross-border flag for each trial.
+
+	Profiles repeat heavily, so each distinct role and circumstance combination
+	is resolved once and its effect fraction scaled by the starting point.
+	"""
+	profiles: dict[tuple[str | None, tuple[str, ...]], tuple[float, str, bool]] = {}
+	enhancements: list[float] = []
+	statuses: list[str] = []
+	uses_aggravation: list[bool] = []
+	for starting, uses_role_profile, primary_role, circumstances in zip(
+		trials["predicted_starting_point_months"],
+		trials["uses_role_profile"],
+		trials["selected_primary_role"],
+		trials["selected_circumstances"],
+	):
+		if pd.isna(starting):
+			enhancement, status, flag = np.nan, "starting point unavailable", False
+		elif uses_role_profile:
+			key = (primary_role, tuple(circumstances))
+			if key not in profiles:
+				profiles[key] = role_profile_prediction(primary_role, circumstances, 1.0, role_effects)
+			effect, status, flag = profiles[key]
+			enhancement = starting * effect
+		else:
+			enhancement, status, flag = 0.0, "no sentencing role profile", False
+		enhancements.append(enhancement)
+		statuses.append(status)
+		uses_aggravation.append(flag)
+	return np.asarray(enhancements, dtype=float), statuses, uses_aggravation
+
+
+def predict_held_out(
+	test: pd.DataFrame,
+	supported_effects: dict[tuple[str, str], float],
+	role_effects: dict[str, Any],
+) -> pd.DataFrame:
+	"""Add the role, aggravation, mitigation and plea stage predictions to ``test``."""
+	test = test.copy()
+	test["uses_role_profile"] = test["role_selection_source"].ne("none")
+	test["prediction_role_factors"] = [[] for _ in range(len(test))]
+	test["prediction_aggravating_factors"] = [
+		role_aware_aggravating_factors(factors, primary_role, circumstances)
+		if uses_role_profile
+		else factors
+		for factors, primary_role, circumstances, uses_role_profile in zip(
+			test["other_aggravating_factors"],
+			test["selected_primary_role"],
+			test["selected_circumstances"],
+			test["uses_role_profile"],
 		)
-		for factor in dict.fromkeys(factors)
-		if factor not in LEGACY_PERCENTAGE_EFFECTS[stage]
 	]
-	role = 0.0
-	after_role = max(0.0, starting + role)
+	enhancements, role_statuses, uses_aggravation = role_profile_predictions(test, role_effects)
+	test["predicted_role_enhancement_months"] = enhancements
+	test["role_profile_status"] = role_statuses
+	test["courier_cross_border_uses_aggravation"] = uses_aggravation
+	test["role_factor_status"] = test["role_profile_status"]
+	stage_factors = {
+		"aggravation": test["prediction_aggravating_factors"].tolist(),
+		"mitigation": test["canonical_mitigating_factors"].tolist(),
+		"plea": [plea_factor(plea) for plea in test["guilty_plea"]],
+	}
+	for stage, factor_lists in stage_factors.items():
+		test[f"{stage}_factor_status"] = factor_status_column(factor_lists, stage, supported_effects)
+	indicators, columns = encode_stage_factors(stage_factors)
+	stages = predict_stages(
+		test["predicted_starting_point_months"].to_numpy(dtype=float),
+		enhancements,
+		indicators,
+		effect_matrix(columns, [supported_effects]),
+	)
+	for name, values in stages.items():
+		test[f"predicted_{name}"] = values[0]
+	return test
+
+
+def supported_factor_effects(factor_effects: pd.DataFrame) -> dict[tuple[str, str], float]:
+	return factor_effects.loc[factor_effects["supported"]].set_index(
+		["stage", "canonical_factor"]
+	)["median_effect_fraction"].to_dict()
+
+
+def predict_trials(
+	trials: pd.DataFrame,
+	compiled_curves: dict[str, tuple[np.ndarray, np.ndarray]],
+	supported_effects: dict[tuple[str, str], float],
+	role_effects: dict[str, Any],
+	mixed_drug_method: str = MIXED_DRUG_METHOD,
+) -> pd.DataFrame:
+	"""Predict the starting point and every later stage for ``trials``."""
+	trials = trials.copy()
+	starting_predictions = weighted_starting_points(
+		drug_quantity_triples(trials["drug_amounts"]),
+		compiled_curves,
+		len(trials),
+		mixed_drug_method,
+	)
+	trials[starting_predictions.columns] = starting_predictions.set_axis(trials.index)
+	return predict_held_out(trials, supported_effects, role_effects)
+
+
+def legacy_percentage_predictions(test: pd.DataFrame) -> pd.DataFrame:
+	"""Apply legacy percentages in the new model's stage order for a fair comparison."""
+	stage_factors = {
+		"aggravation": test["other_aggravating_factors"].tolist(),
+		"mitigation": test["canonical_mitigating_factors"].tolist(),
+		"plea": [plea_factor(plea) for plea in test["guilty_plea"]],
+	}
 	legacy_effects = {
 		(stage, factor): effect
 		for stage, effects in LEGACY_PERCENTAGE_EFFECTS.items()
 		for factor, effect in effects.items()
 	}
-	aggravation = stage_effect(aggravating_factors, "aggravation", after_role, legacy_effects)
-	notional = max(0.0, after_role + aggravation)
-	mitigation = min(notional, max(0.0, stage_effect(mitigating_factors, "mitigation", notional, legacy_effects)))
-	pre_plea = max(0.0, notional - mitigation)
-	plea = min(pre_plea, max(0.0, stage_effect(plea_factors, "plea", pre_plea, legacy_effects)))
-	return {
-		"legacy_percentage_factor_status": "supported" if not unsupported else f"unsupported factors: {' | '.join(unsupported)}",
-		"legacy_percentage_compatible": not unsupported,
-		"legacy_percentage_sentence_after_role_months": after_role,
-		"legacy_percentage_notional_sentence_months": notional,
-		"legacy_percentage_mitigation_reduction_months": mitigation,
-		"legacy_percentage_final_sentence_months": max(0.0, pre_plea - plea),
-	}
+	starting = test["predicted_starting_point_months"].to_numpy(dtype=float)
+	available = ~np.isnan(starting)
+	unsupported = [
+		[
+			f"{stage}: {factor}"
+			for stage, factors in zip(stage_factors, trial_factors)
+			for factor in dict.fromkeys(factors)
+			if factor not in LEGACY_PERCENTAGE_EFFECTS[stage]
+		]
+		for trial_factors in zip(*stage_factors.values())
+	]
+	indicators, columns = encode_stage_factors(stage_factors)
+	stages = predict_stages(
+		starting,
+		np.zeros(len(test)),
+		indicators,
+		effect_matrix(columns, [legacy_effects]),
+		legacy_clamps=True,
+	)
+	return pd.DataFrame({
+		"legacy_percentage_factor_status": [
+			"starting point unavailable" if not is_available
+			else "supported" if not factors
+			else f"unsupported factors: {' | '.join(factors)}"
+			for is_available, factors in zip(available, unsupported)
+		],
+		"legacy_percentage_compatible": available & np.array([not factors for factors in unsupported], dtype=bool),
+		"legacy_percentage_sentence_after_role_months": stages["sentence_after_role_months"][0],
+		"legacy_percentage_notional_sentence_months": stages["notional_sentence_months"][0],
+		"legacy_percentage_mitigation_reduction_months": stages["mitigation_reduction_months"][0],
+		"legacy_percentage_final_sentence_months": stages["final_sentence_months"][0],
+	}, index=test.index)
 
 
-def plea_factor(plea_json: str) -> list[str]:
-	plea = json.loads(plea_json)
+def plea_factor(plea: dict[str, Any]) -> list[str]:
 	if not plea.get("pleaded_guilty"):
 		return []
 	stage = plea.get("high_court_stage") or plea.get("district_court_stage") or "Unknown"
@@ -1091,21 +1784,6 @@ def build_factor_percentage_error_report(
 	return pd.DataFrame(report_rows).sort_values(["stage", "canonical_factor"]).reset_index(drop=True)
 
 
-def excel_safe(value: Any) -> Any:
-	if isinstance(value, str):
-		return EXCEL_ILLEGAL_CHARACTERS.sub("", value)
-	if isinstance(value, (list, tuple, dict)):
-		return EXCEL_ILLEGAL_CHARACTERS.sub("", json.dumps(value, default=str))
-	return value
-
-
-def write_sheet(writer: pd.ExcelWriter, dataframe: pd.DataFrame, sheet_name: str) -> None:
-	safe_dataframe = dataframe.copy()
-	for column in safe_dataframe:
-		safe_dataframe[column] = safe_dataframe[column].map(excel_safe)
-	safe_dataframe.to_excel(writer, sheet_name=sheet_name, index=False)
-
-
 def write_deployment_artifact(
 	notebook_dir: Path,
 	cache_metadata: dict[str, Any],
@@ -1114,7 +1792,8 @@ def write_deployment_artifact(
 	role_effects: dict[str, Any],
 	role_workbook_provenance: dict[str, Any],
 ) -> Path:
-	"""Write the static, dependency-free parameters used by the deployment predictor."""
+	"""Write the static, dependency-free parameters used by the deployment predictor
+	and publish them to the model registry."""
 	active_effects = factor_effects.loc[factor_effects["supported"]].copy()
 	artifact = {
 		"model_name": "data-derived-linear-interpolation",
@@ -1138,7 +1817,7 @@ def write_deployment_artifact(
 			"minimum_curve_support": MIN_CURVE_SUPPORT,
 			"minimum_factor_support": MIN_FACTOR_SUPPORT,
 			"curve_method": "single-drug training quantile medians; cumulative-maximum monotonic interpolation",
-			"mixed_drug_method": "legacy total-quantity weighted average",
+			"mixed_drug_method": MIXED_DRUG_METHODS[MIXED_DRUG_METHOD],
 			"factor_percentage_bases": {
 				"aggravation": "starting point",
 				"mitigation": "notional sentence",
@@ -1175,7 +1854,6 @@ def write_deployment_artifact(
 	}
 	artifact_json = json.dumps(artifact, indent=2, sort_keys=True)
 	artifact_path = notebook_dir / "data_derived_linear_model.json"
-	artifact_path.write_text(artifact_json)
 	typescript_artifact_path = (
 		notebook_dir.parent
 		/ "featureVerification"
@@ -1184,91 +1862,226 @@ def write_deployment_artifact(
 		/ artifact_path.name
 	)
 	typescript_artifact_path.parent.mkdir(parents=True, exist_ok=True)
-	typescript_artifact_path.write_text(artifact_json)
+	# Replace rather than rewrite in place: prediction_service reloads the
+	# artifact as soon as it changes.
+	for path in (artifact_path, typescript_artifact_path):
+		write_replacing(path, artifact_json)
+	# Earlier versions stay servable side by side from the registry.
+	ModelRegistry(notebook_dir / "model_registry").publish(artifact)
 	return artifact_path
 
 
-def run_analysis(refresh_cache: bool = False) -> dict[str, pd.DataFrame | str]:
-	notebook_dir = get_notebook_dir()
-	documents, cache_metadata = load_documents(notebook_dir, refresh_cache)
-	trials, effects = flatten_documents(documents)
-	trials, role_reconciliation, role_workbook_provenance = attach_role_catalogue(
-		trials,
-		notebook_dir,
-	)
-	trials, effects, excluded_trial_keys = remove_workbook_exclusions(trials, effects)
+def split_trials(
+	trials: pd.DataFrame,
+	effects: pd.DataFrame,
+	notebook_dir: Path,
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
 	trials, split_membership = assign_partition(trials, notebook_dir)
-	partition_lookup = trials[["role_catalogue_key", "case_id", "partition"]].drop_duplicates(
-		"role_catalogue_key"
+	return trials, split_membership, partition_effects(trials, effects)
+
+
+def fit_training_curves(
+	general_trials: pd.DataFrame,
+) -> tuple[dict[str, pd.DataFrame], pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+	all_drug_types = sorted({drug for amounts in general_trials["drug_amounts"] for drug in amounts})
+	return fit_curves(general_trials.loc[general_trials["partition"] == "train"], all_drug_types)
+
+
+def learn_training_factor_effects(general_effects: pd.DataFrame) -> pd.DataFrame:
+	return learn_factor_effects(general_effects.loc[general_effects["partition"] == "train"])
+
+
+def build_training_role_effects(trials: pd.DataFrame) -> tuple[dict[str, Any], pd.DataFrame]:
+	return build_role_effects(trials.loc[trials["partition"] == "train"])
+
+
+def predict_test_partition(
+	general_trials: pd.DataFrame,
+	curves: dict[str, pd.DataFrame],
+	factor_effects: pd.DataFrame,
+	role_effects: dict[str, Any],
+) -> pd.DataFrame:
+	"""Held-out predictions with reported (rounded) months and the legacy % comparison."""
+	test = predict_trials(
+		general_trials.loc[general_trials["partition"] == "test"],
+		compile_curves(curves),
+		supported_factor_effects(factor_effects),
+		role_effects,
 	)
-	effects = effects.merge(
-		partition_lookup[["role_catalogue_key", "partition"]],
-		on="role_catalogue_key",
-		how="left",
-		validate="many_to_one",
+	for column in [
+		"predicted_starting_point_months",
+		"predicted_role_enhancement_months",
+		"predicted_sentence_after_role_months",
+		"predicted_aggravation_months",
+		"predicted_notional_sentence_months",
+		"predicted_mitigation_reduction_months",
+		"predicted_pre_plea_months",
+		"predicted_plea_reduction_months",
+		"predicted_final_sentence_months",
+	]:
+		test[f"reported_{column}"] = test[column].round().astype("Int64")
+	return pd.concat([test, legacy_percentage_predictions(test)], axis=1)
+
+
+ANALYSIS_STAGES = [
+	analysis_pipeline.Stage(
+		"role catalogue",
+		attach_role_catalogue,
+		inputs={"trials": "loaded_trials", "notebook_dir": "notebook_dir"},
+		outputs=("catalogued_trials", "role_reconciliation", "role_workbook_provenance"),
+		files=(ROLE_WORKBOOK_FILENAME,),
+	),
+	analysis_pipeline.Stage(
+		"workbook exclusions",
+		remove_workbook_exclusions,
+		inputs={"trials": "catalogued_trials", "effects": "loaded_effects"},
+		outputs=("included_trials", "included_effects", "excluded_trial_keys"),
+	),
+	analysis_pipeline.Stage(
+		"split",
+		split_trials,
+		inputs={"trials": "included_trials", "effects": "included_effects", "notebook_dir": "notebook_dir"},
+		outputs=("trials", "split_membership", "effects"),
+		files=("stage_model_analysis.xlsx",),
+	),
+	analysis_pipeline.Stage(
+		"general stages",
+		general_stage_data,
+		inputs={"trials": "trials", "effects": "effects"},
+		outputs=("general_trials", "general_effects", "source_excluded_trial_keys"),
+	),
+	analysis_pipeline.Stage(
+		"curves",
+		fit_training_curves,
+		inputs={"general_trials": "general_trials"},
+		outputs=("curves", "curve_support", "curve_knots", "single_drug_rows"),
+	),
+	analysis_pipeline.Stage(
+		"factor effects",
+		learn_training_factor_effects,
+		inputs={"general_effects": "general_effects"},
+		outputs=("factor_effects",),
+	),
+	analysis_pipeline.Stage(
+		"role effects",
+		build_training_role_effects,
+		inputs={"trials": "trials"},
+		outputs=("role_effects", "role_effect_support"),
+	),
+	analysis_pipeline.Stage(
+		"held-out predictions",
+		predict_test_partition,
+		inputs={
+			"general_trials": "general_trials",
+			"curves": "curves",
+			"factor_effects": "factor_effects",
+			"role_effects": "role_effects",
+		},
+		outputs=("test",),
+	),
+]
+
+
+def load_analysis_stages(
+	notebook_dir: Path,
+	outputs: list[str],
+	refresh_cache: bool = False,
+	*,
+	use_stage_cache: bool = True,
+) -> tuple[dict[str, Any], pd.DataFrame]:
+	"""Load ``outputs`` of ``ANALYSIS_STAGES``, reusing cached stage results.
+
+	Besides the stage outputs, ``outputs`` may name the sources
+	``loaded_trials``, ``loaded_effects``, ``cache_metadata`` and
+	``notebook_dir``.  Returns the values and the stage log.
+	"""
+	# The report's held-out predictions sheet shows every trial column.
+	trials, effects, cache_metadata = load_trial_tables(
+		notebook_dir, refresh_cache, trial_columns=TRIAL_TABLE_COLUMNS
+	)
+	return analysis_pipeline.run_stages(
+		ANALYSIS_STAGES,
+		{
+			"notebook_dir": notebook_dir,
+			"loaded_trials": trials,
+			"loaded_effects": effects,
+			"cache_metadata": cache_metadata,
+		},
+		outputs,
+		notebook_dir=notebook_dir,
+		cache_dir=analysis_pipeline.stage_cache_dir(notebook_dir) if use_stage_cache else None,
+	)
+
+
+def run_analysis(
+	refresh_cache: bool = False,
+	report_formats: tuple[str, ...] = ("xlsx",),
+	*,
+	use_stage_cache: bool = True,
+) -> dict[str, pd.DataFrame | str]:
+	notebook_dir = get_notebook_dir()
+	values, pipeline_stages = load_analysis_stages(
+		notebook_dir,
+		[
+			"cache_metadata",
+			"role_reconciliation",
+			"role_workbook_provenance",
+			"excluded_trial_keys",
+			"trials",
+			"split_membership",
+			"effects",
+			"general_trials",
+			"general_effects",
+			"source_excluded_trial_keys",
+			"curves",
+			"curve_support",
+			"curve_knots",
+			"single_drug_rows",
+			"factor_effects",
+			"role_effects",
+			"role_effect_support",
+			"test",
+		],
+		refresh_cache,
+		use_stage_cache=use_stage_cache,
 	)
+	cache_metadata = values["cache_metadata"]
+	role_reconciliation = values["role_reconciliation"]
+	role_workbook_provenance = values["role_workbook_provenance"]
+	excluded_trial_keys = values["excluded_trial_keys"]
+	trials = values["trials"]
+	split_membership = values["split_membership"]
+	effects = values["effects"]
+	general_trials = values["general_trials"]
+	general_effects = values["general_effects"]
+	source_excluded_trial_keys = values["source_excluded_trial_keys"]
+	curves = values["curves"]
+	curve_support = values["curve_support"]
+	curve_knots = values["curve_knots"]
+	single_drug_rows = values["single_drug_rows"]
+	factor_effects = values["factor_effects"]
+	role_effects = values["role_effects"]
+	role_effect_support = values["role_effect_support"]
+	test = values["test"]
 	assert not effects["partition"].isna().any()
 	assert not trials["role_catalogue_key"].isin(excluded_trial_keys).any()
 	assert not effects["role_catalogue_key"].isin(excluded_trial_keys).any()
-	general_trials, general_effects, source_excluded_trial_keys = general_stage_data(
-		trials,
-		effects,
-	)
 	assert not general_trials["source_document_excluded"].any()
 	assert not general_effects["role_catalogue_key"].isin(source_excluded_trial_keys).any()
 
-	curve_candidates = general_trials.loc[
-		(general_trials["partition"] == "train")
-		& general_trials["starting_point_months"].notna()
-		& ~general_trials["starting_point_inferred"]
-	].copy()
-	curve_candidates["positive_drugs"] = curve_candidates["drug_amounts"].map(
-		lambda amounts: {drug: quantity for drug, quantity in amounts.items() if quantity > 0}
-	)
-	curve_candidates["single_drug_type"] = curve_candidates["positive_drugs"].map(
-		lambda amounts: next(iter(amounts)) if len(amounts) == 1 else None
-	)
-	curve_candidates["single_drug_quantity"] = curve_candidates["positive_drugs"].map(
-		lambda amounts: next(iter(amounts.values())) if len(amounts) == 1 else np.nan
-	)
-	single_drug_rows = curve_candidates.loc[curve_candidates["single_drug_type"].notna()].copy()
-	curves: dict[str, pd.DataFrame] = {}
-	curve_support_rows: list[dict[str, Any]] = []
-	curve_knot_frames: list[pd.DataFrame] = []
-	all_drug_types = sorted({drug for amounts in general_trials["drug_amounts"] for drug in amounts})
-	for drug_type in all_drug_types:
-		knots, support = build_curve(
-			drug_type,
-			single_drug_rows.loc[single_drug_rows["single_drug_type"] == drug_type],
-		)
-		curve_support_rows.append(support)
-		if support["supported"]:
-			curves[drug_type] = knots
-			curve_knot_frames.append(knots)
-	curve_support = pd.DataFrame(curve_support_rows).sort_values("drug_type").reset_index(drop=True)
-	curve_knots = pd.concat(curve_knot_frames, ignore_index=True) if curve_knot_frames else pd.DataFrame()
+	compiled_curves = compile_curves(curves)
 	assert set(single_drug_rows["partition"]) <= {"train"}
 	assert set(curve_knots["drug_type"]) <= set(curves)
-	for _, knots in curve_knots.groupby("drug_type"):
-		for quantity, expected in zip(knots["quantity_grams"], knots["interpolated_months"]):
-			assert np.isclose(interpolate_curve(quantity, knots), expected)
-		assert np.isclose(interpolate_curve(knots["quantity_grams"].min() - 1, knots), knots["interpolated_months"].iloc[0])
-		assert np.isclose(interpolate_curve(knots["quantity_grams"].max() + 1, knots), knots["interpolated_months"].iloc[-1])
-		assert set(" | ".join(knots["training_citations"]).split(" | ")) <= set(single_drug_rows["case_id"])
-
-	factor_effects = learn_factor_effects(
-		general_effects.loc[general_effects["partition"] == "train"]
-	)
-	role_effects, role_effect_support = build_role_effects(
-		trials.loc[trials["partition"] == "train"]
-	)
+	for drug_type, (quantities, months) in compiled_curves.items():
+		assert np.allclose(np.interp(quantities, quantities, months), months)
+		assert np.isclose(np.interp(quantities[0] - 1, quantities, months), months[0])
+		assert np.isclose(np.interp(quantities[-1] + 1, quantities, months), months[-1])
+		assert set(" | ".join(curves[drug_type]["training_citations"]).split(" | ")) <= set(single_drug_rows["case_id"])
+
 	factor_percentage_errors = build_factor_percentage_error_report(
 		factor_effects,
 		general_effects.loc[general_effects["partition"] == "test"],
 	)
-	supported_effects = factor_effects.loc[factor_effects["supported"]].set_index(
-		["stage", "canonical_factor"]
-	)["median_effect_fraction"].to_dict()
 	deployment_artifact_path = write_deployment_artifact(
 		notebook_dir,
 		cache_metadata,
@@ -1277,101 +2090,6 @@ def run_analysis(refresh_cache: bool = False) -> dict[str, pd.DataFrame | str]:
 		role_effects,
 		role_workbook_provenance,
 	)
-	test = general_trials.loc[general_trials["partition"] == "test"].copy()
-	starting_predictions = test["drug_amounts"].map(lambda amounts: starting_point_from_legacy_weighted_total(amounts, curves))
-	test[["predicted_starting_point_months", "starting_prediction_status", "unsupported_drugs"]] = pd.DataFrame(
-		starting_predictions.tolist(), index=test.index
-	)
-	test["unsupported_drugs"] = test["unsupported_drugs"].map(lambda values: " | ".join(values))
-	for _, row in test.loc[test["starting_prediction_status"] == "supported"].iterrows():
-		positive_amounts = {drug: amount for drug, amount in row["drug_amounts"].items() if amount > 0}
-		if len(positive_amounts) > 1:
-			total_amount = sum(positive_amounts.values())
-			expected = sum(
-				interpolate_curve(total_amount, curves[drug_type]) * quantity
-				for drug_type, quantity in positive_amounts.items()
-			) / total_amount
-			assert np.isclose(row["predicted_starting_point_months"], expected)
-	test["uses_role_profile"] = test["role_selection_source"].ne("none")
-	test["prediction_role_factors"] = [[] for _ in range(len(test))]
-	test["prediction_aggravating_factors"] = test.apply(
-		lambda row: role_aware_aggravating_factors(
-			row["other_aggravating_factors"],
-			row["selected_primary_role"],
-			row["selected_circumstances"],
-		)
-		if row["uses_role_profile"]
-		else row["other_aggravating_factors"],
-		axis=1,
-	)
-
-	def predict_role_row(row: pd.Series) -> tuple[float, str, bool]:
-		if pd.isna(row["predicted_starting_point_months"]):
-			return np.nan, "starting point unavailable", False
-		if row["uses_role_profile"]:
-			return role_profile_prediction(
-				row["selected_primary_role"],
-				row["selected_circumstances"],
-				row["predicted_starting_point_months"],
-				role_effects,
-			)
-		return 0.0, "no sentencing role profile", False
-
-	test[[
-		"predicted_role_enhancement_months",
-		"role_profile_status",
-		"courier_cross_border_uses_aggravation",
-	]] = test.apply(predict_role_row, axis=1, result_type="expand")
-	test["role_factor_status"] = test["role_profile_status"]
-	test["aggravation_factor_status"] = test["prediction_aggravating_factors"].map(
-		lambda factors: factor_status(factors, "aggravation", supported_effects)
-	)
-	test["mitigation_factor_status"] = test["canonical_mitigating_factors"].map(
-		lambda factors: factor_status(factors, "mitigation", supported_effects)
-	)
-	test["plea_factor_status"] = test["guilty_plea_json"].map(
-		lambda plea_json: factor_status(plea_factor(plea_json), "plea", supported_effects)
-	)
-	test["predicted_sentence_after_role_months"] = test["predicted_starting_point_months"] + test["predicted_role_enhancement_months"]
-	test["predicted_aggravation_months"] = test.apply(
-		lambda row: stage_effect(row["prediction_aggravating_factors"], "aggravation", row["predicted_starting_point_months"], supported_effects)
-		if pd.notna(row["predicted_starting_point_months"])
-		else np.nan,
-		axis=1,
-	)
-	test["predicted_notional_sentence_months"] = test["predicted_sentence_after_role_months"] + test["predicted_aggravation_months"]
-	test["predicted_mitigation_reduction_months"] = test.apply(
-		lambda row: min(
-			row["predicted_notional_sentence_months"],
-			max(0.0, stage_effect(row["canonical_mitigating_factors"], "mitigation", row["predicted_notional_sentence_months"], supported_effects)),
-		)
-		if pd.notna(row["predicted_notional_sentence_months"])
-		else np.nan,
-		axis=1,
-	)
-	test["predicted_pre_plea_months"] = test["predicted_notional_sentence_months"] - test["predicted_mitigation_reduction_months"]
-	test["predicted_plea_reduction_months"] = test.apply(
-		lambda row: min(
-			row["predicted_pre_plea_months"],
-			max(0.0, stage_effect(plea_factor(row["guilty_plea_json"]), "plea", row["predicted_pre_plea_months"], supported_effects)),
-		)
-		if pd.notna(row["predicted_pre_plea_months"])
-		else np.nan,
-		axis=1,
-	)
-	test["predicted_final_sentence_months"] = test["predicted_pre_plea_months"] - test["predicted_plea_reduction_months"]
-	for column in [
-		"predicted_starting_point_months",
-		"predicted_role_enhancement_months",
-		"predicted_sentence_after_role_months",
-		"predicted_aggravation_months",
-		"predicted_notional_sentence_months",
-		"predicted_mitigation_reduction_months",
-		"predicted_pre_plea_months",
-		"predicted_plea_reduction_months",
-		"predicted_final_sentence_months",
-	]:
-		test[f"reported_{column}"] = test[column].round().astype("Int64")
 	predicted_columns = [column for column in test.columns if column.startswith("predicted_")]
 	assert (test[predicted_columns].dropna(how="all") >= 0).all().all()
 	assert np.allclose(
@@ -1389,8 +2107,6 @@ def run_analysis(refresh_cache: bool = False) -> dict[str, pd.DataFrame | str]:
 		test.loc[test["predicted_notional_sentence_months"].notna(), "predicted_sentence_after_role_months"]
 		+ test.loc[test["predicted_notional_sentence_months"].notna(), "predicted_aggravation_months"],
 	)
-	legacy_predictions = test.apply(legacy_percentage_prediction, axis=1, result_type="expand")
-	test = pd.concat([test, legacy_predictions], axis=1)
 	legacy_eligible = test.loc[
 		test["legacy_percentage_compatible"]
 		& test["final_sentence_months"].notna()
@@ -1441,7 +2157,7 @@ def run_analysis(refresh_cache: bool = False) -> dict[str, pd.DataFrame | str]:
 	])
 	unsupported_test_drugs = test.loc[
 		test["starting_prediction_status"] != "supported",
-		["case_id", "neutral_citation", "trial_index", "charge_no", "defendant_id", "starting_prediction_status", "unsupported_drugs", "drugs_json"],
+		["case_id", "neutral_citation", "trial_index", "charge_no", "defendant_id", "starting_prediction_status", "unsupported_drugs", "drugs"],
 	].copy()
 	comparison = pd.DataFrame()
 	baseline_path = notebook_dir / "stage_model_analysis.xlsx"
@@ -1481,24 +2197,9 @@ def run_analysis(refresh_cache: bool = False) -> dict[str, pd.DataFrame | str]:
 	assert (factor_effects.loc[~factor_effects["supported"], "support_trials"] < MIN_FACTOR_SUPPORT).all()
 
 	output_path = notebook_dir / "linear_interpolation_analysis.xlsx"
-	export_trials = trials.copy()
-	for column in [
-		"drug_amounts",
-		"canonical_aggravating_factors",
-		"canonical_mitigating_factors",
-		"role_factors",
-		"other_aggravating_factors",
-		"workbook_circumstances",
-		"verified_circumstances",
-		"selected_circumstances",
-		"prediction_role_factors",
-		"prediction_aggravating_factors",
-	]:
-		if column in export_trials:
-			export_trials[column] = export_trials[column].map(excel_safe)
-	with pd.ExcelWriter(output_path, engine="openpyxl") as writer:
-		write_sheet(writer, pd.DataFrame([{
-			"cache_document_count": len(documents),
+	sheets = {
+		"summary": pd.DataFrame([{
+			"cache_document_count": cache_metadata.get("document_count"),
 			"cache_created_at": cache_metadata.get("created_at"),
 			"source_excluded_document_count": cache_metadata.get("source_excluded_document_count"),
 			"source_excluded_documents_included_for_trial_reconciliation": cache_metadata.get(
@@ -1514,30 +2215,34 @@ def run_analysis(refresh_cache: bool = False) -> dict[str, pd.DataFrame | str]:
 			"test_size": TEST_SIZE,
 			"minimum_curve_support": MIN_CURVE_SUPPORT,
 			"minimum_factor_support": MIN_FACTOR_SUPPORT,
-		}]), "summary")
-		write_sheet(writer, split_membership, "split membership")
-		write_sheet(writer, eligibility_summary, "eligibility summary")
-		write_sheet(writer, role_reconciliation, "role workbook reconciliation")
-		write_sheet(writer, role_effect_support, "role effect support")
-		write_sheet(writer, single_drug_rows, "single-drug training")
-		write_sheet(writer, curve_support, "curve support")
-		write_sheet(writer, curve_knots, "curve knots")
-		write_sheet(writer, unsupported_test_drugs, "unsupported drugs")
-		write_sheet(writer, factor_effects, "learned factor effects")
-		write_sheet(writer, factor_percentage_errors, "factor percentage errors")
-		write_sheet(writer, metrics, "held-out metrics")
-		write_sheet(writer, comparison, "method comparison")
-		write_sheet(writer, legacy_percentage_comparison, "legacy % comparison")
-		write_sheet(writer, test, "held-out predictions")
-		write_sheet(writer, export_trials, "modelling rows")
-
-	exported_split = pd.read_excel(output_path, sheet_name="split membership")
-	pd.testing.assert_frame_equal(
-		split_membership.sort_values("case_id").reset_index(drop=True),
-		exported_split.sort_values("case_id").reset_index(drop=True),
-	)
+		}]),
+		"split membership": split_membership,
+		"eligibility summary": eligibility_summary,
+		"role workbook reconciliation": role_reconciliation,
+		"role effect support": role_effect_support,
+		"single-drug training": single_drug_rows,
+		"curve support": curve_support,
+		"curve knots": curve_knots,
+		"unsupported drugs": unsupported_test_drugs,
+		"learned factor effects": factor_effects,
+		"factor percentage errors": factor_percentage_errors,
+		"held-out metrics": metrics,
+		"method comparison": comparison,
+		"legacy % comparison": legacy_percentage_comparison,
+		"held-out predictions": test,
+		"modelling rows": trials,
+	}
+	# Check the exported split in memory instead of reading the workbook back.
+	assert split_membership["case_id"].is_unique
+	assert (
+		trials["partition"].to_numpy()
+		== trials["case_id"].map(split_membership.set_index("case_id")["partition"]).to_numpy()
+	).all()
+	report_paths = analysis_report.write_report(output_path, sheets, report_formats)
 	return {
 		"output_path": str(output_path),
+		"report_paths": [str(path) for path in report_paths],
+		"pipeline_stages": pipeline_stages,
 		"deployment_artifact_path": str(deployment_artifact_path),
 		"metrics": metrics,
 		"eligibility_summary": eligibility_summary,
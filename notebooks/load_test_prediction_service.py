@@ -0,0 +1,221 @@
+"""Open-loop load test for ``prediction_service``.
+
+Requests are sent at a fixed rate whatever the server's progress, over a pool
+of keep-alive HTTP/1.1 connections.  Each latency is measured from the time
+the request was scheduled, not sent, so a server that falls behind shows up
+in the tail instead of quietly slowing the test down.
+
+``--in-process`` calls the ASGI application directly with no server or
+network in between, which isolates the service's own cost.
+
+The report has the achieved rate, the count of each status code and the
+p50, p90, p99 and maximum latency in milliseconds.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter
+from collections.abc import Awaitable, Callable
+from typing import Any
+from urllib.parse import urlsplit
+
+from prediction_service import (
+	AGGRAVATING_FACTORS,
+	GUILTY_PLEA_STAGES,
+	MITIGATING_FACTORS,
+	PREDICTION_PATH,
+	PUBLIC_ROLES,
+	PredictionService,
+)
+
+LOAD_TEST_DRUG_TYPES = ("Cocaine", "Ketamine", "Methamphetamine", "Heroin", "Cannabis/THC", "Ecstasy")
+REPORTED_PERCENTILES = (50, 90, 99)
+
+Sender = Callable[[bytes], Awaitable[int]]
+
+
+def sample_requests(count: int, seed: int = 0) -> list[bytes]:
+	"""Encoded, valid prediction requests with varied drugs and factors."""
+	rng = random.Random(seed)
+	mitigating = [factor for factor in MITIGATING_FACTORS if not factor.startswith("Assistance - ")]
+	assistance = [factor for factor in MITIGATING_FACTORS if factor.startswith("Assistance - ")]
+	bodies = []
+	for _ in range(count):
+		role = rng.choice([None, *PUBLIC_ROLES])
+		request = {
+			"drugs": [
+				{"type": drug_type, "quantity": round(rng.uniform(0.1, 2000), 2)}
+				for drug_type in rng.sample(LOAD_TEST_DRUG_TYPES, rng.randint(1, 2))
+			],
+			"defendantRole": role,
+			"additionalCircumstances": ["Cross-border trafficking"] if role and rng.random() < 0.3 else [],
+			"guiltyPlea": rng.choice(list(GUILTY_PLEA_STAGES)),
+			"aggravatingFactors": rng.sample(list(AGGRAVATING_FACTORS), rng.randint(0, 2)),
+			"mitigatingFactors": [
+				*rng.sample(mitigating, rng.randint(0, 2)),
+				*rng.sample(assistance, rng.randint(0, 1)),
+			],
+		}
+		bodies.append(json.dumps(request).encode())
+	return bodies
+
+
+class Connection:
+	"""One keep-alive HTTP/1.1 connection that posts JSON."""
+
+	def __init__(self, host: str, port: int, path: str) -> None:
+		self.host = host
+		self.port = port
+		self.path = path
+		self.reader: asyncio.StreamReader | None = None
+		self.writer: asyncio.StreamWriter | None = None
+
+	async def post(self, body: bytes) -> int:
+		if self.writer is None:
+			self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+		self.writer.write(
+			f"POST {self.path} HTTP/1.1\r\n"
+			f"Host: {self.host}:{self.port}\r\n"
+			"Content-Type: application/json\r\n"
+			f"Content-Length: {len(body)}\r\n\r\n".encode()
+			+ body
+		)
+		await self.writer.drain()
+		status = int((await self.reader.readline()).split()[1])
+		length = 0
+		while (line := await self.reader.readline()) not in (b"\r\n", b""):
+			name, _, value = line.decode().partition(":")
+			if name.lower() == "content-length":
+				length = int(value)
+		await self.reader.readexactly(length)
+		return status
+
+	async def close(self) -> None:
+		if self.writer is not None:
+			self.writer.close()
+			await self.writer.wait_closed()
+
+
+async def run_load(send: Sender, bodies: list[bytes], rate: float, duration: float) -> dict[str, Any]:
+	"""Send ``rate`` requests a second for ``duration`` seconds."""
+	total = max(1, int(rate * duration))
+	latencies: list[float] = []
+	statuses: Counter[int | str] = Counter()
+	started = time.perf_counter()
+
+	async def one(scheduled: float, body: bytes) -> None:
+		try:
+			statuses[await send(body)] += 1
+		except (OSError, asyncio.IncompleteReadError, ValueError, IndexError):
+			statuses["error"] += 1
+		latencies.append(time.perf_counter() - scheduled)
+
+	tasks = []
+	for index in range(total):
+		scheduled = started + index / rate
+		delay = scheduled - time.perf_counter()
+		if delay > 0:
+			await asyncio.sleep(delay)
+		tasks.append(asyncio.create_task(one(scheduled, bodies[index % len(bodies)])))
+	await asyncio.gather(*tasks)
+	return latency_summary(latencies, statuses, time.perf_counter() - started, rate)
+
+
+def latency_summary(
+	latencies: list[float],
+	statuses: Counter[int | str],
+	elapsed: float,
+	target_rate: float,
+) -> dict[str, Any]:
+	ordered = sorted(latencies)
+	summary: dict[str, Any] = {
+		"requests": len(ordered),
+		"target_rps": target_rate,
+		"achieved_rps": len(ordered) / elapsed if elapsed else 0.0,
+		"statuses": dict(statuses),
+	}
+	for percentile in REPORTED_PERCENTILES:
+		# Nearest rank: the smallest latency at or above the percentile.
+		rank = max(1, -(-percentile * len(ordered) // 100))
+		summary[f"p{percentile}_ms"] = ordered[rank - 1] * 1000 if ordered else None
+	summary["max_ms"] = ordered[-1] * 1000 if ordered else None
+	return summary
+
+
+def in_process_sender(app: PredictionService, path: str = PREDICTION_PATH) -> Sender:
+	async def send(body: bytes) -> int:
+		response: dict[str, Any] = {}
+		messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+		async def receive() -> dict[str, Any]:
+			return messages.pop() if messages else {"type": "http.disconnect"}
+
+		async def capture(message: dict[str, Any]) -> None:
+			if message["type"] == "http.response.start":
+				response["status"] = message["status"]
+
+		await app({"type": "http", "method": "POST", "path": path, "headers": []}, receive, capture)
+		return response["status"]
+
+	return send
+
+
+async def load_test(
+	url: str | None,
+	*,
+	rate: float,
+	duration: float,
+	connections: int,
+	seed: int = 0,
+) -> dict[str, Any]:
+	"""Load-test ``url``, or a fresh in-process service when ``url`` is None."""
+	bodies = sample_requests(1000, seed)
+	if url is None:
+		service = PredictionService(poll_seconds=0)
+		service.load()
+		return await run_load(in_process_sender(service), bodies, rate, duration)
+	target = urlsplit(url)
+	pool: asyncio.Queue[Connection] = asyncio.Queue()
+	for _ in range(connections):
+		pool.put_nowait(Connection(target.hostname, target.port or 80, target.path or PREDICTION_PATH))
+
+	async def send(body: bytes) -> int:
+		connection = await pool.get()
+		try:
+			return await connection.post(body)
+		except BaseException:
+			await connection.close()
+			connection = Connection(connection.host, connection.port, connection.path)
+			raise
+		finally:
+			pool.put_nowait(connection)
+
+	try:
+		return await run_load(send, bodies, rate, duration)
+	finally:
+		while not pool.empty():
+			await pool.get_nowait().close()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Open-loop load test for the prediction service.")
+	parser.add_argument("url", nargs="?", default=f"http://127.0.0.1:8000{PREDICTION_PATH}")
+	parser.add_argument("--in-process", action="store_true", help="call the ASGI app directly instead of url")
+	parser.add_argument("--rate", type=float, default=2000.0, help="requests per second")
+	parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+	parser.add_argument("--connections", type=int, default=64)
+	parser.add_argument("--seed", type=int, default=0)
+	args = parser.parse_args()
+	summary = asyncio.run(load_test(
+		None if args.in_process else args.url,
+		rate=args.rate,
+		duration=args.duration,
+		connections=args.connections,
+		seed=args.seed,
+	))
+	print(json.dumps(summary, indent=2))
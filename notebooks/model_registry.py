@@ -0,0 +1,143 @@
+"""Content-addressed store of deployment-model artifacts.
+
+``write_deployment_artifact`` replaces ``data_derived_linear_model.json`` in
+place, so only the newest model can be served.  A ``ModelRegistry`` keeps
+every published artifact in one directory under its ``artifact_digest``:
+
+- ``<digest>.json``: the artifact, written once and never rewritten.
+- ``index.json``: one entry per artifact in publication order, with its
+  model name, ``model_version`` and publication time.
+
+A model is referred to by its digest, a unique digest prefix, a
+``model_version`` (the latest artifact published with it) or ``latest``.  A
+*variant* adds an adjustment strategy: ``"2026-07-19:legacy_percentages"``,
+``"latest"`` (the default ``learned`` strategy).
+
+``predictor`` loads and compiles each (digest, strategy) pair once and keeps
+the ``max_loaded`` most recently used, so switching between variants costs a
+dict lookup.  ``predict_variants`` scores one request against several
+variants and ``predict_many_variants`` a batch, for A/B comparisons of model
+versions on the same traffic.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from collections import OrderedDict
+from collections.abc import Iterable, Mapping, Sequence
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from data_derived_linear_model import DataDerivedLinearPredictor, Prediction, artifact_digest
+
+DEFAULT_REGISTRY_DIR = Path(__file__).with_name("model_registry")
+INDEX_NAME = "index.json"
+DEFAULT_STRATEGY = "learned"
+DEFAULT_MAX_LOADED = 8
+
+
+class RegisteredModel(NamedTuple):
+	digest: str
+	model_name: str | None
+	model_version: str | None
+	published_at: float
+
+
+class ModelRegistry:
+	"""Published artifacts under ``root`` and a cache of their predictors."""
+
+	def __init__(self, root: str | Path = DEFAULT_REGISTRY_DIR, *, max_loaded: int = DEFAULT_MAX_LOADED) -> None:
+		if max_loaded < 1:
+			raise ValueError("max_loaded must be at least 1")
+		self.root = Path(root)
+		self.max_loaded = max_loaded
+		self._loaded: OrderedDict[tuple[str, str], DataDerivedLinearPredictor] = OrderedDict()
+		self._index: tuple[tuple[int, int], list[RegisteredModel]] | None = None
+
+	def artifact_path(self, digest: str) -> Path:
+		return self.root / f"{digest}.json"
+
+	def models(self) -> list[RegisteredModel]:
+		"""Published artifacts, oldest first."""
+		index_path = self.root / INDEX_NAME
+		try:
+			stat = index_path.stat()
+		except FileNotFoundError:
+			return []
+		# Resolved on every served request, so reread only when it changes.
+		signature = (stat.st_mtime_ns, stat.st_size)
+		if self._index is None or self._index[0] != signature:
+			self._index = (signature, [RegisteredModel(**entry) for entry in json.loads(index_path.read_text())])
+		return list(self._index[1])
+
+	def publish(self, artifact: Mapping[str, Any] | str | Path) -> str:
+		"""Add an artifact, given parsed or as a path, and return its digest.
+
+		Publishing an artifact that is already registered changes nothing.
+		"""
+		model = json.loads(Path(artifact).read_text()) if isinstance(artifact, (str, Path)) else artifact
+		digest = artifact_digest(model)
+		models = self.models()
+		if any(entry.digest == digest for entry in models):
+			return digest
+		self.root.mkdir(parents=True, exist_ok=True)
+		write_replacing(self.artifact_path(digest), json.dumps(model, indent=2, sort_keys=True))
+		models.append(RegisteredModel(digest, model.get("model_name"), model.get("model_version"), time.time()))
+		write_replacing(self.root / INDEX_NAME, json.dumps([entry._asdict() for entry in models], indent=2))
+		return digest
+
+	def resolve(self, ref: str) -> str:
+		"""The digest ``ref`` refers to; ``KeyError`` when there is none or
+		a digest prefix is ambiguous."""
+		models = self.models()
+		if ref == "latest":
+			if not models:
+				raise KeyError(f"No models are published in {self.root}")
+			return models[-1].digest
+		for entry in reversed(models):
+			if entry.digest == ref or entry.model_version == ref:
+				return entry.digest
+		matches = {entry.digest for entry in models if entry.digest.startswith(ref)}
+		if len(matches) != 1:
+			raise KeyError(f"{ref!r} matches {len(matches)} published models")
+		return matches.pop()
+
+	def predictor(self, ref: str, adjustment_strategy: str = DEFAULT_STRATEGY) -> DataDerivedLinearPredictor:
+		digest = self.resolve(ref)
+		key = (digest, adjustment_strategy)
+		predictor = self._loaded.get(key)
+		if predictor is not None:
+			self._loaded.move_to_end(key)
+			return predictor
+		predictor = DataDerivedLinearPredictor(self.artifact_path(digest), adjustment_strategy)
+		self._loaded[key] = predictor
+		if len(self._loaded) > self.max_loaded:
+			self._loaded.popitem(last=False)
+		return predictor
+
+	def variant(self, spec: str) -> DataDerivedLinearPredictor:
+		"""The predictor of ``"<ref>[:<adjustment strategy>]"``."""
+		ref, _, strategy = spec.partition(":")
+		return self.predictor(ref, strategy or DEFAULT_STRATEGY)
+
+	def predict_variants(self, variants: Sequence[str], *args: Any, **kwargs: Any) -> dict[str, Prediction]:
+		"""``predict_stages`` of one request under each variant, keyed by spec."""
+		return {spec: self.variant(spec).predict_stages(*args, **kwargs) for spec in variants}
+
+	def predict_many_variants(
+		self,
+		variants: Sequence[str],
+		cases: Iterable[Mapping[str, Any]] | Mapping[str, Sequence[Any]],
+	) -> dict[str, dict[str, list[Any]]]:
+		"""``predict_many`` of one batch under each variant, keyed by spec."""
+		if not isinstance(cases, Mapping):
+			cases = list(cases)
+		return {spec: self.variant(spec).predict_many(cases) for spec in variants}
+
+
+def write_replacing(path: Path, text: str) -> None:
+	"""Write ``text`` to ``path`` so readers never see a partial file."""
+	temporary_path = path.with_suffix(path.suffix + ".tmp")
+	temporary_path.write_text(text)
+	temporary_path.replace(path)
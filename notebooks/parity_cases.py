@@ -0,0 +1,107 @@
+"""Seeded inputs and checks shared by the batch-versus-single parity tests.
+
+Each batch path in the notebooks is pinned against its own one-at-a-time
+path on these inputs, not against a copy of an older implementation.
+"""
+
+import unittest
+from collections.abc import Mapping, Sequence
+from typing import Any
+
+import numpy as np
+
+import similar_case_index
+from data_derived_linear_model import DataDerivedLinearPredictor
+
+SIMILAR_CASE_DRUGS = {
+    "Cocaine": "Cocaine",
+    "Ketamine": "Ketamine",
+    "Methamphetamine": "Methamphetamine",
+    "Heroin": "Heroin",
+    "Cannabis": "Cannabis/THC",
+    "Ecstasy": "Ecstasy",
+}
+
+
+def assert_columns_match_records(
+    test: unittest.TestCase,
+    columns: Mapping[str, Sequence[Any]],
+    records: Sequence[Mapping[str, Any]],
+    names: Sequence[str],
+) -> None:
+    """Check each named column of a batch result against the single results."""
+    for name in names:
+        values = columns[name]
+        values = values.tolist() if isinstance(values, np.ndarray) else list(values)
+        test.assertEqual(values, [record.get(name) for record in records], name)
+
+
+def random_deployment_cases(predictor: DataDerivedLinearPredictor, seed: int, count: int) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    drugs = [*predictor.drug_curves, "Unknown"]
+    aggravating = ["On bail", "Import", "Role of the defendant", "Unlisted", *predictor.factor_effects["aggravation"]]
+    mitigating = ["Unlisted", *predictor.factor_effects["mitigation"]]
+    cases = []
+    for _ in range(count):
+        case = {
+            "drug_amounts": {
+                str(rng.choice(drugs, p=[0.96 / (len(drugs) - 1)] * (len(drugs) - 1) + [0.04])): float(
+                    rng.choice([0.0, rng.uniform(0, 5), rng.uniform(0, 5000)])
+                )
+                for _ in range(int(rng.integers(1, 4)))
+            },
+            "aggravating_factors": list(rng.choice(aggravating, size=int(rng.integers(0, 3)), replace=False)),
+            "mitigating_factors": list(rng.choice(mitigating, size=int(rng.integers(0, 3)), replace=False)),
+            "pleaded_guilty": bool(rng.random() < 0.7),
+            "guilty_plea_stage": rng.choice([None, "Up to committal", "After trial date fixed"]),
+        }
+        if rng.random() < 0.4:
+            case["primary_role"] = str(rng.choice(["Courier / Storekeeper", "Actual trafficker", "Manager / Organiser"]))
+            case["additional_circumstances"] = list(
+                rng.choice(["Cross-border trafficking", "Divan keeping", "Manufacturing"], size=int(rng.integers(0, 3)), replace=False)
+            )
+        cases.append(case)
+    return cases
+
+
+def random_legacy_inputs(seed: int, count: int) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    matrix = np.zeros((count, 17))
+    matrix[:, 0] = rng.random(count) < 0.3
+    matrix[:, 1] = rng.choice([0, 0, 1, 2, 3, 4], count)
+    matrix[:, 2:7] = rng.random((count, 5)) < 0.25
+    boundaries = [0, 1, 10, 50, 300, 1000, 2999.5, 3000, 15000, 100000, 250000]
+    amounts = np.where(rng.random((count, 8)) < 0.5, rng.uniform(0, 20, (count, 8)), rng.uniform(0, 6000, (count, 8)))
+    amounts = np.where(rng.random((count, 8)) < 0.1, rng.choice(boundaries, (count, 8)), amounts)
+    matrix[:, 7:15] = np.where(rng.random((count, 8)) < 0.25, amounts, 0.0)
+    plea = rng.random(count)
+    matrix[:, 15] = plea < 0.3
+    matrix[:, 16] = (plea >= 0.3) & (plea < 0.6)
+    return matrix
+
+
+def random_recommender_corpus(seed: int, count: int) -> list[dict]:
+    rng = np.random.default_rng(seed)
+    families = list(SIMILAR_CASE_DRUGS)
+    records = []
+    for row in range(count):
+        held = rng.choice(families, size=rng.choice([1, 1, 1, 2, 3]), replace=False)
+        drugs = {str(family): float(rng.choice([5.0, 10.0, 20.0, 50.0, 120.0])) for family in held}
+        model_drugs = [{"type": SIMILAR_CASE_DRUGS[family], "quantity": quantity} for family, quantity in drugs.items()]
+        records.append({
+            # Shared citations exercise the one-case-per-judgment rule.
+            "neutralCitation": f"[2024] HKCFI {rng.integers(0, count // 2)}",
+            "title": f"HKSAR v D{row}",
+            "url": f"https://example.test/{row}",
+            "language": "english",
+            "drugs": drugs,
+            "role": rng.choice([None, None, "Actual trafficker", "Manager / Organiser"]),
+            "crossBorder": bool(rng.random() < 0.3),
+            "aggravating": [factor for factor in ("Refugee/Asylum", "On bail") if rng.random() < 0.2],
+            "mitigating": [],
+            "assistance": int(rng.choice([0, 0, 0, 1, 2, 3, 4])),
+            "plea": str(rng.choice(["early", "late", "none"])),
+            "actualFinalMonths": float(rng.integers(12, 240)),
+            "startingPointMonths": round(similar_case_index.predict_notional_weighted_months(model_drugs), 6),
+        })
+    return records
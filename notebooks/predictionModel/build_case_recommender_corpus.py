@@ -6,9 +6,13 @@ version, computes guideline starting points, and emits:
 
 - notebooks/predictionModel/case_recommender_corpus.json
 - predictorBackend/src/case_recommender_corpus.json (read by the backend at runtime)
+- notebooks/predictionModel/case_recommender_corpus.bin, the same records in the
+  compact columnar format of recommender_corpus.py (read by similar_case_index.py)
 
 The starting-point buckets below mirror predictorBackend/src/guidelineModel.ts
-(single source of truth). Run from the repo root:
+(single source of truth). They are compiled into per-family breakpoint arrays,
+so a column of quantities is looked up with one searchsorted, and records are
+built column by column from the flattened trial frame. Run from the repo root:
 
     featureExtraction/.venv/bin/python notebooks/predictionModel/build_case_recommender_corpus.py
 """
@@ -18,11 +22,12 @@ from __future__ import annotations
 import argparse
 import json
 import os
-import re
 import sys
-from collections import defaultdict
+from collections.abc import Mapping
 from pathlib import Path
+from typing import NamedTuple
 
+import numpy as np
 import pandas as pd
 from bson import ObjectId
 from dotenv import load_dotenv
@@ -34,11 +39,17 @@ repo_root = notebook_dir.parent
 sys.path.insert(0, str(notebook_dir))
 
 from linear_interpolation_model import (  # noqa: E402
-    clean_quantity,
     flatten_documents,
     load_documents,
+    numeric_column,
     trial_catalogue_key,
 )
+from recommender_corpus import (  # noqa: E402
+    COLUMNAR_CORPUS,
+    CORPUS_FAMILIES,
+    build_url,
+    emit_columnar,
+)
 
 ROLE_WORKBOOK = prediction_model_dir / "Role Sentence Adjustments_updated 2026.07.30.xlsx"
 JSON_OUT = prediction_model_dir / "case_recommender_corpus.json"
@@ -199,13 +210,79 @@ def family_for(drug_type: str, variant: str | None = None) -> str | None:
     return FAMILY.get(drug_type)
 
 
-def interpolate(bucket: dict, quantity: float, previous_high_s: float | None) -> float:
-    if bucket["high_q"] is not None and bucket["high_s"] is not None:
-        u = (quantity - bucket["low_q"]) / (bucket["high_q"] - bucket["low_q"])
-        return bucket["low_s"] + u * (bucket["high_s"] - bucket["low_s"])
-    if bucket["kind"] == "discretionTop" and previous_high_s is not None:
-        return previous_high_s
-    return bucket["low_s"]
+class GuidelineTable(NamedTuple):
+    """One family's buckets as arrays; an open top bucket has ``high_q`` inf."""
+
+    low_q: np.ndarray
+    high_q: np.ndarray
+    low_s: np.ndarray
+    high_s: np.ndarray
+    interpolates: np.ndarray
+    # The sentence of a bucket that does not interpolate.
+    flat_s: np.ndarray
+
+
+def compile_guideline_table(buckets: list[dict]) -> GuidelineTable:
+    low_q = np.array([bucket["low_q"] for bucket in buckets], dtype=float)
+    high_q = np.array(
+        [np.inf if bucket["high_q"] is None else bucket["high_q"] for bucket in buckets],
+        dtype=float,
+    )
+    if np.any(high_q[:-1] > low_q[1:]) or np.any(high_q <= low_q):
+        raise ValueError("Guideline buckets must be ordered and must not overlap")
+    previous_high_s = None
+    flat_s = []
+    for bucket in buckets:
+        if bucket["kind"] == "discretionTop" and previous_high_s is not None:
+            flat_s.append(previous_high_s)
+        else:
+            flat_s.append(bucket["low_s"])
+        if bucket["high_s"] is not None:
+            previous_high_s = bucket["high_s"]
+    return GuidelineTable(
+        low_q=low_q,
+        high_q=high_q,
+        low_s=np.array([bucket["low_s"] for bucket in buckets], dtype=float),
+        high_s=np.array(
+            [np.nan if bucket["high_s"] is None else bucket["high_s"] for bucket in buckets],
+            dtype=float,
+        ),
+        interpolates=np.array(
+            [bucket["high_q"] is not None and bucket["high_s"] is not None for bucket in buckets]
+        ),
+        flat_s=np.array(flat_s, dtype=float),
+    )
+
+
+GUIDELINE_TABLES = {
+    family: compile_guideline_table(buckets) for family, buckets in GUIDELINE_BUCKETS.items()
+}
+GUIDELINE_FAMILIES = list(GUIDELINE_TABLES)
+# Corpus family -> code of its guideline family; Midazolam is scored as powder.
+CORPUS_GUIDELINE_CODES = np.array(
+    [
+        GUIDELINE_FAMILIES.index("Midazolam-powder" if family == "Midazolam" else family)
+        for family in CORPUS_FAMILIES
+    ]
+)
+
+
+def guideline_months(family: str, quantities: np.ndarray) -> np.ndarray:
+    """Starting point of each quantity in ``family``'s buckets, NaN where no
+    bucket holds it."""
+    table = GUIDELINE_TABLES[family]
+    quantities = np.asarray(quantities, dtype=float)
+    bucket = np.searchsorted(table.low_q, quantities, side="right") - 1
+    clipped = np.maximum(bucket, 0)
+    low_q = table.low_q[clipped]
+    low_s = table.low_s[clipped]
+    u = (quantities - low_q) / (table.high_q[clipped] - low_q)
+    months = np.where(
+        table.interpolates[clipped],
+        low_s + u * (table.high_s[clipped] - low_s),
+        table.flat_s[clipped],
+    )
+    return np.where((bucket >= 0) & (quantities < table.high_q[clipped]), months, np.nan)
 
 
 def predict_starting_point_months(
@@ -214,17 +291,8 @@ def predict_starting_point_months(
     family = family_for(drug_type, variant)
     if family is None:
         return None
-    previous_high_s = None
-    for bucket in GUIDELINE_BUCKETS[family]:
-        if bucket["high_q"] is not None:
-            if bucket["low_q"] <= quantity < bucket["high_q"]:
-                return interpolate(bucket, quantity, previous_high_s)
-        else:
-            if quantity >= bucket["low_q"]:
-                return interpolate(bucket, quantity, previous_high_s)
-        if bucket["high_s"] is not None:
-            previous_high_s = bucket["high_s"]
-    return None
+    months = float(guideline_months(family, np.array([quantity]))[0])
+    return None if np.isnan(months) else months
 
 
 def predict_notional_weighted_months(drugs: list[dict]) -> float | None:
@@ -242,6 +310,30 @@ def predict_notional_weighted_months(drugs: list[dict]) -> float | None:
     return starting
 
 
+def notional_weighted_months(quantities: np.ndarray, families: np.ndarray) -> np.ndarray:
+    """Column form of ``predict_notional_weighted_months``.
+
+    Row ``i`` holds one case's drugs in order: slot ``k`` has the quantity in
+    ``quantities[i, k]`` and the ``GUIDELINE_FAMILIES`` code in
+    ``families[i, k]``, -1 for an empty slot. Sums run slot by slot, as the
+    scalar version sums drug by drug, so both give the same floats. NaN where
+    a drug's family has no bucket for the total quantity.
+    """
+    held = families >= 0
+    total = np.zeros(len(quantities))
+    for slot in range(quantities.shape[1]):
+        total = total + np.where(held[:, slot], quantities[:, slot], 0.0)
+    starting = np.zeros(len(quantities))
+    for slot in range(quantities.shape[1]):
+        for code, family in enumerate(GUIDELINE_FAMILIES):
+            rows = held[:, slot] & (families[:, slot] == code)
+            if rows.any():
+                starting[rows] += guideline_months(family, total[rows]) * (
+                    quantities[rows, slot] / total[rows]
+                )
+    return np.where(total > 0, starting, 0.0)
+
+
 def load_judgement_languages(
     source_ids: set[str],
     refresh: bool = False,
@@ -283,22 +375,137 @@ def load_judgement_languages(
     return languages
 
 
-def build_url(neutral_citation: str, language: str) -> str | None:
-    match = re.search(r"\[([0-9]*)\] ([a-zA-Z]*) ([0-9]*)", neutral_citation)
-    if not match:
-        return None
-    year, court, cno = match.groups()
-    segment = "tc" if language in ("chinese", "traditional_chinese") else "en"
-    return (
-        f"https://www.hklii.hk/{segment}/cases/{court.lower()}/{year}/{cno}"
-    )
-
-
 def emit_json(records: list[dict], path: Path) -> None:
     path.write_text(json.dumps(records, indent=1, sort_keys=True))
     print("Wrote", path)
 
 
+def build_records(
+    trial_rows: pd.DataFrame, language_by_citation: Mapping[str, str]
+) -> tuple[list[dict], dict[str, int]]:
+    """Corpus records of the kept trial rows and the skipped-row counts.
+
+    ``trial_rows`` are flattened trials joined with the role workbook's
+    ``model_role`` and ``model_cross_border``. Drugs, factors and pleas are
+    decoded for the whole frame at once; only the final records are built
+    one by one. Records are sorted by citation and actual sentence, and share
+    the title of their citation's first record.
+    """
+    row_count = len(trial_rows)
+    drugs = pd.DataFrame(
+        [
+            (row, drug["drug_type"], drug.get("quantity"), drug.get("other_drug_type"))
+            for row, items in enumerate(trial_rows["drugs"].tolist())
+            for drug in items
+            if drug.get("drug_type")
+        ],
+        columns=["row", "drug_type", "quantity", "other_drug_type"],
+    )
+    quantity = numeric_column(drugs["quantity"].tolist())
+    drugs = drugs.assign(quantity=quantity).loc[np.isfinite(quantity) & (quantity > 0)]
+    other_midazolam = (
+        drugs["other_drug_type"].fillna("").astype(str).str.lower().str.contains("midazolam", regex=False)
+    )
+    family = drugs["drug_type"].map(DRUG_VERIFIED_TO_FAMILY).astype(object)
+    family = family.where(~drugs["drug_type"].eq("Other"), other_midazolam.map({True: "Midazolam", False: None}))
+    unsupported = np.zeros(row_count, dtype=bool)
+    unsupported[drugs.loc[family.isna(), "row"].to_numpy(dtype=int)] = True
+
+    supported = family.notna().to_numpy()
+    rows = drugs["row"].to_numpy(dtype=int)[supported]
+    columns = family[supported].map({name: column for column, name in enumerate(CORPUS_FAMILIES)}).to_numpy(dtype=int)
+    # Amounts accumulate in drug order and each case's families keep the
+    # order they first appear in, as the notional-quantity sum expects.
+    amounts = np.zeros((row_count, len(CORPUS_FAMILIES)))
+    np.add.at(amounts, (rows, columns), drugs["quantity"].to_numpy(dtype=float)[supported])
+    first_seen = np.full(amounts.shape, np.inf)
+    np.minimum.at(first_seen, (rows, columns), np.arange(len(rows)))
+    slots = np.argsort(first_seen, axis=1, kind="stable")
+    slot_held = np.isfinite(np.take_along_axis(first_seen, slots, axis=1))
+    starting_point = notional_weighted_months(
+        np.take_along_axis(amounts, slots, axis=1),
+        np.where(slot_held, CORPUS_GUIDELINE_CODES[slots], -1),
+    )
+    has_drugs = slot_held.any(axis=1)
+    keep = np.flatnonzero(~unsupported & has_drugs & ~np.isnan(starting_point))
+
+    citations = trial_rows["neutral_citation"].to_numpy(dtype=object)[keep]
+    languages = [language_by_citation.get(citation, "unknown") for citation in citations]
+    languages = [language if language in ("english", "chinese") else "english" for language in languages]
+    urls = {key: build_url(*key) for key in set(zip(citations, languages))}
+    record_urls = [urls[key] for key in zip(citations, languages)]
+
+    canonical_aggravating = trial_rows["canonical_aggravating_factors"].to_numpy(dtype=object)[keep]
+    canonical_mitigating = trial_rows["canonical_mitigating_factors"].to_numpy(dtype=object)[keep]
+    cross_border = trial_rows["model_cross_border"].eq(True).to_numpy()[keep] | np.array(
+        ["Cross-border trafficking" in factors for factors in canonical_aggravating], dtype=bool
+    )
+    pleas = trial_rows["guilty_plea"].to_numpy(dtype=object)[keep]
+    stages = pd.Series(
+        [
+            plea.get("high_court_stage") or plea.get("district_court_stage") or "Unknown"
+            for plea in pleas
+        ],
+        dtype=object,
+    )
+    pleaded = np.array([bool(plea.get("pleaded_guilty")) for plea in pleas], dtype=bool)
+    plea_buckets = np.select(
+        [pleaded & stages.isin(PLEA_EARLY).to_numpy(), pleaded & stages.isin(PLEA_LATE).to_numpy()],
+        ["early", "late"],
+        "none",
+    )
+    roles = trial_rows["model_role"].astype(object)
+    roles = roles.where(roles.notna(), None).to_numpy(dtype=object)[keep]
+    final_months = trial_rows["final_sentence_months"].to_numpy(dtype=float)[keep]
+    titles = [f"HKSAR v {name}" for name in trial_rows["defendant_name"].to_numpy(dtype=object)[keep]]
+    first_titles: dict[str, str] = {}
+    for citation, title in zip(citations, titles):
+        first_titles.setdefault(citation, title)
+
+    _citation_order, citation_codes = np.unique(citations.astype(str), return_inverse=True)
+    records = []
+    for position in np.lexsort((final_months, citation_codes)).tolist():
+        row = keep[position]
+        citation = citations[position]
+        records.append(
+            {
+                "neutralCitation": citation,
+                "title": first_titles[citation],
+                "url": record_urls[position] or "",
+                "language": languages[position],
+                "drugs": {
+                    CORPUS_FAMILIES[column]: float(amounts[row, column])
+                    for column in slots[row][slot_held[row]].tolist()
+                },
+                "role": roles[position],
+                "crossBorder": bool(cross_border[position]),
+                "aggravating": [
+                    AGGRAVATING_MODEL_MAP[factor]
+                    for factor in dict.fromkeys(canonical_aggravating[position])
+                    if factor in AGGRAVATING_MODEL_MAP
+                ],
+                "mitigating": [
+                    factor
+                    for factor in canonical_mitigating[position]
+                    if factor in MITIGATING_MODEL_FACTORS
+                ],
+                "assistance": max(
+                    (ASSISTANCE_TIER.get(factor, 0) for factor in canonical_mitigating[position]),
+                    default=0,
+                ),
+                "plea": str(plea_buckets[position]),
+                "actualFinalMonths": float(final_months[position]),
+                "startingPointMonths": round(float(starting_point[row]), 6),
+            }
+        )
+    skipped = {
+        "unsupported_drug": int(unsupported.sum()),
+        "no_supported_drug": int((~unsupported & ~has_drugs).sum()),
+        "bad_url": sum(url is None for url in record_urls),
+    }
+    return records, skipped
+
+
 def main() -> None:
     parser = argparse.ArgumentParser(description="Build the case-recommendation corpus")
     parser.add_argument(
@@ -367,133 +574,13 @@ def main() -> None:
         role_rows, on="role_catalogue_key", how="left", validate="many_to_one"
     )
 
-    records = []
-    skipped = {"unsupported_drug": 0, "no_supported_drug": 0, "bad_url": 0}
-    for _index, row in trial_rows.iterrows():
-        drugs = json.loads(row["drugs_json"])
-        amounts = defaultdict(float)
-        unsupported = False
-        for drug in drugs:
-            drug_type = drug.get("drug_type")
-            if not drug_type:
-                continue
-            quantity, invalid = clean_quantity(drug.get("quantity"))
-            if invalid or quantity <= 0:
-                continue
-            if drug_type == "Other":
-                other = (drug.get("other_drug_type") or "").strip().lower()
-                if "midazolam" in other:
-                    amounts["Midazolam"] += quantity
-                else:
-                    unsupported = True
-                continue
-            family = DRUG_VERIFIED_TO_FAMILY.get(drug_type)
-            if family is None:
-                unsupported = True
-                continue
-            amounts[family] += quantity
-        if unsupported:
-            skipped["unsupported_drug"] += 1
-            continue
-        if not amounts:
-            skipped["no_supported_drug"] += 1
-            continue
-
-        model_drugs = []
-        for family, quantity in amounts.items():
-            if family == "Midazolam":
-                model_drugs.append(
-                    {"type": "Midazolam", "quantity": quantity, "variant": "powder"}
-                )
-            else:
-                model_type = "Cannabis/THC" if family == "Cannabis" else family
-                model_drugs.append({"type": model_type, "quantity": quantity})
-        starting_point = predict_notional_weighted_months(model_drugs)
-        if starting_point is None:
-            continue
-
-        citation = row["neutral_citation"]
-        language = language_by_citation.get(citation, "unknown")
-        if language not in ("english", "chinese"):
-            language = "english"
-        url = build_url(citation, language)
-        if url is None:
-            skipped["bad_url"] += 1
-            url = ""
-
-        canonical_aggravating = set(row["canonical_aggravating_factors"])
-        aggravating = [
-            AGGRAVATING_MODEL_MAP[f]
-            for f in canonical_aggravating
-            if f in AGGRAVATING_MODEL_MAP
-        ]
-        model_cross_border = row.get("model_cross_border")
-        if pd.isna(model_cross_border):
-            model_cross_border = False
-        cross_border = bool(model_cross_border) or (
-            "Cross-border trafficking" in canonical_aggravating
-        )
-        mitigating = [
-            f
-            for f in row["canonical_mitigating_factors"]
-            if f in MITIGATING_MODEL_FACTORS
-        ]
-        assistance = 0
-        for f in row["canonical_mitigating_factors"]:
-            if f in ASSISTANCE_TIER:
-                assistance = max(assistance, ASSISTANCE_TIER[f])
-
-        plea = json.loads(row["guilty_plea_json"])
-        plea_bucket = "none"
-        if plea.get("pleaded_guilty"):
-            stage = (
-                plea.get("high_court_stage")
-                or plea.get("district_court_stage")
-                or "Unknown"
-            )
-            if stage in PLEA_EARLY:
-                plea_bucket = "early"
-            elif stage in PLEA_LATE:
-                plea_bucket = "late"
-
-        role = row.get("model_role")
-        if pd.isna(role):
-            role = None
-        records.append(
-            {
-                "neutralCitation": citation,
-                "title": f"HKSAR v {row['defendant_name']}",
-                "url": url,
-                "language": language,
-                "drugs": dict(amounts),
-                "role": role,
-                "crossBorder": cross_border,
-                "aggravating": aggravating,
-                "mitigating": mitigating,
-                "assistance": assistance,
-                "plea": plea_bucket,
-                "actualFinalMonths": row["final_sentence_months"],
-                "startingPointMonths": round(starting_point, 6),
-            }
-        )
-
-    titles = {}
-    for record in records:
-        title = titles.get(record["neutralCitation"])
-        if title is None:
-            titles[record["neutralCitation"]] = record["title"]
-        else:
-            record["title"] = title
-
-    corpus = sorted(
-        records,
-        key=lambda r: (r["neutralCitation"], r["actualFinalMonths"]),
-    )
+    corpus, skipped = build_records(trial_rows, language_by_citation)
     print(f"corpus records: {len(corpus)}")
     print(f"skipped: {skipped}")
 
     emit_json(corpus, JSON_OUT)
     emit_json(corpus, BACKEND_JSON_OUT)
+    emit_columnar(corpus, COLUMNAR_CORPUS)
 
 
 if __name__ == "__main__":
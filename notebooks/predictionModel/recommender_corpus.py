@@ -0,0 +1,311 @@
+"""Compact columnar format for the case-recommendation corpus.
+
+The JSON corpus repeats every key, title and HKLII URL on every record. The
+columnar file stores each field once per corpus:
+
+- strings (citations, titles, languages, roles, plea buckets, factors) as
+  dictionaries, with one integer code per record, as narrow as the
+  dictionary allows.
+- drug quantities as a float64 matrix with one column per family (0 when a
+  case has none), and months, assistance and cross-border as fixed-width
+  arrays.
+- factor lists as codes with per-record offsets.
+- HKLII URLs not at all when ``build_url`` rebuilds them from the citation and
+  language, which it does for every record the builder writes.
+
+Layout: an 8-byte magic, the little-endian header length, a JSON header (the
+dictionaries and each array's dtype, shape and offset), then the arrays, each
+8-byte aligned. ``load_corpus`` memory-maps the file and views the arrays in
+place, so loading costs the header parse and pages are shared by every process
+holding the corpus. ``CorpusColumns.records`` decodes the JSON records again.
+
+Convert an existing JSON corpus with:
+
+    python notebooks/predictionModel/recommender_corpus.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import mmap
+import re
+import struct
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+prediction_model_dir = Path(__file__).resolve().parent
+
+JSON_CORPUS = prediction_model_dir / "case_recommender_corpus.json"
+COLUMNAR_CORPUS = prediction_model_dir / "case_recommender_corpus.bin"
+
+MAGIC = b"HKCRC\x00\x01\x00"
+HEADER_LENGTH = struct.Struct("<Q")
+ALIGNMENT = 8
+CORPUS_FAMILIES = (
+    "Cocaine",
+    "Ketamine",
+    "Methamphetamine",
+    "Heroin",
+    "Cannabis",
+    "Ecstasy",
+    "Nimetazepam",
+    "Midazolam",
+)
+# Code of a record without a role, and of a URL rebuilt by build_url.
+NO_CODE = -1
+
+
+def build_url(neutral_citation: str, language: str) -> str | None:
+    match = re.search(r"\[([0-9]*)\] ([a-zA-Z]*) ([0-9]*)", neutral_citation)
+    if not match:
+        return None
+    year, court, cno = match.groups()
+    segment = "tc" if language in ("chinese", "traditional_chinese") else "en"
+    return (
+        f"https://www.hklii.hk/{segment}/cases/{court.lower()}/{year}/{cno}"
+    )
+
+
+def rebuilt_url(neutral_citation: str, language: str) -> str:
+    return build_url(neutral_citation, language) or ""
+
+
+def dictionary_encode(values: Sequence[Any]) -> tuple[list[Any], np.ndarray]:
+    """Distinct values in first-seen order and each value's code."""
+    table: dict[Any, int] = {}
+    codes = [table.setdefault(value, len(table)) for value in values]
+    return list(table), np.array(codes, dtype=np.int32)
+
+
+def code_dtype(size: int, candidates: Sequence[type] = (np.uint8, np.uint16, np.uint32)) -> np.dtype:
+    """The first of ``candidates`` that holds every code of a ``size``-entry
+    dictionary, little-endian."""
+    for candidate in candidates:
+        if size - 1 <= np.iinfo(candidate).max:
+            return np.dtype(candidate).newbyteorder("<")
+    raise ValueError(f"{size} dictionary entries do not fit {np.dtype(candidates[-1])} codes")
+
+
+def encode_lists(lists: Sequence[Sequence[str]]) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """Dictionary, concatenated codes and per-record offsets of string lists."""
+    table, codes = dictionary_encode([value for values in lists for value in values])
+    offsets = np.zeros(len(lists) + 1, dtype=np.int32)
+    np.cumsum([len(values) for values in lists], out=offsets[1:])
+    return table, codes.astype(code_dtype(len(table))), offsets
+
+
+def encode_corpus(records: Sequence[Mapping[str, Any]]) -> bytes:
+    """The columnar file of ``records``."""
+    roles = [record["role"] for record in records]
+    role_table, role_codes = dictionary_encode([role for role in roles if role is not None])
+    role_column = np.full(len(records), NO_CODE, dtype=code_dtype(len(role_table), (np.int16, np.int32)))
+    role_column[[row for row, role in enumerate(roles) if role is not None]] = role_codes
+    # Only URLs build_url cannot rebuild are stored.
+    url_table: dict[str, int] = {}
+    url_column = np.array(
+        [
+            NO_CODE
+            if record["url"] == rebuilt_url(record["neutralCitation"], record["language"])
+            else url_table.setdefault(record["url"], len(url_table))
+            for record in records
+        ],
+        dtype=np.int32,
+    )
+    quantities = np.zeros((len(records), len(CORPUS_FAMILIES)), dtype="<f8")
+    for row, record in enumerate(records):
+        for family, quantity in record["drugs"].items():
+            quantities[row, CORPUS_FAMILIES.index(family)] = quantity
+    citations, citation_codes = dictionary_encode([record["neutralCitation"] for record in records])
+    titles, title_codes = dictionary_encode([record["title"] for record in records])
+    languages, language_codes = dictionary_encode([record["language"] for record in records])
+    pleas, plea_codes = dictionary_encode([record["plea"] for record in records])
+    aggravating, aggravating_codes, aggravating_offsets = encode_lists(
+        [record["aggravating"] for record in records]
+    )
+    mitigating, mitigating_codes, mitigating_offsets = encode_lists(
+        [record["mitigating"] for record in records]
+    )
+    arrays = {
+        "citation": citation_codes.astype("<i4"),
+        "title": title_codes.astype("<i4"),
+        "language": language_codes.astype(code_dtype(len(languages))),
+        "url": url_column.astype("<i4"),
+        "role": role_column,
+        "plea": plea_codes.astype(code_dtype(len(pleas))),
+        "cross_border": np.array([bool(record["crossBorder"]) for record in records], dtype=np.uint8),
+        "assistance": np.array([record["assistance"] for record in records], dtype=np.uint8),
+        "quantities": quantities,
+        "actual_final_months": np.array([record["actualFinalMonths"] for record in records], dtype="<f8"),
+        "starting_point_months": np.array([record["startingPointMonths"] for record in records], dtype="<f8"),
+        "aggravating_codes": aggravating_codes,
+        "aggravating_offsets": aggravating_offsets.astype("<i4"),
+        "mitigating_codes": mitigating_codes,
+        "mitigating_offsets": mitigating_offsets.astype("<i4"),
+    }
+    header = {
+        "rows": len(records),
+        "families": list(CORPUS_FAMILIES),
+        "citations": citations,
+        "titles": titles,
+        "languages": languages,
+        "urls": list(url_table),
+        "roles": role_table,
+        "pleas": pleas,
+        "aggravating": aggravating,
+        "mitigating": mitigating,
+        "arrays": {},
+    }
+    # Offsets count from the end of the header, so they do not depend on the
+    # header's own length.
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header, separators=(",", ":"), ensure_ascii=False).encode()
+    header_bytes += b" " * (-(len(MAGIC) + HEADER_LENGTH.size + len(header_bytes)) % ALIGNMENT)
+    chunks = [MAGIC, HEADER_LENGTH.pack(len(header_bytes)), header_bytes]
+    for array in arrays.values():
+        data = np.ascontiguousarray(array).tobytes()
+        chunks.append(data + b"\x00" * (-len(data) % ALIGNMENT))
+    return b"".join(chunks)
+
+
+def emit_columnar(records: Sequence[Mapping[str, Any]], path: Path) -> None:
+    temporary_path = path.with_suffix(path.suffix + ".tmp")
+    temporary_path.write_bytes(encode_corpus(records))
+    temporary_path.replace(path)
+    print("Wrote", path)
+
+
+class CorpusColumns:
+    """Read-only views of a columnar corpus held in ``buffer``.
+
+    ``quantities`` has one column per entry of ``families``; the other arrays
+    hold one code or value per record.
+    """
+
+    def __init__(self, buffer: Any) -> None:
+        view = memoryview(buffer)
+        if bytes(view[: len(MAGIC)]) != MAGIC:
+            raise ValueError("Not a columnar case-recommender corpus")
+        (header_length,) = HEADER_LENGTH.unpack_from(view, len(MAGIC))
+        start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(bytes(view[start : start + header_length]))
+        data_start = start + header_length
+        self.buffer = buffer
+        self.rows: int = header["rows"]
+        self.families: list[str] = header["families"]
+        self.citations: list[str] = header["citations"]
+        self.titles: list[str] = header["titles"]
+        self.languages: list[str] = header["languages"]
+        self.urls: list[str] = header["urls"]
+        self.roles: list[str] = header["roles"]
+        self.pleas: list[str] = header["pleas"]
+        self.aggravating: list[str] = header["aggravating"]
+        self.mitigating: list[str] = header["mitigating"]
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            shape = tuple(spec["shape"])
+            arrays[name] = np.frombuffer(
+                view,
+                dtype=dtype,
+                count=int(np.prod(shape)),
+                offset=data_start + spec["offset"],
+            ).reshape(shape)
+        self.citation_codes: np.ndarray = arrays["citation"]
+        self.title_codes: np.ndarray = arrays["title"]
+        self.language_codes: np.ndarray = arrays["language"]
+        self.url_codes: np.ndarray = arrays["url"]
+        self.role_codes: np.ndarray = arrays["role"]
+        self.plea_codes: np.ndarray = arrays["plea"]
+        self.cross_border: np.ndarray = arrays["cross_border"]
+        self.assistance: np.ndarray = arrays["assistance"]
+        self.quantities: np.ndarray = arrays["quantities"]
+        self.actual_final_months: np.ndarray = arrays["actual_final_months"]
+        self.starting_point_months: np.ndarray = arrays["starting_point_months"]
+        self.aggravating_codes: np.ndarray = arrays["aggravating_codes"]
+        self.aggravating_offsets: np.ndarray = arrays["aggravating_offsets"]
+        self.mitigating_codes: np.ndarray = arrays["mitigating_codes"]
+        self.mitigating_offsets: np.ndarray = arrays["mitigating_offsets"]
+
+    @classmethod
+    def from_records(cls, records: Sequence[Mapping[str, Any]]) -> CorpusColumns:
+        return cls(encode_corpus(records))
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def citation(self, row: int) -> str:
+        return self.citations[self.citation_codes[row]]
+
+    def title(self, row: int) -> str:
+        return self.titles[self.title_codes[row]]
+
+    def language(self, row: int) -> str:
+        return self.languages[self.language_codes[row]]
+
+    def url(self, row: int) -> str:
+        code = int(self.url_codes[row])
+        if code == NO_CODE:
+            return rebuilt_url(self.citation(row), self.language(row))
+        return self.urls[code]
+
+    def role(self, row: int) -> str | None:
+        code = int(self.role_codes[row])
+        return None if code == NO_CODE else self.roles[code]
+
+    def factor_rows(self, offsets: np.ndarray) -> np.ndarray:
+        """The record of each entry of a factor-code array."""
+        return np.repeat(np.arange(self.rows), np.diff(offsets))
+
+    def record(self, row: int) -> dict[str, Any]:
+        """Record ``row`` as the JSON corpus holds it."""
+        aggravating = self.aggravating_codes[self.aggravating_offsets[row] : self.aggravating_offsets[row + 1]]
+        mitigating = self.mitigating_codes[self.mitigating_offsets[row] : self.mitigating_offsets[row + 1]]
+        quantities = self.quantities[row]
+        return {
+            "actualFinalMonths": float(self.actual_final_months[row]),
+            "aggravating": [self.aggravating[code] for code in aggravating.tolist()],
+            "assistance": int(self.assistance[row]),
+            "crossBorder": bool(self.cross_border[row]),
+            "drugs": {
+                family: float(quantities[column])
+                for column, family in sorted(enumerate(self.families), key=lambda item: item[1])
+                if quantities[column] > 0
+            },
+            "language": self.language(row),
+            "mitigating": [self.mitigating[code] for code in mitigating.tolist()],
+            "neutralCitation": self.citation(row),
+            "plea": self.pleas[self.plea_codes[row]],
+            "role": self.role(row),
+            "startingPointMonths": float(self.starting_point_months[row]),
+            "title": self.title(row),
+            "url": self.url(row),
+        }
+
+    def records(self) -> list[dict[str, Any]]:
+        return [self.record(row) for row in range(self.rows)]
+
+
+def load_corpus(path: str | Path = COLUMNAR_CORPUS) -> CorpusColumns:
+    """Memory-map the columnar corpus at ``path``."""
+    with open(path, "rb") as file:
+        buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return CorpusColumns(buffer)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write the columnar form of a JSON case-recommendation corpus")
+    parser.add_argument("--json", type=Path, default=JSON_CORPUS)
+    parser.add_argument("--output", type=Path, default=COLUMNAR_CORPUS)
+    args = parser.parse_args()
+    emit_columnar(json.loads(args.json.read_text()), args.output)
+
+
+if __name__ == "__main__":
+    main()
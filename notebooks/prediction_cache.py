@@ -0,0 +1,294 @@
+"""Memoised deployment predictions keyed by canonical requests.
+
+Interactive users repeat near-identical requests: the same drugs and
+quantities with factors in another order or under another name.
+``canonical_request`` reduces a ``predict`` call to one hashable form:
+
+- drug amounts merged per drug, zero amounts dropped, rounded to
+  ``quantity_decimals`` places (an amount that would round to zero keeps its
+  exact value) and sorted by drug.
+- aggravating and mitigating factors mapped through the artifact's
+  ``canonical_factor_map``, deduplicated and sorted.
+- the plea stage dropped when there is no guilty plea, and additional
+  circumstances sorted.
+
+``PredictionCache`` stores the ``Prediction`` of each canonical request under
+the model it came from, in an LRU of ``max_entries`` whose entries expire
+after ``ttl_seconds``.  A verbatim repeat costs two dict lookups; a request
+that only matches after canonicalising also pays for the canonicalisation.
+Predictions are computed from the canonical request, so every spelling of a
+request gets the same numbers; ``predict`` lists drugs and unsupported
+factors in the order the request names them, whether or not it hit the
+cache.  ``stats`` reports hits, misses, the hit ratio and the mean time of
+each.
+"""
+
+from __future__ import annotations
+
+import math
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import Callable, Mapping, Sequence
+from typing import Any, NamedTuple
+
+from data_derived_linear_model import (
+	EFFECT_STAGES,
+	DataDerivedLinearPredictor,
+	Prediction,
+	artifact_digest,
+	stage_factor_status,
+)
+
+DEFAULT_MAX_ENTRIES = 4096
+DEFAULT_TTL_SECONDS = 3600.0
+# Milligram precision: finer differences are not meaningful in the source data.
+DEFAULT_QUANTITY_DECIMALS = 3
+
+
+class CanonicalRequest(NamedTuple):
+	drug_amounts: tuple[tuple[str, float], ...]
+	aggravating_factors: tuple[str, ...]
+	mitigating_factors: tuple[str, ...]
+	pleaded_guilty: bool
+	guilty_plea_stage: str | None
+	primary_role: str | None
+	additional_circumstances: tuple[str, ...]
+
+	def arguments(self) -> dict[str, Any]:
+		"""Keyword arguments for ``DataDerivedLinearPredictor.predict``."""
+		return {**self._asdict(), "drug_amounts": dict(self.drug_amounts)}
+
+
+def canonical_factors(predictor: DataDerivedLinearPredictor, factors: Sequence[str]) -> tuple[str, ...]:
+	canonical = predictor.compiled.canonical_factors
+	return tuple(sorted({canonical.get(factor, factor) for factor in factors if factor}))
+
+
+def request_order(
+	predictor: DataDerivedLinearPredictor,
+	requested: Sequence[str],
+) -> Callable[[str], int]:
+	"""Sort key putting canonical factors in the order ``requested`` names
+	them; factors it does not name keep their place after those it does.
+
+	A cached profile lists factors in canonical order, and a response must
+	not show whether it came from the cache.
+	"""
+	canonical = predictor.compiled.canonical_factors
+	positions: dict[str, int] = {}
+	for factor in requested:
+		positions.setdefault(canonical.get(factor, factor), len(positions))
+	return lambda factor: positions.get(factor, len(positions))
+
+
+def canonical_request(
+	predictor: DataDerivedLinearPredictor,
+	drug_amounts: Mapping[str, float],
+	aggravating_factors: Sequence[str] = (),
+	mitigating_factors: Sequence[str] = (),
+	pleaded_guilty: bool = False,
+	guilty_plea_stage: str | None = None,
+	primary_role: str | None = None,
+	additional_circumstances: Sequence[str] = (),
+	*,
+	quantity_decimals: int | None = DEFAULT_QUANTITY_DECIMALS,
+) -> CanonicalRequest:
+	"""``predict``'s arguments in canonical form.  ``quantity_decimals=None``
+	keeps quantities unrounded.
+
+	Additional circumstances keep their duplicates so the predictor still
+	rejects them.
+	"""
+	amounts: dict[str, float] = {}
+	for drug_type, raw_amount in drug_amounts.items():
+		amount = float(raw_amount)
+		if not math.isfinite(amount) or amount < 0:
+			raise ValueError(f"{drug_type} amount must be a finite, non-negative number")
+		if amount > 0:
+			amounts[drug_type] = amounts.get(drug_type, 0.0) + amount
+	if quantity_decimals is not None:
+		# Rounding must never turn a positive quantity into no drug at all.
+		amounts = {
+			drug_type: round(amount, quantity_decimals) or amount for drug_type, amount in amounts.items()
+		}
+	pleaded_guilty = bool(pleaded_guilty)
+	return CanonicalRequest(
+		drug_amounts=tuple(sorted(amounts.items())),
+		aggravating_factors=canonical_factors(predictor, aggravating_factors),
+		mitigating_factors=canonical_factors(predictor, mitigating_factors),
+		pleaded_guilty=pleaded_guilty,
+		guilty_plea_stage=guilty_plea_stage if pleaded_guilty else None,
+		primary_role=primary_role,
+		additional_circumstances=tuple(sorted(additional_circumstances)),
+	)
+
+
+def model_digest(predictor: DataDerivedLinearPredictor) -> str:
+	return artifact_digest(predictor.model)
+
+
+class PredictionCache:
+	"""A bounded LRU of predictions with a time-to-live.
+
+	The predictor is passed on every call, so one cache can serve a predictor
+	that is swapped for a newer model: entries are keyed by the model's
+	version, adjustment strategy and artifact digest, and entries of the old
+	model age out.  Cached ``Prediction`` objects are shared; treat them as
+	read-only.
+	"""
+
+	def __init__(
+		self,
+		max_entries: int = DEFAULT_MAX_ENTRIES,
+		ttl_seconds: float | None = DEFAULT_TTL_SECONDS,
+		*,
+		quantity_decimals: int | None = DEFAULT_QUANTITY_DECIMALS,
+		clock: Callable[[], float] = time.monotonic,
+	) -> None:
+		if max_entries < 1:
+			raise ValueError("max_entries must be at least 1")
+		self.max_entries = max_entries
+		self.ttl_seconds = ttl_seconds
+		self.quantity_decimals = quantity_decimals
+		self.clock = clock
+		self.entries: OrderedDict[tuple[Any, ...], tuple[float, Prediction]] = OrderedDict()
+		# Exact argument tuples -> canonical keys, oldest first, so a verbatim
+		# repeat skips canonicalisation.
+		self.aliases: dict[tuple[Any, ...], tuple[Any, ...]] = {}
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self.expirations = 0
+		self.hit_seconds = 0.0
+		self.miss_seconds = 0.0
+		self._model_keys: weakref.WeakKeyDictionary[DataDerivedLinearPredictor, tuple[Any, ...]] = (
+			weakref.WeakKeyDictionary()
+		)
+
+	def model_key(self, predictor: DataDerivedLinearPredictor) -> tuple[Any, ...]:
+		key = self._model_keys.get(predictor)
+		if key is None:
+			key = self._model_keys[predictor] = (
+				predictor.model.get("model_version"),
+				predictor.adjustment_strategy,
+				model_digest(predictor),
+			)
+		return key
+
+	def predict_stages(
+		self,
+		predictor: DataDerivedLinearPredictor,
+		drug_amounts: Mapping[str, float],
+		aggravating_factors: Sequence[str] = (),
+		mitigating_factors: Sequence[str] = (),
+		pleaded_guilty: bool = False,
+		guilty_plea_stage: str | None = None,
+		primary_role: str | None = None,
+		additional_circumstances: Sequence[str] = (),
+	) -> Prediction:
+		"""``predictor.predict_stages`` of the canonical request, memoised."""
+		started = time.perf_counter()
+		model_key = self.model_key(predictor)
+		raw_key = (
+			model_key,
+			tuple(drug_amounts.items()),
+			tuple(aggravating_factors),
+			tuple(mitigating_factors),
+			pleaded_guilty,
+			guilty_plea_stage,
+			primary_role,
+			tuple(additional_circumstances),
+		)
+		key = self.aliases.get(raw_key)
+		if key is None:
+			key = (model_key, canonical_request(
+				predictor,
+				drug_amounts,
+				aggravating_factors,
+				mitigating_factors,
+				pleaded_guilty,
+				guilty_plea_stage,
+				primary_role,
+				additional_circumstances,
+				quantity_decimals=self.quantity_decimals,
+			))
+			self.aliases[raw_key] = key
+			if len(self.aliases) > self.max_entries:
+				del self.aliases[next(iter(self.aliases))]
+		now = self.clock()
+		entry = self.entries.get(key)
+		if entry is not None:
+			expires_at, prediction = entry
+			if expires_at > now:
+				self.entries.move_to_end(key)
+				self.hits += 1
+				self.hit_seconds += time.perf_counter() - started
+				return prediction
+			del self.entries[key]
+			self.expirations += 1
+		prediction = predictor.predict_stages(**key[1].arguments())
+		self.entries[key] = (math.inf if self.ttl_seconds is None else now + self.ttl_seconds, prediction)
+		if len(self.entries) > self.max_entries:
+			self.entries.popitem(last=False)
+			self.evictions += 1
+		self.misses += 1
+		self.miss_seconds += time.perf_counter() - started
+		return prediction
+
+	def predict(
+		self,
+		predictor: DataDerivedLinearPredictor,
+		drug_amounts: Mapping[str, float],
+		aggravating_factors: Sequence[str] = (),
+		mitigating_factors: Sequence[str] = (),
+		pleaded_guilty: bool = False,
+		guilty_plea_stage: str | None = None,
+		primary_role: str | None = None,
+		additional_circumstances: Sequence[str] = (),
+	) -> dict[str, Any]:
+		"""``predictor.predict`` of the canonical request, ordered like the
+		request; a fresh dict each call."""
+		prediction = self.predict_stages(
+			predictor,
+			drug_amounts,
+			aggravating_factors,
+			mitigating_factors,
+			pleaded_guilty,
+			guilty_plea_stage,
+			primary_role,
+			additional_circumstances,
+		)
+		response = prediction.as_dict()
+		if prediction.status != "supported":
+			return response
+		amounts = prediction.drug_amounts
+		response["drug_amounts"] = {drug: amounts[drug] for drug in drug_amounts if drug in amounts}
+		mitigating_order = request_order(predictor, mitigating_factors)
+		stage_orders = (request_order(predictor, aggravating_factors), mitigating_order, mitigating_order)
+		profile = prediction.profile
+		for stage, factors, unsupported, order in zip(
+			EFFECT_STAGES,
+			profile.stage_factors,
+			profile.unsupported_factors,
+			stage_orders,
+		):
+			response["factors"][stage] = stage_factor_status(factors, sorted(unsupported, key=order))
+		return response
+
+	def clear(self) -> None:
+		self.entries.clear()
+		self.aliases.clear()
+
+	def stats(self) -> dict[str, Any]:
+		lookups = self.hits + self.misses
+		return {
+			"entries": len(self.entries),
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_ratio": self.hits / lookups if lookups else None,
+			"evictions": self.evictions,
+			"expirations": self.expirations,
+			"mean_hit_microseconds": self.hit_seconds / self.hits * 1e6 if self.hits else None,
+			"mean_miss_microseconds": self.miss_seconds / self.misses * 1e6 if self.misses else None,
+		}
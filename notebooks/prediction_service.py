@@ -0,0 +1,688 @@
+"""Asyncio ASGI service for the data-derived deployment predictor.
+
+Serves the ``/api/sentence-predictions`` contract in
+``PUBLIC_SENTENCE_PREDICTION_API.md`` from ``DataDerivedLinearPredictor``:
+
+- ``POST /api/sentence-predictions``: one request, one response.
+- ``POST /api/sentence-predictions/batch``: a JSON array of requests.  The
+  response is an array of ``{"statusCode": ..., "body": ...}`` items in
+  request order, each what the single endpoint would have returned.
+- ``GET /api/health``.
+- ``GET /metrics``: request counts, latency histograms and the serving model
+  in the Prometheus text format.
+
+The model is loaded once at startup.  A background task polls the artifact's
+size and modification time; when they change the new artifact is loaded off
+the event loop and swapped in with one assignment, so every request (and
+every batch) is served wholly by one model.  An artifact that fails to load
+leaves the current model serving until the file changes again.
+
+Predictions are memoised in a ``prediction_cache.PredictionCache`` keyed by
+the canonical request and the serving model; ``/metrics`` reports its hits,
+misses and lookup times.
+
+Given a ``model_registry.ModelRegistry``, a prediction request with an
+``x-model-variant: <ref>[:<adjustment strategy>]`` header is served by that
+registered model instead, e.g. to A/B-compare model versions on live
+traffic.  Registry models are loaded on first use and stay loaded; the
+``x-model-version`` response header names the model that answered.
+
+Public values are mapped to the artifact's names, e.g. ``Cannabis/THC`` to
+the ``Cannabis`` curve and ``Plead guilty (before trial starts)`` to the
+``After dates fixed`` plea stage.  Adjustments are reported against the bases
+the artifact was fitted on: role and aggravation on the starting point,
+mitigation on the notional sentence and the plea on the pre-plea sentence.  A
+drug, role or factor without a fitted curve or effect is a ``422``, never a
+zero adjustment.
+
+Serve it with ``uvicorn prediction_service:app`` or ``python
+prediction_service.py``; uvicorn is only needed for HTTP.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import math
+import sys
+import time
+from collections.abc import Awaitable, Callable, Mapping
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from data_derived_linear_model import (
+	COURIER_STOREKEEPER_ROLE,
+	DEFAULT_MODEL_PATH,
+	DataDerivedLinearPredictor,
+)
+from model_registry import ModelRegistry
+from prediction_cache import DEFAULT_MAX_ENTRIES, DEFAULT_TTL_SECONDS, PredictionCache, request_order
+
+PREDICTION_PATH = "/api/sentence-predictions"
+BATCH_PATH = "/api/sentence-predictions/batch"
+HEALTH_PATH = "/api/health"
+VARIANT_HEADER = b"x-model-variant"
+METRICS_PATH = "/metrics"
+# Routes with their own metric labels; anything else is "unmatched".
+METRIC_ROUTES = {PREDICTION_PATH, BATCH_PATH, HEALTH_PATH}
+PUBLIC_DRUG_TYPES = {
+	"Cocaine": "Cocaine",
+	"Ketamine": "Ketamine",
+	"Fluorodeschloroketamine": "Ketamine",
+	"Methamphetamine": "Methamphetamine",
+	"Heroin": "Heroin",
+	"Cannabis/THC": "Cannabis",
+	"Ecstasy": "Ecstasy",
+	"Midazolam": "Midazolam",
+	"Nimetazepam": "Nimetazepam",
+}
+PUBLIC_ROLES = {
+	"Courier / Storekeeper": COURIER_STOREKEEPER_ROLE,
+	"Actual trafficker": "Actual trafficker",
+	"Manager / Organiser": "Manager / Organiser",
+	"Operator / Financial Controller": "Operator / Financial controller",
+}
+CROSS_BORDER = "Cross-border trafficking"
+# Public plea option -> the artifact's plea stage (None for not guilty).
+GUILTY_PLEA_STAGES = {
+	"Plead not guilty": None,
+	"Plead guilty (earliest opportunity)": "Up to committal",
+	"Plead guilty (before trial dates are set)": "After committal",
+	"Plead guilty (before trial starts)": "After dates fixed",
+	"Plead guilty (first day of trial)": "First day",
+	"Plead guilty (during the trial)": "During trial",
+}
+AGGRAVATING_FACTORS = {
+	"Multiple Drugs": "Multiple drugs",
+	"Persistent offender": "Persistent offender",
+	"On bail": "On bail",
+	"Refugee/Asylum": "Refugee claimant",
+	"Use of minors": "Use of minors",
+}
+MITIGATING_FACTORS = (
+	"Self-consumption",
+	"Assistance - limited",
+	"Assistance - useful",
+	"Assistance - testify",
+	"Assistance - risk",
+	"Young offender",
+	"Medical conditions",
+	"Family illness",
+	"Rehabilitation programme",
+)
+REQUEST_FIELDS = {
+	"drugs",
+	"defendantRole",
+	"additionalCircumstances",
+	"guiltyPlea",
+	"aggravatingFactors",
+	"mitigatingFactors",
+}
+DRUG_FIELDS = {"type", "quantity"}
+MAX_BODY_BYTES = 1 << 20
+MAX_BATCH_SIZE = 1000
+RELOAD_POLL_SECONDS = 1.0
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+INVALID_BODY = "The request body is invalid"
+
+logger = logging.getLogger(__name__)
+
+Scope = Mapping[str, Any]
+Receive = Callable[[], Awaitable[dict[str, Any]]]
+Send = Callable[[dict[str, Any]], Awaitable[None]]
+
+
+@dataclass(frozen=True)
+class PredictionRequest:
+	"""A validated request, still in the public vocabulary."""
+
+	drugs: tuple[tuple[str, float], ...]
+	defendant_role: str | None
+	additional_circumstances: tuple[str, ...]
+	guilty_plea: str
+	aggravating_factors: tuple[str, ...]
+	mitigating_factors: tuple[str, ...]
+
+
+def validation_error(fields: dict[str, str]) -> dict[str, Any]:
+	return {"error": "VALIDATION_ERROR", "message": INVALID_BODY, "fields": fields}
+
+
+def unavailable_error(message: str, **details: Any) -> dict[str, Any]:
+	return {"error": "MODEL_INPUT_UNAVAILABLE", "message": message, **details}
+
+
+def list_field(
+	body: Mapping[str, Any],
+	name: str,
+	accepted: Mapping[str, Any] | tuple[str, ...],
+	fields: dict[str, str],
+) -> tuple[str, ...]:
+	values = body.get(name, [])
+	if not isinstance(values, list):
+		fields[name] = "Expected a list"
+		return ()
+	seen: set[str] = set()
+	for index, value in enumerate(values):
+		if not isinstance(value, str) or value not in accepted:
+			fields[f"{name}[{index}]"] = "Unsupported value"
+		elif value in seen:
+			fields[f"{name}[{index}]"] = "Duplicate values are not allowed"
+		else:
+			seen.add(value)
+	return tuple(values)
+
+
+def parse_request(body: Any) -> tuple[PredictionRequest | None, dict[str, str]]:
+	"""Validate a decoded request body; field paths follow the API
+	documentation, e.g. ``drugs[0].quantity``."""
+	if not isinstance(body, dict):
+		return None, {"body": "Expected a JSON object"}
+	fields = {key: "Unrecognised field" for key in body if key not in REQUEST_FIELDS}
+	drugs: list[tuple[str, float]] = []
+	raw_drugs = body.get("drugs")
+	if not isinstance(raw_drugs, list) or not raw_drugs:
+		fields["drugs"] = "At least one drug is required"
+	else:
+		for index, drug in enumerate(raw_drugs):
+			path = f"drugs[{index}]"
+			if not isinstance(drug, dict):
+				fields[path] = "Expected an object"
+				continue
+			fields.update({f"{path}.{key}": "Unrecognised field" for key in drug if key not in DRUG_FIELDS})
+			drug_type = drug.get("type")
+			quantity = drug.get("quantity")
+			if not isinstance(drug_type, str) or drug_type not in PUBLIC_DRUG_TYPES:
+				fields[f"{path}.type"] = "Unsupported drug type"
+			if (
+				isinstance(quantity, bool)
+				or not isinstance(quantity, (int, float))
+				or not math.isfinite(quantity)
+				or quantity <= 0
+			):
+				fields[f"{path}.quantity"] = "Quantity must be greater than zero"
+			else:
+				drugs.append((drug_type, float(quantity)))
+	role = body.get("defendantRole")
+	if role is not None and (not isinstance(role, str) or role not in PUBLIC_ROLES):
+		fields["defendantRole"] = "Unsupported defendant role"
+	circumstances = list_field(body, "additionalCircumstances", (CROSS_BORDER,), fields)
+	plea = body.get("guiltyPlea")
+	if not isinstance(plea, str) or plea not in GUILTY_PLEA_STAGES:
+		fields["guiltyPlea"] = "A guilty-plea option is required"
+	aggravating = list_field(body, "aggravatingFactors", AGGRAVATING_FACTORS, fields)
+	mitigating = list_field(body, "mitigatingFactors", MITIGATING_FACTORS, fields)
+	if circumstances and role is None:
+		fields["defendantRole"] = "Defendant role is required when additional circumstances are selected"
+	if sum(isinstance(factor, str) and factor.startswith("Assistance - ") for factor in mitigating) > 1:
+		fields["mitigatingFactors"] = "Only one assistance factor may be selected"
+	if fields:
+		return None, fields
+	return PredictionRequest(
+		drugs=tuple(drugs),
+		defendant_role=role,
+		additional_circumstances=circumstances,
+		guilty_plea=plea,
+		aggravating_factors=aggravating,
+		mitigating_factors=mitigating,
+	), {}
+
+
+def display(value: float) -> float:
+	"""Two decimal places, rounding halves up like the TypeScript service."""
+	return math.floor((value + sys.float_info.epsilon) * 100 + 0.5) / 100
+
+
+def adjustment(
+	factor: str,
+	category: str,
+	effect: float,
+	base_months: float,
+) -> dict[str, Any]:
+	months = abs(base_months * effect)
+	increases = category in ("defendantRole", "aggravating")
+	return {
+		"factor": factor,
+		"category": category,
+		"direction": "increase" if (effect >= 0) == increases else "decrease",
+		"percentage": display(abs(effect) * 100),
+		"baseMonths": display(base_months),
+		"months": display(months),
+		"years": display(months / 12),
+	}
+
+
+def predict_response(
+	predictor: DataDerivedLinearPredictor,
+	request: PredictionRequest,
+	cache: PredictionCache | None = None,
+) -> tuple[int, dict[str, Any]]:
+	"""Status code and body for one validated request, memoised in ``cache``
+	when one is given."""
+	drug_amounts: dict[str, float] = {}
+	for drug_type, quantity in request.drugs:
+		model_drug = PUBLIC_DRUG_TYPES[drug_type]
+		if model_drug not in predictor.compiled.curves:
+			return 422, unavailable_error(
+				"A prediction is not currently available for this drug type",
+				drug={"type": drug_type},
+			)
+		drug_amounts[model_drug] = drug_amounts.get(model_drug, 0.0) + quantity
+	role = None if request.defendant_role is None else PUBLIC_ROLES[request.defendant_role]
+	plea_stage = GUILTY_PLEA_STAGES[request.guilty_plea]
+	arguments = {
+		"drug_amounts": drug_amounts,
+		"aggravating_factors": [AGGRAVATING_FACTORS[factor] for factor in request.aggravating_factors],
+		"mitigating_factors": request.mitigating_factors,
+		"pleaded_guilty": plea_stage is not None,
+		"guilty_plea_stage": plea_stage,
+		"primary_role": role,
+		"additional_circumstances": request.additional_circumstances,
+	}
+	if cache is None:
+		prediction = predictor.predict_stages(**arguments)
+	else:
+		prediction = cache.predict_stages(predictor, **arguments)
+	profile = prediction.profile
+	if profile is None:
+		return 422, unavailable_error("A prediction is not currently available for this request")
+	severe_cross_border = (
+		role not in (None, COURIER_STOREKEEPER_ROLE)
+		and CROSS_BORDER in request.additional_circumstances
+	)
+	cross_border_effect = predictor.role_effects.get("severe_cross_border_effect")
+	if role is not None and profile.role_effect is None:
+		return 422, unavailable_error(f"A role adjustment is not available for {request.defendant_role}")
+	if severe_cross_border and cross_border_effect is None:
+		return 422, unavailable_error(f"A cross-border adjustment is not available for {request.defendant_role}")
+	aggravating_order = request_order(predictor, arguments["aggravating_factors"])
+	mitigating_order = request_order(predictor, arguments["mitigating_factors"])
+	stage_orders = (aggravating_order, mitigating_order, mitigating_order)
+	unsupported = [
+		factor
+		for factors, order in zip(profile.unsupported_factors, stage_orders)
+		for factor in sorted(factors, key=order)
+	]
+	if unsupported:
+		return 422, unavailable_error(f"An adjustment is not available for {' | '.join(unsupported)}")
+
+	starting_point = prediction.starting_point_months
+	adjustments = []
+	if role is not None:
+		primary_effect = float(predictor.role_effects["primary_effects"][role])
+		adjustments.append(adjustment(request.defendant_role, "defendantRole", primary_effect, starting_point))
+		if severe_cross_border:
+			adjustments.append(adjustment(CROSS_BORDER, "defendantRole", float(cross_border_effect), starting_point))
+	public_factors = {model: public for public, model in AGGRAVATING_FACTORS.items()}
+	aggravation_factors, mitigation_factors, _ = profile.stage_factors
+	aggravation_effects, mitigation_effects, plea_effects = profile.stage_effects
+	for factor, effect in sorted(
+		zip(aggravation_factors, aggravation_effects),
+		key=lambda pair: aggravating_order(pair[0]),
+	):
+		adjustments.append(adjustment(public_factors.get(factor, factor), "aggravating", effect, starting_point))
+	for factor, effect in sorted(
+		zip(mitigation_factors, mitigation_effects),
+		key=lambda pair: mitigating_order(pair[0]),
+	):
+		adjustments.append(adjustment(factor, "mitigating", effect, prediction.notional_sentence_months))
+	for effect in plea_effects:
+		adjustments.append(adjustment(request.guilty_plea, "guiltyPlea", effect, prediction.pre_plea_months))
+	final_sentence = prediction.final_sentence_months
+	return 200, {
+		"status": "supported",
+		"startingPointMonths": display(starting_point),
+		"startingPointYears": display(starting_point / 12),
+		"adjustments": adjustments,
+		"finalSentenceMonths": display(final_sentence),
+		"finalSentenceYears": display(final_sentence / 12),
+	}
+
+
+def respond_to_body(
+	predictor: DataDerivedLinearPredictor,
+	body: Any,
+	cache: PredictionCache | None = None,
+) -> tuple[int, dict[str, Any]]:
+	request, fields = parse_request(body)
+	if request is None:
+		return 400, validation_error(fields)
+	return predict_response(predictor, request, cache)
+
+
+class ServiceMetrics:
+	"""Counters and latency histograms rendered for ``/metrics``."""
+
+	def __init__(self) -> None:
+		self.requests: dict[tuple[str, int], int] = {}
+		self.latency_buckets: dict[str, list[int]] = {}
+		self.latency_sums: dict[str, float] = {}
+		self.batch_items = 0
+		self.reloads = 0
+		self.reload_failures = 0
+
+	def observe(self, route: str, status: int, seconds: float) -> None:
+		self.requests[route, status] = self.requests.get((route, status), 0) + 1
+		buckets = self.latency_buckets.setdefault(route, [0] * (len(LATENCY_BUCKETS) + 1))
+		for index, bound in enumerate(LATENCY_BUCKETS):
+			if seconds <= bound:
+				buckets[index] += 1
+				break
+		else:
+			buckets[-1] += 1
+		self.latency_sums[route] = self.latency_sums.get(route, 0.0) + seconds
+
+	def render(self, service: PredictionService) -> str:
+		lines = [
+			"# HELP prediction_requests_total Requests served, by route and status code.",
+			"# TYPE prediction_requests_total counter",
+		]
+		for (route, status), count in sorted(self.requests.items()):
+			lines.append(f'prediction_requests_total{{route="{route}",status="{status}"}} {count}')
+		lines += [
+			"# HELP prediction_request_seconds Time to serve a request, by route.",
+			"# TYPE prediction_request_seconds histogram",
+		]
+		for route, buckets in sorted(self.latency_buckets.items()):
+			cumulative = 0
+			for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), buckets):
+				cumulative += count
+				lines.append(f'prediction_request_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+			lines.append(f'prediction_request_seconds_sum{{route="{route}"}} {self.latency_sums[route]}')
+			lines.append(f'prediction_request_seconds_count{{route="{route}"}} {cumulative}')
+		lines += [
+			"# TYPE prediction_batch_items_total counter",
+			f"prediction_batch_items_total {self.batch_items}",
+			"# TYPE prediction_model_reloads_total counter",
+			f"prediction_model_reloads_total {self.reloads}",
+			"# TYPE prediction_model_reload_failures_total counter",
+			f"prediction_model_reload_failures_total {self.reload_failures}",
+		]
+		if service.cache is not None:
+			cache = service.cache
+			lines += [
+				"# HELP prediction_cache_lookups_total Prediction cache lookups, by result.",
+				"# TYPE prediction_cache_lookups_total counter",
+				f'prediction_cache_lookups_total{{result="hit"}} {cache.hits}',
+				f'prediction_cache_lookups_total{{result="miss"}} {cache.misses}',
+				"# HELP prediction_cache_lookup_seconds_total Time spent in cache lookups, by result.",
+				"# TYPE prediction_cache_lookup_seconds_total counter",
+				f'prediction_cache_lookup_seconds_total{{result="hit"}} {cache.hit_seconds}',
+				f'prediction_cache_lookup_seconds_total{{result="miss"}} {cache.miss_seconds}',
+				"# TYPE prediction_cache_evictions_total counter",
+				f"prediction_cache_evictions_total {cache.evictions}",
+				"# TYPE prediction_cache_expirations_total counter",
+				f"prediction_cache_expirations_total {cache.expirations}",
+				"# TYPE prediction_cache_entries gauge",
+				f"prediction_cache_entries {len(cache.entries)}",
+			]
+		predictor = service.predictor
+		if predictor is not None:
+			lines += [
+				"# HELP prediction_model_info The model currently serving.",
+				"# TYPE prediction_model_info gauge",
+				"prediction_model_info{"
+				f'model_version="{predictor.model.get("model_version")}",'
+				f'adjustment_strategy="{predictor.adjustment_strategy}"'
+				"} 1",
+				"# TYPE prediction_model_loaded_timestamp_seconds gauge",
+				f"prediction_model_loaded_timestamp_seconds {service.loaded_at}",
+			]
+		return "\n".join(lines) + "\n"
+
+
+class PredictionService:
+	"""The ASGI application.  ``poll_seconds=0`` disables hot reload and
+	``cache_entries=0`` the prediction cache."""
+
+	def __init__(
+		self,
+		model_path: str | Path | None = None,
+		adjustment_strategy: str = "learned",
+		*,
+		poll_seconds: float = RELOAD_POLL_SECONDS,
+		cache_entries: int = DEFAULT_MAX_ENTRIES,
+		cache_ttl_seconds: float | None = DEFAULT_TTL_SECONDS,
+		registry: ModelRegistry | None = None,
+	) -> None:
+		self.model_path = Path(model_path) if model_path is not None else DEFAULT_MODEL_PATH
+		self.adjustment_strategy = adjustment_strategy
+		self.poll_seconds = poll_seconds
+		# Keyed by model, so entries of a replaced model are never served.
+		self.cache = PredictionCache(cache_entries, cache_ttl_seconds) if cache_entries > 0 else None
+		self.registry = registry
+		self.predictor: DataDerivedLinearPredictor | None = None
+		self.model_signature: tuple[int, int] | None = None
+		self.loaded_at: float | None = None
+		self.metrics = ServiceMetrics()
+		self._failed_signature: tuple[int, int] | None = None
+		self._watcher: asyncio.Task[None] | None = None
+
+	def artifact_signature(self) -> tuple[int, int] | None:
+		try:
+			stat = self.model_path.stat()
+		except OSError:
+			return None
+		return stat.st_mtime_ns, stat.st_size
+
+	def load(self) -> DataDerivedLinearPredictor:
+		signature = self.artifact_signature()
+		predictor = DataDerivedLinearPredictor(self.model_path, self.adjustment_strategy)
+		self.swap(predictor, signature)
+		return predictor
+
+	def swap(self, predictor: DataDerivedLinearPredictor, signature: tuple[int, int] | None) -> None:
+		# Handlers read self.predictor once per request, so one assignment is
+		# the whole swap.
+		self.predictor = predictor
+		self.model_signature = signature
+		self.loaded_at = time.time()
+
+	async def reload_if_changed(self) -> bool:
+		"""Load and swap in the artifact if it changed since the last load."""
+		signature = self.artifact_signature()
+		if signature is None or signature in (self.model_signature, self._failed_signature):
+			return False
+		try:
+			predictor = await asyncio.to_thread(
+				DataDerivedLinearPredictor,
+				self.model_path,
+				self.adjustment_strategy,
+			)
+		except (OSError, ValueError, KeyError, TypeError):
+			# Retried once the file changes again, e.g. when a write finishes.
+			logger.exception("Keeping the current model; %s did not load", self.model_path)
+			self._failed_signature = signature
+			self.metrics.reload_failures += 1
+			return False
+		self.swap(predictor, signature)
+		self.metrics.reloads += 1
+		logger.info("Loaded model version %s from %s", predictor.model.get("model_version"), self.model_path)
+		return True
+
+	async def watch(self) -> None:
+		while True:
+			await asyncio.sleep(self.poll_seconds)
+			await self.reload_if_changed()
+
+	async def start(self) -> None:
+		await asyncio.to_thread(self.load)
+		if self.poll_seconds > 0:
+			self._watcher = asyncio.create_task(self.watch())
+
+	async def stop(self) -> None:
+		if self._watcher is not None:
+			self._watcher.cancel()
+			try:
+				await self._watcher
+			except asyncio.CancelledError:
+				pass
+			self._watcher = None
+
+	async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+		if scope["type"] == "lifespan":
+			await self.lifespan(receive, send)
+		elif scope["type"] == "http":
+			await self.handle_http(scope, receive, send)
+
+	async def lifespan(self, receive: Receive, send: Send) -> None:
+		while True:
+			message = await receive()
+			if message["type"] == "lifespan.startup":
+				try:
+					await self.start()
+				except Exception as error:
+					await send({"type": "lifespan.startup.failed", "message": str(error)})
+					return
+				await send({"type": "lifespan.startup.complete"})
+			elif message["type"] == "lifespan.shutdown":
+				await self.stop()
+				await send({"type": "lifespan.shutdown.complete"})
+				return
+
+	async def handle_http(self, scope: Scope, receive: Receive, send: Send) -> None:
+		started = time.perf_counter()
+		route = (scope["method"], scope["path"])
+		predictor = self.predictor
+		try:
+			if predictor is None:
+				# Only without a lifespan startup; load in a worker thread so
+				# other requests keep being served.
+				predictor = await asyncio.to_thread(self.load)
+			variant = dict(scope["headers"]).get(VARIANT_HEADER)
+			if variant is not None and scope["method"] == "POST":
+				predictor, fields = self.variant_predictor(variant.decode("latin-1"), predictor)
+			else:
+				fields = {}
+			if fields:
+				status, body = 400, validation_error(fields)
+			elif route == ("POST", PREDICTION_PATH):
+				status, body = await self.predict(predictor, receive)
+			elif route == ("POST", BATCH_PATH):
+				status, body = await self.predict_batch(predictor, receive)
+			elif route == ("GET", HEALTH_PATH):
+				status, body = 200, {"status": "ok"}
+			elif route == ("GET", METRICS_PATH):
+				await send_response(send, 200, self.metrics.render(self).encode(), b"text/plain; version=0.0.4")
+				return
+			else:
+				status, body = 404, {"error": "NOT_FOUND", "message": "Route not found"}
+		except Exception:
+			logger.exception("Prediction request failed")
+			status, body = 500, {"error": "INTERNAL_ERROR", "message": "The request could not be processed"}
+		await send_response(
+			send,
+			status,
+			json.dumps(body, separators=(",", ":")).encode(),
+			b"application/json",
+			model_version=None if predictor is None else str(predictor.model.get("model_version")),
+		)
+		metric_route = scope["path"] if scope["path"] in METRIC_ROUTES else "unmatched"
+		self.metrics.observe(metric_route, status, time.perf_counter() - started)
+
+	def variant_predictor(
+		self,
+		variant: str,
+		serving: DataDerivedLinearPredictor,
+	) -> tuple[DataDerivedLinearPredictor, dict[str, str]]:
+		"""The registry model a request asked for, or validation fields."""
+		if self.registry is None:
+			return serving, {"x-model-variant": "This service has no model registry"}
+		try:
+			return self.registry.variant(variant), {}
+		except (KeyError, ValueError) as error:
+			message = error.args[0] if error.args else str(error)
+			return serving, {"x-model-variant": f"Unknown model variant: {message}"}
+
+	async def predict(self, predictor: DataDerivedLinearPredictor, receive: Receive) -> tuple[int, Any]:
+		body, fields = await read_json(receive)
+		if fields:
+			return 400, validation_error(fields)
+		return respond_to_body(predictor, body, self.cache)
+
+	async def predict_batch(self, predictor: DataDerivedLinearPredictor, receive: Receive) -> tuple[int, Any]:
+		body, fields = await read_json(receive)
+		if not fields and not isinstance(body, list):
+			fields = {"body": "Expected a JSON array of prediction requests"}
+		elif not fields and not 0 < len(body) <= MAX_BATCH_SIZE:
+			fields = {"body": f"A batch holds between 1 and {MAX_BATCH_SIZE} requests"}
+		if fields:
+			return 400, validation_error(fields)
+		results = []
+		for item in body:
+			status, item_body = respond_to_body(predictor, item, self.cache)
+			results.append({"statusCode": status, "body": item_body})
+		self.metrics.batch_items += len(results)
+		return 200, results
+
+
+async def read_json(receive: Receive) -> tuple[Any, dict[str, str]]:
+	"""The decoded request body, or the validation fields explaining why not."""
+	chunks: list[bytes] = []
+	size = 0
+	while True:
+		message = await receive()
+		if message["type"] == "http.disconnect":
+			break
+		chunk = message.get("body", b"")
+		size += len(chunk)
+		if size > MAX_BODY_BYTES:
+			return None, {"body": f"The request body exceeds {MAX_BODY_BYTES} bytes"}
+		chunks.append(chunk)
+		if not message.get("more_body", False):
+			break
+	try:
+		return json.loads(b"".join(chunks)), {}
+	except ValueError:
+		return None, {"body": "The request body is not valid JSON"}
+
+
+async def send_response(
+	send: Send,
+	status: int,
+	payload: bytes,
+	content_type: bytes,
+	*,
+	model_version: str | None = None,
+) -> None:
+	headers = [(b"content-type", content_type), (b"content-length", str(len(payload)).encode())]
+	if model_version is not None:
+		headers.append((b"x-model-version", model_version.encode()))
+	await send({"type": "http.response.start", "status": status, "headers": headers})
+	await send({"type": "http.response.body", "body": payload})
+
+
+app = PredictionService()
+
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Serve the data-derived sentence predictor over HTTP.")
+	parser.add_argument("--host", default="127.0.0.1")
+	parser.add_argument("--port", type=int, default=8000)
+	parser.add_argument("--model-path", type=Path, default=DEFAULT_MODEL_PATH)
+	parser.add_argument("--adjustment-strategy", default="learned")
+	parser.add_argument("--poll-seconds", type=float, default=RELOAD_POLL_SECONDS)
+	parser.add_argument("--cache-entries", type=int, default=DEFAULT_MAX_ENTRIES)
+	parser.add_argument("--registry-dir", type=Path, help="serve x-model-variant requests from this registry")
+	args = parser.parse_args()
+	if importlib.util.find_spec("uvicorn") is None:
+		raise SystemExit("Serving over HTTP needs uvicorn: pip install uvicorn")
+	import uvicorn
+
+	logging.basicConfig(level=logging.INFO)
+	uvicorn.run(
+		PredictionService(
+			args.model_path,
+			args.adjustment_strategy,
+			poll_seconds=args.poll_seconds,
+			cache_entries=args.cache_entries,
+			registry=None if args.registry_dir is None else ModelRegistry(args.registry_dir),
+		),
+		host=args.host,
+		port=args.port,
+		log_level="warning",
+	)
@@ -0,0 +1,400 @@
+"""Indexed similar-case retrieval over the case-recommender corpus.
+
+``predictorBackend/src/similarCases.ts`` answers every request by filtering
+the whole corpus written by ``predictionModel/build_case_recommender_corpus.py``
+once per quantity band and again for every tier.  ``SimilarCaseIndex`` builds
+its indexes once, from the columnar corpus of ``recommender_corpus``, and
+answers the same query from them:
+
+- per drug family, the rows of the cases holding it sorted by quantity, so a
+  quantity band is two binary searches.
+- boolean bitmaps over the corpus for each family's presence, cross-border
+  trafficking, role, plea bucket, assistance level and aggravating factor, so
+  the candidate pool and every tier are bitmap intersections.
+
+Tiers keep corpus order and scores repeat the backend's arithmetic step for
+step, so ``query`` returns what ``pickSimilarCases`` returns for the same
+public request.  ``query_many`` answers a batch, and ``similar_cases_report``
+asks, for every case in the corpus (the verified trials it was built from),
+which other judgments the recommender would show next to it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from collections.abc import Iterable, Mapping, Sequence
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+PREDICTION_MODEL_DIR = Path(__file__).resolve().with_name("predictionModel")
+if str(PREDICTION_MODEL_DIR) not in sys.path:
+	sys.path.insert(0, str(PREDICTION_MODEL_DIR))
+
+from build_case_recommender_corpus import (  # noqa: E402
+	ASSISTANCE_TIER,
+	FAMILY,
+	JSON_OUT,
+	predict_notional_weighted_months,
+)
+from recommender_corpus import COLUMNAR_CORPUS, NO_CODE, CorpusColumns, load_corpus  # noqa: E402
+
+# Column order of the quantity matrix; also the order the backend sums the
+# weight of families a request does not have.
+DRUG_FAMILIES = (
+	"Cocaine",
+	"Ketamine",
+	"Methamphetamine",
+	"Heroin",
+	"Cannabis",
+	"Ecstasy",
+	"Nimetazepam",
+	"Midazolam",
+)
+FAMILY_COLUMNS = {family: column for column, family in enumerate(DRUG_FAMILIES)}
+FAMILY_BY_DRUG_TYPE = {**FAMILY, "Midazolam": "Midazolam"}
+# Relative quantity bands tried in turn until one holds ``count`` cases; only
+# the first also excludes cases with families the request does not have.
+REQUESTED_FAMILY_ENFORCEMENT = (0.2, 0.5, 1)
+ASSISTANCE_LEVELS = (1, 2, 3, 4)
+REFUGEE_FACTOR = "Refugee/Asylum"
+CROSS_BORDER = "Cross-border trafficking"
+PLEA_BUCKETS = {
+	"Plead guilty (earliest opportunity)": "early",
+	"Plead guilty (before trial dates are set)": "late",
+	"Plead guilty (before trial starts)": "late",
+	"Plead guilty (first day of trial)": "late",
+	"Plead guilty (during the trial)": "late",
+}
+# A public plea option standing for each bucket, for requests built from
+# corpus records.
+BUCKET_PLEAS = {
+	"early": "Plead guilty (earliest opportunity)",
+	"late": "Plead guilty (before trial starts)",
+	"none": "Plead not guilty",
+}
+PLEA_TIERS = {"early": ("early", "late", "none"), "late": ("late", "early", "none")}
+DRUG_SIMILARITY_WEIGHT = 0.8
+STARTING_POINT_SIMILARITY_WEIGHT = 0.2
+MIN_SIMILARITY_SCORE = 0.6
+DEFAULT_COUNT = 10
+REPORT_COLUMNS = [
+	"case_row",
+	"neutral_citation",
+	"title",
+	"rank",
+	"similar_citation",
+	"similar_title",
+	"similar_url",
+	"score",
+]
+
+
+def family_amounts(drugs: Iterable[Mapping[str, Any]]) -> dict[str, float]:
+	"""Quantity per drug family in first-seen order; unknown types are skipped."""
+	amounts: dict[str, float] = {}
+	for drug in drugs:
+		family = FAMILY_BY_DRUG_TYPE.get(drug["type"])
+		if family is not None:
+			amounts[family] = amounts.get(family, 0.0) + drug["quantity"]
+	return amounts
+
+
+def assistance_level(mitigating_factors: Iterable[str]) -> int:
+	"""The level of the first assistance factor, 0 without one."""
+	for factor in mitigating_factors:
+		if factor in ASSISTANCE_TIER:
+			return ASSISTANCE_TIER[factor]
+	return 0
+
+
+def plea_bucket(guilty_plea: str | None) -> str:
+	return PLEA_BUCKETS.get(guilty_plea, "none")
+
+
+def code_bitmaps(codes: np.ndarray, table: Sequence[Any]) -> dict[Any, np.ndarray]:
+	"""One bitmap per dictionary value, marking the rows coded with it."""
+	return {value: codes == code for code, value in enumerate(table)}
+
+
+def record_request(record: Mapping[str, Any]) -> dict[str, Any]:
+	"""The public prediction request a corpus record stands for.
+
+	Midazolam keeps the ``powder`` variant the corpus builder scored it with.
+	Mitigating factors lead with the assistance factor of the record's level,
+	the highest it was given.
+	"""
+	drugs = []
+	for family, quantity in record["drugs"].items():
+		if family == "Midazolam":
+			drugs.append({"type": "Midazolam", "quantity": quantity, "variant": "powder"})
+		else:
+			drugs.append({"type": "Cannabis/THC" if family == "Cannabis" else family, "quantity": quantity})
+	assistance = [factor for factor, level in ASSISTANCE_TIER.items() if level == record["assistance"]]
+	return {
+		"drugs": drugs,
+		"defendantRole": record["role"],
+		"additionalCircumstances": [CROSS_BORDER] if record["crossBorder"] else [],
+		"guiltyPlea": BUCKET_PLEAS[record["plea"]],
+		"aggravatingFactors": list(record["aggravating"]),
+		"mitigatingFactors": assistance
+		+ [factor for factor in record["mitigating"] if factor not in ASSISTANCE_TIER],
+	}
+
+
+class SimilarCaseIndex:
+	"""A columnar ``corpus`` and the indexes ``query`` searches."""
+
+	def __init__(self, corpus: CorpusColumns) -> None:
+		self.corpus = corpus
+		size = len(corpus)
+		if tuple(corpus.families) == DRUG_FAMILIES:
+			self.quantities = corpus.quantities
+		else:
+			self.quantities = np.zeros((size, len(DRUG_FAMILIES)), dtype=float)
+			for corpus_column, family in enumerate(corpus.families):
+				self.quantities[:, FAMILY_COLUMNS[family]] = corpus.quantities[:, corpus_column]
+		self.present = self.quantities > 0
+		self.family_rows: list[np.ndarray] = []
+		self.family_quantities: list[np.ndarray] = []
+		for column in range(len(DRUG_FAMILIES)):
+			rows = np.flatnonzero(self.present[:, column])
+			rows = rows[np.argsort(self.quantities[rows, column], kind="stable")]
+			self.family_rows.append(rows)
+			self.family_quantities.append(self.quantities[rows, column])
+		self.starting_points = corpus.starting_point_months
+		self.citation_codes = corpus.citation_codes
+		self.citation_index = {citation: code for code, citation in enumerate(corpus.citations)}
+		self.no_rows = np.zeros(size, dtype=bool)
+		self.cross_border = corpus.cross_border.astype(bool)
+		self.role_bitmaps = code_bitmaps(corpus.role_codes, corpus.roles)
+		self.role_bitmaps[None] = corpus.role_codes == NO_CODE
+		self.plea_bitmaps = code_bitmaps(corpus.plea_codes, corpus.pleas)
+		self.assistance_bitmaps = {
+			int(level): corpus.assistance == level for level in np.unique(corpus.assistance)
+		}
+		factor_rows = corpus.factor_rows(corpus.aggravating_offsets)
+		self.aggravating_bitmaps: dict[str, np.ndarray] = {}
+		for code, factor in enumerate(corpus.aggravating):
+			bitmap = np.zeros(size, dtype=bool)
+			bitmap[factor_rows[corpus.aggravating_codes == code]] = True
+			self.aggravating_bitmaps[factor] = bitmap
+
+	@classmethod
+	def from_records(cls, records: Sequence[Mapping[str, Any]]) -> SimilarCaseIndex:
+		return cls(CorpusColumns.from_records(records))
+
+	@classmethod
+	def from_json(cls, path: str | Path = JSON_OUT) -> SimilarCaseIndex:
+		return cls.from_records(json.loads(Path(path).read_text()))
+
+	@classmethod
+	def load(cls, path: str | Path = COLUMNAR_CORPUS) -> SimilarCaseIndex:
+		"""The index of a columnar corpus file, memory-mapped."""
+		return cls(load_corpus(path))
+
+	def __len__(self) -> int:
+		return len(self.corpus)
+
+	def band_pool(self, families: Mapping[int, float], band: float, exclusive: bool) -> np.ndarray:
+		"""Rows holding every requested family within ``band`` of its quantity;
+		``exclusive`` also drops rows holding any other family."""
+		pool = np.ones(len(self.corpus), dtype=bool)
+		for column, quantity in families.items():
+			quantities = self.family_quantities[column]
+			low = np.searchsorted(quantities, quantity * (1 - band), side="left")
+			high = np.searchsorted(quantities, quantity * (1 + band), side="right")
+			in_band = np.zeros(len(self.corpus), dtype=bool)
+			in_band[self.family_rows[column][low:high]] = True
+			pool &= in_band
+		if exclusive:
+			others = [column for column in range(len(DRUG_FAMILIES)) if column not in families]
+			pool &= ~self.present[:, others].any(axis=1)
+		return pool
+
+	def candidate_pool(self, families: Mapping[int, float], count: int) -> np.ndarray:
+		"""The narrowest band holding ``count`` rows, else every row holding
+		the requested families."""
+		for band in REQUESTED_FAMILY_ENFORCEMENT:
+			pool = self.band_pool(families, band, band == REQUESTED_FAMILY_ENFORCEMENT[0])
+			if np.count_nonzero(pool) >= count:
+				return pool
+		return self.present[:, list(families)].all(axis=1)
+
+	def tiers(self, pool: np.ndarray, request: Mapping[str, Any]) -> list[np.ndarray]:
+		"""Bitmaps partitioning ``pool``, most relevant first."""
+		tiers = []
+		working = pool
+		assistance = assistance_level(request.get("mitigatingFactors") or ())
+		if assistance > 0:
+			for level in sorted(ASSISTANCE_LEVELS, key=lambda level: abs(level - assistance)):
+				tiers.append(working & self.assistance_bitmaps.get(level, self.no_rows))
+			working = working & self.assistance_bitmaps.get(0, self.no_rows)
+		if REFUGEE_FACTOR in (request.get("aggravatingFactors") or ()):
+			refugee = self.aggravating_bitmaps.get(REFUGEE_FACTOR, self.no_rows)
+			tiers.append(working & refugee)
+			working = working & ~refugee
+		role = request.get("defendantRole")
+		if role is not None:
+			same_role = self.role_bitmaps.get(role, self.no_rows)
+			tiers.append(working & same_role)
+			working = working & ~same_role
+		plea = plea_bucket(request.get("guiltyPlea"))
+		if plea in PLEA_TIERS:
+			tiers.extend(working & self.plea_bitmaps.get(bucket, self.no_rows) for bucket in PLEA_TIERS[plea])
+		else:
+			no_plea = self.plea_bitmaps.get("none", self.no_rows)
+			tiers.extend((working & no_plea, working & ~no_plea))
+		return tiers
+
+	def scores(self, rows: np.ndarray, families: Mapping[int, float], starting_point: float) -> np.ndarray:
+		"""The backend's similarity of each row to the request, summed in the
+		backend's order so the floats match."""
+		quantities = self.quantities[rows]
+		total = 0.0
+		for quantity in families.values():
+			total += quantity
+		if total == 0:
+			drug_similarity = np.zeros(len(rows))
+		else:
+			weighted = np.zeros(len(rows))
+			for column, quantity in families.items():
+				candidate = quantities[:, column]
+				ratio = np.where(
+					candidate > 0,
+					np.minimum(quantity, candidate) / np.maximum(quantity, candidate),
+					0.0,
+				)
+				weighted += (quantity / total) * ratio
+			extra = np.zeros(len(rows))
+			for column in range(len(DRUG_FAMILIES)):
+				if column not in families:
+					extra += quantities[:, column] / total
+			drug_similarity = weighted / (1 + extra)
+		candidate_points = self.starting_points[rows]
+		starting_point_similarity = np.minimum(starting_point, candidate_points) / np.maximum(
+			np.maximum(starting_point, candidate_points), 0.1
+		)
+		return DRUG_SIMILARITY_WEIGHT * drug_similarity + STARTING_POINT_SIMILARITY_WEIGHT * starting_point_similarity
+
+	def query_rows(
+		self,
+		request: Mapping[str, Any],
+		count: int = DEFAULT_COUNT,
+		*,
+		exclude_citation: str | None = None,
+	) -> tuple[np.ndarray, np.ndarray]:
+		"""Corpus rows of the top ``count`` similar cases and their scores.
+
+		``exclude_citation`` drops that judgment from the ranking; the pool is
+		still chosen as the backend would choose it.
+		"""
+		starting_point = predict_notional_weighted_months(request["drugs"])
+		if starting_point is None:
+			return np.zeros(0, dtype=int), np.zeros(0)
+		families = {
+			FAMILY_COLUMNS[family]: quantity
+			for family, quantity in family_amounts(request["drugs"]).items()
+			if quantity > 0
+		}
+		pool = self.candidate_pool(families, count)
+		if CROSS_BORDER in (request.get("additionalCircumstances") or ()):
+			pool &= self.cross_border
+		rows = np.concatenate([np.flatnonzero(tier) for tier in self.tiers(pool, request)])
+		# One case per judgment: the first seen, i.e. from the best tier.
+		_codes, first = np.unique(self.citation_codes[rows], return_index=True)
+		rows = rows[np.sort(first)]
+		if exclude_citation is not None:
+			rows = rows[self.citation_codes[rows] != self.citation_index.get(exclude_citation, NO_CODE)]
+		scores = self.scores(rows, families, starting_point)
+		similar = scores >= MIN_SIMILARITY_SCORE
+		rows, scores = rows[similar], scores[similar]
+		order = np.argsort(-scores, kind="stable")[:count]
+		return rows[order], scores[order]
+
+	def query(
+		self,
+		request: Mapping[str, Any],
+		count: int = DEFAULT_COUNT,
+		*,
+		exclude_citation: str | None = None,
+	) -> list[dict[str, Any]]:
+		"""``pickSimilarCases`` of a public prediction request."""
+		rows, scores = self.query_rows(request, count, exclude_citation=exclude_citation)
+		return [
+			{
+				"neutralCitation": self.corpus.citation(row),
+				"title": self.corpus.title(row),
+				"url": self.corpus.url(row),
+				"score": float(score),
+			}
+			for row, score in zip(rows.tolist(), scores.tolist())
+		]
+
+	def query_many(self, requests: Iterable[Mapping[str, Any]], count: int = DEFAULT_COUNT) -> list[list[dict[str, Any]]]:
+		"""``query`` of each request, in request order."""
+		return [self.query(request, count) for request in requests]
+
+
+def similar_cases_report(
+	index: SimilarCaseIndex,
+	count: int = DEFAULT_COUNT,
+	*,
+	exclude_own_case: bool = True,
+) -> pd.DataFrame:
+	"""The similar cases of every corpus case, one row per (case, rank).
+
+	With ``exclude_own_case`` a case's own judgment is left out of its
+	results.
+	"""
+	rows = []
+	corpus = index.corpus
+	for case_row in range(len(corpus)):
+		record = corpus.record(case_row)
+		similar_rows, scores = index.query_rows(
+			record_request(record),
+			count,
+			exclude_citation=record["neutralCitation"] if exclude_own_case else None,
+		)
+		for rank, (similar_row, score) in enumerate(zip(similar_rows.tolist(), scores.tolist()), start=1):
+			rows.append(
+				(
+					case_row,
+					record["neutralCitation"],
+					record["title"],
+					rank,
+					corpus.citation(similar_row),
+					corpus.title(similar_row),
+					corpus.url(similar_row),
+					score,
+				)
+			)
+	return pd.DataFrame(rows, columns=REPORT_COLUMNS)
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="Report the similar cases of every case in the recommender corpus")
+	parser.add_argument(
+		"--corpus",
+		type=Path,
+		default=COLUMNAR_CORPUS,
+		help="Columnar corpus, or a JSON corpus when the name ends in .json",
+	)
+	parser.add_argument("--count", type=int, default=DEFAULT_COUNT)
+	parser.add_argument("--include-own-case", action="store_true", help="Keep each case's own judgment in its results")
+	parser.add_argument("--output", type=Path, default=Path("similar_cases_report.csv"))
+	args = parser.parse_args()
+
+	index = SimilarCaseIndex.from_json(args.corpus) if args.corpus.suffix == ".json" else SimilarCaseIndex.load(args.corpus)
+	report = similar_cases_report(index, args.count, exclude_own_case=not args.include_own_case)
+	report.to_csv(args.output, index=False)
+	matched = report["case_row"].nunique()
+	print(f"{matched} of {len(index)} cases have similar cases; wrote {len(report)} rows to {args.output}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,288 @@
+"""Resampled evaluation of the linear interpolation stage model.
+
+``assign_partition`` gives one seeded train/test split, so ``run_analysis``
+reports a single held-out sample.  This module refits the curves, factor
+medians and role effects on many case-level resamples and reports the spread
+of the ``build_metrics`` results:
+
+- grouped k-fold: cases are shuffled once and cut into ``folds`` groups, and
+  each group is held out in turn.
+- case bootstrap: cases are drawn with replacement for training and the cases
+  never drawn are held out.
+
+Replicates run in a process pool.  The prepared trial and effect frames are
+written once to a Parquet snapshot that every worker memory-maps at start-up,
+so each task only carries its case ids.  Without ``pyarrow`` the frames are
+sent to each worker once instead.
+"""
+
+from __future__ import annotations
+
+import os
+import tempfile
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+import analysis_report
+import verified_snapshot
+from linear_interpolation_model import (
+	MODELLING_TRIAL_COLUMNS,
+	RANDOM_SEED,
+	attach_role_catalogue,
+	build_metrics,
+	build_role_effects,
+	compile_curves,
+	fit_curves,
+	general_stage_data,
+	get_notebook_dir,
+	learn_factor_effects,
+	load_trial_tables,
+	predict_trials,
+	remove_workbook_exclusions,
+	supported_factor_effects,
+)
+
+DEFAULT_FOLDS = 5
+DEFAULT_BOOTSTRAP_REPLICATES = 200
+CONFIDENCE_LEVEL = 0.95
+METRIC_COLUMNS = (
+	"coverage_rate",
+	"mae_months",
+	"median_absolute_error_months",
+	"mean_case_accuracy",
+)
+SHARED_TABLES = ("trials", "effects")
+# Replicates handed to a worker at a time; refits are short, so batching keeps
+# the pool from idling on task hand-offs.
+POOL_CHUNKSIZE = 4
+
+Split = tuple[str, int, np.ndarray, np.ndarray]
+
+_worker_frames: dict[str, Any] | None = None
+
+
+def grouped_k_fold_splits(case_ids: np.ndarray, folds: int, seed: int) -> list[Split]:
+	"""Hold out each of ``folds`` disjoint case groups in turn."""
+	shuffled = np.array(sorted(set(case_ids)), dtype=object)
+	np.random.default_rng(seed).shuffle(shuffled)
+	groups = np.array_split(shuffled, folds)
+	return [
+		(
+			"grouped k-fold",
+			fold,
+			np.concatenate([group for index, group in enumerate(groups) if index != fold]),
+			test_cases,
+		)
+		for fold, test_cases in enumerate(groups)
+	]
+
+
+def case_bootstrap_splits(case_ids: np.ndarray, replicates: int, seed: int) -> list[Split]:
+	"""Train on cases drawn with replacement and test on the cases left out."""
+	cases = np.array(sorted(set(case_ids)), dtype=object)
+	generator = np.random.default_rng(seed)
+	splits: list[Split] = []
+	for replicate in range(replicates):
+		drawn = generator.integers(len(cases), size=len(cases))
+		out_of_bag = np.ones(len(cases), dtype=bool)
+		out_of_bag[drawn] = False
+		splits.append(("case bootstrap", replicate, cases[drawn], cases[out_of_bag]))
+	return splits
+
+
+def index_frames(trials: pd.DataFrame, effects: pd.DataFrame) -> dict[str, Any]:
+	"""Split the frames into their modelling views and index rows by case."""
+	general_trials, general_effects, _ = general_stage_data(trials, effects)
+	frames = {
+		"trials": trials.reset_index(drop=True),
+		"general_trials": general_trials.reset_index(drop=True),
+		"general_effects": general_effects.reset_index(drop=True),
+	}
+	return {
+		"frames": frames,
+		"positions": {
+			name: frame.groupby("case_id", sort=False).indices
+			for name, frame in frames.items()
+		},
+		"drug_types": sorted({drug for amounts in general_trials["drug_amounts"] for drug in amounts}),
+	}
+
+
+def case_rows(indexed: dict[str, Any], name: str, case_ids: np.ndarray) -> pd.DataFrame:
+	"""Rows of ``name`` for ``case_ids``, repeated as often as a case is listed."""
+	positions = indexed["positions"][name]
+	selected = [positions[case_id] for case_id in case_ids if case_id in positions]
+	return indexed["frames"][name].iloc[
+		np.concatenate(selected) if selected else np.array([], dtype=np.intp)
+	]
+
+
+def fit_and_evaluate(
+	indexed: dict[str, Any],
+	train_case_ids: np.ndarray,
+	test_case_ids: np.ndarray,
+) -> pd.DataFrame:
+	"""Refit every stage on the training cases and score the held-out cases."""
+	curves, _, _, _ = fit_curves(
+		case_rows(indexed, "general_trials", train_case_ids),
+		indexed["drug_types"],
+	)
+	factor_effects = learn_factor_effects(case_rows(indexed, "general_effects", train_case_ids))
+	role_effects, _ = build_role_effects(case_rows(indexed, "trials", train_case_ids))
+	predictions = predict_trials(
+		case_rows(indexed, "general_trials", test_case_ids),
+		compile_curves(curves),
+		supported_factor_effects(factor_effects),
+		role_effects,
+	)
+	return build_metrics(predictions)
+
+
+def write_shared_frames(directory: Path, trials: pd.DataFrame, effects: pd.DataFrame) -> None:
+	for name, frame in zip(SHARED_TABLES, (trials, effects)):
+		verified_snapshot.write_parquet(frame, directory / f"{name}.parquet")
+
+
+def read_shared_frames(directory: Path) -> tuple[pd.DataFrame, pd.DataFrame]:
+	trials, effects = (
+		verified_snapshot.read_parquet(directory / f"{name}.parquet") for name in SHARED_TABLES
+	)
+	return trials, effects
+
+
+def init_worker(source: Path | tuple[pd.DataFrame, pd.DataFrame]) -> None:
+	global _worker_frames
+	trials, effects = read_shared_frames(source) if isinstance(source, Path) else source
+	_worker_frames = index_frames(trials, effects)
+
+
+def run_split(split: Split) -> pd.DataFrame:
+	scheme, replicate, train_case_ids, test_case_ids = split
+	metrics = fit_and_evaluate(_worker_frames, train_case_ids, test_case_ids)
+	metrics.insert(0, "scheme", scheme)
+	metrics.insert(1, "replicate", replicate)
+	metrics.insert(2, "test_cases", len(test_case_ids))
+	return metrics
+
+
+def run_splits(
+	splits: list[Split],
+	trials: pd.DataFrame,
+	effects: pd.DataFrame,
+	workers: int,
+) -> Iterator[pd.DataFrame]:
+	if workers <= 1:
+		init_worker((trials, effects))
+		yield from map(run_split, splits)
+		return
+	with tempfile.TemporaryDirectory(prefix="stage-model-resampling-") as shared_dir:
+		source: Path | tuple[pd.DataFrame, pd.DataFrame] = (trials, effects)
+		if verified_snapshot.arrow_available():
+			source = Path(shared_dir)
+			write_shared_frames(source, trials, effects)
+		with ProcessPoolExecutor(
+			max_workers=workers,
+			initializer=init_worker,
+			initargs=(source,),
+		) as executor:
+			yield from executor.map(run_split, splits, chunksize=POOL_CHUNKSIZE)
+
+
+def summarise_metrics(
+	replicate_metrics: pd.DataFrame,
+	confidence_level: float = CONFIDENCE_LEVEL,
+) -> pd.DataFrame:
+	"""Mean, spread and percentile interval of each metric per scheme and stage."""
+	tail = (1 - confidence_level) / 2
+	long = replicate_metrics.melt(
+		id_vars=["scheme", "stage"],
+		value_vars=list(METRIC_COLUMNS),
+		var_name="metric",
+	)
+	grouped = long.groupby(["scheme", "stage", "metric"], sort=False)["value"]
+	summary = grouped.agg(
+		replicates="count",
+		mean="mean",
+		std="std",
+		median="median",
+	)
+	summary["ci_lower"] = grouped.quantile(tail)
+	summary["ci_upper"] = grouped.quantile(1 - tail)
+	summary["confidence_level"] = confidence_level
+	return summary.reset_index()
+
+
+def resample_stage_model(
+	trials: pd.DataFrame,
+	effects: pd.DataFrame,
+	*,
+	folds: int = DEFAULT_FOLDS,
+	bootstrap_replicates: int = DEFAULT_BOOTSTRAP_REPLICATES,
+	seed: int = RANDOM_SEED,
+	workers: int | None = None,
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+	"""Run grouped k-fold and case bootstrap refits of the stage model.
+
+	``trials`` and ``effects`` are the frames ``run_analysis`` partitions: role
+	catalogue attached and workbook exclusions removed.  Returns one metrics
+	row per replicate and stage, and the interval summary.
+	"""
+	case_ids = trials["case_id"].to_numpy(dtype=object)
+	splits: list[Split] = []
+	if folds > 1:
+		splits.extend(grouped_k_fold_splits(case_ids, folds, seed))
+	if bootstrap_replicates > 0:
+		splits.extend(case_bootstrap_splits(case_ids, bootstrap_replicates, seed))
+	shared_columns = [column for column in trials.columns if column != "partition"]
+	replicate_metrics = pd.concat(
+		list(run_splits(
+			splits,
+			trials[shared_columns],
+			effects.drop(columns="partition", errors="ignore"),
+			(os.cpu_count() or 1) if workers is None else workers,
+		)),
+		ignore_index=True,
+	)
+	return replicate_metrics, summarise_metrics(replicate_metrics)
+
+
+def run_resampling(
+	refresh_cache: bool = False,
+	*,
+	folds: int = DEFAULT_FOLDS,
+	bootstrap_replicates: int = DEFAULT_BOOTSTRAP_REPLICATES,
+	workers: int | None = None,
+) -> dict[str, pd.DataFrame | str]:
+	notebook_dir = get_notebook_dir()
+	trials, effects, _ = load_trial_tables(
+		notebook_dir, refresh_cache, trial_columns=MODELLING_TRIAL_COLUMNS
+	)
+	trials, _, _ = attach_role_catalogue(trials, notebook_dir)
+	trials, effects, _ = remove_workbook_exclusions(trials, effects)
+	replicate_metrics, metric_intervals = resample_stage_model(
+		trials,
+		effects,
+		folds=folds,
+		bootstrap_replicates=bootstrap_replicates,
+		workers=workers,
+	)
+	output_path = notebook_dir / "linear_interpolation_resampling.xlsx"
+	analysis_report.write_report(output_path, {
+		"metric intervals": metric_intervals,
+		"replicate metrics": replicate_metrics,
+	})
+	return {
+		"output_path": str(output_path),
+		"metric_intervals": metric_intervals,
+		"replicate_metrics": replicate_metrics,
+	}
+
+
+if __name__ == "__main__":
+	results = run_resampling()
+	print(results["metric_intervals"].to_string(index=False))
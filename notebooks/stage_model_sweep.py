@@ -0,0 +1,244 @@
+"""Hyper-parameter sweeps over the stage model's curve and factor settings.
+
+``run_analysis`` fits one model from the module constants.  A sweep loads and
+partitions the trials once, then scores every point of a grid of
+``quantiles``, ``min_curve_support``, ``min_factor_support`` and
+``mixed_drug_method`` on the held-out partition.  Each worker memoises the
+stage fits, so a point only refits what its settings change: curves for the
+quantiles and curve support, factor medians for the factor support, and
+starting points for the mixed-drug method.  Role effects do not depend on
+any swept setting and are fitted once per worker.
+
+Grid points run in a process pool set up as in ``stage_model_resampling``.
+The results table has one row per point with the held-out metrics of every
+stage.
+"""
+
+from __future__ import annotations
+
+import itertools
+import math
+import os
+import tempfile
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+import verified_snapshot
+from linear_interpolation_model import (
+	MIN_CURVE_SUPPORT,
+	MIN_FACTOR_SUPPORT,
+	MIXED_DRUG_METHOD,
+	MODELLING_TRIAL_COLUMNS,
+	QUANTILES,
+	assign_partition,
+	attach_role_catalogue,
+	build_metrics,
+	build_role_effects,
+	compile_curves,
+	drug_quantity_triples,
+	fit_curves,
+	general_stage_data,
+	get_notebook_dir,
+	learn_factor_effects,
+	load_trial_tables,
+	partition_effects,
+	predict_held_out,
+	remove_workbook_exclusions,
+	supported_factor_effects,
+	weighted_starting_points,
+)
+from stage_model_resampling import read_shared_frames, write_shared_frames
+
+SWEEP_DEFAULTS = {
+	"quantiles": QUANTILES,
+	"min_curve_support": MIN_CURVE_SUPPORT,
+	"min_factor_support": MIN_FACTOR_SUPPORT,
+	"mixed_drug_method": MIXED_DRUG_METHOD,
+}
+REPORTED_METRICS = ("covered_test_trials", "mae_months", "mean_case_accuracy")
+RESULTS_FILENAME = "linear_interpolation_sweep.csv"
+
+_worker_data: dict[str, Any] | None = None
+
+
+def parameter_grid(**values: list[Any]) -> list[dict[str, Any]]:
+	"""Every combination of the given settings; unlisted ones keep their default."""
+	unknown = set(values) - set(SWEEP_DEFAULTS)
+	if unknown:
+		raise ValueError(f"Unknown sweep settings: {sorted(unknown)}")
+	options = {
+		name: [tuple(value) if name == "quantiles" else value for value in values.get(name, [default])]
+		for name, default in SWEEP_DEFAULTS.items()
+	}
+	return [dict(zip(options, combination)) for combination in itertools.product(*options.values())]
+
+
+def prepare_sweep_data(trials: pd.DataFrame, effects: pd.DataFrame) -> dict[str, Any]:
+	"""Split partitioned frames into the pieces each stage is refitted from."""
+	general_trials, general_effects, _ = general_stage_data(trials, effects)
+	test_trials = general_trials.loc[general_trials["partition"] == "test"]
+	role_effects, _ = build_role_effects(trials.loc[trials["partition"] == "train"])
+	return {
+		"curve_training_trials": general_trials.loc[general_trials["partition"] == "train"],
+		"factor_training_effects": general_effects.loc[general_effects["partition"] == "train"],
+		"drug_types": sorted({drug for amounts in general_trials["drug_amounts"] for drug in amounts}),
+		"role_effects": role_effects,
+		"test_trials": test_trials,
+		"test_drug_quantities": drug_quantity_triples(test_trials["drug_amounts"]),
+	}
+
+
+def init_worker(source: Path | tuple[pd.DataFrame, pd.DataFrame]) -> None:
+	global _worker_data
+	trials, effects = read_shared_frames(source) if isinstance(source, Path) else source
+	_worker_data = prepare_sweep_data(trials, effects)
+	for stage_fit in (fitted_curves, fitted_factor_effects, starting_point_predictions):
+		stage_fit.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def fitted_curves(
+	quantiles: tuple[float, ...],
+	min_curve_support: int,
+) -> tuple[dict[str, tuple[np.ndarray, np.ndarray]], int]:
+	curves, _, _, _ = fit_curves(
+		_worker_data["curve_training_trials"],
+		_worker_data["drug_types"],
+		min_support=min_curve_support,
+		quantiles=quantiles,
+	)
+	return compile_curves(curves), len(curves)
+
+
+@lru_cache(maxsize=None)
+def fitted_factor_effects(min_factor_support: int) -> dict[tuple[str, str], float]:
+	return supported_factor_effects(
+		learn_factor_effects(_worker_data["factor_training_effects"], min_factor_support)
+	)
+
+
+@lru_cache(maxsize=None)
+def starting_point_predictions(
+	quantiles: tuple[float, ...],
+	min_curve_support: int,
+	mixed_drug_method: str,
+) -> pd.DataFrame:
+	compiled_curves, _ = fitted_curves(quantiles, min_curve_support)
+	test_trials = _worker_data["test_trials"]
+	starting_predictions = weighted_starting_points(
+		_worker_data["test_drug_quantities"],
+		compiled_curves,
+		len(test_trials),
+		mixed_drug_method,
+	)
+	return test_trials.assign(**{
+		column: starting_predictions[column].to_numpy()
+		for column in starting_predictions.columns
+	})
+
+
+def evaluate_point(point: dict[str, Any]) -> dict[str, Any]:
+	_, supported_curves = fitted_curves(point["quantiles"], point["min_curve_support"])
+	supported_effects = fitted_factor_effects(point["min_factor_support"])
+	predictions = predict_held_out(
+		starting_point_predictions(
+			point["quantiles"],
+			point["min_curve_support"],
+			point["mixed_drug_method"],
+		),
+		supported_effects,
+		_worker_data["role_effects"],
+	)
+	row = {
+		**point,
+		"quantiles": " | ".join(f"{quantile:g}" for quantile in point["quantiles"]),
+		"supported_curves": supported_curves,
+		"supported_factors": len(supported_effects),
+		"test_trials": len(predictions),
+	}
+	for metric in build_metrics(predictions).itertuples(index=False):
+		prefix = metric.stage.lower().replace("-", "_").replace(" ", "_")
+		for name in REPORTED_METRICS:
+			row[f"{prefix}_{name}"] = getattr(metric, name)
+	return row
+
+
+def evaluate_points(
+	points: list[dict[str, Any]],
+	trials: pd.DataFrame,
+	effects: pd.DataFrame,
+	workers: int,
+) -> Iterator[dict[str, Any]]:
+	if workers <= 1:
+		init_worker((trials, effects))
+		yield from map(evaluate_point, points)
+		return
+	# Neighbouring points share curve fits, so hand them out in runs that a
+	# worker's caches can reuse.
+	chunksize = max(1, math.ceil(len(points) / (workers * 4)))
+	with tempfile.TemporaryDirectory(prefix="stage-model-sweep-") as shared_dir:
+		source: Path | tuple[pd.DataFrame, pd.DataFrame] = (trials, effects)
+		if verified_snapshot.arrow_available():
+			source = Path(shared_dir)
+			write_shared_frames(source, trials, effects)
+		with ProcessPoolExecutor(
+			max_workers=workers,
+			initializer=init_worker,
+			initargs=(source,),
+		) as executor:
+			yield from executor.map(evaluate_point, points, chunksize=chunksize)
+
+
+def sweep_stage_model(
+	trials: pd.DataFrame,
+	effects: pd.DataFrame,
+	points: list[dict[str, Any]],
+	*,
+	workers: int | None = None,
+) -> pd.DataFrame:
+	"""Score every grid point on the held-out partition.
+
+	``trials`` and ``effects`` carry the ``partition`` column, as returned by
+	``load_sweep_tables``.
+	"""
+	ordered = sorted(
+		points,
+		key=lambda point: (point["quantiles"], point["min_curve_support"], point["mixed_drug_method"]),
+	)
+	return pd.DataFrame(list(evaluate_points(
+		ordered,
+		trials,
+		effects,
+		(os.cpu_count() or 1) if workers is None else workers,
+	)))
+
+
+def load_sweep_tables(refresh_cache: bool = False) -> tuple[pd.DataFrame, pd.DataFrame]:
+	"""Load and partition the modelling frames once for any number of sweeps."""
+	notebook_dir = get_notebook_dir()
+	trials, effects, _ = load_trial_tables(
+		notebook_dir, refresh_cache, trial_columns=MODELLING_TRIAL_COLUMNS
+	)
+	trials, _, _ = attach_role_catalogue(trials, notebook_dir)
+	trials, effects, _ = remove_workbook_exclusions(trials, effects)
+	trials, _ = assign_partition(trials, notebook_dir)
+	return trials, partition_effects(trials, effects)
+
+
+def run_sweep(
+	points: list[dict[str, Any]],
+	refresh_cache: bool = False,
+	*,
+	workers: int | None = None,
+) -> dict[str, pd.DataFrame | str]:
+	trials, effects = load_sweep_tables(refresh_cache)
+	results = sweep_stage_model(trials, effects, points, workers=workers)
+	output_path = get_notebook_dir() / RESULTS_FILENAME
+	results.to_csv(output_path, index=False)
+	return {"output_path": str(output_path), "results": results}
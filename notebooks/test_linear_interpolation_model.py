@@ -1,23 +1,74 @@
+import asyncio
+import hashlib
+import importlib.util
 import json
+import os
+import sys
 import tempfile
 import unittest
+from datetime import datetime
 from pathlib import Path
 from unittest.mock import patch
 
 import numpy as np
 import pandas as pd
 
-from data_derived_linear_model import DataDerivedLinearPredictor
+import analysis_pipeline
+import analysis_report
+import data_derived_linear_model
+import evaluate_verified_sentences
+import load_test_prediction_service
+import parity_cases
+import prediction_service
+import similar_case_index
+import stage_model_resampling
+import stage_model_sweep
+import verified_snapshot
+from benchmark_deployment_predictor import benchmark_case, benchmark_predictor
+from data_derived_linear_model import EFFECT_STAGES, STAGE_COLUMNS, DataDerivedLinearPredictor
+from legacy_model import DkPredictor
 from linear_interpolation_model import (
+    ANALYSIS_STAGES,
     COURIER_STOREKEEPER_ROLE,
+    INFERRED_ROLE_SOURCE,
+    MODELLING_TRIAL_COLUMNS,
+    TRIAL_TABLE_COLUMNS,
+    assign_partition,
     attach_role_catalogue,
+    build_metrics,
     build_role_effects,
+    compile_curves,
+    drug_quantity_triples,
+    effect_matrix,
+    encode_stage_factors,
+    fetch_changed_documents,
+    fit_curves,
     flatten_documents,
     general_stage_data,
+    learn_factor_effects,
+    learn_training_factor_effects,
+    load_documents,
+    load_trial_tables,
+    legacy_percentage_predictions,
+    partition_effects,
+    plea_factor,
+    predict_held_out,
+    predict_stages,
+    predict_trials,
     remove_workbook_exclusions,
     role_aware_aggravating_factors,
     role_profile_prediction,
+    supported_factor_effects,
+    weighted_starting_points,
 )
+from model_registry import ModelRegistry
+from parity_cases import random_deployment_cases, random_legacy_inputs, random_recommender_corpus
+from prediction_cache import PredictionCache, canonical_request
+from verified_snapshot import documents_to_frame, frame_to_documents
+
+# predictionModel/ is on the path once similar_case_index is imported.
+import build_case_recommender_corpus  # noqa: E402
+import recommender_corpus  # noqa: E402
 
 
 class RoleAdjustmentModelTest(unittest.TestCase):
@@ -293,6 +344,48 @@ class RoleAdjustmentModelTest(unittest.TestCase):
         self.assertTrue(augmented_trials["workbook_excluded"].iloc[0])
         self.assertEqual(provenance["fallback_matched_excluded_rows"], 1)
 
+    def test_trial_index_fallback_skips_ambiguous_candidates(self) -> None:
+        excluded_row = {
+            "workbook_excluded": True,
+            "workbook_primary_role": None,
+            "workbook_circumstances": [],
+            "workbook_starting_point_months": np.nan,
+            "workbook_difference_months": np.nan,
+            "workbook_effect_fraction": np.nan,
+        }
+        catalogue = pd.DataFrame([
+            # Two trials share this fallback key.
+            {"role_catalogue_key": "[2025] hkcf 1|5|1|1", "role_catalogue_fallback_key": "[2025] hkcf 1|1|1", **excluded_row},
+            # Two unmatched workbook rows share this fallback key.
+            {"role_catalogue_key": "[2025] hkcf 2|5|1|1", "role_catalogue_fallback_key": "[2025] hkcf 2|1|1", **excluded_row},
+            {"role_catalogue_key": "[2025] hkcf 2|6|1|1", "role_catalogue_fallback_key": "[2025] hkcf 2|1|1", **excluded_row},
+            # Unambiguous.
+            {"role_catalogue_key": "[2025] hkcf 3|5|1|1", "role_catalogue_fallback_key": "[2025] hkcf 3|1|1", **excluded_row},
+        ])
+        trials = pd.DataFrame([
+            {"neutral_citation": citation, "trial_index": trial_index, "charge_no": 1, "defendant_id": 1, "sentencing_role": None}
+            for citation, trial_index in (
+                ("[2025] HKCF 1", 0),
+                ("[2025] HKCF 1", 1),
+                ("[2025] HKCF 2", 0),
+                ("[2025] HKCF 3", 0),
+            )
+        ])
+
+        with patch(
+            "linear_interpolation_model.load_role_catalogue",
+            return_value=(catalogue, {}),
+        ):
+            with self.assertWarnsRegex(RuntimeWarning, "could not be matched"):
+                augmented_trials, _, provenance = attach_role_catalogue(trials, Path("."))
+
+        self.assertEqual(augmented_trials["workbook_excluded"].tolist(), [False, False, False, True])
+        self.assertEqual(provenance["fallback_matched_excluded_rows"], 1)
+        self.assertEqual(
+            provenance["unmatched_excluded_keys"],
+            ["[2025] hkcf 1|5|1|1", "[2025] hkcf 2|5|1|1", "[2025] hkcf 2|6|1|1"],
+        )
+
     def test_deployment_predictor_applies_role_rules(self) -> None:
         artifact = {
             "canonical_factor_map": {},
@@ -370,5 +463,1661 @@ class RoleAdjustmentModelTest(unittest.TestCase):
             )
 
 
+class DeploymentPredictorBatchTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.predictor = DataDerivedLinearPredictor()
+        self.cases = random_deployment_cases(self.predictor, seed=43, count=3000)
+        self.expected = [self.predictor.predict(**case) for case in self.cases]
+
+    def assert_matches_predict(self, batch: dict) -> None:
+        parity_cases.assert_columns_match_records(self, batch, self.expected, ["status", *STAGE_COLUMNS])
+        for index, result in enumerate(self.expected):
+            if result["status"] == "supported":
+                self.assertEqual(
+                    {stage: batch[f"{stage}_status"][index] for stage in result["factors"]},
+                    result["factors"],
+                )
+            else:
+                self.assertEqual(batch["unsupported_drugs"][index], result["unsupported_drugs"])
+
+    def test_pure_python_batch_matches_predict(self) -> None:
+        self.assert_matches_predict(self.predictor.predict_many(self.cases, use_numpy=False))
+
+    def test_numpy_batch_matches_predict_exactly(self) -> None:
+        self.assertGreater(sum(result["status"] == "supported" for result in self.expected), 2000)
+        self.assert_matches_predict(self.predictor.predict_many(self.cases, use_numpy=True))
+
+    def test_columns_are_accepted_in_place_of_records(self) -> None:
+        columns = {
+            "drug_amounts": [{"Cocaine": 10.0}, {"Heroin": 0.0}, {"Cocaine": 2.0, "Heroin": 30.0}],
+            "pleaded_guilty": np.array([True, False, True]),
+            "guilty_plea_stage": ["Up to committal", None, None],
+        }
+        records = [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+        batch = self.predictor.predict_many(columns)
+
+        self.assertEqual(batch, self.predictor.predict_many(records, use_numpy=False))
+        self.assertEqual(batch["status"][1], "no positive drug quantity")
+        self.assertIsNone(batch["final_sentence_months"][1])
+        self.assertEqual(batch["final_sentence_months"][0], self.predictor.predict(**records[0])["final_sentence_months"])
+        with self.assertRaisesRegex(ValueError, "same length"):
+            self.predictor.predict_many({"drug_amounts": [{"Cocaine": 1.0}], "pleaded_guilty": []})
+
+
+# sha256 of json.dumps(results, sort_keys=True) for the 1000 seed-44
+# random_deployment_cases, produced by predict before the artifact was
+# compiled into lookup tables.  Refreeze it only when the artifact changes.
+FROZEN_PREDICTIONS_SHA256 = "9f9e00fd50e657d6ad0e49ee9a0bea520dcbf6ced5b93959eac47fb8c007ea17"
+
+
+class CompiledDeploymentPredictorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.predictor = DataDerivedLinearPredictor()
+
+    def test_compiled_tables_match_artifact(self) -> None:
+        compiled = self.predictor.compiled
+        for drug, knots in self.predictor.drug_curves.items():
+            self.assertEqual(compiled.curves[drug], tuple(zip(*knots)))
+        for raw, canonical in self.predictor.canonical_factor_map.items():
+            self.assertEqual(compiled.canonical_factors[raw], canonical)
+        for stage, effects_by_id in zip(EFFECT_STAGES, compiled.stage_effects):
+            for factor, factor_id in compiled.factor_ids.items():
+                self.assertEqual(effects_by_id[factor_id], self.predictor.factor_effects[stage].get(factor))
+
+    def test_predictions_match_frozen_reference(self) -> None:
+        cases = random_deployment_cases(self.predictor, seed=44, count=1000)
+        results = [self.predictor.predict(**case) for case in cases]
+
+        self.assertEqual(
+            [result["final_sentence_months"] for result in results[:5]],
+            [32.61403582981271, 313.4889164172192, 33.89108580487004, None, 251.79756400913294],
+        )
+        self.assertEqual(
+            hashlib.sha256(json.dumps(results, sort_keys=True).encode()).hexdigest(),
+            FROZEN_PREDICTIONS_SHA256,
+        )
+        for case, result in zip(cases, results):
+            prediction = self.predictor.predict_stages(**case)
+            self.assertEqual(prediction.as_dict(), result)
+            self.assertEqual(prediction.reported_months, result["reported_months"])
+            if prediction.status == "supported":
+                self.assertEqual(prediction.stages, {column: result[column] for column in STAGE_COLUMNS})
+
+    def test_profiles_are_shared_and_render_statuses_lazily(self) -> None:
+        case = benchmark_case(self.predictor)
+        first = self.predictor.predict_stages(**case)
+        second = self.predictor.predict_stages(**{**case, "drug_amounts": {"Cocaine": 5.0}})
+
+        self.assertIs(first.profile, second.profile)
+        self.assertIsNone(first.profile._factors)
+        factors = first.factors
+        self.assertEqual(factors["role"], "primary role supported | Divan keeping supported")
+        factors["role"] = "changed"
+        self.assertNotEqual(second.factors["role"], "changed")
+        with self.assertRaises(AttributeError):
+            first.profile.extra = 1
+
+    def test_profile_cache_keeps_the_most_recently_used_profiles(self) -> None:
+        def profile(factor: str):
+            return self.predictor.predict_stages({"Cocaine": 10.0}, aggravating_factors=[factor]).profile
+
+        with patch.object(data_derived_linear_model, "PROFILE_CACHE_SIZE", 2):
+            first = profile("On bail")
+            profile("Import")
+            self.assertIs(profile("On bail"), first)
+            profile("Unlisted")
+
+            self.assertEqual(
+                [key[0] for key in self.predictor._profile_cache],
+                [("On bail",), ("Unlisted",)],
+            )
+            profile("Import")
+            self.assertEqual(
+                [key[0] for key in self.predictor._profile_cache],
+                [("Unlisted",), ("Import",)],
+            )
+
+    def test_single_prediction_stays_within_budget(self) -> None:
+        results = benchmark_predictor(self.predictor, calls=200, repeats=3)
+        for row in results.itertuples(index=False):
+            self.assertLessEqual(row.peak_bytes, row.peak_bytes_budget, row.method)
+            self.assertLessEqual(row.microseconds, row.microseconds_budget, row.method)
+        peak = results.set_index("method")["peak_bytes"]
+        self.assertLess(peak["predict_stages"], peak["predict"])
+
+
+PUBLIC_PREDICTION_REQUEST = {
+    "drugs": [{"type": "Cocaine", "quantity": 10}, {"type": "Fluorodeschloroketamine", "quantity": 20}],
+    "defendantRole": "Actual trafficker",
+    "additionalCircumstances": ["Cross-border trafficking"],
+    "guiltyPlea": "Plead guilty (earliest opportunity)",
+    "aggravatingFactors": ["Multiple Drugs", "Refugee/Asylum"],
+    "mitigatingFactors": ["Assistance - useful", "Rehabilitation programme"],
+}
+
+
+def asgi_call(app, method: str, path: str, body=None, headers=()) -> tuple[int, dict, bytes]:
+    messages = [{"type": "http.request", "body": b"" if body is None else json.dumps(body).encode()}]
+    sent = []
+
+    async def receive() -> dict:
+        return messages.pop()
+
+    async def send(message: dict) -> None:
+        sent.append(message)
+
+    asyncio.run(app({"type": "http", "method": method, "path": path, "headers": list(headers)}, receive, send))
+    start, response = sent
+    return start["status"], dict(start["headers"]), response["body"]
+
+
+class PredictionServiceTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.service = prediction_service.PredictionService(poll_seconds=0)
+
+    def post(self, body, path: str = prediction_service.PREDICTION_PATH) -> tuple[int, dict]:
+        status, _, payload = asgi_call(self.service, "POST", path, body)
+        return status, json.loads(payload)
+
+    def test_prediction_follows_the_public_contract(self) -> None:
+        status, body = self.post(PUBLIC_PREDICTION_REQUEST)
+
+        expected = self.service.predictor.predict_stages(
+            {"Cocaine": 10.0, "Ketamine": 20.0},
+            aggravating_factors=["Multiple drugs", "Refugee claimant"],
+            mitigating_factors=["Assistance - useful", "Rehabilitation programme"],
+            pleaded_guilty=True,
+            guilty_plea_stage="Up to committal",
+            primary_role="Actual trafficker",
+            additional_circumstances=["Cross-border trafficking"],
+        )
+        self.assertEqual(status, 200)
+        self.assertEqual(body["startingPointMonths"], round(expected.starting_point_months, 2))
+        self.assertEqual(body["finalSentenceMonths"], round(expected.final_sentence_months, 2))
+        self.assertEqual(
+            [(item["factor"], item["category"], item["direction"]) for item in body["adjustments"]],
+            [
+                ("Actual trafficker", "defendantRole", "increase"),
+                ("Cross-border trafficking", "defendantRole", "increase"),
+                ("Multiple Drugs", "aggravating", "increase"),
+                ("Refugee/Asylum", "aggravating", "increase"),
+                ("Assistance - useful", "mitigating", "decrease"),
+                ("Rehabilitation programme", "mitigating", "decrease"),
+                ("Plead guilty (earliest opportunity)", "guiltyPlea", "decrease"),
+            ],
+        )
+        self.assertEqual(body["adjustments"][-1]["baseMonths"], round(expected.pre_plea_months, 2))
+
+    def test_cache_does_not_change_responses(self) -> None:
+        predictor = DataDerivedLinearPredictor()
+        requests = [
+            {"drugs": [{"type": "Cocaine", "quantity": 0.0004}], "guiltyPlea": "Plead not guilty"},
+            {**PUBLIC_PREDICTION_REQUEST, "mitigatingFactors": ["Rehabilitation programme", "Assistance - useful"]},
+            {**PUBLIC_PREDICTION_REQUEST, "aggravatingFactors": ["Refugee/Asylum", "Multiple Drugs"]},
+        ]
+        for request in requests:
+            cache = PredictionCache()
+            uncached = prediction_service.respond_to_body(predictor, request)
+            self.assertEqual(uncached[0], 200)
+            # The second call is served from the cache.
+            self.assertEqual(prediction_service.respond_to_body(predictor, request, cache), uncached)
+            self.assertEqual(prediction_service.respond_to_body(predictor, request, cache), uncached)
+            self.assertEqual(cache.hits, 1)
+
+    def test_invalid_and_unavailable_requests(self) -> None:
+        status, body = self.post({
+            **PUBLIC_PREDICTION_REQUEST,
+            "drugs": [{"type": "Cocaine", "quantity": 0}],
+            "defendantRole": None,
+            "mitigatingFactors": ["Assistance - useful", "Assistance - risk", "Extreme youth"],
+        })
+        self.assertEqual(status, 400)
+        self.assertEqual(body["error"], "VALIDATION_ERROR")
+        self.assertEqual(
+            set(body["fields"]),
+            {"drugs[0].quantity", "defendantRole", "mitigatingFactors", "mitigatingFactors[2]"},
+        )
+
+        status, body = self.post({**PUBLIC_PREDICTION_REQUEST, "drugs": [{"type": "Nimetazepam", "quantity": 1}]})
+        self.assertEqual((status, body["error"], body["drug"]), (422, "MODEL_INPUT_UNAVAILABLE", {"type": "Nimetazepam"}))
+
+        status, _, payload = asgi_call(self.service, "POST", prediction_service.PREDICTION_PATH)
+        self.assertEqual((status, json.loads(payload)["fields"]), (400, {"body": "The request body is not valid JSON"}))
+        self.assertEqual(asgi_call(self.service, "GET", "/api/unknown")[0], 404)
+
+    def test_batch_matches_single_requests_and_is_counted(self) -> None:
+        requests = [PUBLIC_PREDICTION_REQUEST, {}, {**PUBLIC_PREDICTION_REQUEST, "guiltyPlea": "Plead not guilty"}]
+
+        status, results = self.post(requests, prediction_service.BATCH_PATH)
+
+        self.assertEqual(status, 200)
+        self.assertEqual([[item["statusCode"], item["body"]] for item in results], [list(self.post(request)) for request in requests])
+        self.assertEqual(self.post({}, prediction_service.BATCH_PATH)[0], 400)
+        metrics = asgi_call(self.service, "GET", prediction_service.METRICS_PATH)[2].decode()
+        self.assertIn('prediction_requests_total{route="/api/sentence-predictions/batch",status="200"} 1', metrics)
+        self.assertIn("prediction_batch_items_total 3", metrics)
+        self.assertIn('model_version="2026-07-19"', metrics)
+
+    def test_a_model_that_fails_to_load_is_a_json_error(self) -> None:
+        with tempfile.TemporaryDirectory() as temporary_dir:
+            service = prediction_service.PredictionService(Path(temporary_dir) / "missing.json", poll_seconds=0)
+            with self.assertLogs(prediction_service.logger, "ERROR"):
+                status, headers, payload = asgi_call(
+                    service, "POST", prediction_service.PREDICTION_PATH, PUBLIC_PREDICTION_REQUEST
+                )
+
+        self.assertEqual(status, 500)
+        self.assertEqual(json.loads(payload)["error"], "INTERNAL_ERROR")
+        self.assertNotIn(b"x-model-version", headers)
+        self.assertIsNone(service.predictor)
+
+    def test_changed_artifact_is_swapped_in_and_bad_artifacts_are_ignored(self) -> None:
+        with tempfile.TemporaryDirectory() as temporary_dir:
+            model_path = Path(temporary_dir) / "model.json"
+            artifact = json.loads(prediction_service.DEFAULT_MODEL_PATH.read_text())
+            model_path.write_text(json.dumps(artifact))
+            service = prediction_service.PredictionService(model_path, poll_seconds=0)
+            service.load()
+            original = service.predictor
+
+            self.assertFalse(asyncio.run(service.reload_if_changed()))
+            model_path.write_text(json.dumps({**artifact, "model_version": "next"}))
+            os.utime(model_path, ns=(1, 1))
+            self.assertTrue(asyncio.run(service.reload_if_changed()))
+            self.assertIsNot(service.predictor, original)
+            headers = asgi_call(service, "POST", prediction_service.PREDICTION_PATH, PUBLIC_PREDICTION_REQUEST)[1]
+            self.assertEqual(headers[b"x-model-version"], b"next")
+
+            model_path.write_text("{")
+            with self.assertLogs(prediction_service.logger, "ERROR"):
+                self.assertFalse(asyncio.run(service.reload_if_changed()))
+            self.assertEqual(service.predictor.model["model_version"], "next")
+            self.assertEqual(service.metrics.reload_failures, 1)
+            self.assertFalse(asyncio.run(service.reload_if_changed()))
+
+    def test_in_process_load_test_reports_latency_percentiles(self) -> None:
+        summary = asyncio.run(load_test_prediction_service.load_test(None, rate=2000, duration=0.1, connections=1))
+
+        self.assertEqual(summary["statuses"], {200: 200})
+        self.assertLessEqual(summary["p50_ms"], summary["p99_ms"])
+        self.assertLessEqual(summary["p99_ms"], summary["max_ms"])
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class PredictionCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.predictor = DataDerivedLinearPredictor()
+        self.clock = FakeClock()
+        self.cache = PredictionCache(2, 60.0, clock=self.clock)
+        self.case = benchmark_case(self.predictor)
+
+    def test_equivalent_requests_share_one_entry(self) -> None:
+        first = self.cache.predict_stages(self.predictor, **self.case)
+        aggravating = self.case["aggravating_factors"]
+        respelled = {
+            **self.case,
+            "drug_amounts": {"Heroin": 30.0000001, "Cocaine": 120.0, "Ecstasy": 0.0},
+            "aggravating_factors": [*reversed(aggravating), aggravating[0]],
+        }
+
+        self.assertIs(self.cache.predict_stages(self.predictor, **respelled), first)
+        self.assertIs(self.cache.predict_stages(self.predictor, **respelled), first)
+        self.assertEqual(
+            canonical_request(self.predictor, {"Cocaine": 1.0}, ["Export", "Cross-border trafficking"], guilty_plea_stage="First day"),
+            canonical_request(self.predictor, {"Cocaine": 1.0}, ["Import"]),
+        )
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+        self.assertEqual(self.cache.stats()["hit_ratio"], 2 / 3)
+        self.assertEqual(canonical_request(self.predictor, {"Cocaine": 0.0004}).drug_amounts, (("Cocaine", 0.0004),))
+
+    def test_cached_predictions_match_the_predictor(self) -> None:
+        cache = PredictionCache()
+        for case in random_deployment_cases(self.predictor, seed=45, count=300):
+            try:
+                expected = self.predictor.predict(**canonical_request(self.predictor, **case).arguments())
+            except ValueError:
+                continue
+            self.assertEqual(cache.predict(self.predictor, **case), expected)
+            self.assertEqual(cache.predict(self.predictor, **case), expected)
+
+    def test_hits_and_misses_follow_the_request_order(self) -> None:
+        case = {
+            "drug_amounts": {"Heroin": 30.0, "Cocaine": 120.0},
+            "aggravating_factors": ["Zeta aggravation", "Alpha aggravation"],
+            "mitigating_factors": ["Zeta mitigation", "Alpha mitigation"],
+        }
+        reordered = {
+            "drug_amounts": {"Cocaine": 120.0, "Heroin": 30.0},
+            "aggravating_factors": ["Alpha aggravation", "Zeta aggravation"],
+            "mitigating_factors": ["Alpha mitigation", "Zeta mitigation"],
+        }
+        miss = self.cache.predict(self.predictor, **case)
+        hit = self.cache.predict(self.predictor, **case)
+        reordered_hit = self.cache.predict(self.predictor, **reordered)
+
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 1))
+        self.assertEqual(miss, self.predictor.predict(**case))
+        self.assertEqual(hit, miss)
+        self.assertEqual(list(hit["drug_amounts"]), ["Heroin", "Cocaine"])
+        self.assertEqual(hit["factors"]["aggravation"], "unsupported factors: Zeta aggravation | Alpha aggravation")
+        self.assertEqual(reordered_hit, self.predictor.predict(**reordered))
+        self.assertEqual(list(reordered_hit["drug_amounts"]), ["Cocaine", "Heroin"])
+        self.assertEqual(reordered_hit["factors"]["mitigation"], "unsupported factors: Alpha mitigation | Zeta mitigation")
+
+    def test_entries_are_evicted_and_expire(self) -> None:
+        for quantity in (1.0, 2.0, 3.0):
+            self.cache.predict_stages(self.predictor, {"Cocaine": quantity})
+        self.assertEqual((len(self.cache.entries), self.cache.evictions), (2, 1))
+
+        self.clock.now = 61.0
+        self.cache.predict_stages(self.predictor, {"Cocaine": 3.0})
+        self.assertEqual((self.cache.expirations, self.cache.misses), (1, 4))
+
+    def test_entries_are_keyed_by_model(self) -> None:
+        cached = self.cache.predict_stages(self.predictor, **self.case)
+        legacy = DataDerivedLinearPredictor(adjustment_strategy="legacy_percentages")
+
+        self.assertIsNot(self.cache.predict_stages(legacy, **self.case), cached)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertNotEqual(self.cache.model_key(legacy), self.cache.model_key(self.predictor))
+
+    def test_service_reports_cache_metrics(self) -> None:
+        service = prediction_service.PredictionService(poll_seconds=0)
+        for _ in range(2):
+            asgi_call(service, "POST", prediction_service.PREDICTION_PATH, PUBLIC_PREDICTION_REQUEST)
+        metrics = asgi_call(service, "GET", prediction_service.METRICS_PATH)[2].decode()
+
+        self.assertIn('prediction_cache_lookups_total{result="hit"} 1', metrics)
+        self.assertIn('prediction_cache_lookups_total{result="miss"} 1', metrics)
+        self.assertIsNone(prediction_service.PredictionService(poll_seconds=0, cache_entries=0).cache)
+
+
+class ModelRegistryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temporary_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_dir.cleanup)
+        self.registry = ModelRegistry(temporary_dir.name, max_loaded=2)
+        self.artifact = json.loads(prediction_service.DEFAULT_MODEL_PATH.read_text())
+        self.current = self.registry.publish(prediction_service.DEFAULT_MODEL_PATH)
+        self.next = self.registry.publish({**self.artifact, "model_version": "next"})
+
+    def test_artifacts_are_content_addressed(self) -> None:
+        self.assertEqual(self.registry.publish(dict(reversed(self.artifact.items()))), self.current)
+        self.assertEqual([entry.digest for entry in self.registry.models()], [self.current, self.next])
+        self.assertEqual(json.loads(self.registry.artifact_path(self.current).read_text()), self.artifact)
+
+        self.assertEqual(self.registry.resolve("latest"), self.next)
+        self.assertEqual(self.registry.resolve("2026-07-19"), self.current)
+        self.assertEqual(self.registry.resolve(self.next[:8]), self.next)
+        with self.assertRaises(KeyError):
+            self.registry.resolve("missing")
+
+    def test_predictors_are_loaded_once_per_variant(self) -> None:
+        learned = self.registry.variant("2026-07-19")
+        self.assertIs(self.registry.predictor(self.current, "learned"), learned)
+        self.assertIsNot(self.registry.variant("2026-07-19:legacy_percentages"), learned)
+        self.registry.variant("next")
+        self.assertIsNot(self.registry.variant("2026-07-19"), learned)
+
+    def test_one_request_is_scored_by_every_variant(self) -> None:
+        predictor = DataDerivedLinearPredictor()
+        case = benchmark_case(predictor)
+        variants = ["2026-07-19", "next:legacy_percentages"]
+
+        predictions = self.registry.predict_variants(variants, **case)
+        batches = self.registry.predict_many_variants(variants, [case, case])
+
+        legacy = DataDerivedLinearPredictor(adjustment_strategy="legacy_percentages")
+        self.assertEqual(predictions["2026-07-19"].as_dict(), predictor.predict(**case))
+        self.assertEqual(predictions["next:legacy_percentages"].as_dict(), legacy.predict(**case))
+        self.assertEqual(batches["next:legacy_percentages"], legacy.predict_many([case, case]))
+
+    def test_service_serves_requested_variants(self) -> None:
+        service = prediction_service.PredictionService(poll_seconds=0, registry=self.registry)
+        path = prediction_service.PREDICTION_PATH
+
+        status, headers, payload = asgi_call(service, "POST", path, PUBLIC_PREDICTION_REQUEST, [(b"x-model-variant", b"next")])
+        self.assertEqual((status, headers[b"x-model-version"]), (200, b"next"))
+        self.assertEqual(json.loads(payload), json.loads(asgi_call(service, "POST", path, PUBLIC_PREDICTION_REQUEST)[2]))
+
+        status, _, payload = asgi_call(service, "POST", path, PUBLIC_PREDICTION_REQUEST, [(b"x-model-variant", b"next:median")])
+        self.assertEqual(status, 400)
+        self.assertIn("x-model-variant", json.loads(payload)["fields"])
+
+
+SNAPSHOT_DOCUMENTS = [
+    {
+        "_id": "65f000000000000000000001",
+        "source_judgement_id": "65f000000000000000000101",
+        "exclude": False,
+        "judgement": {"neutral_citation": "[2025] HKCF 1"},
+        "trials": {
+            "trials": [
+                {
+                    "charge_type": {"charge_no": 1, "defendant_id": 1},
+                    "drugs": [{"drug_type": "Cocaine", "quantity": 12.5}],
+                    "aggravating_factors": [{"factor": "On bail", "enhancement_months": 6}],
+                    "mitigating_factors": [],
+                    "guilty_plea": {"pleaded_guilty": True, "reduction_percentage": 33.3},
+                    "starting_point": {"total_months": 60},
+                    "notional_sentence": {"total_months": 66},
+                    "final_sentence": {"total_months": 44},
+                },
+            ],
+        },
+    },
+    {"_id": "65f000000000000000000002", "filename": "DCCC1_2025.htm"},
+]
+
+
+
+class FlattenDocumentsTest(unittest.TestCase):
+    documents = [
+        {
+            "_id": "doc-a",
+            "source_judgement_id": "src-a",
+            "filename": "HCCC1_2025.htm",
+            "exclude": True,
+            "judgement": {"neutral_citation": "[2025] HKCFI 1"},
+            "trials": {"trials": [
+                {
+                    "charge_type": {"charge_no": 2, "defendant_id": 1, "defendant_name": "Chan"},
+                    "drugs": [
+                        {"drug_type": "Cocaine", "quantity": "2"},
+                        {"drug_type": "Cocaine", "quantity": 1.5},
+                        {"drug_type": "Heroin", "quantity": "abc"},
+                        {"drug_type": "", "quantity": 3},
+                    ],
+                    "aggravating_factors": [
+                        {"factor": "Import", "enhancement_months": 6},
+                        {"factor": "Export", "enhancement_months": "3"},
+                        {"factor": "Role of the defendant", "enhancement_months": 12},
+                        {"factor": "On bail", "enhancement_months": 4, "inferred": True},
+                        {"factor": None, "enhancement_months": 2},
+                    ],
+                    "mitigating_factors": [{"factor": "Clear record", "reduction_months": 6}, {"factor": "Remorse"}],
+                    "guilty_plea": {
+                        "pleaded_guilty": True,
+                        "reduction_percentage": 25,
+                        "high_court_stage": "Up to committal",
+                        "source": "judge",
+                    },
+                    "starting_point": {"total_months": 60, "source": "table"},
+                    "sentence_after_role": {"total_months": 60, "source": INFERRED_ROLE_SOURCE},
+                    "notional_sentence": {"sentence_years": 6, "sentence_months": None},
+                    "mitigation_reduction": {"reduction_months": 8},
+                    "final_sentence": {"sentence_months": 48},
+                    "sentencing_role": {"primary_role": "Actual trafficker"},
+                },
+                {},
+            ]},
+        },
+        {"_id": "doc-b", "filename": "DCCC2_2025.htm"},
+        {
+            "_id": "doc-c",
+            "trials": {"trials": [{
+                "starting_point": {"total_months": 0},
+                "aggravating_factors": [{"factor": "On bail", "enhancement_months": 3}],
+                "guilty_plea": {"pleaded_guilty": True, "reduction_years": 1, "inferred": True},
+            }]},
+        },
+    ]
+
+    def test_each_trial_keeps_its_document_and_charge(self) -> None:
+        trials, _ = flatten_documents(self.documents)
+
+        expected = pd.DataFrame({
+            "case_id": ["[2025] HKCFI 1", "[2025] HKCFI 1", "doc-c"],
+            "source_document_excluded": [True, True, False],
+            "trial_index": [0, 1, 0],
+            "charge_no": [2.0, np.nan, np.nan],
+            "role_catalogue_key": ["[2025] hkcfi 1|0|2|1", "[2025] hkcfi 1|1||", "|0||"],
+            "drug_amounts": [{"Cocaine": 3.5, "Heroin": 0.0}, {}, {}],
+            "invalid_drug_quantities": ["Heroin:abc", "", ""],
+            "guilty_plea_inferred": [False, False, True],
+        })
+        self.assertEqual(tuple(trials.columns), TRIAL_TABLE_COLUMNS)
+        pd.testing.assert_frame_equal(trials[expected.columns], expected, check_dtype=False)
+
+    def test_factors_are_canonicalised_and_role_factors_split_out(self) -> None:
+        trials, _ = flatten_documents(self.documents)
+        first = trials.iloc[0]
+
+        self.assertEqual(
+            list(first["canonical_aggravating_factors"]),
+            ["Cross-border trafficking", "Role of the defendant", "On bail"],
+        )
+        self.assertEqual(list(first["role_factors"]), ["Role of the defendant"])
+        self.assertEqual(list(first["other_aggravating_factors"]), ["Cross-border trafficking", "On bail"])
+        self.assertEqual(list(first["canonical_mitigating_factors"]), ["Clear record", "Remorse"])
+        self.assertEqual(list(trials.iloc[2]["other_aggravating_factors"]), ["On bail"])
+
+    def test_stage_months_are_read_from_any_sentence_shape(self) -> None:
+        trials, _ = flatten_documents(self.documents)
+        first = trials.iloc[0]
+
+        self.assertEqual(
+            [first[f"{stage}_months"] for stage in ("starting_point", "sentence_after_role", "notional_sentence", "mitigation_reduction", "pre_plea", "final_sentence")],
+            [60.0, 60.0, 72.0, 8.0, 64.0, 48.0],
+        )
+        self.assertEqual(first["starting_point_source"], "table")
+        self.assertTrue(first["sentence_after_role_inferred"])
+        self.assertTrue(trials.iloc[1][["starting_point_months", "final_sentence_months"]].isna().all())
+        self.assertEqual(trials.iloc[2]["starting_point_months"], 0.0)
+
+    def test_effects_are_fractions_of_their_stage_base(self) -> None:
+        _, effects = flatten_documents(self.documents)
+
+        # Role and inferred factors, unnamed factors, factors without months
+        # and trials without a positive base contribute no effect.
+        expected = pd.DataFrame({
+            "case_id": ["[2025] HKCFI 1"] * 4,
+            "role_catalogue_key": ["[2025] hkcfi 1|0|2|1"] * 4,
+            "stage": ["aggravation", "aggravation", "mitigation", "plea"],
+            "canonical_factor": ["Cross-border trafficking", "Cross-border trafficking", "Clear record", "Guilty plea: Up to committal"],
+            "adjustment_months": [6.0, 3.0, 6.0, 16.0],
+            "base_months": [60.0, 60.0, 72.0, 64.0],
+            "effect_fraction": [0.1, 0.05, 6 / 72, 0.25],
+        })
+        pd.testing.assert_frame_equal(effects, expected, check_dtype=False)
+
+    def test_documents_without_trials_flatten_to_empty_frames(self) -> None:
+        trials, effects = flatten_documents([{"_id": "a"}])
+
+        self.assertTrue(trials.empty)
+        self.assertTrue(effects.empty)
+        self.assertIn("effect_fraction", effects.columns)
+
+
+class HeldOutPredictionTest(unittest.TestCase):
+    supported_effects = {
+        ("aggravation", "Cross-border trafficking"): 0.25,
+        ("aggravation", "On bail"): 0.1,
+        ("aggravation", "Refugee claimant"): -0.6,
+        ("mitigation", "Self-consumption"): 0.2,
+        ("mitigation", "Remorse"): 1.5,
+        ("plea", "Guilty plea: Up to committal"): 1 / 3,
+        ("plea", "Guilty plea: Unknown"): 0.2,
+    }
+    role_effects = {
+        "primary_effects": {COURIER_STOREKEEPER_ROLE: 0.0, "Actual trafficker": 0.15, "Manager / Organiser": -1.4},
+        "circumstance_effects": {"Divan keeping": 0.3},
+        "severe_cross_border_effect": 0.2,
+    }
+
+    def held_out_trials(self) -> pd.DataFrame:
+        def trial(starting_point: float, **fields) -> dict:
+            return {
+                "predicted_starting_point_months": starting_point,
+                "role_selection_source": "none",
+                "selected_primary_role": None,
+                "selected_circumstances": [],
+                "other_aggravating_factors": [],
+                "canonical_mitigating_factors": [],
+                "guilty_plea": {"pleaded_guilty": False},
+                **fields,
+            }
+
+        return pd.DataFrame([
+            trial(
+                100.0,
+                other_aggravating_factors=["On bail", "Unseen", "On bail"],
+                canonical_mitigating_factors=["Self-consumption"],
+                guilty_plea={"pleaded_guilty": True, "high_court_stage": "Up to committal"},
+            ),
+            trial(
+                100.0,
+                role_selection_source="workbook",
+                selected_primary_role="Actual trafficker",
+                selected_circumstances=["Cross-border trafficking", "Divan keeping"],
+            ),
+            trial(
+                80.0,
+                role_selection_source="verified",
+                selected_primary_role=COURIER_STOREKEEPER_ROLE,
+                selected_circumstances=["Cross-border trafficking"],
+                other_aggravating_factors=["On bail"],
+                guilty_plea={"pleaded_guilty": True},
+            ),
+            trial(np.nan, guilty_plea={}),
+            trial(
+                50.0,
+                role_selection_source="workbook",
+                selected_primary_role="Manager / Organiser",
+                other_aggravating_factors=["Refugee claimant"],
+                canonical_mitigating_factors=["Remorse"],
+            ),
+        ], index=pd.RangeIndex(10, 15))
+
+    def test_stages_apply_role_and_factor_effects_in_turn(self) -> None:
+        predicted = predict_held_out(self.held_out_trials(), self.supported_effects, self.role_effects)
+
+        # A severe role adds its cross-border effect and circumstances to the
+        # starting point; a courier's cross-border trafficking is aggravation.
+        expected = pd.DataFrame({
+            "predicted_role_enhancement_months": [0.0, 65.0, 0.0, np.nan, -70.0],
+            "predicted_aggravation_months": [10.0, 0.0, 28.0, np.nan, -30.0],
+            "predicted_notional_sentence_months": [110.0, 165.0, 108.0, np.nan, -50.0],
+            "predicted_mitigation_reduction_months": [22.0, 0.0, 0.0, np.nan, -50.0],
+            "predicted_pre_plea_months": [88.0, 165.0, 108.0, np.nan, 0.0],
+            "predicted_plea_reduction_months": [88 / 3, 0.0, 21.6, np.nan, 0.0],
+            "predicted_final_sentence_months": [88 * 2 / 3, 165.0, 86.4, np.nan, 0.0],
+            "courier_cross_border_uses_aggravation": [False, False, True, False, False],
+        }, index=pd.RangeIndex(10, 15))
+        pd.testing.assert_frame_equal(predicted[expected.columns], expected, check_dtype=False)
+        self.assertEqual(list(predicted.loc[12, "prediction_aggravating_factors"]), ["On bail", "Cross-border trafficking"])
+        self.assertEqual(
+            predicted["role_factor_status"].tolist(),
+            [
+                "no sentencing role profile",
+                "primary role supported | severe-role cross-border supported | Divan keeping supported",
+                "primary role supported | cross-border uses Import/Export effect",
+                "starting point unavailable",
+                "primary role supported",
+            ],
+        )
+        self.assertEqual(
+            predicted["aggravation_factor_status"].tolist(),
+            ["unsupported factors: Unseen", "no factors", "supported", "no factors", "supported"],
+        )
+
+    def test_legacy_percentages_score_only_their_own_factors(self) -> None:
+        predicted = predict_held_out(self.held_out_trials(), self.supported_effects, self.role_effects)
+
+        legacy = legacy_percentage_predictions(predicted)
+
+        self.assertEqual(
+            legacy["legacy_percentage_factor_status"].tolist(),
+            [
+                "unsupported factors: aggravation: Unseen",
+                "supported",
+                "unsupported factors: plea: Guilty plea: Unknown",
+                "starting point unavailable",
+                "unsupported factors: mitigation: Remorse",
+            ],
+        )
+        self.assertEqual(legacy["legacy_percentage_compatible"].tolist(), [False, True, False, False, False])
+        np.testing.assert_allclose(
+            legacy["legacy_percentage_final_sentence_months"],
+            [62.466, 100.0, 83.288, np.nan, 52.975],
+        )
+
+    def test_candidate_models_are_evaluated_together(self) -> None:
+        test = self.held_out_trials()
+        test["uses_role_profile"] = False
+        stage_factors = {
+            "aggravation": test["other_aggravating_factors"].tolist(),
+            "mitigation": test["canonical_mitigating_factors"].tolist(),
+            "plea": [plea_factor(plea) for plea in test["guilty_plea"]],
+        }
+        indicators, columns = encode_stage_factors(stage_factors)
+        candidates = [self.supported_effects, {}, {key: value / 2 for key, value in self.supported_effects.items()}]
+        starting = test["predicted_starting_point_months"].to_numpy(dtype=float)
+
+        together = predict_stages(starting, np.zeros(len(test)), indicators, effect_matrix(columns, candidates))
+
+        self.assertEqual(together["final_sentence_months"].shape, (3, len(test)))
+        for candidate, effects in enumerate(candidates):
+            alone = predict_stages(starting, np.zeros(len(test)), indicators, effect_matrix(columns, [effects]))
+            for name, values in alone.items():
+                np.testing.assert_array_equal(together[name][candidate], values[0])
+        np.testing.assert_array_equal(together["final_sentence_months"][1], starting)
+
+
+class WeightedStartingPointTest(unittest.TestCase):
+    curves = {
+        "Cocaine": pd.DataFrame({"quantity_grams": [1.0, 10.0, 100.0], "interpolated_months": [20.0, 60.0, 150.0]}),
+        "Heroin": pd.DataFrame({"quantity_grams": [5.0, 50.0], "interpolated_months": [30.0, 90.0]}),
+    }
+
+    def test_curves_are_read_at_the_trials_total_quantity(self) -> None:
+        drug_amounts = [
+            {"Cocaine": 10.0},
+            # Heroin at 10g is 30 + 5/45 * 60 months.
+            {"Cocaine": 4.0, "Heroin": 6.0},
+            {"Cocaine": 0.5},
+            {"Cocaine": 500.0},
+            {"Cocaine": np.nan, "Heroin": 50.0},
+            {"Cocaine": 0.0, "Heroin": -1.0},
+            {},
+            {"Ketamine": 2.0, "Amphetamine": 1.0, "Cocaine": 3.0},
+        ]
+
+        predicted = weighted_starting_points(
+            drug_quantity_triples(drug_amounts),
+            compile_curves(self.curves),
+            len(drug_amounts),
+        )
+
+        np.testing.assert_allclose(
+            predicted["predicted_starting_point_months"],
+            [60.0, (60.0 * 4 + (30.0 + 60.0 / 9) * 6) / 10, 20.0, 150.0, 90.0, np.nan, np.nan, np.nan],
+        )
+        self.assertEqual(
+            predicted["starting_prediction_status"].tolist(),
+            ["supported"] * 5 + ["no positive drug quantity"] * 2 + ["unsupported drug curve"],
+        )
+        self.assertEqual(predicted["unsupported_drugs"].tolist(), [""] * 7 + ["Amphetamine | Ketamine"])
+
+    def test_own_quantity_method_reads_each_curve_at_its_drug_quantity(self) -> None:
+        drug_amounts = [{"Cocaine": 10.0, "Heroin": 50.0}]
+        compiled = compile_curves(self.curves)
+
+        total = weighted_starting_points(drug_quantity_triples(drug_amounts), compiled, 1)
+        own = weighted_starting_points(drug_quantity_triples(drug_amounts), compiled, 1, "own quantity")
+
+        self.assertAlmostEqual(total["predicted_starting_point_months"].iloc[0], (110.0 * 10 + 90.0 * 50) / 60)
+        self.assertAlmostEqual(own["predicted_starting_point_months"].iloc[0], (60.0 * 10 + 90.0 * 50) / 60)
+        with self.assertRaises(ValueError):
+            weighted_starting_points(drug_quantity_triples(drug_amounts), compiled, 1, "maximum")
+
+
+def synthetic_modelling_tables(seed: int, count: int) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Flattened trials with the role catalogue attached, as run_analysis partitions them."""
+    rng = np.random.default_rng(seed)
+    documents = []
+    for index in range(count):
+        trials = []
+        for trial_index in range(int(rng.integers(1, 3))):
+            drug = ["Cocaine", "Heroin", "Ketamine"][int(rng.integers(3))]
+            quantity = float(rng.uniform(1, 500))
+            starting = 20 + 0.3 * quantity
+            trials.append({
+                "charge_type": {"charge_no": trial_index + 1, "defendant_id": 1},
+                "drugs": [{"drug_type": drug, "quantity": quantity}],
+                "aggravating_factors": [
+                    {"factor": factor, "enhancement_months": round(starting * rng.uniform(0.02, 0.1), 1)}
+                    for factor in ("On bail", "Import")
+                    if rng.random() < 0.3
+                ],
+                "mitigating_factors": [
+                    {"factor": "Self-consumption", "reduction_months": round(starting * rng.uniform(0.05, 0.15), 1)}
+                ] if rng.random() < 0.3 else [],
+                "guilty_plea": {"pleaded_guilty": True, "high_court_stage": "Up to committal", "reduction_percentage": 33.3},
+                "sentencing_role": {"primary_role": "Actual trafficker"} if rng.random() < 0.2 else None,
+                "starting_point": {"total_months": round(starting, 1)},
+                "final_sentence": {"total_months": round(starting * rng.uniform(0.6, 1.0), 1)},
+            })
+        documents.append({
+            "_id": f"doc-{index}",
+            "judgement": {"neutral_citation": f"[2025] HKCFI {index}"},
+            "trials": {"trials": trials},
+        })
+    trials, effects = flatten_documents(documents)
+    catalogue = pd.DataFrame(columns=[
+        "role_catalogue_key",
+        "role_catalogue_fallback_key",
+        "workbook_excluded",
+        "workbook_primary_role",
+        "workbook_circumstances",
+        "workbook_starting_point_months",
+        "workbook_difference_months",
+        "workbook_effect_fraction",
+    ])
+    with patch("linear_interpolation_model.load_role_catalogue", return_value=(catalogue, {})):
+        trials, _, _ = attach_role_catalogue(trials, Path("."))
+    return trials, effects
+
+
+class StageModelResamplingTest(unittest.TestCase):
+    def test_grouped_folds_hold_out_every_case_once(self) -> None:
+        case_ids = np.array(["a", "b", "b", "c", "d", "e", "f", "g"], dtype=object)
+
+        splits = stage_model_resampling.grouped_k_fold_splits(case_ids, folds=3, seed=1)
+
+        held_out = np.concatenate([test_cases for _, _, _, test_cases in splits])
+        self.assertEqual(sorted(held_out), ["a", "b", "c", "d", "e", "f", "g"])
+        for _, _, train_cases, test_cases in splits:
+            self.assertFalse(set(train_cases) & set(test_cases))
+
+    def test_bootstrap_tests_on_cases_left_out_of_the_draw(self) -> None:
+        case_ids = np.array([f"case-{index}" for index in range(40)], dtype=object)
+
+        splits = stage_model_resampling.case_bootstrap_splits(case_ids, replicates=5, seed=1)
+
+        for _, _, train_cases, test_cases in splits:
+            self.assertEqual(len(train_cases), 40)
+            self.assertLess(len(set(train_cases)), 40)
+            self.assertEqual(set(train_cases) | set(test_cases), set(case_ids))
+            self.assertFalse(set(train_cases) & set(test_cases))
+
+    def test_process_pool_matches_a_serial_run(self) -> None:
+        trials, effects = synthetic_modelling_tables(seed=37, count=80)
+
+        serial, serial_summary = stage_model_resampling.resample_stage_model(
+            trials, effects, folds=3, bootstrap_replicates=4, workers=1
+        )
+        pooled, _ = stage_model_resampling.resample_stage_model(
+            trials, effects, folds=3, bootstrap_replicates=4, workers=2
+        )
+
+        self.assertEqual(len(serial), 7 * 5)
+        self.assertTrue(serial.loc[serial["stage"] == "Starting point", "mae_months"].notna().all())
+        pd.testing.assert_frame_equal(pooled, serial)
+        intervals = serial_summary.loc[
+            (serial_summary["metric"] == "mae_months")
+            & serial_summary["stage"].isin(["Starting point", "Final sentence"])
+        ]
+        self.assertTrue((intervals["ci_lower"] <= intervals["mean"]).all())
+        self.assertTrue((intervals["mean"] <= intervals["ci_upper"]).all())
+        self.assertEqual(sorted(intervals["replicates"]), [3, 3, 4, 4])
+
+
+class StageModelSweepTest(unittest.TestCase):
+    def setUp(self) -> None:
+        trials, effects = synthetic_modelling_tables(seed=38, count=120)
+        with tempfile.TemporaryDirectory() as notebook_dir:
+            self.trials, _ = assign_partition(trials, Path(notebook_dir))
+        self.effects = partition_effects(self.trials, effects)
+
+    def test_default_point_matches_a_direct_fit(self) -> None:
+        general_trials, general_effects, _ = general_stage_data(self.trials, self.effects)
+        curves, _, _, _ = fit_curves(
+            general_trials.loc[general_trials["partition"] == "train"],
+            sorted({drug for amounts in general_trials["drug_amounts"] for drug in amounts}),
+        )
+        predictions = predict_trials(
+            general_trials.loc[general_trials["partition"] == "test"],
+            compile_curves(curves),
+            supported_factor_effects(learn_factor_effects(general_effects.loc[general_effects["partition"] == "train"])),
+            build_role_effects(self.trials.loc[self.trials["partition"] == "train"])[0],
+        )
+        expected = build_metrics(predictions).set_index("stage")
+
+        results = stage_model_sweep.sweep_stage_model(
+            self.trials, self.effects, stage_model_sweep.parameter_grid(), workers=1
+        )
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results["final_sentence_mae_months"].iloc[0], expected.loc["Final sentence", "mae_months"])
+        self.assertEqual(results["starting_point_mae_months"].iloc[0], expected.loc["Starting point", "mae_months"])
+
+    def test_grid_refits_only_the_stages_a_setting_changes(self) -> None:
+        points = stage_model_sweep.parameter_grid(
+            quantiles=[(0.0, 0.5, 1.0), (0.0, 0.25, 0.5, 0.75, 1.0)],
+            min_factor_support=[1, 3, 50],
+            mixed_drug_method=["total quantity", "own quantity"],
+        )
+
+        serial = stage_model_sweep.sweep_stage_model(self.trials, self.effects, points, workers=1)
+
+        self.assertEqual(len(serial), 12)
+        self.assertEqual(stage_model_sweep.fitted_curves.cache_info().misses, 2)
+        self.assertEqual(stage_model_sweep.fitted_factor_effects.cache_info().misses, 3)
+        self.assertEqual(stage_model_sweep.starting_point_predictions.cache_info().misses, 4)
+        self.assertEqual(serial.loc[serial["min_factor_support"] == 50, "supported_factors"].max(), 0)
+        pooled = stage_model_sweep.sweep_stage_model(self.trials, self.effects, points, workers=2)
+        pd.testing.assert_frame_equal(pooled, serial)
+
+    def test_unknown_settings_are_rejected(self) -> None:
+        with self.assertRaisesRegex(ValueError, "min_support"):
+            stage_model_sweep.parameter_grid(min_support=[1])
+
+
+class AnalysisPipelineTest(unittest.TestCase):
+    def setUp(self) -> None:
+        trials, effects = synthetic_modelling_tables(seed=41, count=60)
+        self.sources = {"catalogued_trials": trials, "loaded_effects": effects}
+        # The role catalogue stage reads the workbook; start from its output.
+        self.stages = ANALYSIS_STAGES[1:]
+
+    def run_stages(self, notebook_dir: Path, *, cache: bool = True) -> tuple[dict, pd.DataFrame]:
+        values, log = analysis_pipeline.run_stages(
+            self.stages,
+            {**self.sources, "notebook_dir": notebook_dir},
+            ["curves", "test"],
+            notebook_dir=notebook_dir,
+            cache_dir=analysis_pipeline.stage_cache_dir(notebook_dir) if cache else None,
+        )
+        return values, dict(zip(log["stage"], log["status"]))
+
+    def test_second_run_loads_every_stage_from_the_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            first, first_status = self.run_stages(Path(directory))
+            second, second_status = self.run_stages(Path(directory))
+            uncached, _ = self.run_stages(Path(directory), cache=False)
+
+        self.assertEqual(set(first_status.values()), {"run"})
+        self.assertEqual(second_status["curves"], "cached")
+        self.assertEqual(second_status["held-out predictions"], "cached")
+        self.assertEqual(second_status["split"], "not needed")
+        pd.testing.assert_frame_equal(second["test"], first["test"])
+        pd.testing.assert_frame_equal(uncached["test"], first["test"])
+        self.assertEqual(list(second["curves"]), list(first["curves"]))
+
+    def test_code_change_reruns_only_the_stages_downstream_of_it(self) -> None:
+        fingerprint = analysis_pipeline.code_fingerprint
+
+        def changed_fingerprint(function):
+            return fingerprint(function) + ("-edited" if function is learn_training_factor_effects else "")
+
+        with tempfile.TemporaryDirectory() as directory:
+            self.run_stages(Path(directory))
+            with patch("analysis_pipeline.code_fingerprint", side_effect=changed_fingerprint):
+                _, status = self.run_stages(Path(directory))
+
+        self.assertEqual(status, {
+            "workbook exclusions": "not needed",
+            "split": "not needed",
+            "general stages": "cached",
+            "curves": "cached",
+            "factor effects": "run",
+            "role effects": "cached",
+            "held-out predictions": "run",
+        })
+
+    def test_stage_cache_keeps_the_most_recently_used_keys(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            stage_dir = Path(directory)
+            for minute, key in enumerate("abcd"):
+                analysis_pipeline.save_stage(stage_dir / f"{key}.pkl", {"key": key})
+                os.utime(stage_dir / f"{key}.pkl", ns=(minute * 60 * 10**9,) * 2)
+            self.assertEqual(analysis_pipeline.load_stage(stage_dir / "a.pkl"), {"key": "a"})
+            analysis_pipeline.save_stage(stage_dir / "e.pkl", {"key": "e"})
+            kept = sorted(path.stem for path in stage_dir.glob("*.pkl"))
+
+        self.assertEqual(analysis_pipeline.STAGE_CACHE_KEYS, 4)
+        self.assertEqual(kept, ["a", "c", "d", "e"])
+
+    def test_keys_follow_source_content_not_identity(self) -> None:
+        notebook_dir = Path(".")
+        keys = analysis_pipeline.stage_keys(self.stages, {**self.sources, "notebook_dir": notebook_dir}, notebook_dir)
+        copied = {name: frame.copy() for name, frame in self.sources.items()}
+        edited_effects = copied["loaded_effects"].copy()
+        edited_effects.loc[edited_effects.index[0], "adjustment_months"] += 1
+
+        copied_keys = analysis_pipeline.stage_keys(self.stages, {**copied, "notebook_dir": notebook_dir}, notebook_dir)
+        edited_keys = analysis_pipeline.stage_keys(
+            self.stages,
+            {**copied, "loaded_effects": edited_effects, "notebook_dir": notebook_dir},
+            notebook_dir,
+        )
+
+        self.assertEqual(copied_keys, keys)
+        self.assertTrue(all(edited_keys[name] != keys[name] for name in keys))
+        self.assertEqual(
+            analysis_pipeline.content_digest({"b": {2, 1}, "a": [1]}),
+            analysis_pipeline.content_digest({"a": [1], "b": {1, 2}}),
+        )
+
+
+class CodeFingerprintTest(unittest.TestCase):
+    helper_source = "OFFSET = 1\n\n\ndef scale(value):\n    return value * 2\n"
+    stage_source = (
+        "import json\n\nimport pipeline_helper\nfrom pipeline_helper import scale\n\n\n"
+        "def imported_function(value):\n    return scale(value)\n\n\n"
+        "def module_attribute(value):\n    return value + pipeline_helper.OFFSET\n\n\n"
+        "def same_module(value):\n    return doubled(value)\n\n\n"
+        "def doubled(value):\n    return value * 2\n\n\n"
+        "def library_only(value):\n    return json.dumps(value)\n"
+    )
+
+    def fingerprints(self, root: Path, version: str, helper_source: str, stage_source: str) -> dict[str, str]:
+        # Each version gets its own directory so no source or bytecode cache
+        # outlives an edit.
+        directory = root / version
+        directory.mkdir()
+        (directory / "pipeline_helper.py").write_text(helper_source)
+        (directory / "pipeline_stages.py").write_text(stage_source)
+        with (
+            patch.object(sys, "path", [str(directory), *sys.path]),
+            patch.dict(sys.modules),
+            patch.object(analysis_pipeline, "LOCAL_CODE_DIRS", (root.resolve(),)),
+        ):
+            sys.modules.pop("pipeline_helper", None)
+            sys.modules.pop("pipeline_stages", None)
+            stages = importlib.import_module("pipeline_stages")
+            return {
+                name: analysis_pipeline.code_fingerprint(getattr(stages, name))
+                for name in ("imported_function", "module_attribute", "same_module", "library_only")
+            }
+
+    def test_edits_to_imported_and_same_module_code_change_the_fingerprint(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            root = Path(directory)
+            original = self.fingerprints(root, "original", self.helper_source, self.stage_source)
+            helper_edited = self.fingerprints(
+                root, "helper", self.helper_source.replace("value * 2", "value * 3"), self.stage_source
+            )
+            stage_edited = self.fingerprints(
+                root,
+                "stage",
+                self.helper_source,
+                self.stage_source.replace("return value * 2", "return value + value"),
+            )
+
+        changed_by_helper = {name for name in original if helper_edited[name] != original[name]}
+        changed_by_stage = {name for name in original if stage_edited[name] != original[name]}
+        self.assertEqual(changed_by_helper, {"imported_function", "module_attribute"})
+        self.assertEqual(changed_by_stage, {"same_module"})
+
+
+class AnalysisReportTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.sheets = {
+            "held-out predictions": pd.DataFrame({
+                "case_id": pd.Series(["a\x01b", "c"], dtype="str"),
+                "drug_amounts": [{"Cocaine": 12.5}, None],
+                "factors": [["On bail\x0b"], "plain\x02text"],
+                "final_sentence_months": [48.0, np.nan],
+                "covered": pd.array([1, pd.NA], dtype="Int64"),
+            }),
+            "summary": pd.DataFrame([{"random_seed": 1}]),
+        }
+
+    def test_excel_safe_frame_strips_text_and_encodes_containers(self) -> None:
+        frame = self.sheets["held-out predictions"]
+        safe = analysis_report.excel_safe_frame(frame)
+
+        self.assertEqual(safe["case_id"].tolist(), ["ab", "c"])
+        self.assertEqual(safe["drug_amounts"].tolist(), ['{"Cocaine": 12.5}', None])
+        self.assertEqual(safe["factors"].tolist(), ['["On bail\\u000b"]', "plaintext"])
+        pd.testing.assert_series_equal(safe["final_sentence_months"], frame["final_sentence_months"])
+        self.assertEqual(frame["case_id"].tolist(), ["a\x01b", "c"])
+
+    def test_workbook_and_tables_read_back(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "analysis.xlsx"
+            formats = ("xlsx", "csv", "parquet") if importlib.util.find_spec("pyarrow") else ("xlsx", "csv")
+            written = analysis_report.write_report(path, self.sheets, formats)
+            workbook = pd.read_excel(path, sheet_name=None)
+            table = pd.read_csv(Path(directory) / "analysis" / "held_out_predictions.csv")
+
+        self.assertEqual(len(written), 1 + 2 * (len(formats) - 1))
+        self.assertEqual(list(workbook), ["held-out predictions", "summary"])
+        predictions = workbook["held-out predictions"]
+        self.assertEqual(predictions["case_id"].tolist(), ["ab", "c"])
+        self.assertEqual(predictions["final_sentence_months"].iloc[0], 48.0)
+        self.assertTrue(pd.isna(predictions["covered"].iloc[1]))
+        self.assertEqual(table["drug_amounts"].iloc[0], '{"Cocaine": 12.5}')
+        self.assertEqual(table["case_id"].iloc[0], "a\x01b")
+
+    def test_unknown_formats_are_rejected(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            with self.assertRaisesRegex(ValueError, "json"):
+                analysis_report.write_report(Path(directory) / "analysis.xlsx", self.sheets, ("json",))
+
+
+class VerifiedSnapshotTest(unittest.TestCase):
+    def write_json_cache(self, notebook_dir: Path) -> None:
+        cache_dir = notebook_dir / ".cache"
+        cache_dir.mkdir()
+        (cache_dir / "stage_model_analysis_verified_features.json").write_text(
+            json.dumps(SNAPSHOT_DOCUMENTS)
+        )
+        (cache_dir / "stage_model_analysis_verified_features.metadata.json").write_text(
+            json.dumps({"created_at": "2026-01-01T00:00:00+00:00"})
+        )
+
+    def test_document_frame_round_trips_the_json_cache_shape(self) -> None:
+        self.assertEqual(frame_to_documents(documents_to_frame(SNAPSHOT_DOCUMENTS)), SNAPSHOT_DOCUMENTS)
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_snapshot_tables_match_a_fresh_flatten(self) -> None:
+        expected_trials, expected_effects = flatten_documents(SNAPSHOT_DOCUMENTS)
+        with tempfile.TemporaryDirectory() as directory:
+            notebook_dir = Path(directory)
+            self.write_json_cache(notebook_dir)
+            load_trial_tables(notebook_dir, refresh_cache=False, trial_columns=TRIAL_TABLE_COLUMNS)
+            (notebook_dir / ".cache" / "stage_model_analysis_verified_features.json").unlink()
+
+            documents, _ = load_documents(notebook_dir, refresh_cache=False)
+            trials, effects, metadata = load_trial_tables(
+                notebook_dir, refresh_cache=False, trial_columns=TRIAL_TABLE_COLUMNS
+            )
+            modelling_trials, _, _ = load_trial_tables(
+                notebook_dir, refresh_cache=False, trial_columns=MODELLING_TRIAL_COLUMNS
+            )
+
+        self.assertEqual(documents, SNAPSHOT_DOCUMENTS)
+        self.assertEqual(metadata["document_count"], 2)
+        self.assertEqual(trials["drug_amounts"].tolist(), [{"Cocaine": 12.5}])
+        self.assertEqual(trials["canonical_aggravating_factors"].tolist(), [["On bail"]])
+        pd.testing.assert_frame_equal(trials, expected_trials, check_dtype=False)
+        pd.testing.assert_frame_equal(effects, expected_effects, check_dtype=False)
+        self.assertEqual(list(modelling_trials), list(MODELLING_TRIAL_COLUMNS))
+        pd.testing.assert_frame_equal(
+            modelling_trials, expected_trials[list(MODELLING_TRIAL_COLUMNS)], check_dtype=False
+        )
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_nested_columns_are_stored_as_arrow_types(self) -> None:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        trials, _ = flatten_documents(SNAPSHOT_DOCUMENTS)
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "trials.parquet"
+            verified_snapshot.write_parquet(trials, path)
+            schema = pq.read_schema(path)
+
+        self.assertEqual(json.loads(schema.metadata[verified_snapshot.JSON_COLUMNS_METADATA_KEY]), [])
+        self.assertTrue(pa.types.is_map(schema.field("drug_amounts").type))
+        self.assertTrue(pa.types.is_list(schema.field("drugs").type))
+        self.assertTrue(pa.types.is_struct(schema.field("drugs").type.value_type))
+        self.assertTrue(pa.types.is_list(schema.field("canonical_aggravating_factors").type))
+
+    @unittest.skipUnless(importlib.util.find_spec("pyarrow"), "pyarrow is not installed")
+    def test_mixed_nested_values_fall_back_to_json_text(self) -> None:
+        frame = pd.DataFrame({
+            "case_id": ["a", "b"],
+            "drugs": [[{"quantity": 1.5}], [{"quantity": "abc"}]],
+            "factors": [["On bail"], []],
+        })
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "table.parquet"
+            verified_snapshot.write_parquet(frame, path)
+            subset = verified_snapshot.read_parquet(path, ["drugs", "case_id"])
+            full = verified_snapshot.read_parquet(path)
+
+        self.assertEqual(list(subset), ["drugs", "case_id"])
+        self.assertEqual(subset["drugs"].tolist(), frame["drugs"].tolist())
+        pd.testing.assert_frame_equal(full, frame, check_dtype=False)
+
+    def test_json_cache_is_used_without_a_snapshot(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            notebook_dir = Path(directory)
+            self.write_json_cache(notebook_dir)
+            with patch("verified_snapshot.arrow_available", return_value=False):
+                documents, metadata = load_documents(notebook_dir, refresh_cache=False)
+                trials, _, _ = load_trial_tables(
+                    notebook_dir, refresh_cache=False, trial_columns=MODELLING_TRIAL_COLUMNS
+                )
+            snapshot_written = (notebook_dir / ".cache" / "verified_features_snapshot").exists()
+
+        self.assertEqual(documents, SNAPSHOT_DOCUMENTS)
+        self.assertEqual(metadata["created_at"], "2026-01-01T00:00:00+00:00")
+        self.assertEqual(len(trials), 1)
+        self.assertFalse(snapshot_written)
+
+
+class LegacyModelTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.predictor = DkPredictor()
+
+    def test_bucket_tables_keep_the_legacy_curves(self) -> None:
+        self.assertEqual(self.predictor.predict_cocaine(10), 60)
+        self.assertEqual(self.predictor.predict_meth(5), 60)
+        self.assertEqual(self.predictor.predict_cocaine(200000), 420)
+        self.assertEqual(self.predictor.predict_ketamine(3000), self.predictor.predict_cocaine(3000) * 0.806)
+        self.assertEqual(self.predictor.predict_cannabisresin(499), 6)
+        self.assertEqual(self.predictor.predict_herbalcannabis(6000), 14.5)
+
+    def test_explain_many_matches_explain(self) -> None:
+        matrix = random_legacy_inputs(seed=46, count=3000)
+        batch = self.predictor.explain_many(matrix)
+        parity_cases.assert_columns_match_records(
+            self,
+            batch,
+            [self.predictor.explain(list(row)) for row in matrix],
+            ["starting_point", "sentence_after_trial", "final_sentence"],
+        )
+        with self.assertRaisesRegex(ValueError, "17"):
+            self.predictor.explain_many(matrix[:, :16])
+
+    def test_snapshot_evaluation_scores_every_verified_trial(self) -> None:
+        documents = [
+            *SNAPSHOT_DOCUMENTS,
+            {**SNAPSHOT_DOCUMENTS[0], "_id": "65f000000000000000000003", "exclude": True},
+        ]
+        with tempfile.TemporaryDirectory() as temporary_dir:
+            cache_dir = Path(temporary_dir) / ".cache"
+            cache_dir.mkdir()
+            (cache_dir / "stage_model_analysis_verified_features.json").write_text(json.dumps(documents))
+            results = evaluate_verified_sentences.evaluate_snapshot(Path(temporary_dir), models=["legacy"])
+
+        trial = SNAPSHOT_DOCUMENTS[0]["trials"]["trials"][0]
+        expected = self.predictor.explain(evaluate_verified_sentences.build_model_input(trial))["final_sentence"]
+        self.assertEqual(results["neutral_citation"].tolist(), ["[2025] HKCF 1"])
+        self.assertEqual(results["legacy_predicted_months"].tolist(), [expected])
+        self.assertEqual(results["legacy_difference_months"].tolist(), [expected - 44])
+
+
+class OfflineEvaluationTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temporary_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temporary_dir.cleanup)
+        self.results_dir = Path(temporary_dir.name)
+        trial = SNAPSHOT_DOCUMENTS[0]["trials"]["trials"][0]
+        self.documents = [
+            {**SNAPSHOT_DOCUMENTS[0], "trials": {"trials": [trial, {**trial, "drugs": [{"drug_type": "Heroin", "quantity": 3}]}]}},
+        ]
+        self.scored: list[int] = []
+
+    def counting_scorer(self, version: str = "1") -> evaluate_verified_sentences.TrialScorer:
+        def score(trials: list[dict]) -> np.ndarray:
+            self.scored.append(len(trials))
+            return np.array([float(trial["drugs"][0]["quantity"]) for trial in trials])
+
+        return evaluate_verified_sentences.TrialScorer("quantity", version, score)
+
+    def test_only_changed_trials_are_rescored(self) -> None:
+        evaluate = evaluate_verified_sentences.evaluate_models
+        first = evaluate(self.documents, [self.counting_scorer()], self.results_dir)
+        second = evaluate(self.documents, [self.counting_scorer()], self.results_dir)
+        self.documents[0]["trials"]["trials"][1]["drugs"][0]["quantity"] = 4
+        changed = evaluate(self.documents, [self.counting_scorer()], self.results_dir)
+        evaluate(self.documents, [self.counting_scorer("2")], self.results_dir)
+
+        self.assertEqual(self.scored, [2, 1, 2])
+        self.assertEqual([frame.attrs["scored_trials"]["quantity"] for frame in (first, second, changed)], [2, 0, 1])
+        pd.testing.assert_frame_equal(second, first)
+        self.assertEqual(changed["quantity_predicted_months"].tolist(), [12.5, 4.0])
+        self.assertEqual(changed["quantity_difference_months"].tolist(), [12.5 - 44, 4.0 - 44])
+
+    def test_mapping_changes_invalidate_cached_scores(self) -> None:
+        legacy = evaluate_verified_sentences.legacy_scorer().version
+        deployment = evaluate_verified_sentences.model_scorer("data-derived").version
+        self.assertEqual(evaluate_verified_sentences.legacy_scorer().version, legacy)
+
+        with patch.dict(evaluate_verified_sentences.ASSISTANCE_FACTOR_TO_INPUT, {"Assistance - useful": 3}):
+            self.assertNotEqual(evaluate_verified_sentences.legacy_scorer().version, legacy)
+        with patch.object(evaluate_verified_sentences, "deployment_case", evaluate_verified_sentences.factor_names):
+            self.assertNotEqual(evaluate_verified_sentences.model_scorer("data-derived").version, deployment)
+        with patch.object(evaluate_verified_sentences, "normalize_primary_role", evaluate_verified_sentences.normalize_circumstances):
+            self.assertNotEqual(evaluate_verified_sentences.model_scorer("data-derived").version, deployment)
+
+    def test_models_are_scored_side_by_side(self) -> None:
+        scorers = [evaluate_verified_sentences.model_scorer(spec) for spec in ("legacy", "data-derived", "data-derived:legacy_percentages")]
+        results = evaluate_verified_sentences.evaluate_models(self.documents, scorers)
+
+        trials = self.documents[0]["trials"]["trials"]
+        cases = [evaluate_verified_sentences.deployment_case(trial) for trial in trials]
+        self.assertEqual(cases[0]["drug_amounts"], {"Cocaine": 12.5})
+        self.assertEqual(cases[0]["aggravating_factors"], ["On bail"])
+        for spec, strategy in (("data-derived", "learned"), ("data-derived:legacy_percentages", "legacy_percentages")):
+            predictor = DataDerivedLinearPredictor(adjustment_strategy=strategy)
+            self.assertEqual(
+                results[f"{spec}_predicted_months"].tolist(),
+                [predictor.predict(**case)["final_sentence_months"] for case in cases],
+            )
+        self.assertEqual(
+            results["legacy_predicted_months"].tolist(),
+            [DkPredictor().explain(evaluate_verified_sentences.build_model_input(trial))["final_sentence"] for trial in trials],
+        )
+        summary = evaluate_verified_sentences.model_summary(results)
+        self.assertEqual(summary["model"].tolist(), ["legacy", "data-derived", "data-derived:legacy_percentages"])
+        self.assertEqual(summary["predicted_trials"].tolist(), [2, 2, 2])
+
+
+def similar_case_record(citation: str, drugs: dict[str, float], starting_point: float, **fields) -> dict:
+    return {
+        "neutralCitation": citation,
+        "title": f"HKSAR v {citation}",
+        "url": "",
+        "language": "english",
+        "drugs": drugs,
+        "role": None,
+        "crossBorder": False,
+        "aggravating": [],
+        "mitigating": [],
+        "assistance": 0,
+        "plea": "none",
+        "actualFinalMonths": 60.0,
+        "startingPointMonths": starting_point,
+        **fields,
+    }
+
+
+def similar_case_request(drugs: dict[str, float], **fields) -> dict:
+    return {
+        "drugs": [{"type": drug_type, "quantity": quantity} for drug_type, quantity in drugs.items()],
+        "defendantRole": None,
+        "additionalCircumstances": [],
+        "guiltyPlea": "Plead not guilty",
+        "aggravatingFactors": [],
+        "mitigatingFactors": [],
+        **fields,
+    }
+
+
+class SimilarCaseIndexTest(unittest.TestCase):
+    """Rankings worked out by hand from the rules of similarCases.ts."""
+
+    def setUp(self) -> None:
+        self.request = similar_case_request({"Cocaine": 100.0})
+        self.starting_point = similar_case_index.predict_notional_weighted_months(self.request["drugs"])
+        point = self.starting_point
+        self.corpus = [
+            similar_case_record("[2024] HKCFI 1", {"Cocaine": 110.0}, point, crossBorder=True),
+            similar_case_record("[2024] HKCFI 2", {"Cocaine": 100.0, "Ketamine": 5.0}, point),
+            similar_case_record("[2024] HKCFI 3", {"Cocaine": 140.0}, point, crossBorder=True),
+            similar_case_record("[2024] HKCFI 4", {"Cocaine": 300.0}, point),
+            similar_case_record("[2024] HKCFI 5", {"Ketamine": 100.0}, point),
+        ]
+        self.index = similar_case_index.SimilarCaseIndex.from_records(self.corpus)
+
+    def ranking(self, request: dict, count: int = 10) -> list[tuple[str, float]]:
+        return [(result["neutralCitation"], round(result["score"], 4)) for result in self.index.query(request, count)]
+
+    def test_quantity_bands_widen_until_the_pool_is_full(self) -> None:
+        # Scores are 0.8 * drug similarity + 0.2 * starting-point similarity.
+        # Case 1 holds 110g: 0.8 * 100 / 110 + 0.2.  Case 2 matches the
+        # cocaine exactly but carries 5% extra ketamine: 0.8 / 1.05 + 0.2.
+        # Only case 1 is inside the exclusive 20% band, so it is the single
+        # result even though case 2 scores higher.
+        self.assertEqual(self.ranking(self.request, count=1), [("[2024] HKCFI 1", 0.9273)])
+        # Two results need the 50% band; case 3 at 140g loses on score.
+        self.assertEqual(self.ranking(self.request, count=2), [("[2024] HKCFI 2", 0.9619), ("[2024] HKCFI 1", 0.9273)])
+        # Ten results fall back to every case holding cocaine.  Case 4 at 300g
+        # scores 0.8 / 3 + 0.2, below the 0.6 cut-off.
+        self.assertEqual(
+            self.ranking(self.request),
+            [("[2024] HKCFI 2", 0.9619), ("[2024] HKCFI 1", 0.9273), ("[2024] HKCFI 3", 0.7714)],
+        )
+
+    def test_cross_border_requests_only_see_cross_border_cases(self) -> None:
+        request = {
+            **self.request,
+            "defendantRole": "Actual trafficker",
+            "additionalCircumstances": ["Cross-border trafficking"],
+        }
+
+        self.assertEqual(self.ranking(request), [("[2024] HKCFI 1", 0.9273), ("[2024] HKCFI 3", 0.7714)])
+
+    def test_starting_point_similarity_is_a_fifth_of_the_score(self) -> None:
+        index = similar_case_index.SimilarCaseIndex.from_records([
+            similar_case_record("[2024] HKCFI 1", {"Cocaine": 80.0}, self.starting_point / 2),
+            similar_case_record("[2024] HKCFI 2", {"Cocaine": 50.0}, self.starting_point / 2),
+        ])
+
+        # 0.8 * 0.8 + 0.2 * 0.5; 50g scores 0.8 * 0.5 + 0.2 * 0.5, below 0.6.
+        [result] = index.query(self.request)
+        self.assertEqual(result["neutralCitation"], "[2024] HKCFI 1")
+        self.assertAlmostEqual(result["score"], 0.74)
+
+    def test_one_case_per_judgment_comes_from_the_best_tier(self) -> None:
+        citation = "[2024] HKCFI 9"
+        variants = {
+            "no role": {},
+            "trafficker": {"role": "Actual trafficker"},
+            "late plea": {"plea": "late"},
+            "assistance risk": {"assistance": 4},
+            "assistance useful": {"assistance": 2},
+            "refugee": {"aggravating": ["Refugee/Asylum"]},
+        }
+        index = similar_case_index.SimilarCaseIndex.from_records([
+            {**similar_case_record(citation, {"Cocaine": 100.0}, self.starting_point, **fields), "title": title}
+            for title, fields in variants.items()
+        ])
+        cases = [
+            ({}, "no role"),
+            ({"defendantRole": "Actual trafficker"}, "trafficker"),
+            ({"guiltyPlea": "Plead guilty (during the trial)"}, "late plea"),
+            # Assistance tiers go by distance from the requested level, and
+            # cases with another level leave the later tiers.
+            ({"mitigatingFactors": ["Assistance - testify"]}, "assistance useful"),
+            ({"mitigatingFactors": ["Assistance - risk"]}, "assistance risk"),
+            ({"aggravatingFactors": ["Refugee/Asylum"]}, "refugee"),
+        ]
+        for fields, title in cases:
+            with self.subTest(title=title):
+                [result] = index.query({**self.request, **fields})
+                self.assertEqual(result["title"], title)
+                self.assertEqual(result["score"], 1.0)
+
+    def test_requests_without_candidates_have_no_similar_cases(self) -> None:
+        self.assertEqual(self.index.query(similar_case_request({"Midazolam": 1.0})), [])
+        self.assertEqual(self.index.query_many([similar_case_request({"Heroin": 10.0})]), [[]])
+
+    def test_shipped_corpus_rankings_are_well_formed(self) -> None:
+        index = similar_case_index.SimilarCaseIndex.load()
+        corpus = index.corpus.records()
+
+        for record in corpus[::97]:
+            results = index.query(similar_case_index.record_request(record))
+            scores = [result["score"] for result in results]
+            self.assertLessEqual(len(results), similar_case_index.DEFAULT_COUNT)
+            self.assertEqual(scores, sorted(scores, reverse=True))
+            self.assertTrue(all(score >= similar_case_index.MIN_SIMILARITY_SCORE for score in scores))
+            self.assertEqual(len({result["neutralCitation"] for result in results}), len(results))
+
+    def test_report_leaves_out_each_cases_own_judgment(self) -> None:
+        corpus = random_recommender_corpus(seed=9, count=120)
+        index = similar_case_index.SimilarCaseIndex.from_records(corpus)
+
+        report = similar_case_index.similar_cases_report(index, count=3)
+
+        self.assertEqual(list(report.columns), similar_case_index.REPORT_COLUMNS)
+        self.assertFalse(report.empty)
+        self.assertFalse((report["neutral_citation"] == report["similar_citation"]).any())
+        self.assertTrue((report.groupby("case_row")["rank"].max() <= 3).all())
+        first = report.loc[report["case_row"] == report["case_row"].iloc[0]]
+        request = similar_case_index.record_request(corpus[int(first["case_row"].iloc[0])])
+        # The pool is still chosen for the request as sent, so its results
+        # without the case's own judgment lead the report.
+        expected = [
+            result["neutralCitation"]
+            for result in index.query(request, count=3)
+            if result["neutralCitation"] != first["neutral_citation"].iloc[0]
+        ]
+        self.assertEqual(first["similar_citation"].tolist()[: len(expected)], expected)
+
+
+class RecommenderCorpusFormatTest(unittest.TestCase):
+    def test_columnar_corpus_round_trips_records(self) -> None:
+        records = random_recommender_corpus(seed=10, count=50)
+        records[0] = {**records[0], "role": None, "aggravating": [], "url": ""}
+        records[1] = {
+            **records[1],
+            "neutralCitation": "[2023] HKDC 12",
+            "language": "chinese",
+            "url": "https://www.hklii.hk/tc/cases/hkdc/2023/12",
+        }
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / "corpus.bin"
+            path.write_bytes(similar_case_index.CorpusColumns.from_records(records).buffer)
+            corpus = similar_case_index.load_corpus(path)
+
+            self.assertEqual(corpus.records(), records)
+            # Builder URLs are rebuilt from the citation; others are stored.
+            self.assertEqual(corpus.urls, [""] + [record["url"] for record in records[2:]])
+            self.assertEqual(int(corpus.url_codes[1]), similar_case_index.NO_CODE)
+
+    def test_codes_widen_with_their_dictionary(self) -> None:
+        records = random_recommender_corpus(seed=10, count=300)
+        for row, record in enumerate(records):
+            record["aggravating"] = [f"Factor {row}", "On bail"]
+            record["role"] = f"Role {row}"
+
+        corpus = similar_case_index.CorpusColumns.from_records(records)
+
+        self.assertEqual(corpus.aggravating_codes.dtype, np.uint16)
+        self.assertEqual(corpus.mitigating_codes.dtype, np.uint8)
+        self.assertEqual(corpus.role_codes.dtype, np.int16)
+        self.assertEqual(corpus.records(), records)
+        self.assertEqual(recommender_corpus.code_dtype(2**16 + 1), np.uint32)
+        with self.assertRaisesRegex(ValueError, "do not fit"):
+            recommender_corpus.code_dtype(2**15 + 1, (np.int16,))
+
+    def test_shipped_columnar_corpus_matches_the_json_corpus(self) -> None:
+        corpus = similar_case_index.load_corpus()
+
+        self.assertEqual(corpus.records(), json.loads(similar_case_index.JSON_OUT.read_text()))
+        self.assertEqual(corpus.urls, [])
+
+
+class RecommenderCorpusBuildTest(unittest.TestCase):
+    languages = {"[2024] HKCFI 12": "chinese", "[2023] HKDC 7": "english"}
+
+    def trial_rows(self) -> pd.DataFrame:
+        def trial(citation: str, name: str, drugs: list[dict], final_months: float, **fields) -> dict:
+            return {
+                "neutral_citation": citation,
+                "defendant_name": name,
+                "drugs": drugs,
+                "canonical_aggravating_factors": [],
+                "canonical_mitigating_factors": [],
+                "guilty_plea": {},
+                "model_role": np.nan,
+                "model_cross_border": np.nan,
+                "final_sentence_months": final_months,
+                **fields,
+            }
+
+        return pd.DataFrame([
+            trial(
+                "[2024] HKCFI 12",
+                "A",
+                [{"drug_type": "Cocaine", "quantity": 10.0}, {"drug_type": "Cocaine", "quantity": "12.5"}],
+                60.0,
+                canonical_aggravating_factors=["Multiple drugs", "On bail", "On bail", "Import"],
+                canonical_mitigating_factors=["Assistance - useful", "Assistance - risk", "Clear record"],
+                guilty_plea={"pleaded_guilty": True, "high_court_stage": "Up to committal"},
+                model_role="Actual trafficker",
+            ),
+            trial(
+                "[2024] HKCFI 12",
+                "B",
+                [{"drug_type": "Other", "other_drug_type": "  MIDAZOLAM ", "quantity": 600.0}],
+                24.0,
+                guilty_plea={"pleaded_guilty": True, "high_court_stage": None, "district_court_stage": "First day"},
+                model_cross_border=True,
+            ),
+            trial(
+                "[2023] HKDC 7",
+                "C",
+                [{"drug_type": "Heroin", "quantity": 5.0}, {"drug_type": "Fluorodeschloroketamine", "quantity": 5.0}],
+                36.0,
+                canonical_aggravating_factors=["Cross-border trafficking"],
+                canonical_mitigating_factors=["Young offender"],
+                model_role="Manager / Organiser",
+                model_cross_border=False,
+            ),
+            trial("[2023] HKDC 7", "D", [{"drug_type": "Cocaine", "quantity": 5.0}, {"drug_type": "LSD", "quantity": 1.0}], 48.0),
+            trial(
+                "[2023] HKDC 7",
+                "E",
+                [{"drug_type": "Cocaine", "quantity": "abc"}, {"drug_type": "Heroin", "quantity": 0}, {"drug_type": "", "quantity": 9.0}],
+                48.0,
+            ),
+            trial(
+                "DCCC 9/2024",
+                "F",
+                [{"drug_type": "Cocaine", "quantity": 10.0}],
+                12.0,
+                guilty_plea={"pleaded_guilty": False, "high_court_stage": "Up to committal"},
+            ),
+        ])
+
+    def test_guideline_buckets_interpolate_within_their_range(self) -> None:
+        np.testing.assert_array_equal(
+            build_case_recommender_corpus.guideline_months("Cocaine", np.array([0, 5, 10, 30000, 45000, -1, np.nan])),
+            [24.0, 42.0, 60.0, 360.0, 360.0, np.nan, np.nan],
+        )
+        np.testing.assert_array_equal(
+            build_case_recommender_corpus.guideline_months("Ketamine", np.array([0.5, 3000, 5000])),
+            [12.0, 240.0, 240.0],
+        )
+
+    def test_kept_trials_become_records_sorted_by_citation_and_sentence(self) -> None:
+        records, skipped = build_case_recommender_corpus.build_records(self.trial_rows(), self.languages)
+
+        self.assertEqual(skipped, {"unsupported_drug": 1, "no_supported_drug": 1, "bad_url": 1})
+        self.assertEqual(
+            [(record["neutralCitation"], record["actualFinalMonths"], record["title"]) for record in records],
+            [
+                ("DCCC 9/2024", 12.0, "HKSAR v F"),
+                ("[2023] HKDC 7", 36.0, "HKSAR v C"),
+                ("[2024] HKCFI 12", 24.0, "HKSAR v A"),
+                ("[2024] HKCFI 12", 60.0, "HKSAR v A"),
+            ],
+        )
+        self.assertEqual(
+            [record["url"] for record in records],
+            [
+                "",
+                "https://www.hklii.hk/en/cases/hkdc/2023/7",
+                "https://www.hklii.hk/tc/cases/hkcfi/2024/12",
+                "https://www.hklii.hk/tc/cases/hkcfi/2024/12",
+            ],
+        )
+        self.assertEqual([record["language"] for record in records], ["english", "english", "chinese", "chinese"])
+        self.assertEqual(
+            [list(record["drugs"].items()) for record in records],
+            [[("Cocaine", 10.0)], [("Heroin", 5.0), ("Ketamine", 5.0)], [("Midazolam", 600.0)], [("Cocaine", 22.5)]],
+        )
+        # Midazolam is scored as powder; mixed drugs are read at their total.
+        self.assertEqual([record["startingPointMonths"] for record in records], [60.0, 54.0, 7.2, 71.25])
+
+    def test_factors_roles_and_pleas_use_the_recommender_vocabulary(self) -> None:
+        records, _ = build_case_recommender_corpus.build_records(self.trial_rows(), self.languages)
+
+        self.assertEqual([record["plea"] for record in records], ["none", "none", "late", "early"])
+        self.assertEqual([record["crossBorder"] for record in records], [False, True, True, False])
+        self.assertEqual([record["role"] for record in records], [None, "Manager / Organiser", None, "Actual trafficker"])
+        self.assertEqual(records[1]["aggravating"], [])
+        self.assertEqual(records[1]["mitigating"], ["Young offender"])
+        self.assertEqual(records[3]["aggravating"], ["Multiple Drugs", "On bail"])
+        self.assertEqual(records[3]["mitigating"], ["Assistance - useful", "Assistance - risk"])
+        self.assertEqual([record["assistance"] for record in records], [0, 0, 0, 4])
+
+    def test_empty_frame_builds_no_records(self) -> None:
+        records, skipped = build_case_recommender_corpus.build_records(self.trial_rows().iloc[:0], {})
+
+        self.assertEqual(records, [])
+        self.assertEqual(skipped, {"unsupported_drug": 0, "no_supported_drug": 0, "bad_url": 0})
+
+
+class FakeVerifiedCollection:
+    """Evaluates the is_verified / watermark / _id filters fetch_changed_documents sends."""
+
+    def __init__(self, documents: list[dict]) -> None:
+        self.documents = documents
+
+    @staticmethod
+    def matches_clause(document: dict, clause: dict) -> bool:
+        ((field_name, condition),) = clause.items()
+        value = document.get(field_name)
+        if "$gte" in condition:
+            return value is not None and value >= condition["$gte"]
+        return value in condition["$in"]
+
+    def find(self, query: dict, projection: dict) -> list[dict]:
+        return [
+            {key: value for key, value in document.items() if key == "_id" or key in projection}
+            for document in self.documents
+            if document.get("is_verified") is True
+            and any(self.matches_clause(document, clause) for clause in query.get("$or", [{"_id": {"$in": [document["_id"]]}}]))
+        ]
+
+
+class IncrementalRefreshTest(unittest.TestCase):
+    def test_refresh_merges_changed_and_drops_unverified_documents(self) -> None:
+        watermark = datetime(2026, 1, 2)
+        collection = FakeVerifiedCollection([
+            {"_id": "a", "is_verified": True, "updated_at": datetime(2026, 1, 1), "filename": "a-live"},
+            {"_id": "b", "is_verified": False, "updated_at": datetime(2026, 1, 3), "filename": "b-live"},
+            {"_id": "c", "is_verified": True, "updated_at": datetime(2026, 1, 3), "filename": "c-live"},
+            {"_id": "d", "is_verified": True, "verified_at": datetime(2026, 1, 4), "filename": "d-live"},
+            {"_id": "e", "is_verified": True, "filename": "e-live"},
+        ])
+        cached = [
+            {"_id": "a", "filename": "a-cached"},
+            {"_id": "b", "filename": "b-cached"},
+            {"_id": "c", "filename": "c-cached"},
+        ]
+
+        documents, summary = fetch_changed_documents(collection, cached, watermark)
+
+        self.assertEqual(
+            [(document["_id"], document["filename"]) for document in documents],
+            [("a", "a-cached"), ("c", "c-live"), ("d", "d-live"), ("e", "e-live")],
+        )
+        self.assertTrue(all("updated_at" not in document and "verified_at" not in document for document in documents))
+        self.assertEqual(summary["watermark"], datetime(2026, 1, 4))
+        self.assertEqual(summary["changed_document_count"], 3)
+        self.assertEqual(summary["removed_document_count"], 1)
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,285 @@
+"""Columnar snapshot of the verified-features pull used by the modelling code.
+
+The snapshot lives in ``.cache/verified_features_snapshot/``:
+
+- ``documents.parquet``: one row per verified document.  Top-level fields are
+  typed columns; the ``trials`` payload is kept as JSON text so documents read
+  back exactly as the JSON cache returns them, which keeps the content hashes
+  of ``evaluate_verified_sentences`` stable across the two.
+- ``<table>.parquet``: flattened tables (``trials`` and ``effects``) stored
+  with native list, struct and map columns so callers read just the columns
+  they need without re-flattening.  A payload column whose leaf types differ
+  between rows (a quantity written as text, say) cannot be one Arrow type and
+  falls back to JSON text; the file's schema metadata lists those columns.
+  Struct columns read back with every field of the column, ``None`` where a
+  row did not have it.
+- ``manifest.json``: format version, cache metadata and the files written.
+
+Parquet needs ``pyarrow``.  Without it every function here reports the
+snapshot as unavailable and callers keep using the JSON cache.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import json
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_DIRNAME = "verified_features_snapshot"
+MANIFEST_FILENAME = "manifest.json"
+DOCUMENTS_FILENAME = "documents.parquet"
+PARQUET_COMPRESSION = "zstd"
+# Dict columns whose keys vary by row.  Stored as Arrow maps so they read back
+# with exactly the keys that were written instead of a union struct.
+MAP_COLUMNS = {"drug_amounts"}
+# Schema metadata key listing the columns stored as JSON text.
+JSON_COLUMNS_METADATA_KEY = b"verified_snapshot.json_columns"
+DOCUMENT_COLUMNS = (
+	"_id",
+	"source_judgement_id",
+	"filename",
+	"exclude",
+	"neutral_citation",
+	"trials_json",
+)
+
+
+def arrow_available() -> bool:
+	return importlib.util.find_spec("pyarrow") is not None
+
+
+def snapshot_dir(cache_dir: Path) -> Path:
+	return cache_dir / SNAPSHOT_DIRNAME
+
+
+def read_manifest(directory: Path) -> dict[str, Any] | None:
+	manifest_path = directory / MANIFEST_FILENAME
+	if not manifest_path.exists():
+		return None
+	manifest = json.loads(manifest_path.read_text())
+	if manifest.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+		return None
+	return manifest
+
+
+def load_manifest(cache_dir: Path, *, created_at: str | None) -> dict[str, Any] | None:
+	"""Return the manifest when the snapshot is readable and built from the cache
+	created at ``created_at`` (``None`` accepts any snapshot)."""
+	if not arrow_available():
+		return None
+	manifest = read_manifest(snapshot_dir(cache_dir))
+	if manifest is None:
+		return None
+	if created_at is not None and manifest["metadata"].get("created_at") != created_at:
+		return None
+	return manifest
+
+
+def write_manifest(directory: Path, manifest: dict[str, Any]) -> None:
+	temporary_path = directory / f"{MANIFEST_FILENAME}.tmp"
+	temporary_path.write_text(json.dumps(manifest, indent=2, default=str))
+	temporary_path.replace(directory / MANIFEST_FILENAME)
+
+
+def optional_string(value: Any) -> str | None:
+	return None if value is None else str(value)
+
+
+def documents_to_frame(documents: list[dict[str, Any]]) -> pd.DataFrame:
+	frame = pd.DataFrame(
+		{
+			"_id": [optional_string(document.get("_id")) for document in documents],
+			"source_judgement_id": [
+				optional_string(document.get("source_judgement_id")) for document in documents
+			],
+			"filename": [document.get("filename") for document in documents],
+			"exclude": [document.get("exclude") for document in documents],
+			"neutral_citation": [
+				(document.get("judgement") or {}).get("neutral_citation") for document in documents
+			],
+			"trials_json": [
+				json.dumps(document["trials"], default=str) if "trials" in document else None
+				for document in documents
+			],
+		},
+		columns=list(DOCUMENT_COLUMNS),
+	)
+	frame["exclude"] = frame["exclude"].astype("boolean")
+	return frame
+
+
+def frame_to_documents(frame: pd.DataFrame) -> list[dict[str, Any]]:
+	"""Rebuild the documents as the JSON cache returns them (ids as strings)."""
+	frame = frame[list(DOCUMENT_COLUMNS)].astype(object)
+	frame = frame.where(frame.notna(), None)
+	documents: list[dict[str, Any]] = []
+	for document_id, source_id, filename, exclude, citation, trials_json in zip(
+		*(frame[column].tolist() for column in DOCUMENT_COLUMNS)
+	):
+		document: dict[str, Any] = {"_id": document_id}
+		if source_id is not None:
+			document["source_judgement_id"] = source_id
+		if filename is not None:
+			document["filename"] = filename
+		if exclude is not None:
+			document["exclude"] = bool(exclude)
+		if citation is not None:
+			document["judgement"] = {"neutral_citation": citation}
+		if trials_json is not None:
+			document["trials"] = json.loads(trials_json)
+		documents.append(document)
+	return documents
+
+
+def has_empty_struct(data_type: Any) -> bool:
+	"""Parquet cannot store a struct without fields, e.g. a column of ``{}``."""
+	import pyarrow as pa
+
+	if pa.types.is_struct(data_type):
+		return data_type.num_fields == 0 or any(has_empty_struct(field.type) for field in data_type)
+	if pa.types.is_list(data_type) or pa.types.is_large_list(data_type):
+		return has_empty_struct(data_type.value_type)
+	return False
+
+
+def nested_array(values: pd.Series) -> tuple[Any, bool]:
+	"""A typed Arrow array of ``values``, or JSON text when they have no one
+	Arrow type.  The flag says whether JSON was used."""
+	import pyarrow as pa
+
+	try:
+		array = pa.array(values.tolist(), from_pandas=True)
+	except (pa.ArrowInvalid, pa.ArrowTypeError):
+		array = None
+	if array is None or has_empty_struct(array.type):
+		return pa.array([json.dumps(value, default=str) for value in values], type=pa.string()), True
+	return array, False
+
+
+def is_nested_column(values: pd.Series) -> bool:
+	return values.dtype == object and any(isinstance(value, (dict, list)) for value in values)
+
+
+def write_parquet(frame: pd.DataFrame, path: Path) -> None:
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+
+	map_columns = [column for column in frame.columns if column in MAP_COLUMNS]
+	nested_columns = [
+		column for column in frame.columns if column not in MAP_COLUMNS and is_nested_column(frame[column])
+	]
+	table = pa.Table.from_pandas(frame.drop(columns=map_columns + nested_columns), preserve_index=False)
+	for column in map_columns:
+		table = table.append_column(
+			column,
+			pa.array(
+				[None if value is None else list(value.items()) for value in frame[column]],
+				type=pa.map_(pa.string(), pa.float64()),
+			),
+		)
+	json_columns = []
+	for column in nested_columns:
+		array, is_json = nested_array(frame[column])
+		table = table.append_column(column, array)
+		if is_json:
+			json_columns.append(column)
+	table = table.select(list(frame.columns))
+	table = table.replace_schema_metadata({
+		**(table.schema.metadata or {}),
+		JSON_COLUMNS_METADATA_KEY: json.dumps(json_columns).encode(),
+	})
+	temporary_path = path.with_suffix(".tmp")
+	pq.write_table(table, temporary_path, compression=PARQUET_COMPRESSION)
+	temporary_path.replace(path)
+
+
+def read_parquet(path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+	"""Read ``columns`` (all when ``None``) of a file written by ``write_parquet``.
+
+	Scalar columns convert without copying where Arrow allows it.  Nested
+	columns become the Python lists and dicts the modelling code reads, so
+	callers should name only the columns they use.
+	"""
+	import pyarrow as pa
+	import pyarrow.parquet as pq
+
+	table = pq.read_table(path, columns=columns, memory_map=True)
+	json_columns = set(json.loads((table.schema.metadata or {}).get(JSON_COLUMNS_METADATA_KEY, b"[]")))
+	nested = {
+		field.name for field in table.schema if pa.types.is_nested(field.type) or field.name in json_columns
+	}
+	frame = table.drop_columns(list(nested)).to_pandas()
+	for field in table.schema:
+		if field.name not in nested:
+			continue
+		values = table.column(field.name).to_pylist()
+		if field.name in json_columns:
+			values = [json.loads(value) for value in values]
+		elif pa.types.is_map(field.type):
+			values = [None if value is None else dict(value) for value in values]
+		frame[field.name] = pd.Series(values, index=frame.index, dtype=object)
+	return frame[table.column_names]
+
+
+def write_documents(
+	cache_dir: Path,
+	documents: list[dict[str, Any]],
+	metadata: dict[str, Any],
+) -> bool:
+	"""Write the document snapshot.  Existing flattened tables are dropped."""
+	if not arrow_available():
+		return False
+	directory = snapshot_dir(cache_dir)
+	directory.mkdir(parents=True, exist_ok=True)
+	write_parquet(documents_to_frame(documents), directory / DOCUMENTS_FILENAME)
+	write_manifest(directory, {
+		"format_version": SNAPSHOT_FORMAT_VERSION,
+		"metadata": metadata,
+		"documents": {"file": DOCUMENTS_FILENAME, "rows": len(documents)},
+		"tables": {},
+	})
+	return True
+
+
+def read_documents(
+	cache_dir: Path,
+	manifest: dict[str, Any],
+) -> tuple[list[dict[str, Any]], dict[str, Any]]:
+	frame = read_parquet(snapshot_dir(cache_dir) / manifest["documents"]["file"])
+	return frame_to_documents(frame), manifest["metadata"]
+
+
+def write_tables(cache_dir: Path, tables: dict[str, pd.DataFrame], *, version: str) -> bool:
+	"""Store flattened tables next to the documents they were built from.
+
+	``version`` identifies the code that built the tables; ``read_table``
+	ignores tables written under another version.
+	"""
+	directory = snapshot_dir(cache_dir)
+	manifest = read_manifest(directory)
+	if manifest is None or not arrow_available():
+		return False
+	for name, frame in tables.items():
+		filename = f"{name}.parquet"
+		write_parquet(frame, directory / filename)
+		manifest["tables"][name] = {"file": filename, "rows": len(frame), "version": version}
+	write_manifest(directory, manifest)
+	return True
+
+
+def read_table(
+	cache_dir: Path,
+	manifest: dict[str, Any],
+	name: str,
+	*,
+	version: str,
+	columns: list[str] | None = None,
+) -> pd.DataFrame | None:
+	entry = manifest["tables"].get(name)
+	if entry is None or entry["version"] != version:
+		return None
+	return read_parquet(snapshot_dir(cache_dir) / entry["file"], columns)
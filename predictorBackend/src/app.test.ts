@@ -147,7 +147,7 @@ describe('predictor API', () => {
 		expect(await response.json()).toMatchObject({
 			error: 'VALIDATION_ERROR',
 			fields: {
-				'drugs.0.quantity': 'Too small: expected number to be >0',
+				'drugs[0].quantity': 'Too small: expected number to be >0',
 			},
 		})
 	})
@@ -17,7 +17,13 @@ function validationResponse(
 	const fields: Record<string, string> = {}
 	for (const issue of error.issues) {
 		const field = issue.path.length
-			? issue.path.map(String).join('.')
+			? issue.path
+					.map((key, index) =>
+						typeof key === 'number'
+							? `[${key}]`
+							: `${index ? '.' : ''}${String(key)}`,
+					)
+					.join('')
 			: 'body'
 		fields[field] = issue.message
 	}